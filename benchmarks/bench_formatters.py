@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Compares the throughput of formatting a STRING mask export column by column:
+
+    babel: a babel format_* call per value, resolving the locale and parsing the
+        pattern each time
+    formatter: the cached LocaleFormatter, one call per value
+    format_rows: LocaleFormatter.format_rows, formatting the whole result in batch
+
+Run with: ENV=test python benchmarks/bench_formatters.py [rows]
+"""
+
+import decimal
+import random
+import sys
+import timeit
+
+from datetime import datetime, date, timedelta
+
+from babel import dates, numbers
+
+from un0.formatters import formatter
+
+
+def make_rows(count: int) -> list[dict]:
+    start = datetime(2024, 1, 1, 8, 0)
+    return [
+        {
+            "created_at": start + timedelta(minutes=random.randint(0, 500000)),
+            "date_due": date(2024, 1, 1) + timedelta(days=random.randint(0, 365)),
+            "amount": decimal.Decimal(random.randint(0, 10**8)) / 100,
+        }
+        for _ in range(count)
+    ]
+
+
+def babel_rows(rows: list[dict], locale: str) -> list[dict]:
+    return [
+        {
+            "created_at": dates.format_datetime(
+                row["created_at"], format="medium", locale=locale
+            ),
+            "date_due": dates.format_date(row["date_due"], format="medium", locale=locale),
+            "amount": numbers.format_decimal(row["amount"], locale=locale),
+        }
+        for row in rows
+    ]
+
+
+def formatter_rows(rows: list[dict], locale: str) -> list[dict]:
+    fmt = formatter(locale)
+    return [
+        {
+            "created_at": fmt.format_datetime(row["created_at"]),
+            "date_due": fmt.format_date(row["date_due"]),
+            "amount": fmt.format_decimal(row["amount"]),
+        }
+        for row in rows
+    ]
+
+
+def main(count: int = 100000, locale: str = "en_US", repeat: int = 3) -> None:
+    rows = make_rows(count)
+    column_types = {"created_at": datetime, "date_due": date, "amount": decimal.Decimal}
+    benchmarks = {
+        "babel": lambda: babel_rows(rows, locale),
+        "formatter": lambda: formatter_rows(rows, locale),
+        "format_rows": lambda: formatter(locale).format_rows(rows, column_types),
+    }
+    print(f"Formatting {count} rows x 3 columns in {locale}, best of {repeat}")
+    baseline = None
+    for name, benchmark in benchmarks.items():
+        seconds = min(timeit.repeat(benchmark, number=1, repeat=repeat))
+        baseline = baseline or seconds
+        print(
+            f"{name:>12}: {seconds * 1000:9.1f} ms "
+            f"{count * 3 / seconds:12,.0f} values/s ({baseline / seconds:5.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Compares the response serialization paths for a list of User rows:
+
+    model: validation through List[User], then serialization, as FastAPI does with
+        response_model=List[User]
+    mask: the List mask's precompiled serializer, straight from the row mappings
+    mask (streamed): the List mask's serializer in batches, as Router.get streams it
+
+Run with: ENV=test python benchmarks/bench_serialization.py [rows]
+"""
+
+import datetime
+import sys
+import timeit
+
+from typing import List
+
+from pydantic import TypeAdapter
+
+from un0.authorization.models import User
+
+
+def make_rows(count: int) -> list[dict]:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        {
+            "id": f"{i:026d}",
+            "email": f"user{i}@example.com",
+            "handle": f"user{i}",
+            "full_name": f"User Number {i}",
+            "default_group_id": f"{i % 10:026d}",
+            "is_superuser": False,
+            "is_tenant_admin": False,
+            "tenant_id": f"{i % 10:026d}",
+            "created_at": now,
+            "owned_by_id": f"{0:026d}",
+            "modified_at": now,
+            "modified_by_id": f"{0:026d}",
+            "is_active": True,
+            "is_deleted": False,
+        }
+        for i in range(count)
+    ]
+
+
+def main(count: int = 10000, repeat: int = 5) -> None:
+    rows = make_rows(count)
+    model_adapter = TypeAdapter(List[User])
+    mask = User.masks["List"]
+
+    benchmarks = {
+        "model": lambda: model_adapter.dump_json(model_adapter.validate_python(rows)),
+        "mask": lambda: mask.dump_json(rows),
+        "mask (streamed)": lambda: b"".join(mask.iter_json(rows)),
+    }
+    print(f"Serializing {count} rows, best of {repeat}")
+    baseline = None
+    for name, benchmark in benchmarks.items():
+        seconds = min(timeit.repeat(benchmark, number=1, repeat=repeat))
+        baseline = baseline or seconds
+        print(f"{name:>16}: {seconds * 1000:8.2f} ms ({baseline / seconds:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,160 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Compares soft deleting rows with a single DELETE statement:
+
+    per row: the earlier SoftDelete trigger, one dynamic UPDATE per deleted row
+    set based: the SoftDelete triggers, one UPDATE per DELETE statement
+
+Both tables have a statement level AFTER UPDATE trigger standing in for the audit,
+history, and graph triggers, which counts the UPDATE statements the DELETE caused.
+
+Requires the database created by createdb, the benchmark tables are created in the
+un0_bench schema, which is dropped afterwards.
+
+Run with: ENV=test python benchmarks/bench_soft_delete.py [rows]
+"""
+
+import sys
+import textwrap
+import time
+
+from sqlalchemy import text
+
+from un0.database.management.db_manager import DBManager
+from un0.database.mixins import SoftDelete
+from un0.config import settings
+
+
+SCHEMA = "un0_bench"
+
+LEGACY_FUNCTION = textwrap.dedent(
+    f"""
+    CREATE OR REPLACE FUNCTION {SCHEMA}.legacy_soft_delete()
+    RETURNS TRIGGER
+    LANGUAGE plpgsql
+    AS $$
+    DECLARE
+        user_id TEXT:= current_setting('rls_var.user_id', true);
+    BEGIN
+        IF OLD.is_deleted IS TRUE THEN
+            RETURN OLD;
+        END IF;
+        EXECUTE format('
+            UPDATE %I.%I
+            SET is_deleted = true,
+                is_active = false,
+                deleted_at = now(),
+                deleted_by_id = %L,
+                modified_at = now(),
+                modified_by_id = %L
+            WHERE id = %L', TG_TABLE_SCHEMA, TG_TABLE_NAME, user_id, user_id, OLD.id
+        );
+        RETURN NULL;
+    END;
+    $$;
+
+    CREATE OR REPLACE FUNCTION {SCHEMA}.count_updates()
+    RETURNS TRIGGER
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+        UPDATE {SCHEMA}.update_count SET statements = statements + 1;
+        RETURN NULL;
+    END;
+    $$;
+    """
+)
+
+
+def create_table_sql(table_name: str) -> str:
+    return textwrap.dedent(
+        f"""
+        CREATE TABLE {SCHEMA}.{table_name} (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            is_active BOOLEAN NOT NULL DEFAULT true,
+            is_deleted BOOLEAN NOT NULL DEFAULT false,
+            deleted_at TIMESTAMPTZ,
+            deleted_by_id TEXT,
+            modified_at TIMESTAMPTZ,
+            modified_by_id TEXT
+        );
+        CREATE TRIGGER {table_name}_count_updates_trigger
+            AFTER UPDATE ON {SCHEMA}.{table_name}
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION {SCHEMA}.count_updates();
+        """
+    )
+
+
+def main(count: int = 100000) -> None:
+    eng = DBManager().engine(db_role=f"{settings.DB_NAME}_login")
+    with eng.connect() as conn:
+        conn.execute(text(f"SET ROLE {settings.DB_NAME}_admin"))
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        conn.execute(
+            text(f"CREATE TABLE {SCHEMA}.update_count (statements INT NOT NULL)")
+        )
+        conn.execute(text(LEGACY_FUNCTION))
+        conn.execute(text(create_table_sql("per_row")))
+        conn.execute(
+            text(
+                f"""
+                CREATE TRIGGER per_row_soft_delete_trigger
+                    BEFORE DELETE ON {SCHEMA}.per_row
+                    FOR EACH ROW
+                    EXECUTE FUNCTION {SCHEMA}.legacy_soft_delete();
+                """
+            )
+        )
+        conn.execute(text(create_table_sql("set_based")))
+        conn.execute(
+            text(SoftDelete(table_name="set_based", schema_name=SCHEMA).emit_sql())
+        )
+        conn.commit()
+
+        try:
+            print(f"Soft deleting {count} rows with one DELETE")
+            for table_name in ("per_row", "set_based"):
+                conn.execute(
+                    text(
+                        f"""
+                        INSERT INTO {SCHEMA}.{table_name} (id, name)
+                        SELECT lpad(i::TEXT, 26, '0'), 'row ' || i
+                        FROM generate_series(1, :count) AS i
+                        """
+                    ),
+                    {"count": count},
+                )
+                conn.execute(text(f"DELETE FROM {SCHEMA}.update_count"))
+                conn.execute(text(f"INSERT INTO {SCHEMA}.update_count VALUES (0)"))
+                conn.commit()
+
+                start = time.perf_counter()
+                conn.execute(text(f"DELETE FROM {SCHEMA}.{table_name}"))
+                conn.commit()
+                elapsed = time.perf_counter() - start
+
+                deleted = conn.execute(
+                    text(f"SELECT count(*) FROM {SCHEMA}.{table_name} WHERE is_deleted")
+                ).scalar()
+                statements = conn.execute(
+                    text(f"SELECT statements FROM {SCHEMA}.update_count")
+                ).scalar()
+                print(
+                    f"  {table_name:<10} {elapsed:8.3f}s  "
+                    f"{deleted} rows soft deleted by {statements} UPDATE statements"
+                )
+        finally:
+            conn.rollback()
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            conn.commit()
+    eng.dispose()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
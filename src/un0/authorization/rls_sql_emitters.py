@@ -45,6 +45,7 @@ class RLSSQL(SQLEmitter):
             self.delete_policy(self.schema_name, self.table_name)
             if callable(self.delete_policy)
             else self.delete_policy,
+            self.emit_history_policies_sql(),
         ]
         return "\n".join(sql)
 
@@ -89,6 +90,21 @@ class RLSSQL(SQLEmitter):
             """
         )
 
+    def emit_history_policies_sql(self) -> str:
+        """
+        Emits the SQL statement giving the history table of the table, if it has one
+        (see HistoryTableAuditSQL), the SELECT policies of the table.
+
+        Returns:
+            str: The SQL statement to copy the policies to the history table.
+        """
+        return textwrap.dedent(
+            f"""
+            -- Read the history of {self.schema_name}.{self.table_name} with its policies
+            SELECT audit.copy_history_policies('{self.schema_name}.{self.table_name}'::regclass);
+            """
+        )
+
     def emit_force_rls_sql(self) -> str:
         """
         Emits the SQL statements to force Row Level Security (RLS)
@@ -184,20 +200,29 @@ class RLSSQL(SQLEmitter):
                     */
                     PERFORM set_config('rls_var.email', sub, true);
 
-                    -- Query the user table for the user to get the values for the session variables
-                    SELECT id, email, is_superuser, is_tenant_admin, tenant_id, is_active, is_deleted 
+                    /*
+                    Query the user table for the user to get the values for the session variables
+                    Emails are only unique among the users that are not deleted, the predicate
+                    also lets the planner use the partial unique index on email
+                    */
+                    SELECT id, email, is_superuser, is_tenant_admin, tenant_id, is_active
                     FROM un0.user
-                    WHERE email = sub
+                    WHERE email = sub AND NOT is_deleted
                     INTO
                         user_id,
                         user_email,
                         user_is_superuser,
                         user_is_tenant_admin,
                         user_tenant_id,
-                        user_is_active,
-                        user_is_deleted;
+                        user_is_active;
 
                     IF user_id IS NULL THEN
+                        SELECT EXISTS (
+                            SELECT 1 FROM un0.user WHERE email = sub AND is_deleted
+                        ) INTO user_is_deleted;
+                        IF user_is_deleted THEN
+                            RAISE EXCEPTION 'user was deleted';
+                        END IF;
                         RAISE EXCEPTION 'user not found';
                     END IF;
 
@@ -205,10 +230,6 @@ class RLSSQL(SQLEmitter):
                         RAISE EXCEPTION 'user is not active';
                     END IF; 
 
-                    IF user_is_deleted = TRUE THEN
-                        RAISE EXCEPTION 'user was deleted';
-                    END IF; 
-
                     -- Set the session variables used for RLS
                     PERFORM set_config('rls_var.email', user_email, true);
                     PERFORM set_config('rls_var.user_id', user_id, true);
@@ -0,0 +1,34 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import argparse
+import asyncio
+
+import un0.authorization.models
+import un0.filters.queries
+import un0.workflows.models
+import un0.reports.models
+from un0.reports.rollups import RollupChecker
+
+
+async def check(repair: bool) -> None:
+    differences = await RollupChecker().check_all(repair=repair)
+    for name, count in differences.items():
+        state = "consistent" if not count else f"{count} groups differ"
+        if count and repair:
+            state += ", rebuilt"
+        print(f"{name}: {state}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the rollup summary tables with their source tables."
+    )
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="rebuild the summary tables that differ from their source",
+    )
+    args = parser.parse_args()
+    asyncio.run(check(args.repair))
@@ -0,0 +1,34 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import argparse
+import datetime
+
+from un0.database.management.db_manager import DBManager
+from un0.config import settings
+
+
+def month(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, "%Y-%m").date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the audit rows to files partitioned by tenant and month."
+    )
+    parser.add_argument("--since", type=month, help="first month, YYYY-MM")
+    parser.add_argument("--until", type=month, help="last month, YYYY-MM")
+    parser.add_argument("--directory", default=settings.AUDIT_EXPORT_DIR)
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--workers", type=int, default=settings.AUDIT_EXPORT_WORKERS)
+    args = parser.parse_args()
+
+    db = DBManager()
+    db.export_audit(
+        since=args.since,
+        until=args.until,
+        directory=args.directory,
+        file_format=args.format,
+        workers=args.workers,
+    )
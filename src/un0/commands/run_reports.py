@@ -0,0 +1,46 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+
+import un0.authorization.models
+import un0.filters.queries
+import un0.workflows.models
+import un0.communications.models
+from un0.reports.runner import ReportRunner
+
+
+async def work() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await ReportRunner().run(stop)
+
+
+def run() -> None:
+    asyncio.run(work())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the report workers.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes, each computes one report run at a time",
+    )
+    args = parser.parse_args()
+
+    # Each process creates its own engine and connections
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+
+import un0.authorization.models
+from un0.database.listener import NotificationListener
+from un0.workflows.dispatcher import WorkflowDispatcher
+from un0.workflows.executor import WorkflowWorker
+from un0.workflows.runtime import ObjectFunctionRuntime, import_modules
+from un0.workflows.status import WorkflowStatusUpdater
+from un0.config import settings
+
+
+async def stopped() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+async def work(modules: list[str], processes: int) -> None:
+    # Spawned processes start from a fresh interpreter, without the object functions
+    import_modules(modules)
+    runtime = ObjectFunctionRuntime(max_processes=processes, modules=modules)
+    worker = WorkflowWorker(runtime=runtime)
+    listener = NotificationListener()
+    worker.install(listener)
+    listener.start()
+    stop = asyncio.Event()
+    stopping = asyncio.create_task(stopped())
+    stopping.add_done_callback(lambda task: stop.set())
+    await worker.run(stop)
+    await listener.stop()
+
+
+async def dispatch() -> None:
+    dispatcher = WorkflowDispatcher()
+    listener = NotificationListener()
+    dispatcher.install(listener)
+    listener.start()
+    # The statuses of the workflow records are recomputed by the single dispatcher
+    stop = asyncio.Event()
+    updating = asyncio.create_task(WorkflowStatusUpdater().run(stop))
+    await stopped()
+    stop.set()
+    await updating
+    await listener.stop()
+    await dispatcher.flush()
+
+
+def run(coroutine_function, *args) -> None:
+    asyncio.run(coroutine_function(*args))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the workflow workers.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes, defaults to one per core",
+    )
+    parser.add_argument(
+        "--no-dispatcher",
+        action="store_true",
+        help="do not dispatch DB_EVENT workflows nor update record statuses, a single node must",
+    )
+    parser.add_argument(
+        "--module",
+        action="append",
+        dest="modules",
+        default=list(settings.OBJECT_FUNCTION_MODULES),
+        help="module registering object functions, imported by every worker, repeatable",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=settings.OBJECT_FUNCTION_PROCESSES,
+        help="processes running the cpu bound object functions of each worker, "
+        "defaults to the cores shared between the workers",
+    )
+    args = parser.parse_args()
+    # The workers' pools share the cores, rather than each having one process per core
+    pool_processes = args.processes or max(1, (os.cpu_count() or 1) // args.workers)
+
+    # Each process creates its own engine and connections
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run, args=(work, args.modules, pool_processes))
+        for _ in range(args.workers)
+    ]
+    if not args.no_dispatcher:
+        processes.append(context.Process(target=run, args=(dispatch,)))
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,501 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import datetime
+
+from typing import Optional
+
+from sqlalchemy import BigInteger, Integer, text, func
+from sqlalchemy.dialects.postgresql import (
+    BOOLEAN,
+    ENUM,
+    TEXT,
+    TIMESTAMP,
+    VARCHAR,
+)
+
+from un0.database.fields import FKDefinition, IndexDefinition, FieldDefinition
+from un0.database.models import Model
+from un0.relatedobjects.mixins import RelatedObjectIdMixin
+from un0.authorization.mixins import TenantMixin
+from un0.communications.enums import MessageImportance
+from un0.communications.sql_emitters import (
+    MessageThreadRootSQL,
+    InboxItemSQL,
+    InboxUnreadSQL,
+    InboxRLSSQL,
+)
+
+
+class Message(
+    Model,
+    RelatedObjectIdMixin,
+    TenantMixin,
+    schema_name="un0",
+    table_name="message",
+):
+    """
+    Messages are used to communicate between users.
+
+    The recipients of a message are rows of message_addressed_to and
+    message_copied_to, those of the groups it is sent to are inserted when the
+    message is expanded (see un0.communications.sender), which sets expanded_at.
+
+    Replies reference the message they answer in previous_message_id, and share
+    the thread_root_id of the first message of their thread.
+    """
+
+    # id: str <- RelatedObjectIdMixin
+    # tenant_id: str <- TenantMixin
+
+    sql_emitters = [MessageThreadRootSQL]
+    index_definitions = [
+        # The messages of a thread, in the order they were sent
+        IndexDefinition(
+            name="ix_message_thread_root_id_sent_at",
+            columns=["thread_root_id", "sent_at", "id"],
+        ),
+        # The messages whose expansion did not complete, see MessageSender.expand_pending
+        IndexDefinition(
+            name="ix_message_not_expanded",
+            columns=["sent_at"],
+            where="expanded_at IS NULL",
+        )
+    ]
+    field_definitions = {
+        "sender_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.user.id",
+                ondelete="CASCADE",
+                edge_label="WAS_SENT_BY",
+                reverse_edge_labels=["SENT"],
+            ),
+            nullable=False,
+            index=True,
+            doc="The user that sent the message",
+        ),
+        "previous_message_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.message.id",
+                ondelete="CASCADE",
+                edge_label="HAS_PREVIOUS_MESSAGE",
+                reverse_edge_labels=["HAS_NEXT_MESSAGE"],
+            ),
+            index=True,
+            doc="The message this message replies to or forwards",
+        ),
+        "thread_root_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.message.id",
+                ondelete="CASCADE",
+                edge_label="IS_IN_THREAD_OF",
+                reverse_edge_labels=["IS_THREAD_ROOT_OF"],
+            ),
+            editable=False,
+            doc="The first message of the thread, set on insert by MessageThreadRootSQL",
+        ),
+        "flag": FieldDefinition(
+            data_type=ENUM(
+                MessageImportance,
+                name="messageimportance",
+                create_type=True,
+                schema="un0",
+            ),
+            nullable=False,
+            server_default=MessageImportance.INFORMATION.name,
+            doc="Importance of the message",
+        ),
+        "subject": FieldDefinition(
+            data_type=VARCHAR(255),
+            nullable=False,
+            doc="Subject of the message",
+        ),
+        "body": FieldDefinition(
+            data_type=TEXT,
+            nullable=False,
+            doc="Body of the message",
+        ),
+        "sent_at": FieldDefinition(
+            data_type=TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=func.now(),
+            doc="Time the message was sent",
+        ),
+        "expanded_at": FieldDefinition(
+            data_type=TIMESTAMP(timezone=True),
+            doc="Time the members of the groups the message was sent to became its recipients",
+        ),
+    }
+
+    sender_id: Optional[str] = None
+    previous_message_id: Optional[str] = None
+    thread_root_id: Optional[str] = None
+    flag: Optional[MessageImportance] = MessageImportance.INFORMATION
+    subject: Optional[str] = None
+    body: Optional[str] = None
+    sent_at: Optional[datetime.datetime] = None
+    expanded_at: Optional[datetime.datetime] = None
+
+    def __str__(self) -> str:
+        return self.subject
+
+
+class MessageAddressedTo(
+    Model,
+    schema_name="un0",
+    table_name="message_addressed_to",
+):
+    """Messages addressed to users."""
+
+    sql_emitters = [InboxItemSQL]
+    field_definitions = {
+        "message_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.message.id",
+                ondelete="CASCADE",
+                edge_label="WAS_SENT",
+                reverse_edge_labels=["WAS_SENT_TO"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+        "addressed_to_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.user.id",
+                ondelete="CASCADE",
+                edge_label="WAS_SENT_TO",
+                reverse_edge_labels=["WAS_SENT"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+        "read": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("false"),
+        ),
+        "read_at": FieldDefinition(data_type=TIMESTAMP(timezone=True)),
+    }
+
+    message_id: Optional[str] = None
+    addressed_to_id: Optional[str] = None
+    read: Optional[bool] = False
+    read_at: Optional[datetime.datetime] = None
+
+    def __str__(self) -> str:
+        return f"{self.message_id} - {self.addressed_to_id}"
+
+
+class MessageCopiedTo(
+    Model,
+    schema_name="un0",
+    table_name="message_copied_to",
+):
+    """Messages copied to users."""
+
+    sql_emitters = [InboxItemSQL]
+    field_definitions = {
+        "message_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.message.id",
+                ondelete="CASCADE",
+                edge_label="WAS_CCD_ON",
+                reverse_edge_labels=["WAS_CCD_TO"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+        "copied_to_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.user.id",
+                ondelete="CASCADE",
+                edge_label="WAS_CCD_TO",
+                reverse_edge_labels=["WAS_CCD_ON"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+        "read": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("false"),
+        ),
+        "read_at": FieldDefinition(data_type=TIMESTAMP(timezone=True)),
+    }
+
+    message_id: Optional[str] = None
+    copied_to_id: Optional[str] = None
+    read: Optional[bool] = False
+    read_at: Optional[datetime.datetime] = None
+
+    def __str__(self) -> str:
+        return f"{self.message_id} - {self.copied_to_id}"
+
+
+class MessageGroupRecipient(
+    Model,
+    schema_name="un0",
+    table_name="message_group_recipient",
+):
+    """
+    The groups a message is sent to, whose members are inserted as its recipients
+    when the message is expanded.
+    """
+
+    field_definitions = {
+        "message_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.message.id",
+                ondelete="CASCADE",
+                edge_label="WAS_SENT_TO_GROUP",
+                reverse_edge_labels=["RECEIVED_MESSAGE"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+        "group_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.group.id",
+                ondelete="CASCADE",
+                edge_label="RECEIVED_MESSAGE",
+                reverse_edge_labels=["WAS_SENT_TO_GROUP"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+        "copied": FieldDefinition(
+            data_type=BOOLEAN,
+            primary_key=True,
+            server_default=text("false"),
+            doc="Indicates if the group's members are copied to rather than addressed",
+        ),
+    }
+
+    message_id: Optional[str] = None
+    group_id: Optional[str] = None
+    copied: Optional[bool] = False
+
+    def __str__(self) -> str:
+        return f"{self.message_id} - {self.group_id}"
+
+
+class InboxItem(
+    Model,
+    schema_name="un0",
+    table_name="inbox_item",
+):
+    """
+    The inbox of each user, a projection of the messages addressed or copied to
+    them, maintained by the triggers of the recipient tables (see InboxItemSQL).
+
+    The items are read newest first by keyset pagination over the index on
+    (user_id, sent_at, message_id). sent_at and flag are copied from the message
+    when the recipient is inserted.
+    """
+
+    sql_emitters = [InboxUnreadSQL, InboxRLSSQL]
+    # Written only by the triggers, read through un0.communications.routers
+    router_defs = {}
+    index_definitions = [
+        IndexDefinition(
+            name="ix_inbox_item_user_id_sent_at",
+            columns=["user_id", "sent_at", "message_id"],
+        )
+    ]
+    field_definitions = {
+        "user_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.user.id",
+                ondelete="CASCADE",
+                edge_label="HAS_INBOX_ITEM",
+                reverse_edge_labels=["IS_INBOX_ITEM_OF"],
+            ),
+            primary_key=True,
+        ),
+        "message_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.message.id",
+                ondelete="CASCADE",
+                edge_label="IS_INBOX_ITEM_FOR",
+                reverse_edge_labels=["HAS_INBOX_ITEM"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+        "sent_at": FieldDefinition(
+            data_type=TIMESTAMP(timezone=True),
+            nullable=False,
+            doc="Time the message was sent",
+        ),
+        "flag": FieldDefinition(
+            data_type=ENUM(
+                MessageImportance,
+                name="messageimportance",
+                create_type=True,
+                schema="un0",
+            ),
+            nullable=False,
+            doc="Importance of the message",
+        ),
+        "copied": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("false"),
+            doc="Indicates if the user was copied to the message rather than addressed",
+        ),
+        "read_at": FieldDefinition(
+            data_type=TIMESTAMP(timezone=True),
+            doc="Time the user read the message, NULL while unread",
+        ),
+    }
+
+    user_id: Optional[str] = None
+    message_id: Optional[str] = None
+    sent_at: Optional[datetime.datetime] = None
+    flag: Optional[MessageImportance] = None
+    copied: Optional[bool] = False
+    read_at: Optional[datetime.datetime] = None
+
+    def __str__(self) -> str:
+        return f"{self.user_id} - {self.message_id}"
+
+
+class InboxUnread(
+    Model,
+    schema_name="un0",
+    table_name="inbox_unread",
+):
+    """The number of unread items in each user's inbox, maintained by InboxUnreadSQL."""
+
+    sql_emitters = [InboxRLSSQL]
+    # Written only by the triggers, read through un0.communications.routers
+    router_defs = {}
+    field_definitions = {
+        "user_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.user.id",
+                ondelete="CASCADE",
+                edge_label="HAS_UNREAD_COUNT",
+                reverse_edge_labels=["IS_UNREAD_COUNT_OF"],
+            ),
+            primary_key=True,
+        ),
+        "unread_count": FieldDefinition(
+            data_type=Integer,
+            nullable=False,
+            server_default=text("0"),
+        ),
+    }
+
+    user_id: Optional[str] = None
+    unread_count: Optional[int] = 0
+
+    def __str__(self) -> str:
+        return f"{self.user_id} - {self.unread_count}"
+
+
+class Attachment(
+    Model,
+    RelatedObjectIdMixin,
+    TenantMixin,
+    schema_name="un0",
+    table_name="attachment",
+):
+    """
+    Files attached to messages.
+
+    The content of an attachment is kept in the content addressed store of
+    un0.communications.storage, at the path of its content_hash, attachments with
+    identical contents sharing one stored file. Attachments are uploaded and
+    downloaded as streams through un0.communications.routers.
+    """
+
+    # id: str <- RelatedObjectIdMixin
+    # tenant_id: str <- TenantMixin
+
+    field_definitions = {
+        "name": FieldDefinition(
+            data_type=VARCHAR(255),
+            nullable=False,
+            doc="Name of the file",
+        ),
+        "content_hash": FieldDefinition(
+            data_type=VARCHAR(64),
+            nullable=False,
+            index=True,
+            editable=False,
+            doc="sha256 hex digest of the content, its address in the store",
+        ),
+        "size": FieldDefinition(
+            data_type=BigInteger,
+            nullable=False,
+            editable=False,
+            doc="Size of the content in bytes",
+        ),
+        "content_type": FieldDefinition(
+            data_type=VARCHAR(255),
+            nullable=False,
+            server_default="application/octet-stream",
+            doc="Media type of the content",
+        ),
+    }
+
+    name: Optional[str] = None
+    content_hash: Optional[str] = None
+    size: Optional[int] = None
+    content_type: Optional[str] = "application/octet-stream"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class MessageAttachment(
+    Model,
+    schema_name="un0",
+    table_name="message_attachment",
+):
+    """Attachments of messages."""
+
+    field_definitions = {
+        "message_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.message.id",
+                ondelete="CASCADE",
+                edge_label="HAS_ATTACHMENT",
+                reverse_edge_labels=["WAS_ATTACHED_TO"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+        "attachment_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.attachment.id",
+                ondelete="CASCADE",
+                edge_label="WAS_ATTACHED_TO",
+                reverse_edge_labels=["HAS_ATTACHMENT"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+    }
+
+    message_id: Optional[str] = None
+    attachment_id: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.message_id} - {self.attachment_id}"
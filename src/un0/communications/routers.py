@@ -0,0 +1,287 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import datetime
+
+from typing import Annotated, Any
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse
+from sqlalchemy import Insert, Select, select, insert, func, literal, tuple_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY, VARCHAR, array
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from un0.database.base import get_db
+from un0.communications.models import Message, InboxItem, InboxUnread, Attachment
+from un0.communications.storage import ContentStore
+from un0.errors import AttachmentTooLargeError
+from un0.config import settings
+
+
+inbox_router = APIRouter(prefix="/api/inbox", tags=["Inbox"])
+thread_router = APIRouter(prefix="/api/message", tags=["Message"])
+attachment_router = APIRouter(prefix="/api/attachment", tags=["Attachment"])
+
+content_store = ContentStore()
+
+
+def inbox_statement(
+    limit: int,
+    before_sent_at: datetime.datetime | None = None,
+    before_id: str | None = None,
+) -> Select:
+    """
+    Creates the statement selecting the session user's inbox items, newest first,
+    after the item (before_sent_at, before_id) of the previous page if given.
+
+    The statement is a single range scan of ix_inbox_item_user_id_sent_at.
+    """
+    item = InboxItem.table.__table__
+    stmt = select(
+        item.c.message_id,
+        item.c.sent_at,
+        item.c.flag,
+        item.c.copied,
+        item.c.read_at,
+    ).where(item.c.user_id == func.current_setting("rls_var.user_id", True))
+    if before_sent_at is not None:
+        stmt = stmt.where(
+            tuple_(item.c.sent_at, item.c.message_id) < tuple_(before_sent_at, before_id)
+        )
+    return stmt.order_by(item.c.sent_at.desc(), item.c.message_id.desc()).limit(limit)
+
+
+def unread_statement() -> Select:
+    """Creates the statement selecting the session user's unread count."""
+    unread = InboxUnread.table.__table__
+    return select(unread.c.unread_count).where(
+        unread.c.user_id == func.current_setting("rls_var.user_id", True)
+    )
+
+
+@inbox_router.get("")
+async def inbox(
+    authorization: Annotated[str, Header()],
+    before_sent_at: Annotated[datetime.datetime | None, Query()] = None,
+    before_id: Annotated[str | None, Query()] = None,
+    limit: Annotated[int, Query(ge=1, le=200)] = 50,
+    db: AsyncSession = Depends(get_db),
+) -> list[dict[str, Any]]:
+    """
+    Returns a page of the user's inbox, newest first. The next page is requested
+    with the sent_at and message_id of the last item as before_sent_at and
+    before_id. The messages themselves are read in one request with the ids
+    parameter of the message list endpoint.
+    """
+    if (before_sent_at is None) != (before_id is None):
+        raise HTTPException(
+            status_code=400,
+            detail="before_sent_at and before_id must be given together",
+        )
+    await db.execute(func.un0.authorize_user(authorization))
+    result = await db.execute(inbox_statement(limit, before_sent_at, before_id))
+    return [dict(row) for row in result.mappings()]
+
+
+@inbox_router.get("/unread")
+async def unread(
+    authorization: Annotated[str, Header()],
+    db: AsyncSession = Depends(get_db),
+) -> dict[str, int]:
+    """Returns the number of unread messages in the user's inbox."""
+    await db.execute(func.un0.authorize_user(authorization))
+    count = await db.scalar(unread_statement())
+    return {"unread": count or 0}
+
+
+def thread_statement(max_depth: int) -> Select:
+    """
+    Creates the statement selecting the thread of the message bound to
+    :message_id, with the depth of each message, in one recursive query.
+
+    The recursion starts from the thread's root and follows the replies of each
+    message through the index on previous_message_id, restricted to the thread
+    by thread_root_id, for at most max_depth levels. Messages are ordered depth
+    first by their path of ids, ids being ULIDs the replies to a message are in
+    the order they were created, so the order is stable between requests.
+
+    Only the messages of the session user's tenant are selected, messages not
+    having row level security.
+    """
+    message = Message.table.__table__
+    tenant_id = func.current_setting("rls_var.tenant_id", True)
+    root = (
+        select(message.c.thread_root_id)
+        .where(
+            message.c.id == bindparam("message_id"), message.c.tenant_id == tenant_id
+        )
+        .scalar_subquery()
+    )
+    thread = (
+        select(
+            message.c.id,
+            literal(0).label("depth"),
+            array([message.c.id], type_=ARRAY(VARCHAR)).label("path"),
+        )
+        .where(message.c.id == root, message.c.tenant_id == tenant_id)
+        .cte("thread", recursive=True)
+    )
+    reply = message.alias("reply")
+    thread = thread.union_all(
+        select(
+            reply.c.id,
+            thread.c.depth + 1,
+            func.array_append(thread.c.path, reply.c.id),
+        )
+        .join(thread, reply.c.previous_message_id == thread.c.id)
+        .where(
+            thread.c.depth < max_depth,
+            reply.c.thread_root_id == root,
+            reply.c.tenant_id == tenant_id,
+        )
+    )
+    return (
+        select(
+            message.c.id,
+            message.c.previous_message_id,
+            message.c.sender_id,
+            message.c.flag,
+            message.c.subject,
+            message.c.body,
+            message.c.sent_at,
+            thread.c.depth,
+        )
+        .join(thread, message.c.id == thread.c.id)
+        .order_by(thread.c.path)
+    )
+
+
+@thread_router.get("/{message_id}/thread")
+async def thread(
+    message_id: str,
+    authorization: Annotated[str, Header()],
+    db: AsyncSession = Depends(get_db),
+) -> list[dict[str, Any]]:
+    """
+    Returns the whole thread of the message, from its first message, each
+    message with its depth in the thread, replies following the message they
+    answer. Threads deeper than MESSAGE_THREAD_MAX_DEPTH are truncated.
+    """
+    await db.execute(func.un0.authorize_user(authorization))
+    result = await db.execute(
+        thread_statement(settings.MESSAGE_THREAD_MAX_DEPTH),
+        {"message_id": message_id},
+    )
+    rows = [dict(row) for row in result.mappings()]
+    if not rows:
+        raise HTTPException(status_code=404, detail="Object not found")
+    return rows
+
+
+def attachment_insert_statement() -> Insert:
+    """
+    Creates the statement inserting the attachment bound to :name, :content_hash,
+    :size and :content_type in the session user's tenant.
+    """
+    attachment = Attachment.table.__table__
+    return (
+        insert(attachment)
+        .values(
+            name=bindparam("name"),
+            content_hash=bindparam("content_hash"),
+            size=bindparam("size"),
+            content_type=bindparam("content_type"),
+            tenant_id=func.current_setting("rls_var.tenant_id", True),
+        )
+        .returning(
+            attachment.c.id,
+            attachment.c.name,
+            attachment.c.content_hash,
+            attachment.c.size,
+            attachment.c.content_type,
+        )
+    )
+
+
+def attachment_statement() -> Select:
+    """
+    Creates the statement selecting the attachment bound to :attachment_id, if it
+    is of the session user's tenant, attachments not having row level security.
+    """
+    attachment = Attachment.table.__table__
+    return select(
+        attachment.c.name,
+        attachment.c.content_hash,
+        attachment.c.size,
+        attachment.c.content_type,
+    ).where(
+        attachment.c.id == bindparam("attachment_id"),
+        attachment.c.tenant_id == func.current_setting("rls_var.tenant_id", True),
+    )
+
+
+@attachment_router.post("")
+async def upload_attachment(
+    request: Request,
+    name: Annotated[str, Query(min_length=1, max_length=255)],
+    authorization: Annotated[str, Header()],
+    content_type: Annotated[str, Header()] = "application/octet-stream",
+    content_length: Annotated[int | None, Header()] = None,
+    db: AsyncSession = Depends(get_db),
+) -> dict[str, Any]:
+    """
+    Uploads an attachment, the content being the raw request body.
+
+    The body is streamed to the content store as it is received, hashed on the
+    way, so the file is never held in memory nor spooled to a temporary upload
+    file. An attachment whose content is already stored reuses its file.
+    """
+    max_size = content_store.max_size
+    if max_size is not None and content_length is not None and content_length > max_size:
+        raise HTTPException(status_code=413, detail="Attachment too large")
+    # Authorized before the body is read, unauthorized uploads are not stored
+    await db.execute(func.un0.authorize_user(authorization, "writer"))
+    try:
+        content_hash, size = await content_store.write(request.stream())
+    except AttachmentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=e.message)
+    result = await db.execute(
+        attachment_insert_statement(),
+        {
+            "name": name,
+            "content_hash": content_hash,
+            "size": size,
+            "content_type": content_type,
+        },
+    )
+    row = dict(result.mappings().one())
+    await db.commit()
+    return row
+
+
+@attachment_router.get("/{attachment_id}/content")
+async def download_attachment(
+    attachment_id: str,
+    authorization: Annotated[str, Header()],
+    db: AsyncSession = Depends(get_db),
+) -> FileResponse:
+    """
+    Downloads the content of an attachment.
+
+    The file is streamed from the store in chunks, Range and If-Range requests
+    are answered with the requested ranges, and servers supporting the ASGI
+    pathsend extension send the file themselves, without copying it through
+    Python. The content hash is the ETag, contents being immutable.
+    """
+    await db.execute(func.un0.authorize_user(authorization))
+    result = await db.execute(attachment_statement(), {"attachment_id": attachment_id})
+    row = result.mappings().one_or_none()
+    if row is None or not content_store.exists(row["content_hash"]):
+        raise HTTPException(status_code=404, detail="Object not found")
+    return FileResponse(
+        content_store.path(row["content_hash"]),
+        media_type=row["content_type"],
+        filename=row["name"],
+        headers={"etag": f'"{row["content_hash"]}"'},
+    )
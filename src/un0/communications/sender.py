@@ -0,0 +1,230 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import logging
+
+from typing import Any
+
+from sqlalchemy import (
+    Insert,
+    Select,
+    Table,
+    select,
+    insert,
+    update,
+    exists,
+    func,
+    bindparam,
+    union,
+    text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, VARCHAR, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from un0.database.base import engine as default_engine
+from un0.authorization.models import UserGroupRole
+from un0.communications.models import (
+    Message,
+    MessageAddressedTo,
+    MessageCopiedTo,
+    MessageGroupRecipient,
+)
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def recipients_statement(copied: bool = False) -> Insert:
+    """
+    Creates the statement that inserts the recipients of the message bound to
+    :message_id, in message_copied_to if copied, otherwise message_addressed_to.
+
+    The recipients are the users bound to :user_ids and the members of the
+    message's groups, expanded in the database by a single INSERT ... SELECT.
+    Users addressed by the message are not also copied to it, and the users
+    already recipients are skipped, so the statement can be run again.
+    """
+    group_recipient = MessageGroupRecipient.table.__table__
+    user_group_role = UserGroupRole.table.__table__
+    message_id = bindparam("message_id", type_=VARCHAR(26))
+    if copied:
+        table: Table = MessageCopiedTo.table.__table__
+        column = "copied_to_id"
+    else:
+        table = MessageAddressedTo.table.__table__
+        column = "addressed_to_id"
+    users = union(
+        select(
+            func.unnest(bindparam("user_ids", type_=ARRAY(VARCHAR))).label("user_id")
+        ),
+        select(user_group_role.c.user_id)
+        .join(group_recipient, group_recipient.c.group_id == user_group_role.c.group_id)
+        .where(
+            group_recipient.c.message_id == message_id,
+            group_recipient.c.copied.is_(copied),
+            user_group_role.c.user_id.is_not(None),
+        ),
+    ).subquery("users")
+    recipients = select(message_id, users.c.user_id)
+    if copied:
+        addressed = MessageAddressedTo.table.__table__
+        recipients = recipients.where(
+            ~exists().where(
+                addressed.c.message_id == message_id,
+                addressed.c.addressed_to_id == users.c.user_id,
+            )
+        )
+    return (
+        pg_insert(table)
+        .from_select(["message_id", column], recipients)
+        .on_conflict_do_nothing()
+    )
+
+
+def audience_statement() -> Select:
+    """
+    Creates the statement counting the members of the groups bound to :group_ids,
+    an upper bound of the recipients they add to a message.
+    """
+    user_group_role = UserGroupRole.table.__table__
+    return select(func.count(user_group_role.c.user_id.distinct())).where(
+        user_group_role.c.group_id == func.any(bindparam("group_ids", type_=ARRAY(VARCHAR)))
+    )
+
+
+class MessageSender:
+    """
+    Sends messages to users and groups.
+
+    Recipients are inserted by one INSERT ... SELECT per recipient table, the
+    members of the groups expanded in the database, instead of a row per
+    recipient from Python. The recipient tables are plain join tables, they have
+    no related object nor audit triggers, only the statement level table version
+    trigger fires, once per statement.
+
+    Messages to groups with more than async_threshold members are committed with
+    their direct recipients, and their groups are expanded afterwards in a
+    separate transaction, run as a task. Messages whose expansion did not complete
+    have no expanded_at and are expanded by expand_pending.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine = default_engine,
+        async_threshold: int = settings.MESSAGE_ASYNC_FANOUT_THRESHOLD,
+    ) -> None:
+        self.engine = engine
+        self.async_threshold = async_threshold
+        self.tasks: set[asyncio.Task] = set()
+
+    async def set_role(self, conn: AsyncConnection) -> None:
+        await conn.execute(text(f"SET LOCAL ROLE {settings.DB_NAME}_writer"))
+
+    async def send(
+        self,
+        message: dict[str, Any],
+        to_users: list[str] | None = None,
+        to_groups: list[str] | None = None,
+        cc_users: list[str] | None = None,
+        cc_groups: list[str] | None = None,
+    ) -> str:
+        """
+        Inserts the message, with the columns of message, and its recipients.
+
+        Returns:
+            str: The id of the message.
+        """
+        to_users, to_groups = to_users or [], to_groups or []
+        cc_users, cc_groups = cc_users or [], cc_groups or []
+        groups = [
+            {"group_id": group_id, "copied": copied}
+            for group_ids, copied in ((to_groups, False), (cc_groups, True))
+            for group_id in dict.fromkeys(group_ids)
+        ]
+        async with self.engine.begin() as conn:
+            await self.set_role(conn)
+            message_table = Message.table.__table__
+            message_id = await conn.scalar(
+                insert(message_table).values(**message).returning(message_table.c.id)
+            )
+            deferred = False
+            if groups:
+                audience = await conn.scalar(
+                    audience_statement(),
+                    {"group_ids": [group["group_id"] for group in groups]},
+                )
+                deferred = audience > self.async_threshold
+            if not deferred:
+                await self.insert_groups(conn, message_id, groups)
+            await self.insert_recipients(conn, message_id, to_users, cc_users)
+            if deferred:
+                # Inserted after the direct recipients so the groups are expanded later
+                await self.insert_groups(conn, message_id, groups)
+            else:
+                await self.mark_expanded(conn, message_id)
+        if deferred:
+            task = asyncio.create_task(self.expand(message_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return message_id
+
+    async def insert_groups(
+        self, conn: AsyncConnection, message_id: str, groups: list[dict[str, Any]]
+    ) -> None:
+        if groups:
+            await conn.execute(
+                insert(MessageGroupRecipient.table.__table__),
+                [{"message_id": message_id, **group} for group in groups],
+            )
+
+    async def insert_recipients(
+        self,
+        conn: AsyncConnection,
+        message_id: str,
+        to_users: list[str],
+        cc_users: list[str],
+    ) -> None:
+        # The addressed users first, they are excluded from the copied users
+        await conn.execute(
+            recipients_statement(),
+            {"message_id": message_id, "user_ids": to_users},
+        )
+        await conn.execute(
+            recipients_statement(copied=True),
+            {"message_id": message_id, "user_ids": cc_users},
+        )
+
+    async def mark_expanded(self, conn: AsyncConnection, message_id: str) -> None:
+        message = Message.table.__table__
+        await conn.execute(
+            update(message)
+            .where(message.c.id == message_id)
+            .values(expanded_at=func.now())
+        )
+
+    async def expand(self, message_id: str) -> None:
+        """Inserts the members of the message's groups as its recipients."""
+        try:
+            async with self.engine.begin() as conn:
+                await self.set_role(conn)
+                await self.insert_recipients(conn, message_id, [], [])
+                await self.mark_expanded(conn, message_id)
+        except Exception:
+            logger.exception("Recipients of message %s could not be expanded", message_id)
+
+    async def expand_pending(self) -> int:
+        """Expands the messages whose expansion did not complete, returns their number."""
+        message = Message.table.__table__
+        async with self.engine.begin() as conn:
+            await self.set_role(conn)
+            message_ids = (
+                await conn.scalars(
+                    select(message.c.id).where(message.c.expanded_at.is_(None))
+                )
+            ).all()
+        for message_id in message_ids:
+            await self.expand(message_id)
+        return len(message_ids)
@@ -0,0 +1,233 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import textwrap
+
+from typing import Callable
+
+from pydantic.dataclasses import dataclass
+
+from un0.database.sql_emitters import SQLEmitter
+from un0.authorization.rls_sql_emitters import RLSSQL
+
+
+# The recipient column of each recipient table, and if its recipients are copied
+RECIPIENT_COLUMNS = {
+    "message_addressed_to": ("addressed_to_id", False),
+    "message_copied_to": ("copied_to_id", True),
+}
+
+
+@dataclass
+class MessageThreadRootSQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        """
+        Emits the trigger that sets the thread_root_id of each inserted message,
+        the thread root of the message it replies to, or its own id when it starts
+        a thread, so the messages of a thread are found by one index range scan.
+
+        Triggers of the same event fire in the order of their names, the trigger
+        runs after message_insert_related_object_trigger has assigned NEW.id.
+
+        Returns:
+            str: The SQL statements to create the function and its trigger.
+        """
+        function_string = """
+            BEGIN
+                IF NEW.previous_message_id IS NULL THEN
+                    NEW.thread_root_id := NEW.id;
+                ELSE
+                    SELECT thread_root_id
+                    INTO NEW.thread_root_id
+                    FROM un0.message
+                    WHERE id = NEW.previous_message_id;
+                END IF;
+                RETURN NEW;
+            END;
+            """
+        return self.create_sql_function(
+            "set_thread_root",
+            function_string,
+            include_trigger=True,
+            timing="BEFORE",
+            operation="INSERT",
+            db_function=False,
+        )
+
+
+@dataclass
+class InboxItemSQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        """
+        Emits the statement level triggers that maintain un0.inbox_item from the
+        rows of a recipient table, reading the rows changed by each statement from
+        its transition tables, so a fan out to thousands of recipients updates the
+        inbox with one statement rather than a trigger call per row.
+
+        Returns:
+            str: The SQL statements to create the function and its triggers.
+        """
+        column, copied = RECIPIENT_COLUMNS[self.table_name]
+        function_string = f"""
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO un0.inbox_item
+                        (user_id, message_id, sent_at, flag, copied, read_at)
+                    SELECT
+                        changed.{column},
+                        message.id,
+                        message.sent_at,
+                        message.flag,
+                        {str(copied).lower()},
+                        CASE WHEN changed.read THEN coalesce(changed.read_at, now()) END
+                    FROM new_rows AS changed
+                    JOIN un0.message ON message.id = changed.message_id
+                    ON CONFLICT (user_id, message_id) DO NOTHING;
+                ELSIF TG_OP = 'UPDATE' THEN
+                    UPDATE un0.inbox_item
+                    SET read_at = CASE
+                        WHEN changed.read THEN coalesce(changed.read_at, inbox_item.read_at, now())
+                    END
+                    FROM new_rows AS changed
+                    WHERE inbox_item.user_id = changed.{column}
+                    AND inbox_item.message_id = changed.message_id
+                    AND (inbox_item.read_at IS NULL) = changed.read;
+                ELSE
+                    DELETE FROM un0.inbox_item
+                    USING old_rows AS changed
+                    WHERE inbox_item.user_id = changed.{column}
+                    AND inbox_item.message_id = changed.message_id;
+                END IF;
+                RETURN NULL;
+            END;
+            """
+        function_name = f"{self.table_name}_maintain_inbox"
+        function_sql = self.create_sql_function(
+            function_name,
+            function_string,
+            security_definer="SECURITY DEFINER",
+        )
+        return f"{function_sql}\n{statement_triggers(self, function_name)}"
+
+
+@dataclass
+class InboxUnreadSQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        """
+        Emits the statement level triggers that maintain the unread count of each
+        user in un0.inbox_unread from the changes to un0.inbox_item, an item being
+        unread while its read_at is NULL.
+
+        The counters are upserted in user_id order, so concurrent statements lock
+        them in the same order.
+
+        Returns:
+            str: The SQL statements to create the function and its triggers.
+        """
+        function_string = """
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO un0.inbox_unread (user_id, unread_count)
+                    SELECT user_id, count(*)
+                    FROM new_rows
+                    WHERE read_at IS NULL
+                    GROUP BY user_id
+                    ORDER BY user_id
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET unread_count = inbox_unread.unread_count + EXCLUDED.unread_count;
+                ELSIF TG_OP = 'UPDATE' THEN
+                    INSERT INTO un0.inbox_unread (user_id, unread_count)
+                    SELECT user_id, sum(delta)
+                    FROM (
+                        SELECT user_id, 1 AS delta FROM new_rows WHERE read_at IS NULL
+                        UNION ALL
+                        SELECT user_id, -1 AS delta FROM old_rows WHERE read_at IS NULL
+                    ) AS changed
+                    GROUP BY user_id
+                    HAVING sum(delta) <> 0
+                    ORDER BY user_id
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET unread_count = inbox_unread.unread_count + EXCLUDED.unread_count;
+                ELSE
+                    UPDATE un0.inbox_unread
+                    SET unread_count = inbox_unread.unread_count - changed.unread_count
+                    FROM (
+                        SELECT user_id, count(*) AS unread_count
+                        FROM old_rows
+                        WHERE read_at IS NULL
+                        GROUP BY user_id
+                    ) AS changed
+                    WHERE inbox_unread.user_id = changed.user_id;
+                END IF;
+                RETURN NULL;
+            END;
+            """
+        function_sql = self.create_sql_function(
+            "count_inbox_unread",
+            function_string,
+            security_definer="SECURITY DEFINER",
+        )
+        return f"{function_sql}\n{statement_triggers(self, 'count_inbox_unread')}"
+
+
+def statement_triggers(emitter: SQLEmitter, function_name: str) -> str:
+    """
+    Returns the insert, update and delete statement level triggers of the
+    emitter's table, with their transition tables, executing the function.
+    """
+    return textwrap.dedent(
+        f"""
+        CREATE OR REPLACE TRIGGER {emitter.table_name}_{function_name}_insert_trigger
+            AFTER INSERT
+            ON {emitter.schema_name}.{emitter.table_name}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION {emitter.schema_name}.{function_name}();
+        CREATE OR REPLACE TRIGGER {emitter.table_name}_{function_name}_update_trigger
+            AFTER UPDATE
+            ON {emitter.schema_name}.{emitter.table_name}
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION {emitter.schema_name}.{function_name}();
+        CREATE OR REPLACE TRIGGER {emitter.table_name}_{function_name}_delete_trigger
+            AFTER DELETE
+            ON {emitter.schema_name}.{emitter.table_name}
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION {emitter.schema_name}.{function_name}();
+        """
+    )
+
+
+def inbox_select_policy_sql(schema_name, table_name):
+    return textwrap.dedent(
+        f"""
+        /*
+        The policy to allow:
+            Superusers to select all records;
+            All other users to select only their own records;
+        */
+        CREATE POLICY inbox_select_policy
+        ON {schema_name}.{table_name} FOR SELECT
+        USING (
+            current_setting('rls_var.is_superuser', true)::BOOLEAN OR
+            user_id = current_setting('rls_var.user_id', true)::TEXT
+        );
+        """
+    )
+
+
+@dataclass
+class InboxRLSSQL(RLSSQL):
+    """
+    Users read only their own inbox. The inbox is written only by its triggers,
+    which run as the table owner, so no write policy is created and RLS is not
+    forced on the owner.
+    """
+
+    select_policy: Callable = inbox_select_policy_sql
+    insert_policy: str = ""
+    update_policy: str = ""
+    delete_policy: str = ""
+    force_rls: bool = False
@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import hashlib
+import os
+import uuid
+
+from pathlib import Path
+from typing import AsyncIterable, BinaryIO
+
+from un0.errors import AttachmentTooLargeError
+from un0.config import settings
+
+
+class ContentStore:
+    """
+    A local store of attachment contents, addressed by their sha256.
+
+    Contents are streamed to a temporary file of the store, hashed as they are
+    written, then moved to the path of their hash, {hash[:2]}/{hash[2:4]}/{hash}.
+    A content already stored is not written again, identical attachments share
+    one file. Files are only moved into place once complete, a reader never sees
+    a partial file.
+
+    Writes and hashing run in a thread, hashlib releasing the GIL for large
+    chunks, so the event loop only waits on the stream.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path = settings.ATTACHMENT_DIR,
+        max_size: int | None = settings.ATTACHMENT_MAX_SIZE,
+    ) -> None:
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def path(self, content_hash: str) -> Path:
+        """Returns the path of the content with the hash."""
+        return self.directory / content_hash[:2] / content_hash[2:4] / content_hash
+
+    def exists(self, content_hash: str) -> bool:
+        return self.path(content_hash).is_file()
+
+    async def write(self, chunks: AsyncIterable[bytes]) -> tuple[str, int]:
+        """
+        Stores the content streamed in chunks.
+
+        Returns:
+            tuple[str, int]: The sha256 hex digest and size of the content.
+
+        Raises:
+            AttachmentTooLargeError: If the content is larger than max_size, nothing
+                is stored.
+        """
+        temp_directory = self.directory / "tmp"
+        await asyncio.to_thread(temp_directory.mkdir, parents=True, exist_ok=True)
+        temp_path = temp_directory / uuid.uuid4().hex
+        hasher = hashlib.sha256()
+        size = 0
+        file = await asyncio.to_thread(open, temp_path, "wb")
+        try:
+            try:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if self.max_size is not None and size > self.max_size:
+                        raise AttachmentTooLargeError(
+                            f"Attachment larger than {self.max_size} bytes",
+                            "ATTACHMENT_TOO_LARGE",
+                        )
+                    await asyncio.to_thread(_write_chunk, file, hasher, chunk)
+            finally:
+                await asyncio.to_thread(file.close)
+            content_hash = hasher.hexdigest()
+            await asyncio.to_thread(self._store, temp_path, content_hash)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return content_hash, size
+
+    def _store(self, temp_path: Path, content_hash: str) -> None:
+        path = self.path(content_hash)
+        if path.is_file():
+            # Already stored, identical contents are kept once
+            temp_path.unlink()
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temp_path, path)
+
+
+def _write_chunk(file: BinaryIO, hasher: "hashlib._Hash", chunk: bytes) -> None:
+    hasher.update(chunk)
+    file.write(chunk)
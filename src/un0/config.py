@@ -28,6 +28,89 @@ class General(BaseSettings):
     DEFAULT_LIMIT: int = 100
     DEFAULT_OFFSET: int = 0
     DEFAULT_PAGE_SIZE: int = 25
+    # number of rows fetched per round trip by server side cursors
+    DEFAULT_YIELD_PER: int = 1000
+    # number of records sent per statement by bulk operations
+    DEFAULT_BULK_CHUNK_SIZE: int = 5000
+    # lock timeout (in milliseconds) and retries of each chunk of a bulk update or delete
+    BULK_LOCK_TIMEOUT: int = 2000
+    BULK_LOCK_RETRIES: int = 3
+    # bytes of CSV or NDJSON buffered before they are sent by the export endpoints,
+    # and the rows of each row group of a parquet export
+    EXPORT_CHUNK_SIZE: int = 65536
+    EXPORT_ROW_GROUP_SIZE: int = 10000
+
+    # RESULT CACHE SETTINGS
+    # backend is one of "lru" (in-process), "socket" (local socket server), or "none"
+    CACHE_BACKEND: str = "lru"
+    CACHE_MAX_ENTRIES: int = 10000
+    CACHE_SOCKET_PATH: str = "/tmp/un0_cache.sock"
+    CACHE_NOTIFY_CHANNEL: str = "un0_table_version"
+    # channel on which schema changes (migrations) are published
+    SCHEMA_NOTIFY_CHANNEL: str = "un0_schema_change"
+
+    # HISTORY TABLE SETTINGS
+    # monthly partitions created ahead of the current month
+    HISTORY_PARTITIONS_AHEAD: int = 2
+    # months of history kept, older partitions are detached, 0 keeps all history
+    HISTORY_RETENTION_MONTHS: int = 0
+    # whether detached partitions are dropped rather than kept as standalone tables
+    HISTORY_DROP_DETACHED: bool = False
+    # directory of the audit exports, and the number of units exported in parallel
+    AUDIT_EXPORT_DIR: str = "audit_export"
+    AUDIT_EXPORT_WORKERS: int = 4
+
+    # WORKFLOW SETTINGS
+    # number of events claimed per batch, and the maximum leased at once per tenant,
+    # a soft limit that concurrent claims of several workers may briefly exceed
+    WORKFLOW_BATCH_SIZE: int = 100
+    WORKFLOW_TENANT_CONCURRENCY: int = 10
+    # seconds after which the events of a stopped worker are claimed again
+    WORKFLOW_LEASE_SECONDS: int = 300
+    # attempts before a failing event is abandoned, and the backoff (in seconds) of the first retry
+    WORKFLOW_MAX_ATTEMPTS: int = 5
+    WORKFLOW_RETRY_BACKOFF: float = 30.0
+    # seconds between polls of an idle worker, doubled up to the maximum
+    WORKFLOW_POLL_INTERVAL: float = 1.0
+    WORKFLOW_MAX_POLL_INTERVAL: float = 30.0
+    # channel on which the rows changed by a statement are published for DB_EVENT workflows,
+    # and the seconds during which they are coalesced before their events are created
+    WORKFLOW_NOTIFY_CHANNEL: str = "un0_workflow_change"
+    WORKFLOW_DISPATCH_WINDOW: float = 0.2
+    # flushes of a change failing other than by a lost connection before it is dropped
+    WORKFLOW_DISPATCH_MAX_FAILURES: int = 3
+    # channel on which the creation of workflow events is published to wake the workers
+    WORKFLOW_READY_CHANNEL: str = "un0_workflow_ready"
+    # days before their due date open workflow records are at risk, and the seconds
+    # between recomputations of their statuses
+    WORKFLOW_AT_RISK_DAYS: int = 2
+    WORKFLOW_STATUS_INTERVAL: float = 3600.0
+    # processes running the cpu bound object functions of a worker (one per core if None),
+    # the jobs sent to them per task, and the seconds after which a call times out
+    OBJECT_FUNCTION_PROCESSES: int | None = None
+    OBJECT_FUNCTION_BATCH_SIZE: int = 20
+    OBJECT_FUNCTION_TIMEOUT: float = 60.0
+    # modules imported by the workflow workers, and their pool processes, which register
+    # the object functions with @object_function
+    OBJECT_FUNCTION_MODULES: list[str] = []
+
+    # MESSAGE SETTINGS
+    # members of the groups a message is sent to above which they are expanded in the background
+    MESSAGE_ASYNC_FANOUT_THRESHOLD: int = 1000
+    # levels of replies below the first message of a thread returned by the thread endpoint
+    MESSAGE_THREAD_MAX_DEPTH: int = 100
+    # directory of the content addressed attachment store, and the maximum size (in bytes)
+    # of an uploaded attachment, unlimited if None
+    ATTACHMENT_DIR: str = "attachments"
+    ATTACHMENT_MAX_SIZE: int | None = 100 * 1024 * 1024
+
+    # REPORT SETTINGS
+    # maximum number of groups returned by a report
+    REPORT_MAX_ROWS: int = 10000
+    # seconds after which the runs of a stopped report worker are claimed again,
+    # and the seconds between polls of an idle report worker
+    REPORT_LEASE_SECONDS: int = 900
+    REPORT_POLL_INTERVAL: float = 5.0
 
     # SECURITY SETTINGS
     # jwt related settings
@@ -40,6 +40,10 @@ POSTGRES_INDEXES_NAMING_CONVENTION = {
     "pk": "pk_%(table_name)s",
 }
 
+# The predicate of the rows that are not soft deleted (ActiveDeletedMixin),
+# the indexes of soft deleting models are restricted to these rows
+LIVE_ROWS_WHERE = "NOT is_deleted"
+
 # Creates the metadata object, used to define the database tables
 metadata = MetaData(
     naming_convention=POSTGRES_INDEXES_NAMING_CONVENTION,
@@ -0,0 +1,416 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import secrets
+import socket
+import struct
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any
+
+from pydantic.dataclasses import dataclass
+
+from sqlalchemy import select, func, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from un0.database.base import engine as default_engine
+from un0.database.listener import NotificationListener
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# The tables that row level security policies read from.
+# Every cached result depends on them, so a change in group or role membership
+# invalidates the results cached for every model.
+RLS_DEPENDENCY_TABLES = [
+    "un0.user",
+    "un0.group",
+    "un0.user_group_role",
+    "un0.role_table_operation",
+]
+
+
+@dataclass(frozen=True)
+class PermissionContext:
+    """
+    The effective permission context of a database session, as set by un0.authorize_user.
+
+    Cached results are only served to sessions with an identical context, which ensures
+    that the row level security policies that produced the result apply to the reader.
+
+    Attributes:
+        user_id (str | None): The id of the authorized user.
+        tenant_id (str | None): The id of the user's tenant.
+        is_superuser (bool): Whether the user is a superuser.
+        is_tenant_admin (bool): Whether the user is a tenant admin.
+        role_name (str): The database role the session was set to.
+    """
+
+    user_id: str | None = None
+    tenant_id: str | None = None
+    is_superuser: bool = False
+    is_tenant_admin: bool = False
+    role_name: str = "reader"
+
+    @classmethod
+    async def from_session(
+        cls, db: AsyncSession, role_name: str = "reader"
+    ) -> "PermissionContext":
+        """
+        Reads the row level security session variables set by un0.authorize_user.
+
+        Args:
+            db (AsyncSession): A session on which un0.authorize_user has been executed.
+            role_name (str): The role passed to un0.authorize_user. Defaults to "reader".
+
+        Returns:
+            PermissionContext: The permission context of the session.
+        """
+        result = await db.execute(
+            select(
+                func.current_setting("rls_var.user_id", True),
+                func.current_setting("rls_var.tenant_id", True),
+                func.current_setting("rls_var.is_superuser", True),
+                func.current_setting("rls_var.is_tenant_admin", True),
+            )
+        )
+        user_id, tenant_id, is_superuser, is_tenant_admin = result.one()
+        return cls(
+            user_id=user_id or None,
+            tenant_id=tenant_id or None,
+            is_superuser=str(is_superuser).lower() == "true",
+            is_tenant_admin=str(is_tenant_admin).lower() == "true",
+            role_name=role_name,
+        )
+
+
+def cache_key(
+    model_name: str,
+    mask_name: str,
+    context: PermissionContext,
+    params: dict[str, Any] | None = None,
+) -> str:
+    """
+    Creates the cache key for a query result.
+
+    Args:
+        model_name (str): The name of the queried model.
+        mask_name (str): The name of the mask used to select the fields.
+        context (PermissionContext): The permission context of the session.
+        params (dict[str, Any] | None): The query parameters. Defaults to None.
+
+    Returns:
+        str: A sha256 hex digest of the key components.
+    """
+    components = [
+        model_name,
+        mask_name,
+        context.user_id,
+        context.tenant_id,
+        context.is_superuser,
+        context.is_tenant_admin,
+        context.role_name,
+        params or {},
+    ]
+    return hashlib.sha256(
+        json.dumps(components, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class TableVersions:
+    """
+    Tracks the latest version of each table, as published by un0.bump_table_version.
+
+    Versions are only known while a listener is connected. On each (re)connection the
+    current value of un0.table_version_seq is read, once LISTEN has been issued, as
+    the floor of the versions: the version of a table is the latest of the floor and
+    of the versions notified for it, the writes it names are committed.
+
+    The versions are taken from a single sequence, so the snapshots of processes
+    sharing a cache (the "socket" backend) are comparable whenever each process
+    connected. A notification at or below the version of its table, from a
+    transaction that took its version before an other one, or the floor, was read
+    and committed after it, gives the table a random negative version, which no
+    other snapshot matches, until a later version is notified.
+    """
+
+    def __init__(self, engine: AsyncEngine = default_engine) -> None:
+        self.engine = engine
+        self.versions: dict[str, int] = {}
+        # The tables whose last notification was out of order, with their random version
+        self.reordered: dict[str, int] = {}
+        self.floor = 0
+        self.enabled = False
+
+    async def seed(self) -> None:
+        """Reads the floor of the versions and starts tracking them."""
+        async with self.engine.connect() as conn:
+            await conn.execute(text(f"SET ROLE {settings.DB_NAME}_reader"))
+            floor = await conn.scalar(text("SELECT last_value FROM un0.table_version_seq"))
+        self.connected(floor)
+
+    def connected(self, floor: int = 0) -> None:
+        # Notifications received while the floor was read are kept
+        self.floor = floor
+        self.enabled = True
+
+    def disconnected(self) -> None:
+        self.enabled = False
+        self.versions.clear()
+        self.reordered.clear()
+
+    def notify(self, payload: str) -> None:
+        """
+        Records a version published by un0.bump_table_version.
+
+        Args:
+            payload (str): The notification payload, "<schema>.<table>:<version>".
+        """
+        table_name, _, version = payload.rpartition(":")
+        try:
+            version = int(version)
+        except ValueError:
+            logger.warning("Invalid table version notification: %s", payload)
+            return
+        if version > self.version(table_name):
+            self.versions[table_name] = version
+            self.reordered.pop(table_name, None)
+        else:
+            # Committed out of order, the state of the table is one no version names
+            self.reordered[table_name] = -secrets.randbits(62) - 1
+
+    def version(self, table_name: str) -> int:
+        return max(self.versions.get(table_name, 0), self.floor)
+
+    def snapshot(self, table_names: list[str]) -> tuple[int, ...] | None:
+        """
+        Returns the current versions of the tables, or None if versions are not being tracked.
+
+        Take the snapshot before running the query whose result is cached, so that a write
+        committed while the query runs makes the cached result stale rather than current.
+        """
+        if not self.enabled:
+            return None
+        return tuple(
+            self.reordered.get(table_name) or self.version(table_name)
+            for table_name in sorted(set(table_names + RLS_DEPENDENCY_TABLES))
+        )
+
+    def install(self, listener: NotificationListener) -> None:
+        listener.subscribe(settings.CACHE_NOTIFY_CHANNEL, self.notify)
+        listener.on_connect.append(self.seed)
+        listener.on_disconnect.append(self.disconnected)
+
+
+class ResultCache(ABC):
+    """
+    Abstract base class for query result caches.
+
+    Entries are stored along with the snapshot of table versions taken before the query
+    was run, an entry is only returned if the snapshot still matches the current versions.
+    Cached values must never be None, None is returned on a cache miss.
+    """
+
+    def __init__(self, versions: TableVersions) -> None:
+        self.versions = versions
+
+    def snapshot(self, table_names: list[str]) -> tuple[int, ...] | None:
+        return self.versions.snapshot(table_names)
+
+    async def get(self, key: str, snapshot: tuple[int, ...] | None) -> Any | None:
+        if snapshot is None:
+            return None
+        return await self._get(key, snapshot)
+
+    async def set(self, key: str, value: Any, snapshot: tuple[int, ...] | None) -> None:
+        if snapshot is None or value is None:
+            return
+        await self._set(key, value, snapshot)
+
+    @abstractmethod
+    async def _get(self, key: str, snapshot: tuple[int, ...]) -> Any | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _set(self, key: str, value: Any, snapshot: tuple[int, ...]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+
+class LRUStore:
+    """A least recently used store of (snapshot, value) entries."""
+
+    def __init__(self, max_entries: int = settings.CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[tuple[int, ...], Any]] = OrderedDict()
+
+    def get(self, key: str, snapshot: tuple[int, ...]) -> Any | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] != snapshot:
+            # The entry is stale, it can never become current again
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: str, value: Any, snapshot: tuple[int, ...]) -> None:
+        self.entries[key] = (snapshot, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+class LRUCache(ResultCache):
+    """An in-process least recently used result cache."""
+
+    def __init__(
+        self, versions: TableVersions, max_entries: int = settings.CACHE_MAX_ENTRIES
+    ) -> None:
+        super().__init__(versions)
+        self.store = LRUStore(max_entries)
+
+    async def _get(self, key: str, snapshot: tuple[int, ...]) -> Any | None:
+        return self.store.get(key, snapshot)
+
+    async def _set(self, key: str, value: Any, snapshot: tuple[int, ...]) -> None:
+        self.store.set(key, value, snapshot)
+
+    async def clear(self) -> None:
+        self.store.clear()
+
+
+# Local socket protocol, each message is a 4 byte big endian length followed by a pickle.
+# The socket is created with 0600 permissions, only processes of the same user can use it.
+_HEADER = struct.Struct(">I")
+
+
+async def _send(writer: asyncio.StreamWriter, message: Any) -> None:
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(_HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+
+async def _receive(reader: asyncio.StreamReader) -> Any:
+    header = await reader.readexactly(_HEADER.size)
+    (length,) = _HEADER.unpack(header)
+    return pickle.loads(await reader.readexactly(length))
+
+
+async def serve_cache(
+    path: str = settings.CACHE_SOCKET_PATH,
+    max_entries: int = settings.CACHE_MAX_ENTRIES,
+) -> asyncio.AbstractServer:
+    """
+    Starts a local socket cache server, shared by the api processes on a host.
+
+    Args:
+        path (str): The path of the unix socket. Defaults to settings.CACHE_SOCKET_PATH.
+        max_entries (int): The maximum number of entries. Defaults to settings.CACHE_MAX_ENTRIES.
+
+    Returns:
+        asyncio.AbstractServer: The running server.
+    """
+    store = LRUStore(max_entries)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                operation, *args = await _receive(reader)
+                if operation == "get":
+                    await _send(writer, store.get(*args))
+                elif operation == "set":
+                    store.set(*args)
+                elif operation == "clear":
+                    store.clear()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    # The socket file is created readable by its owner only, entries are unpickled
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    except BaseException:
+        sock.close()
+        raise
+    finally:
+        os.umask(umask)
+    return await asyncio.start_unix_server(handle, sock=sock)
+
+
+class SocketCache(ResultCache):
+    """
+    A result cache client for the local socket server started by serve_cache.
+
+    Errors communicating with the server are logged and treated as cache misses.
+    """
+
+    def __init__(
+        self, versions: TableVersions, path: str = settings.CACHE_SOCKET_PATH
+    ) -> None:
+        super().__init__(versions)
+        self.path = path
+        self.lock = asyncio.Lock()
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+
+    async def _request(self, message: tuple, reply: bool = False) -> Any | None:
+        async with self.lock:
+            try:
+                if self.writer is None:
+                    self.reader, self.writer = await asyncio.open_unix_connection(
+                        self.path
+                    )
+                await _send(self.writer, message)
+                if reply:
+                    return await _receive(self.reader)
+            except (OSError, asyncio.IncompleteReadError, pickle.PickleError):
+                logger.exception("Result cache socket request failed")
+                if self.writer is not None:
+                    self.writer.close()
+                self.reader = self.writer = None
+            return None
+
+    async def _get(self, key: str, snapshot: tuple[int, ...]) -> Any | None:
+        return await self._request(("get", key, snapshot), reply=True)
+
+    async def _set(self, key: str, value: Any, snapshot: tuple[int, ...]) -> None:
+        await self._request(("set", key, value, snapshot))
+
+    async def clear(self) -> None:
+        await self._request(("clear",))
+
+
+def create_result_cache(
+    versions: TableVersions, backend: str = settings.CACHE_BACKEND
+) -> ResultCache | None:
+    if backend == "lru":
+        return LRUCache(versions)
+    if backend == "socket":
+        return SocketCache(versions)
+    return None
+
+
+table_versions = TableVersions()
+result_cache = create_result_cache(table_versions)
@@ -95,3 +95,33 @@ class Cardinality(str, enum.Enum):
     MANY_TO_ONE = "many_to_one"  # Reverse of FKDefinition without unique constraint
     MANY_TO_MANY = "many_to_many"  # To edge of relationship
     REV_MANY_TO_MANY = "rev_many_to_many"  # from edge of many to many relationship
+
+
+class HistorySource(str, enum.Enum):
+    """
+    The audit data from which rows are rebuilt as of a point in time.
+
+    Attributes:
+        HISTORY_TABLE (str): The partitioned history table created by HistoryTableAuditSQL.
+        RECORD_VERSION (str): The supa_audit record_version table, for tables tracked by
+            RecordVersionAuditSQL.
+    """
+
+    HISTORY_TABLE = "history_table"
+    RECORD_VERSION = "record_version"
+
+
+class ExportFormat(str, enum.Enum):
+    """
+    The formats of the exports streamed by the export endpoints of the models.
+
+    Attributes:
+        CSV (str): Comma separated values, with a header row, written by the database.
+        NDJSON (str): One JSON object per line, each row encoded by the database.
+        PARQUET (str): A parquet file, in row groups of settings.EXPORT_ROW_GROUP_SIZE
+            rows, requires pyarrow.
+    """
+
+    CSV = "csv"
+    NDJSON = "ndjson"
+    PARQUET = "parquet"
@@ -0,0 +1,301 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import io
+import json
+
+from functools import cache
+from typing import Any, AsyncIterator, Iterable
+
+from psycopg import postgres
+from sqlalchemy import ColumnElement, Dialect, Select, Table
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from un0.errors import ExportError
+from un0.database.enums import ExportFormat
+from un0.config import settings
+
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.PARQUET: "application/vnd.apache.parquet",
+}
+
+
+def export_value(value: Any) -> Any:
+    """Returns the value as written to the files, json and arrays as JSON text."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+
+# The arrow types of the postgres types, by name, as the pyarrow factory and its
+# arguments, the other types (numeric, json, arrays, enums...) are written as text
+ARROW_TYPES: dict[str, tuple[Any, ...]] = {
+    "bool": ("bool_",),
+    "int2": ("int16",),
+    "int4": ("int32",),
+    "int8": ("int64",),
+    "float4": ("float32",),
+    "float8": ("float64",),
+    "bytea": ("binary",),
+    "date": ("date32",),
+    "time": ("time64", "us"),
+    "timestamp": ("timestamp", "us"),
+    "timestamptz": ("timestamp", "us", "UTC"),
+    "interval": ("duration", "us"),
+}
+
+
+def arrow_schema(columns: list[str], types: list[int]) -> Any:
+    """
+    Returns the arrow schema of the columns, from the oids of their postgres types,
+    so the type of a column does not depend on the values of its first rows.
+    Requires pyarrow.
+    """
+    import pyarrow
+
+    fields = []
+    for name, oid in zip(columns, types):
+        info = postgres.types.get(oid)
+        factory, *args = ARROW_TYPES.get(info.name if info else "", ("string",))
+        fields.append((name, getattr(pyarrow, factory)(*args)))
+    return pyarrow.schema(fields)
+
+
+def arrow_values(values: Iterable[Any], arrow_type: Any) -> list[Any]:
+    """Returns the values of a column, as text for the columns written as text."""
+    import pyarrow
+
+    if not pyarrow.types.is_string(arrow_type):
+        return list(values)
+    return [
+        value if value is None or isinstance(value, str) else str(export_value(value))
+        for value in values
+    ]
+
+
+def copy_source(stmt: Select, dialect: Dialect) -> tuple[str, dict[str, Any]]:
+    """
+    Returns the SQL of the statement and its parameters, as the source of a COPY,
+    which can not be prepared, so its parameters are bound by psycopg on the client.
+    """
+    compiled = stmt.compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    return compiled.string, compiled.params
+
+
+def copy_statement(sql: str, export_format: ExportFormat) -> str:
+    """
+    Returns the COPY of the rows selected by sql, CSV written by the database, one
+    JSON document per row for NDJSON and the binary rows otherwise.
+    """
+    if export_format == ExportFormat.CSV:
+        return f"COPY ({sql}) TO STDOUT (FORMAT CSV, HEADER)"
+    if export_format == ExportFormat.NDJSON:
+        return (
+            "COPY (SELECT convert_to(row_to_json(export)::TEXT || E'\\n', 'UTF8') "
+            f"FROM ({sql}) AS export) TO STDOUT (FORMAT BINARY)"
+        )
+    return f"COPY ({sql}) TO STDOUT (FORMAT BINARY)"
+
+
+@cache
+def query_compiler() -> Any:
+    # The queries of un0.filters are Models, whose module imports this one
+    from un0.filters.compiler import QueryCompiler
+
+    return QueryCompiler()
+
+
+async def query_predicate(
+    conn: AsyncConnection, query_id: str, table: Table
+) -> ColumnElement:
+    """
+    Returns the compiled predicate of the saved query.
+
+    Raises:
+        QueryCompileError: If the query is not found or can not be compiled.
+        ExportError: If the query selects the rows of another table.
+    """
+    queried, predicate = await query_compiler().predicate(conn, query_id)
+    if queried.fullname != table.fullname:
+        raise ExportError(
+            f"Query {query_id} does not query {table.fullname}", "QUERY_TABLE_MISMATCH"
+        )
+    return predicate
+
+
+class ExportSink(io.RawIOBase):
+    """
+    The file a parquet export is written to, which keeps the bytes written since
+    they were last drained, and the position in the whole file.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks: list[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self.chunks.append(chunk)
+        self.position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ParquetStreamWriter:
+    """
+    Writes rows to a zstd compressed parquet file one row group at a time, and
+    returns the bytes of the file each row group adds, so the file is sent as it
+    is written. The schema is that of the postgres types of the columns.
+    Requires pyarrow.
+    """
+
+    def __init__(self, columns: list[str], types: list[int]) -> None:
+        import pyarrow.parquet
+
+        self.schema = arrow_schema(columns, types)
+        self.sink = ExportSink()
+        self.writer = pyarrow.parquet.ParquetWriter(
+            self.sink, self.schema, compression="zstd"
+        )
+
+    def write(self, rows: list[tuple[Any, ...]]) -> bytes:
+        import pyarrow
+
+        batch = pyarrow.Table.from_arrays(
+            [
+                pyarrow.array(arrow_values(values, field.type), type=field.type)
+                for field, values in zip(self.schema, zip(*rows))
+            ],
+            schema=self.schema,
+        )
+        self.writer.write_table(batch)
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+class Exporter:
+    """
+    Streams the rows of select statements as files, read by a COPY ... TO STDOUT
+    on the connection of the request, so the rows are those its row level security
+    allows.
+
+    The export is an async iterator of chunks, the next chunk is only read from
+    the database once the previous one has been sent, so memory is bounded by
+    chunk_size bytes, or row_group_size rows for parquet, whatever the number of
+    rows exported.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = settings.EXPORT_CHUNK_SIZE,
+        row_group_size: int = settings.EXPORT_ROW_GROUP_SIZE,
+    ) -> None:
+        self.chunk_size = chunk_size
+        self.row_group_size = row_group_size
+
+    def check_format(self, export_format: ExportFormat) -> None:
+        """
+        Raises:
+            ExportError: If the format requires a package that is not installed.
+        """
+        if export_format == ExportFormat.PARQUET:
+            try:
+                import pyarrow.parquet  # noqa: F401
+            except ImportError:
+                raise ExportError(
+                    "The parquet format requires pyarrow to be installed",
+                    "PARQUET_NOT_AVAILABLE",
+                )
+
+    async def stream(
+        self, conn: AsyncConnection, stmt: Select, export_format: ExportFormat
+    ) -> AsyncIterator[bytes]:
+        """
+        Streams the rows of the statement in the format.
+
+        Args:
+            conn (AsyncConnection): The connection of the request, on which
+                un0.authorize_user has been called.
+            stmt (Select): The statement selecting the rows exported.
+            export_format (ExportFormat): The format of the file.
+
+        Yields:
+            bytes: The chunks of the file.
+        """
+        sql, params = copy_source(stmt, conn.dialect)
+        raw_connection = await conn.get_raw_connection()
+        async with raw_connection.driver_connection.cursor() as cur:
+            if export_format == ExportFormat.PARQUET:
+                chunks = self.parquet_chunks(cur, sql, params)
+            else:
+                chunks = self.copy_chunks(cur, sql, params, export_format)
+            async for chunk in chunks:
+                yield chunk
+
+    async def copy_chunks(
+        self, cur: Any, sql: str, params: dict[str, Any], export_format: ExportFormat
+    ) -> AsyncIterator[bytes]:
+        """
+        Yields the CSV or NDJSON written by the database, buffered into chunks of
+        at least chunk_size bytes, the last one excepted.
+        """
+        buffer = bytearray()
+        async with cur.copy(copy_statement(sql, export_format), params) as copy:
+            if export_format == ExportFormat.CSV:
+                async for data in copy:
+                    buffer += data
+                    if len(buffer) >= self.chunk_size:
+                        yield bytes(buffer)
+                        buffer.clear()
+            else:
+                copy.set_types(["bytea"])
+                async for (line,) in copy.rows():
+                    buffer += line
+                    if len(buffer) >= self.chunk_size:
+                        yield bytes(buffer)
+                        buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+    async def parquet_chunks(
+        self, cur: Any, sql: str, params: dict[str, Any]
+    ) -> AsyncIterator[bytes]:
+        """
+        Yields the parquet file, one row group of row_group_size rows at a time,
+        encoded in a thread so the event loop is not blocked.
+        """
+        # Binary COPY needs the type of each column to decode the rows
+        await cur.execute(f"SELECT * FROM ({sql}) AS export LIMIT 0", params)
+        columns = [column.name for column in cur.description]
+        types = [column.type_code for column in cur.description]
+        writer = ParquetStreamWriter(columns, types)
+        rows: list[tuple[Any, ...]] = []
+        async with cur.copy(copy_statement(sql, ExportFormat.PARQUET), params) as copy:
+            copy.set_types(types)
+            async for row in copy.rows():
+                rows.append(row)
+                if len(rows) == self.row_group_size:
+                    yield await asyncio.to_thread(writer.write, rows)
+                    rows = []
+        if rows:
+            yield await asyncio.to_thread(writer.write, rows)
+        yield await asyncio.to_thread(writer.close)
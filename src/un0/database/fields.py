@@ -10,6 +10,7 @@ from pydantic.dataclasses import dataclass
 
 from sqlalchemy import (
     Table,
+    text,
     ForeignKey,
     Index,
     UniqueConstraint,
@@ -55,6 +56,8 @@ class UniqueDefinition:
     Attributes:
         columns (list[str]): A list of column names that the unique constraint applies to.
         name (str | None): The name of the unique constraint. Defaults to None.
+        nulls_not_distinct (bool): Whether NULLs are equal to each other in the
+            constraint, so a row with NULL columns conflicts with another. Defaults to False.
 
     Methods:
         create_constraint() -> UniqueConstraint:
@@ -63,6 +66,7 @@ class UniqueDefinition:
 
     columns: list[str]
     name: str | None = None
+    nulls_not_distinct: bool = False
 
     def create_constraint(self) -> UniqueConstraint:
         """
@@ -71,7 +75,32 @@ class UniqueDefinition:
         Returns:
             UniqueConstraint: An instance of UniqueConstraint with the specified columns and name.
         """
-        return UniqueConstraint(*self.columns, name=self.name)
+        return UniqueConstraint(
+            *self.columns,
+            name=self.name,
+            postgresql_nulls_not_distinct=self.nulls_not_distinct or None,
+        )
+
+    def create_index(self, table: Table, where: Any = None) -> Index:
+        """
+        Creates a unique index on the columns, in place of the unique constraint,
+        for models whose indexes are partial (a unique constraint cannot be).
+
+        Args:
+            table (Table): The table of the columns.
+            where (Any): The predicate of the indexed rows. Defaults to None.
+
+        Returns:
+            Index: A unique Index object, partial if where is given.
+        """
+        cols = [table.c[column] for column in self.columns]
+        return Index(
+            self.name,
+            *cols,
+            unique=True,
+            postgresql_where=where,
+            postgresql_nulls_not_distinct=self.nulls_not_distinct or None,
+        )
 
 
 @dataclass
@@ -110,6 +139,8 @@ class IndexDefinition:
     Attributes:
         columns (list[str]): A list of column names that are part of the index.
         name (str | None): The name of the index. Defaults to None.
+        where (str | None): The predicate of the indexed rows, for a partial index
+            on a model without a partial_index_where. Defaults to None.
 
     Methods:
         create_index() -> Index:
@@ -118,14 +149,20 @@ class IndexDefinition:
 
     columns: list[str]
     name: str | None = None
+    where: str | None = None
 
-    def create_index(self, table: Table) -> Index:
+    def create_index(self, table: Table, where: Any = None) -> Index:
         """
         Creates and returns an Index object.
 
         This method constructs an Index object using the name and columns
         attributes of the instance.
 
+        Args:
+            table (Table): The table of the columns.
+            where (Any): The predicate of the indexed rows, for a partial index.
+                Defaults to None, the index definition's own where.
+
         Returns:
             Index: The created Index object.
         """
@@ -133,8 +170,10 @@ class IndexDefinition:
             if column not in table.columns:
                 raise ValueError(f"Column {column} not found in table {table.name}")
         cols = [table.c[column] for column in self.columns]
+        if where is None and self.where is not None:
+            where = text(self.where)
 
-        return Index(self.name, *cols)
+        return Index(self.name, *cols, postgresql_where=where)
 
 
 @dataclass
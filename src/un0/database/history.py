@@ -0,0 +1,193 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import datetime
+
+from functools import cache
+from typing import Any, Iterable
+
+from sqlalchemy import (
+    Table,
+    TableClause,
+    Select,
+    BIGINT,
+    TEXT,
+    table,
+    column,
+    select,
+    func,
+    cast,
+    literal,
+    bindparam,
+    or_,
+    not_,
+)
+from sqlalchemy.dialects.postgresql import (
+    ARRAY,
+    JSONB,
+    REGCLASS,
+    TIMESTAMP,
+    UUID,
+    array,
+    distinct_on,
+)
+
+from un0.database.enums import HistorySource
+from un0.database.sql_emitters import (
+    SQLEmitter,
+    HistoryTableAuditSQL,
+    RecordVersionAuditSQL,
+)
+
+
+# The supa_audit table of record versions, see RecordVersionAuditSQL
+record_version = table(
+    "record_version",
+    column("id", BIGINT),
+    column("record_id", UUID),
+    column("old_record_id", UUID),
+    column("op", TEXT),
+    column("ts", TIMESTAMP(timezone=True)),
+    column("table_oid"),
+    column("record", JSONB),
+    schema="audit",
+)
+
+
+def history_source(sql_emitters: Iterable[type[SQLEmitter]]) -> HistorySource | None:
+    """
+    Returns the audit data a model's rows can be rebuilt from, given its sql_emitters,
+    preferring the history table, or None if the model is not audited.
+    """
+    if HistoryTableAuditSQL in sql_emitters:
+        return HistorySource.HISTORY_TABLE
+    if RecordVersionAuditSQL in sql_emitters:
+        return HistorySource.RECORD_VERSION
+    return None
+
+
+@cache
+def history_table(source: Table) -> TableClause:
+    """
+    Returns the history table of a table, audit.<schema>_<table>, as created by
+    HistoryTableAuditSQL: the columns of the table followed by pk.
+    """
+    return table(
+        f"{source.schema}_{source.name}",
+        *[column(col.name, col.type) for col in source.columns],
+        column("pk", BIGINT),
+        schema="audit",
+    )
+
+
+def as_of_statement(
+    source: Table,
+    columns: list[Any],
+    as_of: datetime.datetime,
+    ids: list[Any] | None = None,
+    history: HistorySource = HistorySource.HISTORY_TABLE,
+) -> Select:
+    """
+    Creates the statement that rebuilds the rows of a table as they were at as_of.
+
+    The latest version of each row written at or before as_of is selected with
+    DISTINCT ON, in (id, modified_at) order for the history table, so a lookup of
+    one or many ids reads only their entries of the (id, modified_at) index, and
+    partitions after as_of are pruned. Rows that were soft deleted, or deleted
+    (record_version only, the history table does not record deletes), at as_of
+    are excluded.
+
+    The rows are those the row level security of the audit data allows: the history
+    table has the SELECT policies of the table (see audit.copy_history_policies),
+    the record versions of a table with row level security are read by superusers only.
+
+    Args:
+        source (Table): The table whose rows are rebuilt.
+        columns (list[Any]): The columns of the table to select.
+        as_of (datetime.datetime): The point in time.
+        ids (list[Any] | None): The ids of the rows to rebuild, all rows if None.
+        history (HistorySource): The audit data the rows are rebuilt from.
+            Defaults to HistorySource.HISTORY_TABLE.
+
+    Returns:
+        Select: A statement returning the columns, labelled with their names.
+    """
+    column_names = [col.name for col in columns]
+    if history == HistorySource.HISTORY_TABLE:
+        return _history_table_as_of(source, column_names, as_of, ids)
+    return _record_version_as_of(source, column_names, as_of, ids)
+
+
+def _history_table_as_of(
+    source: Table,
+    column_names: list[str],
+    as_of: datetime.datetime,
+    ids: list[Any] | None,
+) -> Select:
+    history = history_table(source)
+    soft_deletes = "is_deleted" in source.columns
+    read_names = list(
+        dict.fromkeys(column_names + ["id"] + (["is_deleted"] if soft_deletes else []))
+    )
+    latest = (
+        select(*[history.c[name] for name in read_names])
+        .where(history.c.modified_at <= as_of)
+        .order_by(history.c.id, history.c.modified_at.desc(), history.c.pk.desc())
+        .ext(distinct_on(history.c.id))
+    )
+    if ids is not None:
+        latest = latest.where(
+            history.c.id == func.any(bindparam("as_of_ids", ids, type_=ARRAY(TEXT)))
+        )
+    latest = latest.subquery("as_of")
+    stmt = select(*[latest.c[name] for name in column_names])
+    if soft_deletes:
+        stmt = stmt.where(not_(latest.c.is_deleted))
+    return stmt
+
+
+def _record_version_as_of(
+    source: Table,
+    column_names: list[str],
+    as_of: datetime.datetime,
+    ids: list[Any] | None,
+) -> Select:
+    table_oid = cast(literal(source.fullname), REGCLASS)
+    record_key = func.coalesce(record_version.c.record_id, record_version.c.old_record_id)
+    latest = (
+        select(record_version.c.op, record_version.c.record)
+        .where(record_version.c.table_oid == table_oid, record_version.c.ts <= as_of)
+        .order_by(record_key, record_version.c.ts.desc(), record_version.c.id.desc())
+        .ext(distinct_on(record_key))
+    )
+    if ids is not None:
+        # supa_audit identifies rows by a uuid derived from the table and primary key
+        candidate = func.unnest(
+            bindparam("as_of_ids", ids, type_=ARRAY(TEXT))
+        ).table_valued("id")
+        record_ids = select(
+            func.audit.to_record_id(
+                table_oid,
+                array(["id"], type_=TEXT),
+                func.jsonb_build_object("id", candidate.c.id),
+            )
+        ).scalar_subquery()
+        latest = latest.where(
+            or_(
+                record_version.c.record_id == func.any(func.array(record_ids)),
+                record_version.c.old_record_id == func.any(func.array(record_ids)),
+            )
+        )
+    latest = latest.subquery("as_of")
+    stmt = select(
+        *[
+            cast(latest.c.record[name].astext, source.c[name].type).label(name)
+            for name in column_names
+        ]
+    ).where(latest.c.op != "DELETE")
+    if "is_deleted" in source.columns:
+        stmt = stmt.where(
+            not_(cast(latest.c.record["is_deleted"].astext, source.c.is_deleted.type))
+        )
+    return stmt
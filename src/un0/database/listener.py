@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import inspect
+import logging
+
+from typing import Any, Callable
+
+import psycopg
+
+from psycopg.sql import SQL, Identifier
+from sqlalchemy.engine import make_url
+
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def conninfo(db_url: str = settings.DB_URL) -> str:
+    """
+    Converts the sqlalchemy database url into a libpq connection string usable by psycopg.
+
+    Args:
+        db_url (str): The sqlalchemy database url. Defaults to settings.DB_URL.
+
+    Returns:
+        str: The connection string, without the sqlalchemy driver name.
+    """
+    return (
+        make_url(db_url)
+        .set(drivername="postgresql")
+        .render_as_string(hide_password=False)
+    )
+
+
+class NotificationListener:
+    """
+    Listens on one or more postgres NOTIFY channels and dispatches the payloads to callbacks.
+
+    A dedicated autocommit connection is used for LISTEN. If the connection is lost the
+    on_disconnect callbacks are called, as notifications may have been missed, and the
+    listener reconnects with an exponential backoff.
+
+    Attributes:
+        callbacks (dict[str, list[Callable[[str], None]]]): The callbacks for each channel.
+        on_disconnect (list[Callable[[], None]]): Called whenever the connection is lost.
+        on_connect (list[Callable[[], Any]]): Called once LISTEN has been issued, awaited
+            if they return an awaitable, before the notifications are dispatched.
+        max_backoff (float): The maximum number of seconds to wait between reconnects.
+    """
+
+    def __init__(self, db_url: str = settings.DB_URL, max_backoff: float = 30.0):
+        self.db_url = db_url
+        self.max_backoff = max_backoff
+        self.callbacks: dict[str, list[Callable[[str], None]]] = {}
+        self.on_connect: list[Callable[[], Any]] = []
+        self.on_disconnect: list[Callable[[], None]] = []
+        self.connected = False
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        self.callbacks.setdefault(channel, []).append(callback)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def dispatch(self, channel: str, payload: str) -> None:
+        for callback in self.callbacks.get(channel, []):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("Notification callback failed for %s", channel)
+
+    async def run(self) -> None:
+        backoff = 0.5
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    conninfo(self.db_url), autocommit=True
+                ) as conn:
+                    for channel in self.callbacks:
+                        await conn.execute(
+                            SQL("LISTEN {}").format(Identifier(channel))
+                        )
+                    self.connected = True
+                    backoff = 0.5
+                    for callback in self.on_connect:
+                        result = callback()
+                        if inspect.isawaitable(result):
+                            await result
+                    async for notify in conn.notifies():
+                        self.dispatch(notify.channel, notify.payload)
+            except asyncio.CancelledError:
+                self._disconnected()
+                raise
+            except Exception:
+                logger.exception("Notification listener lost its connection")
+            self._disconnected()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _disconnected(self) -> None:
+        if self.connected:
+            self.connected = False
+            for callback in self.on_disconnect:
+                callback()
@@ -0,0 +1,351 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import csv
+import datetime
+import gzip
+import logging
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable
+
+from pydantic.dataclasses import dataclass
+from sqlalchemy import Engine
+
+from un0.errors import Un0Error
+from un0.database.models import Model
+from un0.database.export import arrow_schema, arrow_values, export_value
+from un0.database.sql_emitters import HistoryTableAuditSQL, RecordVersionAuditSQL
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# The column added to every exported statement to route its rows to their tenant
+TENANT_COLUMN = "export_tenant_id"
+
+# The partition of the rows that belong to no tenant
+NO_TENANT = "none"
+
+# The number of rows buffered per tenant before a parquet row group is written
+PARQUET_ROW_GROUP_SIZE = 50000
+
+
+class AuditExportError(Un0Error):
+    pass
+
+
+def month_range(since: datetime.date, until: datetime.date) -> list[datetime.date]:
+    """
+    Returns the first day of each month from since to until, both included.
+    """
+    months = []
+    month = since.replace(day=1)
+    while month <= until:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def next_month(month: datetime.date) -> datetime.date:
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def previous_month(today: datetime.date | None = None) -> datetime.date:
+    """Returns the first day of the month before today, the last closed month."""
+    first = (today or datetime.date.today()).replace(day=1)
+    return (first - datetime.timedelta(days=1)).replace(day=1)
+
+
+@dataclass(frozen=True)
+class ExportUnit:
+    """
+    The audit rows of one source (a history table, or the record versions of a
+    table) written in one month, exported by a single COPY.
+
+    The statement selects the rows to export followed by the tenant of each row,
+    in the TENANT_COLUMN column, which is used to partition the files and is not
+    written to them.
+    """
+
+    source: str
+    month: datetime.date
+    statement: str
+    params: tuple[Any, ...]
+
+    @property
+    def month_label(self) -> str:
+        return self.month.strftime("%Y-%m")
+
+    @property
+    def name(self) -> str:
+        return f"{self.source}_{self.month_label}"
+
+
+def export_units(months: list[datetime.date]) -> list[ExportUnit]:
+    """
+    Returns the export units of every audited model, for each of the months.
+
+    Models with a HistoryTableAuditSQL are exported from their history table,
+    reading only the month's partition, models with a RecordVersionAuditSQL from
+    the supa_audit record versions of their table.
+    """
+    units = []
+    for model in Model.registry.values():
+        table = model.table.__table__
+        history_table = f"{model.schema_name}_{model.table_name}"
+        tenant = "tenant_id" if "tenant_id" in table.columns else "NULL::TEXT"
+        for month in months:
+            bounds = (
+                datetime.datetime.combine(month, datetime.time(), datetime.UTC),
+                datetime.datetime.combine(
+                    next_month(month), datetime.time(), datetime.UTC
+                ),
+            )
+            if HistoryTableAuditSQL in model.sql_emitters:
+                units.append(
+                    ExportUnit(
+                        source=history_table,
+                        month=month,
+                        statement=(
+                            f"SELECT *, {tenant} AS {TENANT_COLUMN} "
+                            f"FROM audit.{history_table} "
+                            "WHERE modified_at >= %s AND modified_at < %s"
+                        ),
+                        params=bounds,
+                    )
+                )
+            if RecordVersionAuditSQL in model.sql_emitters:
+                units.append(
+                    ExportUnit(
+                        source=f"record_version_{history_table}",
+                        month=month,
+                        statement=(
+                            "SELECT id, record_id, old_record_id, op, ts, "
+                            "record, old_record, coalesce(record, old_record) "
+                            f"->> 'tenant_id' AS {TENANT_COLUMN} "
+                            "FROM audit.record_version "
+                            "WHERE table_oid = %s::regclass AND ts >= %s AND ts < %s"
+                        ),
+                        params=(table.fullname, *bounds),
+                    )
+                )
+    return units
+
+
+class CSVPartitionWriter:
+    """Writes the rows of one partition to a gzip compressed CSV file."""
+
+    suffix = "csv.gz"
+
+    def __init__(self, path: Path, columns: list[str], types: list[int]) -> None:
+        self.file = gzip.open(path, "wt", newline="", compresslevel=6)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, row: tuple[Any, ...]) -> None:
+        self.writer.writerow([export_value(value) for value in row])
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetPartitionWriter:
+    """
+    Writes the rows of one partition to a zstd compressed parquet file, in row
+    groups of PARQUET_ROW_GROUP_SIZE rows, with the schema of the postgres types
+    of the columns. Requires pyarrow.
+    """
+
+    suffix = "parquet"
+
+    def __init__(self, path: Path, columns: list[str], types: list[int]) -> None:
+        import pyarrow.parquet
+
+        self.schema = arrow_schema(columns, types)
+        self.rows: list[tuple[Any, ...]] = []
+        self.writer = pyarrow.parquet.ParquetWriter(
+            path, self.schema, compression="zstd"
+        )
+
+    def write(self, row: tuple[Any, ...]) -> None:
+        self.rows.append(row)
+        if len(self.rows) >= PARQUET_ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        import pyarrow
+
+        if not self.rows:
+            return
+        batch = pyarrow.Table.from_arrays(
+            [
+                pyarrow.array(arrow_values(values, field.type), type=field.type)
+                for field, values in zip(self.schema, zip(*self.rows))
+            ],
+            schema=self.schema,
+        )
+        self.writer.write_table(batch)
+        self.rows = []
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+
+WRITERS = {"csv": CSVPartitionWriter, "parquet": ParquetPartitionWriter}
+
+
+class AuditExporter:
+    """
+    Exports audit rows to local files partitioned by source, tenant and month:
+
+        <directory>/<source>/tenant_id=<tenant>/month=<YYYY-MM>/part.<suffix>
+
+    Each unit (a source and month) is read by a single binary COPY, in its own short
+    transaction so no snapshot is held across the export, ordered by tenant so the
+    rows are written to the file of one tenant at a time, and a single file is open
+    per unit. Units run in parallel on separate connections.
+
+    The files of a unit are written under a temporary name and renamed once the
+    COPY has completed, after which a marker is written to <directory>/_done.
+    An interrupted export is resumed by running it again, units with a marker
+    are skipped and the others are written again from the start.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        directory: str | os.PathLike = settings.AUDIT_EXPORT_DIR,
+        file_format: str = "csv",
+        workers: int = settings.AUDIT_EXPORT_WORKERS,
+    ) -> None:
+        if file_format not in WRITERS:
+            raise AuditExportError(
+                f"Unknown export format: {file_format}", "UNKNOWN_EXPORT_FORMAT"
+            )
+        if file_format == "parquet":
+            try:
+                import pyarrow.parquet  # noqa: F401
+            except ImportError:
+                raise AuditExportError(
+                    "The parquet format requires pyarrow to be installed",
+                    "PARQUET_NOT_AVAILABLE",
+                )
+        self.engine = engine
+        self.directory = Path(directory)
+        self.writer_class = WRITERS[file_format]
+        self.workers = workers
+
+    def marker(self, unit: ExportUnit) -> Path:
+        return self.directory / "_done" / unit.name
+
+    def partition_path(self, unit: ExportUnit, tenant_id: str | None) -> Path:
+        return (
+            self.directory
+            / unit.source
+            / f"tenant_id={tenant_id or NO_TENANT}"
+            / f"month={unit.month_label}"
+            / f"part.{self.writer_class.suffix}"
+        )
+
+    def export(self, months: list[datetime.date]) -> dict[str, int]:
+        """
+        Exports the audit rows of the months, skipping the units already exported.
+
+        Returns:
+            dict[str, int]: The number of rows exported by each unit that was run.
+        """
+        units = [
+            unit for unit in export_units(months) if not self.marker(unit).exists()
+        ]
+        (self.directory / "_done").mkdir(parents=True, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            counts = executor.map(self.export_unit, units)
+            return {unit.name: count for unit, count in zip(units, counts)}
+
+    def export_unit(self, unit: ExportUnit) -> int:
+        """Exports the rows of one unit, returning the number of rows written."""
+        start = time.monotonic()
+        connection = self.engine.raw_connection()
+        try:
+            conn = connection.driver_connection
+            with conn.cursor() as cur:
+                cur.execute(f"SET ROLE {settings.DB_NAME}_admin")
+                # Binary COPY needs the type of each column to decode the rows
+                cur.execute(f"{unit.statement} LIMIT 0", unit.params)
+                columns = [column.name for column in cur.description]
+                types = [column.type_code for column in cur.description]
+                with cur.copy(
+                    f"COPY (SELECT * FROM ({unit.statement}) AS unit "
+                    f"ORDER BY {TENANT_COLUMN}) TO STDOUT (FORMAT BINARY)",
+                    unit.params,
+                ) as copy:
+                    copy.set_types(types)
+                    count, paths = self.write_partitions(
+                        unit, copy.rows(), columns, types
+                    )
+            conn.rollback()
+        finally:
+            connection.close()
+        for path in paths:
+            os.replace(self.temporary_path(path), path)
+        self.marker(unit).touch()
+        elapsed = time.monotonic() - start
+        logger.info("Exported %s: %s rows in %.1fs", unit.name, count, elapsed)
+        return count
+
+    def write_partitions(
+        self,
+        unit: ExportUnit,
+        rows: Iterable[tuple[Any, ...]],
+        columns: list[str],
+        types: list[int],
+    ) -> tuple[int, list[Path]]:
+        """
+        Writes rows ordered by tenant, their last column, to the temporary files of
+        their partitions, closing the file of a tenant when the next one starts.
+
+        Returns:
+            tuple[int, list[Path]]: The number of rows, and the paths of the partitions.
+        """
+        writer = None
+        tenant_id = None
+        paths = []
+        count = 0
+        try:
+            for row in rows:
+                if writer is None or row[-1] != tenant_id:
+                    if writer is not None:
+                        writer.close()
+                    tenant_id = row[-1]
+                    writer = self.open_writer(unit, tenant_id, columns[:-1], types[:-1])
+                    paths.append(self.partition_path(unit, tenant_id))
+                writer.write(row[:-1])
+                count += 1
+        finally:
+            if writer is not None:
+                writer.close()
+        return count, paths
+
+    def open_writer(
+        self,
+        unit: ExportUnit,
+        tenant_id: str | None,
+        columns: list[str],
+        types: list[int],
+    ) -> Any:
+        path = self.partition_path(unit, tenant_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return self.writer_class(self.temporary_path(path), columns, types)
+
+    @staticmethod
+    def temporary_path(path: Path) -> Path:
+        return path.with_name(f"{path.name}.tmp")
+
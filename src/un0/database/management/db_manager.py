@@ -5,6 +5,7 @@
 import sys
 import io
 import textwrap
+import datetime
 
 from sqlalchemy import text, create_engine, Engine
 
@@ -17,8 +18,17 @@ from un0.database.management.sql_emitters import (
     PrivilegeAndSearchPathSQL,
     PGULIDSQLSQL,
     CreateTokenSecretSQL,
+    CreateTableVersionSQL,
+    CreateHistoryPartitionSQL,
+    CreateWorkflowEventNotifySQL,
+    CreateSchemaChangeEventTriggerSQL,
     TablePrivilegeSQL,
 )
+from un0.database.management.audit_export import (
+    AuditExporter,
+    month_range,
+    previous_month,
+)
 from un0.database.models import Model
 from un0.database.base import Base
 from un0.config import settings
@@ -235,6 +245,7 @@ class DBManager:
         1. Creates the necessary schemas and extensions.
         2. Configures the privileges for the schemas.
         3. Sets the search paths for the schemas.
+        4. Creates the event trigger that publishes schema changes.
 
         The method uses an engine with AUTOCOMMIT isolation level to execute the SQL commands.
         """
@@ -251,6 +262,9 @@ class DBManager:
             print("Configuring the privileges for the schemas and setting the paths\n")
             conn.execute(text(PrivilegeAndSearchPathSQL().emit_sql()))
 
+            print("Creating the schema change event trigger\n")
+            conn.execute(text(CreateSchemaChangeEventTriggerSQL().emit_sql()))
+
             conn.close()
         eng.dispose()
 
@@ -262,8 +276,11 @@ class DBManager:
         1. Connects to the database using a specific role.
         2. Creates the token_secret table, function, and trigger.
         3. Creates the pgulid function.
-        4. Creates the necessary database tables.
-        5. Sets the table privileges.
+        4. Creates the table version sequence and function used by the result cache.
+        5. Creates the functions that manage the history table partitions.
+        6. Creates the function that publishes changes for DB_EVENT workflows.
+        7. Creates the necessary database tables.
+        8. Sets the table privileges.
 
         The connection is established with AUTOCOMMIT isolation level to ensure
         that each command is executed immediately. After all operations are
@@ -281,6 +298,15 @@ class DBManager:
             print("Creating the pgulid function\n")
             conn.execute(text(PGULIDSQLSQL().emit_sql()))
 
+            print("Creating the table version sequence and function\n")
+            conn.execute(text(CreateTableVersionSQL().emit_sql()))
+
+            print("Creating the history partition functions\n")
+            conn.execute(text(CreateHistoryPartitionSQL().emit_sql()))
+
+            print("Creating the workflow event notification function\n")
+            conn.execute(text(CreateWorkflowEventNotifySQL().emit_sql()))
+
             # Create the tables
             print("Creating the database tables\n")
             Base.metadata.create_all(bind=conn)
@@ -289,3 +315,61 @@ class DBManager:
             conn.execute(text(TablePrivilegeSQL().emit_sql()))
             conn.close()
         eng.dispose()
+
+    def maintain_history_partitions(
+        self, months_ahead: int = settings.HISTORY_PARTITIONS_AHEAD
+    ) -> None:
+        """
+        Creates the upcoming monthly partitions of the history tables, and detaches
+        (or drops) the partitions older than each table's retention.
+
+        Partitions are also created when a row of a new month is written, run this
+        periodically (e.g. daily, from cron) to apply the retention policies.
+
+        Args:
+            months_ahead (int): The number of months after the current one to create
+                partitions for. Defaults to settings.HISTORY_PARTITIONS_AHEAD.
+        """
+        eng = self.engine(db_role=f"{settings.DB_NAME}_login")
+        with eng.connect() as conn:
+            conn.execute(text(f"SET ROLE {settings.DB_NAME}_admin"))
+            conn.execute(
+                text("SELECT audit.maintain_history_partitions(:months_ahead)"),
+                {"months_ahead": months_ahead},
+            )
+            conn.commit()
+        eng.dispose()
+
+    def export_audit(
+        self,
+        since: datetime.date | None = None,
+        until: datetime.date | None = None,
+        directory: str = settings.AUDIT_EXPORT_DIR,
+        file_format: str = "csv",
+        workers: int = settings.AUDIT_EXPORT_WORKERS,
+    ) -> dict[str, int]:
+        """
+        Exports the history and record version rows of the audited tables to local
+        files partitioned by tenant and month, see AuditExporter.
+
+        Args:
+            since (datetime.date | None): The first month exported. Defaults to the
+                previous month.
+            until (datetime.date | None): The last month exported. Defaults to since.
+            directory (str): The directory of the files. Defaults to settings.AUDIT_EXPORT_DIR.
+            file_format (str): "csv" (gzip compressed) or "parquet". Defaults to "csv".
+            workers (int): The number of months and tables exported in parallel.
+                Defaults to settings.AUDIT_EXPORT_WORKERS.
+
+        Returns:
+            dict[str, int]: The number of rows exported for each table and month.
+        """
+        since = since or previous_month()
+        eng = self.engine(db_role=f"{settings.DB_NAME}_login")
+        try:
+            exporter = AuditExporter(
+                eng, directory=directory, file_format=file_format, workers=workers
+            )
+            return exporter.export(month_range(since, until or since))
+        finally:
+            eng.dispose()
@@ -27,6 +27,9 @@ BASE_ROLE = Identifier(f"{settings.DB_NAME}_base_role")
 DB_NAME = Identifier(settings.DB_NAME)
 DB_SCHEMA = Identifier(settings.DB_SCHEMA)
 
+# The number of ids sent per workflow event notification, within the 8000 byte payload limit
+WORKFLOW_NOTIFY_BATCH_SIZE = 200
+
 
 class DropDatabaseSQL(SQLEmitter):
     def emit_sql(self) -> str:
@@ -353,6 +356,24 @@ class PrivilegeAndSearchPathSQL(SQLEmitter):
             ALTER SCHEMA {schema_name} OWNER TO {admin_role};
             ALTER TABLE audit.record_version OWNER TO {admin_role};
 
+            /*
+            The versions of every tracked table share audit.record_version, which can not
+            have the policies of each table, so only superusers read the versions of the
+            tables with row level security, and other users those of the tables without.
+            Not forced, supa_audit writes the versions as the owner of the table.
+            */
+            ALTER TABLE audit.record_version ENABLE ROW LEVEL SECURITY;
+            DROP POLICY IF EXISTS record_version_select_policy ON audit.record_version;
+            CREATE POLICY record_version_select_policy
+            ON audit.record_version FOR SELECT
+            USING (
+                current_setting('rls_var.is_superuser', true)::BOOLEAN OR
+                NOT EXISTS (
+                    SELECT 1 FROM pg_class c
+                    WHERE c.oid = table_oid AND c.relrowsecurity
+                )
+            );
+
             -- Grant connect privileges to the DB login role
             GRANT CONNECT ON DATABASE {db_name} TO {login_role};
 
@@ -579,3 +600,345 @@ class CreateTokenSecretSQL(SQLEmitter):
             .format(admin_role=ADMIN_ROLE, db_name=DB_NAME)
             .as_string()
         )
+
+
+class CreateTableVersionSQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        return (
+            SQL(
+                """
+            /*
+            Creates the sequence and function used to version tables for the result cache.
+            Each statement that writes to a versioned table takes a new value from the
+            sequence and publishes it with NOTIFY, nextval is non-transactional so writers
+            never contend for a lock, and the notification is only delivered on commit.
+            */
+            SET ROLE {admin_role};
+            CREATE SEQUENCE IF NOT EXISTS un0.table_version_seq;
+            GRANT USAGE ON SEQUENCE un0.table_version_seq TO {writer_role};
+            -- Read by each process when it starts listening, see TableVersions
+            GRANT SELECT ON SEQUENCE un0.table_version_seq TO {reader_role};
+
+            CREATE OR REPLACE FUNCTION un0.bump_table_version()
+            RETURNS TRIGGER
+            LANGUAGE plpgsql
+            VOLATILE
+            SECURITY DEFINER
+            AS $$
+            BEGIN
+                PERFORM pg_notify(
+                    {channel},
+                    TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME || ':' || nextval('un0.table_version_seq')
+                );
+                RETURN NULL;
+            END;
+            $$;
+            """
+            )
+            .format(
+                admin_role=ADMIN_ROLE,
+                reader_role=READER_ROLE,
+                writer_role=WRITER_ROLE,
+                channel=Literal(settings.CACHE_NOTIFY_CHANNEL),
+            )
+            .as_string()
+        )
+
+
+class CreateSchemaChangeEventTriggerSQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        return (
+            SQL(
+                """
+            /*
+            Creates the event trigger that publishes schema changes with NOTIFY,
+            so that each process refreshes its metadata cache when a migration is applied.
+            Event triggers can only be created by a superuser.
+            */
+            CREATE OR REPLACE FUNCTION un0.notify_schema_change()
+            RETURNS EVENT_TRIGGER
+            LANGUAGE plpgsql
+            AS $$
+            BEGIN
+                PERFORM pg_notify({channel}, tg_tag);
+            END;
+            $$;
+
+            DROP EVENT TRIGGER IF EXISTS un0_schema_change;
+            CREATE EVENT TRIGGER un0_schema_change
+                ON ddl_command_end
+                WHEN TAG IN (
+                    'CREATE TABLE',
+                    'ALTER TABLE',
+                    'DROP TABLE',
+                    'CREATE INDEX',
+                    'ALTER INDEX',
+                    'DROP INDEX'
+                )
+                EXECUTE FUNCTION un0.notify_schema_change();
+            """
+            )
+            .format(channel=Literal(settings.SCHEMA_NOTIFY_CHANNEL))
+            .as_string()
+        )
+
+
+class CreateHistoryPartitionSQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        return (
+            SQL(
+                """
+            /*
+            Creates the functions that manage the monthly partitions of the history tables
+            created by HistoryTableAuditSQL, and the retention policy of each history table.
+            Months are in UTC, so the partition bounds do not depend on the session time zone.
+            */
+            SET ROLE {admin_role};
+            CREATE TABLE IF NOT EXISTS audit.history_policy (
+                table_name TEXT PRIMARY KEY,
+                retention_months INT NOT NULL DEFAULT 0,
+                drop_detached BOOLEAN NOT NULL DEFAULT false
+            );
+            COMMENT ON COLUMN audit.history_policy.retention_months IS
+                'Months of history kept, older partitions are detached, 0 keeps all history';
+
+            CREATE OR REPLACE FUNCTION audit.create_history_partition(
+                history_table TEXT,
+                month TIMESTAMP
+            )
+            RETURNS VOID
+            LANGUAGE plpgsql
+            VOLATILE
+            SECURITY DEFINER
+            AS $$
+            DECLARE
+                partition_name TEXT:= history_table || '_p' || to_char(month, 'YYYYMM');
+            BEGIN
+                IF to_regclass('audit.' || quote_ident(partition_name)) IS NOT NULL THEN
+                    RETURN;
+                END IF;
+                -- Concurrent writers of the same new month create its partition once
+                PERFORM pg_advisory_xact_lock(hashtext('audit.' || partition_name));
+                IF to_regclass('audit.' || quote_ident(partition_name)) IS NOT NULL THEN
+                    RETURN;
+                END IF;
+                EXECUTE format(
+                    'CREATE TABLE audit.%I PARTITION OF audit.%I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name,
+                    history_table,
+                    to_char(month, 'YYYY-MM-DD') || ' 00:00:00+00',
+                    to_char(month + INTERVAL '1 month', 'YYYY-MM-DD') || ' 00:00:00+00'
+                );
+            END;
+            $$;
+
+            CREATE OR REPLACE FUNCTION audit.maintain_history_partitions(months_ahead INT)
+            RETURNS VOID
+            LANGUAGE plpgsql
+            VOLATILE
+            SECURITY DEFINER
+            AS $$
+            /*
+            Creates the partitions of the current month and of the months_ahead following
+            months for every history table, then detaches, and optionally drops, the
+            partitions that only hold history older than the table's retention.
+            */
+            DECLARE
+                policy RECORD;
+                part RECORD;
+                current_month TIMESTAMP:= date_trunc('month', now() AT TIME ZONE 'UTC');
+            BEGIN
+                FOR policy IN SELECT * FROM audit.history_policy LOOP
+                    FOR i IN 0..months_ahead LOOP
+                        PERFORM audit.create_history_partition(
+                            policy.table_name,
+                            current_month + make_interval(months => i)
+                        );
+                    END LOOP;
+
+                    CONTINUE WHEN policy.retention_months <= 0;
+
+                    FOR part IN
+                        SELECT c.relname
+                        FROM pg_inherits i
+                        JOIN pg_class c ON c.oid = i.inhrelid
+                        WHERE i.inhparent = to_regclass('audit.' || quote_ident(policy.table_name))
+                            AND to_timestamp(right(c.relname, 6), 'YYYYMM')::TIMESTAMP
+                                < current_month - make_interval(months => policy.retention_months)
+                    LOOP
+                        EXECUTE format(
+                            'ALTER TABLE audit.%I DETACH PARTITION audit.%I',
+                            policy.table_name,
+                            part.relname
+                        );
+                        IF policy.drop_detached THEN
+                            EXECUTE format('DROP TABLE audit.%I', part.relname);
+                        END IF;
+                    END LOOP;
+                END LOOP;
+            END;
+            $$;
+
+            CREATE OR REPLACE FUNCTION audit.copy_history_policies(source REGCLASS)
+            RETURNS VOID
+            LANGUAGE plpgsql
+            VOLATILE
+            AS $$
+            /*
+            Enables row level security on the history table of the source table, if it
+            has one and the source table has row level security, with the SELECT policies
+            of the source table, so its history is only read by those who can read its rows.
+            The history table has the columns of the source table, so the policies apply
+            unchanged. Called when either the history table or the policies are created.
+            */
+            DECLARE
+                source_table RECORD;
+                history_table TEXT;
+                policy RECORD;
+            BEGIN
+                SELECT n.nspname, c.relname, c.relrowsecurity
+                INTO source_table
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.oid = source;
+                history_table := source_table.nspname || '_' || source_table.relname;
+                IF to_regclass('audit.' || quote_ident(history_table)) IS NULL
+                    OR NOT source_table.relrowsecurity THEN
+                    RETURN;
+                END IF;
+
+                -- Not forced, the history triggers write as the owner of the table
+                EXECUTE format('ALTER TABLE audit.%I ENABLE ROW LEVEL SECURITY', history_table);
+                FOR policy IN
+                    SELECT *
+                    FROM pg_policies
+                    WHERE schemaname = source_table.nspname
+                        AND tablename = source_table.relname
+                        AND cmd IN ('SELECT', 'ALL')
+                        AND qual IS NOT NULL
+                LOOP
+                    EXECUTE format(
+                        'DROP POLICY IF EXISTS %I ON audit.%I',
+                        policy.policyname,
+                        history_table
+                    );
+                    EXECUTE format(
+                        'CREATE POLICY %I ON audit.%I AS %s FOR SELECT TO %s USING (%s)',
+                        policy.policyname,
+                        history_table,
+                        policy.permissive,
+                        (SELECT string_agg(quote_ident(r), ', ') FROM unnest(policy.roles) AS r),
+                        policy.qual
+                    );
+                END LOOP;
+            END;
+            $$;
+
+            CREATE OR REPLACE FUNCTION audit.prevent_history_change()
+            RETURNS TRIGGER
+            LANGUAGE plpgsql
+            AS $$
+            BEGIN
+                RAISE EXCEPTION 'History is append only, % of % is not allowed', TG_OP, TG_TABLE_NAME;
+            END;
+            $$;
+            """
+            )
+            .format(admin_role=ADMIN_ROLE)
+            .as_string()
+        )
+
+
+class CreateWorkflowEventNotifySQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        return (
+            SQL(
+                """
+            /*
+            Creates the function of the statement level triggers, emitted by
+            WorkflowEventNotifySQL, that publish the rows changed by a statement with NOTIFY
+            when DB_EVENT workflows apply to the table and operation.
+            The ids are sent in batches of {batch_size} per tenant, within the payload limit,
+            as {{"table_type_id", "operation", "tenant_id", "ids"}}, rows without a tenant
+            cannot have workflow events and are not sent.
+            Notifications are only delivered on commit.
+            */
+            SET ROLE {admin_role};
+            CREATE OR REPLACE FUNCTION un0.notify_workflow_event()
+            RETURNS TRIGGER
+            LANGUAGE plpgsql
+            VOLATILE
+            SECURITY DEFINER
+            AS $$
+            DECLARE
+                changed_table_type_id INT;
+                payload TEXT;
+            BEGIN
+                SELECT id
+                    FROM un0.table_type
+                    WHERE db_schema = TG_TABLE_SCHEMA AND name = TG_TABLE_NAME
+                    INTO changed_table_type_id;
+
+                IF NOT EXISTS (
+                    SELECT 1
+                    FROM un0.workflow
+                    WHERE applicable_table_type_id = changed_table_type_id
+                    AND trigger = 'DB_EVENT'
+                    AND db_event = TG_OP::un0.workflowdbevent
+                ) THEN
+                    RETURN NULL;
+                END IF;
+
+                IF TG_OP = 'DELETE' THEN
+                    FOR payload IN
+                        SELECT json_build_object(
+                            'table_type_id', changed_table_type_id,
+                            'operation', TG_OP,
+                            'tenant_id', tenant_id,
+                            'ids', json_agg(id)
+                        )::TEXT
+                        FROM (
+                            SELECT
+                                id,
+                                to_jsonb(changed) ->> 'tenant_id' AS tenant_id,
+                                (row_number() OVER () - 1) / {batch_size} AS batch
+                            FROM old_rows AS changed
+                        ) AS changed_rows
+                        WHERE tenant_id IS NOT NULL
+                        GROUP BY tenant_id, batch
+                    LOOP
+                        PERFORM pg_notify({channel}, payload);
+                    END LOOP;
+                ELSE
+                    FOR payload IN
+                        SELECT json_build_object(
+                            'table_type_id', changed_table_type_id,
+                            'operation', TG_OP,
+                            'tenant_id', tenant_id,
+                            'ids', json_agg(id)
+                        )::TEXT
+                        FROM (
+                            SELECT
+                                id,
+                                to_jsonb(changed) ->> 'tenant_id' AS tenant_id,
+                                (row_number() OVER () - 1) / {batch_size} AS batch
+                            FROM new_rows AS changed
+                        ) AS changed_rows
+                        WHERE tenant_id IS NOT NULL
+                        GROUP BY tenant_id, batch
+                    LOOP
+                        PERFORM pg_notify({channel}, payload);
+                    END LOOP;
+                END IF;
+                RETURN NULL;
+            END;
+            $$;
+            """
+            )
+            .format(
+                admin_role=ADMIN_ROLE,
+                channel=Literal(settings.WORKFLOW_NOTIFY_CHANNEL),
+                batch_size=Literal(WORKFLOW_NOTIFY_BATCH_SIZE),
+            )
+            .as_string()
+        )
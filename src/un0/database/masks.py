@@ -4,24 +4,46 @@
 
 import textwrap
 
-from typing import Type
+from typing import Type, Any, Optional, Iterable, Iterator, Mapping
 
-from pydantic import BaseModel, model_validator, field_validator, computed_field
+from typing_extensions import TypedDict
+
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    TypeAdapter,
+    model_validator,
+    create_model,
+)
 from pydantic.dataclasses import dataclass
 
+from sqlalchemy import Table, Column
+
+from un0.errors import ModelFieldListError
+from un0.formatters import formatter
 from un0.database.sql_emitters import SQLEmitter
+from un0.database.fields import FieldDefinition
 from un0.database.enums import MaskType, SQLOperation
 from un0.config import settings
 
 
+# The mask names that FieldDefinition.include_in_masks refers to
+STANDARD_MASK_NAMES = ["insert", "update", "select", "list"]
+
+
 @dataclass
 class ViewSQL(SQLEmitter):
-    def emit_sql(self, mask_name: str, field_list: list[str]) -> str:
+    mask_name: str = ""
+    field_list: list[str] | None = None
+
+    def emit_sql(self) -> str:
+        columns = ", ".join(self.field_list or ["*"])
         return textwrap.dedent(
             f"""
-            SET ROLE {settings.DB_USER}_admin;
-            CREATE OR REPLACE VIEW {self.schema_name}.{self.table_name}_{mask_name} AS 
-            SELECT {field_list}
+            SET ROLE {settings.DB_NAME}_admin;
+            CREATE OR REPLACE VIEW {self.schema_name}.{self.table_name}_{self.mask_name.lower()}
+            WITH (security_invoker = true) AS
+            SELECT {columns}
             FROM {self.schema_name}.{self.table_name};
             """
         )
@@ -37,41 +59,215 @@ class MaskDef(BaseModel):
     sql_emitters: list[Type[SQLEmitter]] = []
 
     @model_validator(mode="after")
-    def validate_model(cls, value):
-        if value.include_fields and value.exclude_fields:
+    def validate_model(self) -> "MaskDef":
+        if self.include_fields and self.exclude_fields:
             raise ValueError("Both include_fields and exclude_fields cannot be set.")
-        if value.include_relations:
-            pass
-        if value.operation == SQLOperation.SELECT:
-            cls.create_view()
-        return value
+        if not self.name:
+            if not self.operation:
+                raise ValueError("A name or an operation is required.")
+            self.name = self.operation[0].value
+        return self
 
-    @field_validator("name", mode="before")
-    def name(cls, data) -> list[str]:
-        if not data:
-            return cls.operation.value
-        return data
+    def create_mask(
+        self,
+        table: Table,
+        model_name: str,
+        field_definitions: dict[str, FieldDefinition],
+    ) -> "Mask":
+        """
+        Compiles the mask definition into the list of columns it selects.
 
+        A column is included if it is in include_fields, or, if include_fields is not set,
+        it is not in exclude_fields and its FieldDefinition does not exclude it from the mask.
 
-class Mask(BaseModel):
+        Args:
+            table (Table): The sqlalchemy table of the model.
+            model_name (str): The name of the model class, used to name the response model.
+            field_definitions (dict[str, FieldDefinition]): The field definitions of the model.
+
+        Raises:
+            ModelFieldListError: If include_fields or exclude_fields name a non-existent column.
+
+        Returns:
+            Mask: The compiled mask.
+        """
+        unknown_fields = (self.include_fields | self.exclude_fields) - set(
+            table.columns.keys()
+        )
+        if unknown_fields:
+            raise ModelFieldListError(
+                f"Mask {self.name} of {model_name} references unknown fields: {', '.join(sorted(unknown_fields))}",
+                "MASK_FIELD_NOT_FOUND",
+            )
+        mask_name = self.name.lower()
+        field_list = []
+        for column in table.columns:
+            if self.include_fields:
+                if column.name in self.include_fields:
+                    field_list.append(column.name)
+                continue
+            if column.name in self.exclude_fields:
+                continue
+            field_definition = field_definitions.get(column.name)
+            if field_definition is not None:
+                if mask_name in field_definition.exclude_from_masks:
+                    continue
+                if (
+                    mask_name in STANDARD_MASK_NAMES
+                    and mask_name not in field_definition.include_in_masks
+                ):
+                    continue
+            field_list.append(column.name)
+        column_types = {
+            name: column_python_type(table.columns[name]) for name in field_list
+        }
+        # STRING masks return localized strings, not the columns' python types
+        field_types = (
+            {name: str for name in field_list}
+            if self.mask_type == MaskType.STRING
+            else column_types
+        )
+        return Mask(
+            name=self.name,
+            table_name=table.name,
+            schema_name=table.schema,
+            mask_type=self.mask_type,
+            operation=self.operation,
+            field_list=field_list,
+            columns=[table.columns[name] for name in field_list],
+            column_types=column_types,
+            response_model=create_response_model(
+                f"{model_name}{self.name}", field_types
+            ),
+            serializer=create_serializer(f"{model_name}{self.name}Row", field_types),
+            sql_emitters=self.sql_emitters,
+        )
+
+
+def column_python_type(column: Column) -> Any:
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return Any
+
+
+def create_response_model(name: str, field_types: dict[str, Any]) -> Type[BaseModel]:
     """
-    Enum class for model masks.
+    Creates the pydantic model used to validate and document the responses of a mask.
+
+    All fields are optional, so that a subset of the mask's fields can be returned.
     """
+    return create_model(
+        name,
+        **{
+            field_name: (Optional[field_type], None)
+            for field_name, field_type in field_types.items()
+        },
+    )
 
-    # field_list: list[str] = [] <- computed_field
 
-    table_name: str
+def create_serializer(name: str, field_types: dict[str, Any]) -> TypeAdapter:
+    """
+    Creates the serializer of a mask's rows.
+
+    Rows are serialized straight from their mappings to JSON by pydantic-core,
+    without instantiating a model for each row.
+    """
+    row_type = TypedDict(
+        name,
+        {
+            field_name: Optional[field_type]
+            for field_name, field_type in field_types.items()
+        },
+        total=False,
+    )
+    return TypeAdapter(list[row_type])
+
+
+class Mask(BaseModel):
+    """
+    A compiled MaskDef, the columns a mask selects and the model of its responses.
+    """
+
     name: str
+    table_name: str
     schema_name: str = settings.DB_NAME
+    mask_type: MaskType = MaskType.NATIVE
+    operation: list[SQLOperation] = []
+    field_list: list[str] = []
+    columns: list[Column] = []
+    column_types: dict[str, Any] = {}
+    response_model: Type[BaseModel] | None = None
+    serializer: TypeAdapter | None = None
+    sql_emitters: list[Type[SQLEmitter]] = []
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def select_columns(self, fields: list[str] | None = None) -> list[Column]:
+        """
+        Returns the columns to select, optionally restricted to a subset of the mask's fields.
+
+        Raises:
+            ModelFieldListError: If a requested field is not in the mask.
+        """
+        if not fields:
+            return self.columns
+        unknown_fields = set(fields) - set(self.field_list)
+        if unknown_fields:
+            raise ModelFieldListError(
+                f"Fields not available in {self.name}: {', '.join(sorted(unknown_fields))}",
+                "FIELD_NOT_IN_MASK",
+            )
+        return [column for column in self.columns if column.name in fields]
+
+    def format_rows(self, rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """
+        Formats the rows as localized strings, in the locale of the current request,
+        if the mask is a STRING mask, returns the rows unchanged otherwise.
+        """
+        if self.mask_type != MaskType.STRING:
+            return rows
+        return formatter().format_rows(rows, self.column_types)
+
+    def dump_json(self, rows: list[Mapping[str, Any]]) -> bytes:
+        """Serializes a list of rows to a JSON array."""
+        return self.serializer.dump_json(rows, warnings=False)
+
+    def dump_json_row(self, row: Mapping[str, Any]) -> bytes:
+        """Serializes a single row to a JSON object."""
+        return self.dump_json([row])[1:-1]
 
-    @classmethod
-    def create_view(cls) -> None:
-        cls.sql_emitters.append(ViewSQL().emit_sql())
+    def iter_json(
+        self, rows: Iterable[Mapping[str, Any]], batch_size: int = 1000
+    ) -> Iterator[bytes]:
+        """
+        Serializes rows to a JSON array in chunks of batch_size rows, so the JSON of
+        a large result is never built as a single string. Only the serialization is
+        incremental, the rows are read from the iterable as given, a list of already
+        fetched rows is held in memory as a whole.
+        """
+        yield b"["
+        batch = []
+        separator = b""
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield separator + self.dump_json(batch)[1:-1]
+                separator = b","
+                batch = []
+        if batch:
+            yield separator + self.dump_json(batch)[1:-1]
+        yield b"]"
 
-    @classmethod
-    def emit_sql(cls) -> str:
-        if cls.mask_type != MaskType.SELECT:
-            return ""
+    def emit_sql(self) -> str:
         return "\n".join(
-            [f"{sql_emitter().emit_sql()}" for sql_emitter in cls.sql_emitters]
+            [
+                sql_emitter(
+                    table_name=self.table_name,
+                    schema_name=self.schema_name,
+                    mask_name=self.name,
+                    field_list=self.field_list,
+                ).emit_sql()
+                for sql_emitter in self.sql_emitters
+            ]
         )
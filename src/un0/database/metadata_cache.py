@@ -0,0 +1,237 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import logging
+import textwrap
+
+from pydantic.dataclasses import dataclass, Field
+
+from sqlalchemy import Table, UniqueConstraint, text, bindparam, ARRAY, TEXT
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from un0.database.base import metadata, engine, LIVE_ROWS_WHERE
+from un0.database.listener import NotificationListener
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TableMetadata:
+    """
+    The constraint and column metadata of a table used on the write path.
+
+    Attributes:
+        table_name (str): The schema qualified name of the table.
+        pk_columns (list[str]): The columns of the primary key.
+        unique_constraints (list[list[str]]): The columns of each unique constraint,
+            and of each unique index that is not partial.
+        live_unique_constraints (list[list[str]]): The columns of each unique index
+            restricted to the rows that are not soft deleted (WHERE NOT is_deleted).
+        server_default_columns (list[str]): The columns with a server default,
+            including identity and generated columns.
+        foreign_keys (dict[str, str]): The referenced "schema.table.column" of each
+            foreign key column.
+    """
+
+    table_name: str
+    pk_columns: list[str] = Field(default_factory=list)
+    unique_constraints: list[list[str]] = Field(default_factory=list)
+    live_unique_constraints: list[list[str]] = Field(default_factory=list)
+    server_default_columns: list[str] = Field(default_factory=list)
+    foreign_keys: dict[str, str] = Field(default_factory=dict)
+
+    @classmethod
+    def from_table(cls, table: Table) -> "TableMetadata":
+        """Creates the metadata of a table from its sqlalchemy definition."""
+        unique_constraints = []
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                unique_constraints.append([column.name for column in constraint.columns])
+        for column in table.columns:
+            if column.unique and [column.name] not in unique_constraints:
+                unique_constraints.append([column.name])
+        live_unique_constraints = []
+        for index in table.indexes:
+            if not index.unique:
+                continue
+            columns = [column.name for column in index.columns]
+            where = index.dialect_options["postgresql"].get("where")
+            if where is None:
+                if columns and columns not in unique_constraints:
+                    unique_constraints.append(columns)
+            elif str(where) == LIVE_ROWS_WHERE:
+                live_unique_constraints.append(columns)
+        return cls(
+            table_name=table.fullname,
+            pk_columns=[column.name for column in table.primary_key.columns],
+            unique_constraints=unique_constraints,
+            live_unique_constraints=live_unique_constraints,
+            server_default_columns=[
+                column.name
+                for column in table.columns
+                if column.server_default is not None
+            ],
+            foreign_keys={
+                column.name: foreign_key.target_fullname
+                for column in table.columns
+                for foreign_key in column.foreign_keys
+            },
+        )
+
+
+# A single round trip reads the constraints, unique indexes, and defaults of every
+# table in the schemas, ordered so that multi column keys keep their column order.
+# Unique indexes are kind 'i', or 'l' if restricted to the rows not soft deleted.
+CATALOG_SQL = textwrap.dedent(
+    """
+    SELECT n.nspname || '.' || c.relname AS table_name,
+        con.contype::TEXT AS kind,
+        ARRAY(
+            SELECT a.attname::TEXT
+            FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+            ORDER BY k.ord
+        ) AS columns,
+        fn.nspname || '.' || fc.relname AS target_table,
+        ARRAY(
+            SELECT a.attname::TEXT
+            FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum
+            ORDER BY k.ord
+        ) AS target_columns
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_class fc ON fc.oid = con.confrelid
+    LEFT JOIN pg_namespace fn ON fn.oid = fc.relnamespace
+    WHERE con.contype IN ('p', 'u', 'f') AND n.nspname = ANY(:schemas)
+    UNION ALL
+    SELECT n.nspname || '.' || c.relname,
+        CASE WHEN i.indpred IS NULL THEN 'i' ELSE 'l' END,
+        ARRAY(
+            SELECT a.attname::TEXT
+            FROM unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+            ORDER BY k.ord
+        ),
+        NULL, NULL
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE i.indisunique AND NOT i.indisprimary
+        AND (i.indpred IS NULL OR pg_get_expr(i.indpred, i.indrelid) = '(' || :live_where || ')')
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = i.indexrelid)
+        AND n.nspname = ANY(:schemas)
+    UNION ALL
+    SELECT n.nspname || '.' || c.relname, 'd', ARRAY[a.attname::TEXT], NULL, NULL
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'p') AND a.attnum > 0 AND NOT a.attisdropped
+        AND (a.atthasdef OR a.attidentity <> '' OR a.attgenerated <> '')
+        AND n.nspname = ANY(:schemas)
+    """
+)
+
+
+class MetadataCache:
+    """
+    A per process cache of the TableMetadata of every table.
+
+    The cache is built from the sqlalchemy tables of Model.registry the first time it is
+    used, and replaced with the live catalog by refresh(). refresh() is called when the
+    listener connects and whenever the schema change event trigger created by
+    CreateSchemaChangeEventTriggerSQL reports a migration. Lookups never query the catalog.
+    """
+
+    def __init__(self, async_engine: AsyncEngine = engine) -> None:
+        self.engine = async_engine
+        self.tables: dict[str, TableMetadata] = {}
+        self.loaded = False
+        self._refresh_task: asyncio.Task | None = None
+        self._stale = False
+
+    def load_from_registry(self) -> None:
+        self.tables = {
+            table_name: TableMetadata.from_table(table)
+            for table_name, table in metadata.tables.items()
+        }
+        self.loaded = True
+
+    def get(self, table_name: str) -> TableMetadata:
+        """
+        Returns the metadata of the schema qualified table.
+
+        Raises:
+            KeyError: If the table is unknown.
+        """
+        if not self.loaded:
+            self.load_from_registry()
+        return self.tables[table_name]
+
+    async def refresh(self) -> None:
+        """Replaces the metadata of the registered tables with the live catalog."""
+        if not self.loaded:
+            self.load_from_registry()
+        schemas = sorted({table.schema for table in metadata.tables.values()})
+        stmt = text(CATALOG_SQL).bindparams(
+            bindparam("schemas", value=schemas, type_=ARRAY(TEXT)),
+            bindparam("live_where", value=LIVE_ROWS_WHERE, type_=TEXT),
+        )
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(stmt)).all()
+
+        tables: dict[str, TableMetadata] = {}
+        for table_name, kind, columns, target_table, target_columns in rows:
+            table_metadata = tables.setdefault(
+                table_name, TableMetadata(table_name=table_name)
+            )
+            if kind == "p":
+                table_metadata.pk_columns = list(columns)
+            elif kind in ("u", "i"):
+                table_metadata.unique_constraints.append(list(columns))
+            elif kind == "l":
+                table_metadata.live_unique_constraints.append(list(columns))
+            elif kind == "f":
+                for column, target_column in zip(columns, target_columns):
+                    table_metadata.foreign_keys[column] = (
+                        f"{target_table}.{target_column}"
+                    )
+            elif kind == "d":
+                table_metadata.server_default_columns.extend(columns)
+        # Tables not yet created keep the metadata of their sqlalchemy definition
+        self.tables = {**self.tables, **tables}
+
+    def schedule_refresh(self, payload: str | None = None) -> None:
+        """
+        Refreshes the cache in the background, concurrent requests are coalesced so
+        at most one refresh runs and one more is queued.
+        """
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._stale = True
+            return
+        self._refresh_task = asyncio.get_running_loop().create_task(
+            self._run_refresh()
+        )
+
+    async def _run_refresh(self) -> None:
+        while True:
+            self._stale = False
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Refreshing the metadata cache failed")
+            if not self._stale:
+                return
+
+    def install(self, listener: NotificationListener) -> None:
+        listener.subscribe(settings.SCHEMA_NOTIFY_CHANNEL, self.schedule_refresh)
+        # Migrations applied while disconnected are picked up on (re)connection
+        listener.on_connect.append(self.schedule_refresh)
+
+
+metadata_cache = MetadataCache()
@@ -2,6 +2,8 @@
 #
 # SPDX-License-Identifier: MIT
 
+import textwrap
+
 from typing import Optional
 
 from sqlalchemy import text
@@ -9,6 +11,7 @@ from sqlalchemy.dialects.postgresql import BOOLEAN, TEXT
 
 from pydantic.dataclasses import dataclass
 
+from un0.database.base import LIVE_ROWS_WHERE
 from un0.database.fields import FieldDefinition
 from un0.database.models import ModelMixin
 from un0.database.sql_emitters import SQLEmitter
@@ -61,42 +64,107 @@ class DescriptionMixin(ModelMixin):
 @dataclass
 class SoftDelete(SQLEmitter):
     def emit_sql(self) -> str:
-        function_string = """
+        """
+        Emits the triggers that turn deletes of records that are not yet deleted into
+        soft deletes, records already marked deleted are removed.
+
+        The row trigger only records the id of each record to soft delete, in a transaction
+        local temporary table, and skips its removal. The statement trigger then marks all
+        the recorded records deleted in a single UPDATE, so a bulk DELETE fires the audit,
+        history, and graph triggers of one UPDATE statement rather than one per record.
+
+        The trigger function runs as the invoker, so the UPDATE is subject to the table's
+        update policies. Only the helpers that write and read the temporary table are
+        security definers, so it is always owned by the admin role, whichever role the
+        session is set to.
+
+        Returns:
+            str: The SQL statements to create the functions and triggers.
+        """
+        record_sql = self.create_sql_function(
+            "soft_delete_record",
+            """
+            BEGIN
+                IF to_regclass('pg_temp.un0_soft_delete') IS NULL THEN
+                    CREATE TEMPORARY TABLE un0_soft_delete (
+                        relid OID NOT NULL,
+                        id TEXT NOT NULL
+                    ) ON COMMIT DELETE ROWS;
+                END IF;
+                INSERT INTO pg_temp.un0_soft_delete (relid, id) VALUES (table_relid, record_id);
+            END;
+            """,
+            function_args="table_relid OID, record_id TEXT",
+            return_type="VOID",
+            security_definer="SECURITY DEFINER",
+        )
+        take_sql = self.create_sql_function(
+            "soft_delete_take",
+            """
+            BEGIN
+                IF to_regclass('pg_temp.un0_soft_delete') IS NULL THEN
+                    RETURN;
+                END IF;
+                RETURN QUERY
+                    DELETE FROM pg_temp.un0_soft_delete
+                    WHERE relid = table_relid
+                    RETURNING id;
+            END;
+            """,
+            function_args="table_relid OID",
+            return_type="SETOF TEXT",
+            security_definer="SECURITY DEFINER",
+        )
+        function_string = f"""
             DECLARE
                 user_id TEXT:= current_setting('rls_var.user_id', true);
+                record_ids TEXT[];
             BEGIN
-                /* 
-                */
-                IF OLD.is_deleted IS TRUE THEN
-                    OLD.deleted_at = now();
-                    OLD.deleted_by_id = user_id;
-                    OLD.modified_at = now();
-                    OLD.modified_by_id = user_id;
-                    RETURN OLD;
-                ELSE
+                IF TG_LEVEL = 'STATEMENT' THEN
+                    record_ids := ARRAY(SELECT {self.schema_name}.soft_delete_take(TG_RELID));
                     EXECUTE format('
-                        UPDATE %I 
+                        UPDATE %I.%I AS t
                         SET is_deleted = true,
                             is_active = false,
                             deleted_at = now(),
-                            deleted_by_id = %L,
+                            deleted_by_id = $1,
                             modified_at = now(),
-                            modified_by_id = %L
-                        WHERE id = %L', TG_TABLE_NAME, user_id, user_id, OLD.id
-                    );
+                            modified_by_id = $1
+                        WHERE t.id = ANY($2) AND NOT t.is_deleted',
+                        TG_TABLE_SCHEMA, TG_TABLE_NAME
+                    ) USING user_id, record_ids;
                     RETURN NULL;
                 END IF;
+
+                IF OLD.is_deleted IS TRUE THEN
+                    RETURN OLD;
+                END IF;
+                PERFORM {self.schema_name}.soft_delete_record(TG_RELID, OLD.id);
+                RETURN NULL;
             END;
             """
 
-        return self.create_sql_function(
-            "soft_delete",
-            function_string,
-            include_trigger=True,
-            operation="DELETE",
-            timing="BEFORE",
-            db_function=True,
+        function_sql = self.create_sql_function("soft_delete", function_string)
+        trigger_sql = textwrap.dedent(
+            f"""
+            -- Replace the soft delete triggers of earlier versions
+            DROP TRIGGER IF EXISTS {self.table_name}_soft_delete_trigger
+                ON {self.schema_name}.{self.table_name};
+            DROP TRIGGER IF EXISTS {self.table_name}_soft_delete_prepare_trigger
+                ON {self.schema_name}.{self.table_name};
+            CREATE OR REPLACE TRIGGER {self.table_name}_soft_delete_row_trigger
+                BEFORE DELETE
+                ON {self.schema_name}.{self.table_name}
+                FOR EACH ROW
+                EXECUTE FUNCTION {self.schema_name}.soft_delete();
+            CREATE OR REPLACE TRIGGER {self.table_name}_soft_delete_apply_trigger
+                AFTER DELETE
+                ON {self.schema_name}.{self.table_name}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {self.schema_name}.soft_delete();
+            """
         )
+        return f"{record_sql}\n{take_sql}\n{function_sql}\n{trigger_sql}"
 
 
 class ActiveDeletedMixin(ModelMixin):
@@ -109,11 +177,14 @@ class ActiveDeletedMixin(ModelMixin):
 
     Attributes:
         sql_emitters (list): List of SQL emitters for the mixin.
+        partial_index_where (str): Restricts the model's indexes and unique constraints to the
+            rows that are not soft deleted.
         field_definitions (dict): Dictionary defining the 'is_active' field.
         is_active (bool): Indicates if the record is active. Defaults to True.
     """
 
     sql_emitters = [SoftDelete]
+    partial_index_where = LIVE_ROWS_WHERE
     field_definitions = {
         "is_active": FieldDefinition(
             data_type=BOOLEAN,
@@ -151,6 +222,7 @@ class ImportMixin(ModelMixin):
         ),
         "import_key": FieldDefinition(
             data_type=TEXT,
+            index=True,
             doc="Unique identifier of the original system of the record",
         ),
     }
@@ -8,7 +8,7 @@ from typing import Type, ClassVar
 from pydantic import BaseModel
 from pydantic.dataclasses import dataclass, Field
 
-from sqlalchemy import Table
+from sqlalchemy import Table, Index, text
 
 from un0.errors import ModelRegistryError
 from un0.utilities import convert_snake_to_title
@@ -27,6 +27,7 @@ from un0.database.sql_emitters import (
     SQLEmitter,
     InsertTableTypeSQL,
     AlterGrantSQL,
+    TableVersionSQL,
 )
 from un0.config import settings
 
@@ -51,6 +52,8 @@ class ModelMixin:
         constraint_definitions (ClassVar[list[CheckDefinition | UniqueDefinition]]): A list of constraint
             definitions for the model, including check and unique constraints.
         sql_emitters (ClassVar[list[SQLEmitter]]): A list of SQL emitters associated with the model.
+        partial_index_where (ClassVar[str | None]): The predicate of the rows the model's queries
+            read, if set the model's indexes and unique constraints are restricted to these rows.
 
     Methods:
         emit_sql() -> str:
@@ -61,6 +64,7 @@ class ModelMixin:
     index_definitions: ClassVar[list[IndexDefinition]] = []
     constraint_definitions: ClassVar[list[CheckDefinition | UniqueDefinition]] = []
     sql_emitters: ClassVar[list[SQLEmitter]] = []
+    partial_index_where: ClassVar[str | None] = None
 
     def emit_sql(self) -> str:
         return super().emit_sql()
@@ -138,6 +142,7 @@ class Model(BaseModel, ModelMixin):
     sql_emitters: ClassVar[list[str, Type[SQLEmitter]]] = [
         AlterGrantSQL,
         InsertTableTypeSQL,
+        TableVersionSQL,
     ]
     related_models: ClassVar[dict[str, Type[RelatedModel]]] = {}
 
@@ -159,6 +164,14 @@ class Model(BaseModel, ModelMixin):
             method="GET",
             endpoint="get",
             multiple=True,
+            mask="List",
+        ),
+        # Before the routes of a single object, whose {id} would match "export"
+        "Export": RouterDef(
+            path_suffix="export",
+            method="GET",
+            endpoint="export",
+            mask="List",
         ),
         "Update": RouterDef(
             path_suffix="{id}",
@@ -169,12 +182,21 @@ class Model(BaseModel, ModelMixin):
             path_suffix="{id}",
             method="GET",
             endpoint="get_by_id",
+            mask="Select",
         ),
         "Delete": RouterDef(
             path_suffix="{id}",
             method="DELETE",
             endpoint="delete",
         ),
+        "BulkUpdate": RouterDef(
+            method="PATCH",
+            endpoint="bulk_update",
+        ),
+        "BulkDelete": RouterDef(
+            method="DELETE",
+            endpoint="bulk_delete",
+        ),
     }
     masks: ClassVar[dict[str, Mask]] = {}
     mask_defs: ClassVar[list[MaskDef]] = [
@@ -274,15 +296,37 @@ class Model(BaseModel, ModelMixin):
         cls.update_indices()
         cls.update_sql_emitters()
 
+        # The indexes of models that set partial_index_where (ActiveDeletedMixin) only
+        # cover the rows their queries read. Primary and foreign keys keep full indexes,
+        # as constraint checks and cascades read every row.
+        index_where = (
+            text(cls.partial_index_where) if cls.partial_index_where else None
+        )
+
         # Create and add columns to the SQLAlchemy table object
         columns = []
+        partial_index_columns = {}
         # Add the columns to the table
         for field_name, field_definition in cls.field_definitions.items():
-            columns.append(field_definition.create_column(name=field_name))
+            column = field_definition.create_column(name=field_name)
+            if (
+                index_where is not None
+                and (column.index or column.unique)
+                and not column.primary_key
+                and not column.foreign_keys
+            ):
+                partial_index_columns[field_name] = bool(column.unique)
+                column.index = None
+                column.unique = None
+            columns.append(column)
 
         constraints = []
+        partial_unique_definitions = []
         # Add the constraints to the table
         for constraint in cls.constraint_definitions:
+            if index_where is not None and isinstance(constraint, UniqueDefinition):
+                partial_unique_definitions.append(constraint)
+                continue
             constraints.append(constraint.create_constraint())
 
         # Create the sqlalchemy table object
@@ -297,7 +341,18 @@ class Model(BaseModel, ModelMixin):
         # Add the index_definitions to the table
         # Indices are added to improve the performance of database operations
         for index in cls.index_definitions:
-            table.indexes.add(index.create_index(table))
+            table.indexes.add(index.create_index(table, where=index_where))
+        for field_name, unique in partial_index_columns.items():
+            table.indexes.add(
+                Index(
+                    None,
+                    table.c[field_name],
+                    unique=unique,
+                    postgresql_where=index_where,
+                )
+            )
+        for unique_definition in partial_unique_definitions:
+            table.indexes.add(unique_definition.create_index(table, where=index_where))
 
         # Set the table attribute on the class to the created SQLAlchemy table object
         # cls.table = table
@@ -309,6 +364,14 @@ class Model(BaseModel, ModelMixin):
             )
         cls.properties = properties
 
+        # Compile the mask definitions into the columns and response model of each mask
+        cls.masks = {
+            mask_def.name: mask_def.create_mask(
+                table, cls.__name__, cls.field_definitions
+            )
+            for mask_def in cls.mask_defs
+        }
+
         # if cls.vertex_column:
         #    cls.vertex = Vertex(
         #        table=cls.table,
@@ -402,12 +465,15 @@ class Model(BaseModel, ModelMixin):
 
     @classmethod
     def create_routers(cls) -> None:
+        # Each model has its own list, appending to the inherited list would share it
+        cls.routers = []
         for router_def in cls.router_defs.values():
             cls.routers.append(
                 Router(
                     table=cls.table,
                     model=cls,
                     obj_name=cls.table_name,
+                    mask=router_def.mask,
                     method=router_def.method,
                     endpoint=router_def.endpoint,
                     path_objs="",
@@ -432,6 +498,9 @@ class Model(BaseModel, ModelMixin):
                 for sql_emitter in cls.sql_emitters
             ]
         )
+        for mask in cls.masks.values():
+            if mask.sql_emitters:
+                sql += f"\n{mask.emit_sql()}"
         return sql
 
     def generate_insert_sql_robot(self) -> tuple[str, tuple]:
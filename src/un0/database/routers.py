@@ -2,17 +2,39 @@
 #
 # SPDX-License-Identifier: MIT
 
+import datetime
+
 from typing import Annotated, List, Any
 
 from sqlalchemy import select, func
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from pydantic import BaseModel, ConfigDict, computed_field
 from pydantic.dataclasses import dataclass
 
-from fastapi import APIRouter, FastAPI, HTTPException, Request, Header, Depends
+from fastapi import (
+    APIRouter,
+    FastAPI,
+    HTTPException,
+    Request,
+    Header,
+    Depends,
+    Query,
+)
+from fastapi.responses import Response, StreamingResponse
+
+from un0.errors import ExportError, ModelFieldListError, QueryCompileError
 
 from un0.database.base import get_db
+from un0.database.enums import ExportFormat
+from un0.database.cache import PermissionContext, cache_key, result_cache
+from un0.database.un0db import UnoDB, is_lock_timeout, live_rows
+from un0.database.history import history_source, as_of_statement
+from un0.database.export import EXPORT_MEDIA_TYPES, Exporter, query_predicate
+
+
+exporter = Exporter()
 
 
 @dataclass
@@ -23,6 +45,7 @@ class RouterDef:
     method: str = "GET"
     endpoint: str = "get"
     multiple: bool = False
+    mask: str = ""
     include_in_schema: bool = True
     summary: str = ""
     description: str = ""
@@ -33,6 +56,7 @@ class Router(BaseModel):
 
     app: FastAPI = None
     model: Any
+    table: Any = None
     obj_name: str
     mask: str = ""
     path_objs: str = ""
@@ -57,11 +81,22 @@ class Router(BaseModel):
 
     def add_to_app(self, app: FastAPI):
         router = APIRouter()
+        mask = self.model.masks.get(self.mask)
+        # Masked endpoints return serialized responses, the mask's response model documents them
+        response_model = mask.response_model if mask else self.model
+        if self.method in ("PUT", "PATCH", "DELETE"):
+            # Write endpoints return the affected ids
+            response_model = dict[str, list[str]]
+        if self.endpoint == "export":
+            # Exports are files, streamed as they are read
+            response_model = None
         router.add_api_route(
             self.path,
             endpoint=getattr(self, self.endpoint),
             methods=[self.method],
-            response_model=self.model if not self.multiple else List[self.model],
+            response_model=response_model
+            if not self.multiple
+            else List[response_model],
             include_in_schema=self.include_in_schema,
             tags=self.tags,
             summary=self.summary,
@@ -70,27 +105,204 @@ class Router(BaseModel):
         app.include_router(router)
         return router
 
+    async def cached_query(
+        self,
+        db: AsyncSession,
+        params: dict[str, Any],
+        query: Any,
+        multiple: bool,
+    ) -> Any:
+        """
+        Executes the query, serving the result from the result cache when possible.
+
+        Must be called after un0.authorize_user, the cache key includes the
+        permission context of the session so results are never shared between
+        sessions with different row level security semantics.
+        """
+        if result_cache is None:
+            return await self.execute_query(db, query, multiple)
+        context = await PermissionContext.from_session(db)
+        key = cache_key(self.model.__name__, self.mask, context, params)
+        snapshot = result_cache.snapshot([self.table.__table__.fullname])
+        value = await result_cache.get(key, snapshot)
+        if value is not None:
+            return value
+        value = await self.execute_query(db, query, multiple)
+        await result_cache.set(key, value, snapshot)
+        return value
+
+    async def execute_query(
+        self, db: AsyncSession, query: Any, multiple: bool
+    ) -> list[dict[str, Any]] | dict[str, Any] | None:
+        result = await db.execute(query)
+        if multiple:
+            return [dict(row) for row in result.mappings()]
+        row = result.mappings().first()
+        return dict(row) if row is not None else None
+
+    def select_statement(self, columns: list[Any]) -> Any:
+        """
+        Returns the select statement of the columns, excluding soft deleted rows,
+        with the predicate stated so the planner can use the table's partial indexes.
+        """
+        stmt = select(*columns)
+        where_live = live_rows(self.table.__table__)
+        if where_live is not None:
+            stmt = stmt.where(where_live)
+        return stmt
+
+    def select_columns(self, fields: str | None) -> list[Any]:
+        """
+        Returns the columns selected by the router's mask, restricted to the
+        comma separated fields requested, or all the table's columns if the
+        router has no mask.
+
+        Raises:
+            HTTPException: If a requested field is not in the mask.
+        """
+        mask = self.model.masks.get(self.mask)
+        field_list = [field.strip() for field in fields.split(",")] if fields else []
+        if mask is None:
+            if field_list:
+                raise HTTPException(
+                    status_code=400, detail="Field selection is not supported"
+                )
+            return [self.table.__table__]
+        try:
+            return mask.select_columns(field_list)
+        except ModelFieldListError as e:
+            raise HTTPException(status_code=400, detail=e.message)
+
+    def as_of_statement(
+        self,
+        columns: list[Any],
+        as_of: datetime.datetime,
+        ids: list[str] | None = None,
+    ) -> Any:
+        """
+        Returns the statement rebuilding the rows, of the given ids or all rows,
+        as they were at as_of from the model's audit data.
+
+        Raises:
+            HTTPException: If the model is not audited.
+        """
+        history = history_source(self.model.sql_emitters)
+        if history is None:
+            raise HTTPException(
+                status_code=400, detail="As of reads are not supported"
+            )
+        # A router without a mask selects the whole table
+        columns = [
+            col for column in columns for col in getattr(column, "columns", [column])
+        ]
+        return as_of_statement(
+            self.table.__table__, columns, as_of, ids=ids, history=history
+        )
+
     async def get_by_id(
         self,
         id: str,
         authorization: Annotated[str, Header()],
+        fields: Annotated[str | None, Query()] = None,
+        as_of: Annotated[datetime.datetime | None, Query()] = None,
         db: AsyncSession = Depends(get_db),
     ):
+        columns = self.select_columns(fields)
+        if as_of is None:
+            stmt = self.select_statement(columns).where(
+                self.table.__table__.c.id == id
+            )
+        else:
+            stmt = self.as_of_statement(columns, as_of, ids=[id])
         await db.execute(func.un0.authorize_user(authorization))
-        result = await db.execute(select(self.table).filter_by(id=id))
-        obj = result.scalar()
+        obj = await self.cached_query(
+            db,
+            {"id": id, "fields": fields, "as_of": as_of},
+            stmt,
+            multiple=False,
+        )
         if obj is None:
             raise HTTPException(status_code=404, detail="Object not found")
-        return obj
+        mask = self.model.masks.get(self.mask)
+        if mask is None:
+            return obj
+        # Serialize the row directly, bypassing validation through the response model
+        return Response(
+            content=mask.dump_json_row(mask.format_rows([obj])[0]),
+            media_type="application/json",
+        )
 
     async def get(
         self,
         authorization: Annotated[str, Header()],
+        fields: Annotated[str | None, Query()] = None,
+        as_of: Annotated[datetime.datetime | None, Query()] = None,
+        ids: Annotated[list[str] | None, Query()] = None,
         db: AsyncSession = Depends(get_db),
     ):
+        columns = self.select_columns(fields)
+        if as_of is None:
+            stmt = self.select_statement(columns)
+            if ids is not None:
+                stmt = stmt.where(self.table.__table__.c.id.in_(ids))
+        else:
+            stmt = self.as_of_statement(columns, as_of, ids=ids)
         await db.execute(func.un0.authorize_user(authorization))
-        result = await db.execute(select(self.table))
-        return result.scalars()
+        rows = await self.cached_query(
+            db,
+            {"fields": fields, "as_of": as_of, "ids": ids},
+            stmt,
+            multiple=True,
+        )
+        mask = self.model.masks.get(self.mask)
+        if mask is None:
+            return rows
+        # Serialize the fetched (or cached) rows as JSON in chunks, bypassing validation
+        # through the response model, the rows themselves are already in memory
+        return StreamingResponse(
+            mask.iter_json(mask.format_rows(rows)), media_type="application/json"
+        )
+
+    async def export(
+        self,
+        authorization: Annotated[str, Header()],
+        export_format: Annotated[
+            ExportFormat, Query(alias="format")
+        ] = ExportFormat.CSV,
+        fields: Annotated[str | None, Query()] = None,
+        query_id: Annotated[str | None, Query()] = None,
+        db: AsyncSession = Depends(get_db),
+    ):
+        """
+        Streams the rows of the router's mask, restricted to the fields requested
+        and to the rows matching the saved query query_id, as a file in the format.
+
+        The rows are read by a COPY under the user's row level security and sent as
+        they are read, exports are never cached nor held in memory. The values are
+        exported as stored, the columns of STRING masks are not localized.
+        """
+        columns = self.select_columns(fields)
+        stmt = self.select_statement(columns)
+        try:
+            exporter.check_format(export_format)
+            await db.execute(func.un0.authorize_user(authorization))
+            conn = await db.connection()
+            if query_id is not None:
+                stmt = stmt.where(
+                    await query_predicate(conn, query_id, self.table.__table__)
+                )
+        except QueryCompileError as e:
+            if e.error_code == "QUERY_NOT_FOUND":
+                raise HTTPException(status_code=404, detail=e.message)
+            raise HTTPException(status_code=400, detail=e.message)
+        except ExportError as e:
+            raise HTTPException(status_code=400, detail=e.message)
+        filename = f"{self.obj_name}.{export_format.value}"
+        return StreamingResponse(
+            exporter.stream(conn, stmt, export_format),
+            media_type=EXPORT_MEDIA_TYPES[export_format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
 
     async def post(
         self,
@@ -103,8 +315,77 @@ class Router(BaseModel):
         await db.execute(self.table.insert().values(data))
         return {"message": "post"}
 
-    def put(self):
-        return {"message": "put"}
+    def uno_db(self) -> UnoDB:
+        return UnoDB(self.table.__table__.fullname)
 
-    def delete(self):
-        return {"message": "delete"}
+    async def write(self, operation: Any, *args: Any) -> dict[str, list[str]]:
+        """
+        Runs a chunked UnoDB update or delete, returning the affected ids.
+
+        Invalid filters or values are reported as 400 errors.
+        """
+        try:
+            ids = await operation(*args)
+        except OperationalError as e:
+            if is_lock_timeout(e):
+                raise HTTPException(
+                    status_code=409, detail="Rows are locked, try again later"
+                )
+            raise
+        except ModelFieldListError as e:
+            raise HTTPException(status_code=400, detail=e.message)
+        return {"ids": ids}
+
+    async def put(
+        self,
+        id: str,
+        request: Request,
+        authorization: Annotated[str, Header()],
+    ):
+        values = await request.json()
+        result = await self.write(
+            self.uno_db().update, values, {"id": id}, authorization
+        )
+        if not result["ids"]:
+            raise HTTPException(status_code=404, detail="Object not found")
+        return result
+
+    async def delete(
+        self,
+        id: str,
+        authorization: Annotated[str, Header()],
+    ):
+        result = await self.write(self.uno_db().delete, {"id": id}, authorization)
+        if not result["ids"]:
+            raise HTTPException(status_code=404, detail="Object not found")
+        return result
+
+    async def bulk_update(
+        self,
+        request: Request,
+        authorization: Annotated[str, Header()],
+    ):
+        """
+        Updates every row matching the filters, the body is
+        {"filters": {column: value, ...}, "values": {column: value, ...}}.
+        """
+        body = await request.json()
+        return await self.write(
+            self.uno_db().update,
+            body.get("values", {}),
+            body.get("filters", {}),
+            authorization,
+        )
+
+    async def bulk_delete(
+        self,
+        request: Request,
+        authorization: Annotated[str, Header()],
+    ):
+        """
+        Deletes every row matching the filters, the body is {"filters": {column: value, ...}}.
+        """
+        body = await request.json()
+        return await self.write(
+            self.uno_db().delete, body.get("filters", {}), authorization
+        )
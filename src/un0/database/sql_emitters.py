@@ -139,6 +139,64 @@ class InsertTableTypeSQL(SQLEmitter):
         )
 
 
+@dataclass
+class TableVersionSQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        """
+        Emits a statement level trigger that publishes a new version of the table,
+        via un0.bump_table_version, after every write so cached results can be invalidated.
+
+        Returns:
+            str: The SQL statement to create the trigger.
+        """
+        return textwrap.dedent(
+            f"""
+            -- Publish a new table version after each writing statement
+            CREATE OR REPLACE TRIGGER {self.table_name}_bump_table_version_trigger
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+                ON {self.schema_name}.{self.table_name}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION un0.bump_table_version();
+            """
+        )
+
+
+@dataclass
+class WorkflowEventNotifySQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        """
+        Emits the statement level triggers that publish the rows changed by each
+        statement, from its transition table, via un0.notify_workflow_event, so the
+        events of DB_EVENT workflows are created (see un0.workflows.dispatcher).
+
+        Returns:
+            str: The SQL statement to create the triggers.
+        """
+        return textwrap.dedent(
+            f"""
+            -- Publish the rows changed by each statement for DB_EVENT workflows
+            CREATE OR REPLACE TRIGGER {self.table_name}_workflow_insert_trigger
+                AFTER INSERT
+                ON {self.schema_name}.{self.table_name}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION un0.notify_workflow_event();
+            CREATE OR REPLACE TRIGGER {self.table_name}_workflow_update_trigger
+                AFTER UPDATE
+                ON {self.schema_name}.{self.table_name}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION un0.notify_workflow_event();
+            CREATE OR REPLACE TRIGGER {self.table_name}_workflow_delete_trigger
+                AFTER DELETE
+                ON {self.schema_name}.{self.table_name}
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION un0.notify_workflow_event();
+            """
+        )
+
+
 @dataclass
 class RecordVersionAuditSQL(SQLEmitter):
     def emit_sql(self) -> str:
@@ -152,43 +210,110 @@ class RecordVersionAuditSQL(SQLEmitter):
 
 @dataclass
 class HistoryTableAuditSQL(SQLEmitter):
+    """
+    Emits the append only history table of a table, and the triggers that write to it.
+
+    The history table, audit.<schema>_<table>, is range partitioned by month on modified_at.
+    Partitions are created by audit.create_history_partition when a row of a new month is
+    written, and detached, or dropped, by audit.maintain_history_partitions once they are
+    older than the retention of the table (see CreateHistoryPartitionSQL).
+
+    The history table is given the SELECT policies of the table, by
+    audit.copy_history_policies, here and by RLSSQL, whichever is emitted last.
+    """
+
     def emit_sql(self) -> str:
-        return f"{self.emit_create_history_table_sql}\n{self.emit_create_history_function_and_trigger_sql}"
+        return f"{self.emit_create_history_table_sql()}\n{self.emit_create_history_function_and_trigger_sql()}"
 
     def emit_create_history_table_sql(self) -> str:
+        history_table = f"{self.schema_name}_{self.table_name}"
         return textwrap.dedent(
             f"""
             SET ROLE {settings.DB_NAME}_admin;
-            CREATE TABLE audit.{self.schema_name}_{self.table_name}
-            AS (SELECT * FROM {self.schema_name}.{self.table_name})
-            WITH NO DATA;
+            CREATE TABLE audit.{history_table} (
+                LIKE {self.schema_name}.{self.table_name},
+                pk BIGINT GENERATED ALWAYS AS IDENTITY,
+                PRIMARY KEY (pk, modified_at)
+            ) PARTITION BY RANGE (modified_at);
 
-            ALTER TABLE audit.{self.schema_name}_{self.table_name}
-            ADD COLUMN pk INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY;
+            -- History is read by time range, and by record
+            CREATE INDEX {history_table}_modified_at_idx
+            ON audit.{history_table} USING BRIN (modified_at);
 
-            CREATE INDEX {self.schema_name}_{self.table_name}_pk_idx
-            ON audit.{self.schema_name}_{self.table_name} (pk);
+            CREATE INDEX {history_table}_id_modified_at_idx
+            ON audit.{history_table} (id, modified_at);
 
-            CREATE INDEX {self.schema_name}_{self.table_name}_id_modified_at_idx
-            ON audit.{self.schema_name}_{self.table_name} (id, modified_at);
+            -- History is append only, partitions are removed by detaching them
+            REVOKE UPDATE, DELETE, TRUNCATE ON audit.{history_table} FROM PUBLIC;
+            CREATE TRIGGER {history_table}_append_only_trigger
+                BEFORE UPDATE OR DELETE ON audit.{history_table}
+                FOR EACH ROW
+                EXECUTE FUNCTION audit.prevent_history_change();
+
+            INSERT INTO audit.history_policy (table_name, retention_months, drop_detached)
+            VALUES (
+                '{history_table}',
+                {settings.HISTORY_RETENTION_MONTHS},
+                {str(settings.HISTORY_DROP_DETACHED).lower()}
+            )
+            ON CONFLICT (table_name) DO NOTHING;
+
+            SELECT audit.maintain_history_partitions({settings.HISTORY_PARTITIONS_AHEAD});
+
+            -- History is read with the SELECT policies of the table
+            GRANT SELECT ON audit.{history_table} TO
+                {settings.DB_NAME}_reader,
+                {settings.DB_NAME}_writer;
+            SELECT audit.copy_history_policies('{self.schema_name}.{self.table_name}'::regclass);
             """
         )
 
     def emit_create_history_function_and_trigger_sql(self) -> str:
+        """
+        Emits the statement level triggers that copy the inserted and updated rows, from
+        their transition table, to the history table, creating the partitions of any new
+        months first. The rows are never read back from the table.
+        """
+        history_table = f"{self.schema_name}_{self.table_name}"
         function_string = f"""
-            INSERT INTO audit.{self.schema_name}_{self.table_name}
-            SELECT *
-            FROM {self.schema_name}.{self.table_name}
-            WHERE id = NEW.id;
-            RETURN NEW;
+            DECLARE
+                month TIMESTAMP;
+            BEGIN
+                FOR month IN
+                    SELECT DISTINCT date_trunc('month', modified_at AT TIME ZONE 'UTC')
+                    FROM new_rows
+                LOOP
+                    PERFORM audit.create_history_partition('{history_table}', month);
+                END LOOP;
+                INSERT INTO audit.{history_table}
+                SELECT * FROM new_rows;
+                RETURN NULL;
+            END;
             """
 
-        return self.create_sql_function(
+        function_sql = self.create_sql_function(
             "history",
             function_string,
-            timing="AFTER",
-            operation="INSERT OR UPDATE",
-            include_trigger=True,
             db_function=False,
             security_definer="SECURITY DEFINER",
         )
+        trigger_sql = textwrap.dedent(
+            f"""
+            -- Replace the per row history trigger of earlier versions
+            DROP TRIGGER IF EXISTS {self.table_name}_history_trigger
+                ON {self.schema_name}.{self.table_name};
+            CREATE OR REPLACE TRIGGER {self.table_name}_history_insert_trigger
+                AFTER INSERT
+                ON {self.schema_name}.{self.table_name}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {self.schema_name}.{self.table_name}_history();
+            CREATE OR REPLACE TRIGGER {self.table_name}_history_update_trigger
+                AFTER UPDATE
+                ON {self.schema_name}.{self.table_name}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {self.schema_name}.{self.table_name}_history();
+            """
+        )
+        return f"{function_sql}\n{trigger_sql}"
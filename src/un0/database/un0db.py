@@ -1,24 +1,54 @@
-from typing import Any
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+
+from typing import Any, AsyncIterator
 
 from sqlalchemy import (
     Table,
-    inspect,
+    Select,
+    Row,
+    INTEGER,
+    bindparam,
+    union_all,
     select,
     exists,
     insert,
     update,
     delete,
+    func,
     and_,
     or_,
     not_,
+    text,
 )
-from uno.enumerations import (
-    UnoSelectResultType,
-    Include,
-    Lookup,
-)  # type: ignore
-from uno.database import metadata, engine, async_engine  # type: ignore
-from config import settings  # type: ignore
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from un0.errors import ModelFieldListError
+from un0.database.enums import SelectResultType
+from un0.filters.enums import Include, Lookup
+from un0.database.base import metadata, engine
+from un0.database.metadata_cache import metadata_cache, TableMetadata
+from un0.config import settings
+
+
+def live_rows(table: Table) -> Any | None:
+    """
+    Returns the predicate of the rows of the table that are not soft deleted,
+    matching its partial indexes (see Model.partial_index_where), or None if
+    the table does not soft delete.
+    """
+    if "is_deleted" not in table.columns:
+        return None
+    return not_(table.c.is_deleted)
+
+
+def is_lock_timeout(error: OperationalError) -> bool:
+    """Returns whether the error is a lock timeout (lock_not_available)."""
+    return getattr(error.orig, "sqlstate", None) == "55P03"
 
 
 class UnoDB:
@@ -47,16 +77,20 @@ class UnoDB:
         self.table_name = table_name
         self.db_tables = metadata.tables
         self.engine = engine
-        self.async_engine = async_engine
-        self.pk_fields = []
+        self.async_engine = engine
         self.DB_NAME = settings.DB_SCHEMA
         try:
             self.db_table = self.db_tables[table_name]
         except KeyError as e:
             raise Exception(f"Table {table_name} does not exist in the database") from e
-        for column in self.db_table.columns:
-            if column.primary_key:
-                self.pk_fields.append(column.name)
+        self.pk_fields = list(self.table_metadata.pk_columns)
+
+    @property
+    def table_metadata(self) -> TableMetadata:
+        """
+        The cached constraint and column metadata of the table, see MetadataCache.
+        """
+        return metadata_cache.get(self.db_table.fullname)
 
     def server_default_columns(self) -> list[str]:
         """
@@ -65,9 +99,7 @@ class UnoDB:
         Returns:
             A list of columns with server defaults for the table.
         """
-        return [
-            column.name for column in self.db_table.columns if column.server_default
-        ]
+        return self.table_metadata.server_default_columns
 
     def unique_constraints(self) -> list[str]:
         """
@@ -76,27 +108,20 @@ class UnoDB:
         Returns:
             A list of unique constraints for the table.
         """
-        insp = inspect(self.engine)
-        # The fully schema_name qualified table name cannot be used by the inspector
-        # The table name must be stripped of the schema_name name and they must be passed as separate arguments
-        # TODO - Determine if this is a hack that can be fixed?
-        table_name = self.table_name.replace(f"{settings.DB_SCHEMA}.", "")
-        server_default_columns = self.server_default_columns()
-        pks_ = insp.get_pk_constraint(table_name, schema_name=settings.DB_SCHEMA)
+        table_metadata = self.table_metadata
+        server_default_columns = table_metadata.server_default_columns
         pks = [
             pk_name
-            for pk_name in pks_.get("constrained_columns", [])
+            for pk_name in table_metadata.pk_columns
             if pk_name not in server_default_columns
-        ]  # type: ignore
-        uniques_ = insp.get_unique_constraints(
-            table_name, schema_name=settings.DB_SCHEMA
-        )
+        ]
         uniques = [
-            u
-            for unique in uniques_
-            for u in unique.get("column_names", [])
-            if unique not in server_default_columns
-        ]  # type: ignore
+            column_name
+            for unique in table_metadata.unique_constraints
+            + table_metadata.live_unique_constraints
+            for column_name in unique
+            if column_name not in server_default_columns
+        ]
         if pks and uniques:
             return pks + uniques
         if uniques and not pks:
@@ -116,7 +141,7 @@ class UnoDB:
             column_names (list[str]): The list of column names to compare against.
 
         Raises:
-            Exception: If no valid fields are provided or if a column is missing.
+            ModelFieldListError: If a column is missing.
 
         Returns:
             list[str]: The validated column names.
@@ -125,8 +150,9 @@ class UnoDB:
             column_names = list(self.db_table.columns.keys())
         missing_columns = set(value_keys) - set(column_names)
         if missing_columns:
-            raise Exception(
-                f"Column {missing_columns} is not in the column names provided."
+            raise ModelFieldListError(
+                f"Column {missing_columns} is not in the column names provided.",
+                "COLUMN_NOT_FOUND",
             )
         return column_names
 
@@ -191,30 +217,155 @@ class UnoDB:
         else:
             return ~operation
 
+    def select_statement(
+        self,
+        values: dict[str, Any] | None = None,
+        column_names: list[str] | None = None,
+        include_deleted: bool = False,
+    ) -> Select:
+        """
+        Creates a select statement of the columns, filtered by equality with the values.
+
+        Soft deleted rows are excluded unless include_deleted is set, the predicate
+        is stated so the planner can use the table's partial indexes.
+
+        Args:
+            values (dict[str, Any] | None): The column names and values to filter by.
+            column_names (list[str] | None): The columns to select, all columns if None.
+            include_deleted (bool): Whether soft deleted rows are selected. Defaults to False.
+
+        Raises:
+            Exception: If a column name or a value key is not a column of the table.
+
+        Returns:
+            Select: The select statement.
+        """
+        values = values or {}
+        table_column_names = list(self.db_table.columns.keys())
+        self.validate_columns(list(values.keys()), table_column_names)
+        if column_names:
+            self.validate_columns(column_names, table_column_names)
+        else:
+            column_names = table_column_names
+        columns = [self.db_table.c[column_name] for column_name in column_names]
+        stmt = select(*columns)
+        if values:
+            stmt = stmt.where(*[self.where(key, val) for key, val in values.items()])
+        where_live = live_rows(self.db_table)
+        if where_live is not None and not include_deleted:
+            stmt = stmt.where(where_live)
+        return stmt
+
     async def select(
         self,
-        # columns: list[str] | None = None,
-        values: dict[str, Any],
-        result_type: UnoSelectResultType = UnoSelectResultType.FIRST,
+        values: dict[str, Any] | None = None,
+        result_type: SelectResultType = SelectResultType.FIRST,
         column_names: list[str] | None = None,
-    ) -> bool | None:
-        # if columns is None:
-        #    column_names = list(self.db_table.columns.keys())
-        column_names = self.validate_columns(
-            list(values.keys()), self.db_table.columns.keys()
-        )
-        columns = (self.db_table.c.get(field_name) for field_name in column_names)
+        size: int = settings.DEFAULT_LIMIT,
+        include_deleted: bool = False,
+    ) -> Any:
+        """
+        Selects rows of the table, filtered by equality with the values.
 
-        # Create the statement
-        where_clauses = [
-            self.where(key, val) for key, val in values.items() if key in column_names
-        ]
-        stmt = select(*columns).where(and_(*where_clauses))  # type: ignore
+        Args:
+            values (dict[str, Any] | None): The column names and values to filter by.
+            result_type (SelectResultType): How the result is returned:
+                FETCH_ONE: the first row or None, FETCH_MANY: a list of up to size rows,
+                FETCH_ALL: a list of all rows, FIRST: the first row or None,
+                COUNT: the number of matching rows, KEYS: the selected column names,
+                SCALAR: the first column of the first row or None.
+                Defaults to SelectResultType.FIRST.
+            column_names (list[str] | None): The columns to select, all columns if None.
+            size (int): The number of rows returned by FETCH_MANY.
+                Defaults to settings.DEFAULT_LIMIT.
+            include_deleted (bool): Whether soft deleted rows are selected. Defaults to False.
 
-        # Run the query
-        async with self.async_engine.begin() as conn:
+        Returns:
+            Any: The result, as described for result_type.
+        """
+        stmt = self.select_statement(values, column_names, include_deleted)
+        if result_type == SelectResultType.COUNT:
+            stmt = select(func.count()).select_from(stmt.subquery())
+        elif result_type == SelectResultType.FETCH_MANY:
+            stmt = stmt.limit(size)
+        elif result_type in (
+            SelectResultType.FETCH_ONE,
+            SelectResultType.FIRST,
+            SelectResultType.SCALAR,
+        ):
+            stmt = stmt.limit(1)
+
+        async with self.async_engine.connect() as conn:
             result = await conn.execute(stmt)
-        return getattr(result, result_type)()
+            if result_type == SelectResultType.FETCH_ONE:
+                return result.fetchone()
+            if result_type in (SelectResultType.FETCH_MANY, SelectResultType.FETCH_ALL):
+                return result.fetchall()
+            if result_type == SelectResultType.FIRST:
+                return result.first()
+            if result_type in (SelectResultType.COUNT, SelectResultType.SCALAR):
+                return result.scalar()
+            if result_type == SelectResultType.KEYS:
+                return list(result.keys())
+        raise ValueError(f"Unsupported result type: {result_type}")
+
+    async def stream(
+        self,
+        values: dict[str, Any] | None = None,
+        column_names: list[str] | None = None,
+        yield_per: int = settings.DEFAULT_YIELD_PER,
+        include_deleted: bool = False,
+    ) -> AsyncIterator[Row]:
+        """
+        Streams the rows of the table, filtered by equality with the values,
+        through a server side cursor, fetching yield_per rows at a time.
+
+        Memory use is bounded by yield_per regardless of the number of rows.
+        The cursor and its connection are closed when the iteration ends, is
+        stopped (aclose), or the consuming task is cancelled.
+
+        Args:
+            values (dict[str, Any] | None): The column names and values to filter by.
+            column_names (list[str] | None): The columns to select, all columns if None.
+            yield_per (int): The number of rows fetched per round trip.
+                Defaults to settings.DEFAULT_YIELD_PER.
+            include_deleted (bool): Whether soft deleted rows are selected. Defaults to False.
+
+        Yields:
+            Row: The rows of the result.
+        """
+        async for partition in self.stream_statement(
+            self.select_statement(values, column_names, include_deleted), yield_per
+        ):
+            for row in partition:
+                yield row
+
+    async def stream_statement(
+        self,
+        stmt: Any,
+        yield_per: int = settings.DEFAULT_YIELD_PER,
+    ) -> AsyncIterator[list[Row]]:
+        """
+        Streams the result of a statement through a server side cursor,
+        in partitions of up to yield_per rows.
+
+        Args:
+            stmt (Any): The statement to execute.
+            yield_per (int): The number of rows fetched per round trip.
+                Defaults to settings.DEFAULT_YIELD_PER.
+
+        Yields:
+            list[Row]: The partitions of the result.
+        """
+        async with self.async_engine.connect() as conn:
+            result = await conn.stream(
+                stmt.execution_options(yield_per=yield_per)
+            )
+            try:
+                async for partition in result.partitions():
+                    yield partition
+            finally:
+                await result.close()
 
     async def exists(
         self,
@@ -234,6 +385,133 @@ class UnoDB:
             result = await conn.execute(select(exists(stmt)))
         return result.scalar()
 
+    def key_sets(
+        self, records: list[dict[str, Any]], key_columns: list[str] | None = None
+    ) -> list[list[str]]:
+        """
+        Returns the sets of columns that identify an existing record.
+
+        Args:
+            records (list[dict[str, Any]]): The candidate records.
+            key_columns (list[str] | None): The columns identifying a record,
+                e.g. ["import_key"] for records imported with ImportMixin.
+                Defaults to the primary key and the unique constraints of the table
+                for which every record has a value.
+
+        Raises:
+            Exception: If a key column is not a column of the table, or there is no key.
+        """
+        if key_columns:
+            self.validate_columns(key_columns, list(self.db_table.columns.keys()))
+            return [key_columns]
+        record_keys = set.intersection(*[set(record.keys()) for record in records])
+        table_metadata = self.table_metadata
+        key_sets = [
+            columns
+            for columns in [table_metadata.pk_columns]
+            + table_metadata.unique_constraints
+            + table_metadata.live_unique_constraints
+            if columns and set(columns) <= record_keys
+        ]
+        if not key_sets:
+            raise Exception(
+                f"No primary key or unique constraint of {self.table_name} is set in the records"
+            )
+        return key_sets
+
+    def bulk_exists_statement(
+        self, records: list[dict[str, Any]], key_sets: list[list[str]]
+    ) -> Any:
+        """
+        Creates the statement matching the records to existing rows on each key set.
+
+        The candidate values are sent as one array per column, unnested into a
+        candidates CTE alongside the ordinal of each record, and joined against
+        the table once per key set.
+
+        Soft deleted rows only match on the primary key and on unique constraints,
+        which they still occupy. Other key sets, such as the unique indexes restricted
+        to the rows not soft deleted, state that predicate, so their partial indexes are used.
+
+        Returns:
+            Any: A statement returning (ordinal, primary key columns...) rows.
+        """
+        key_columns = sorted({column for columns in key_sets for column in columns})
+        candidates = (
+            select(
+                func.unnest(
+                    bindparam(
+                        "candidate_ordinal",
+                        list(range(len(records))),
+                        type_=ARRAY(INTEGER),
+                    ),
+                    *[
+                        bindparam(
+                            f"candidate_{column}",
+                            [record.get(column) for record in records],
+                            type_=ARRAY(self.db_table.c[column].type),
+                        )
+                        for column in key_columns
+                    ],
+                )
+                .table_valued("ordinal", *key_columns)
+                .render_derived(name="candidate")
+            )
+        ).cte("candidates")
+        table_metadata = self.table_metadata
+        pk_columns = [self.db_table.c[name] for name in table_metadata.pk_columns]
+        where_live = live_rows(self.db_table)
+        selects = []
+        for columns in key_sets:
+            stmt = select(candidates.c.ordinal, *pk_columns).join(
+                self.db_table,
+                and_(
+                    *[
+                        self.db_table.c[column] == candidates.c[column]
+                        for column in columns
+                    ]
+                ),
+            )
+            if where_live is not None and not (
+                columns == table_metadata.pk_columns
+                or columns in table_metadata.unique_constraints
+            ):
+                stmt = stmt.where(where_live)
+            selects.append(stmt)
+        return union_all(*selects)
+
+    async def bulk_exists(
+        self,
+        records: list[dict[str, Any]],
+        key_columns: list[str] | None = None,
+        chunk_size: int = settings.DEFAULT_BULK_CHUNK_SIZE,
+    ) -> list[Any | None]:
+        """
+        Finds which of many candidate records already exist, in one round trip per chunk.
+
+        Args:
+            records (list[dict[str, Any]]): The candidate records.
+            key_columns (list[str] | None): The columns identifying a record, see key_sets.
+            chunk_size (int): The number of records sent per query.
+                Defaults to settings.DEFAULT_BULK_CHUNK_SIZE.
+
+        Returns:
+            list[Any | None]: For each record, in order, the primary key of the existing
+                row it matches (a tuple if the primary key is composite), or None.
+        """
+        if not records:
+            return []
+        key_sets = self.key_sets(records, key_columns)
+        composite = len(self.table_metadata.pk_columns) > 1
+        existing: list[Any | None] = [None] * len(records)
+        async with self.async_engine.connect() as conn:
+            for start in range(0, len(records), chunk_size):
+                chunk = records[start : start + chunk_size]
+                result = await conn.execute(self.bulk_exists_statement(chunk, key_sets))
+                for ordinal, *pk in result:
+                    existing[start + ordinal] = tuple(pk) if composite else pk[0]
+        return existing
+
     async def insert(self, values: dict[str, Any]) -> None:
         """
         Inserts a row into the table.
@@ -251,13 +529,216 @@ class UnoDB:
             # conn.commit()
             # conn.close()
 
+    def chunk_ids_statement(
+        self,
+        filters: dict[str, Any],
+        after_id: Any | None,
+        chunk_size: int,
+        where: Any | None = None,
+    ) -> Select:
+        """
+        Creates the statement that selects and locks the ids of the next chunk of rows
+        matching the filters, in id order, after after_id.
+        """
+        id_column = self.db_table.c.id
+        stmt = select(id_column)
+        if filters:
+            stmt = stmt.where(*[self.where(key, val) for key, val in filters.items()])
+        if where is not None:
+            stmt = stmt.where(where)
+        if after_id is not None:
+            stmt = stmt.where(id_column > after_id)
+        return stmt.order_by(id_column).limit(chunk_size).with_for_update()
+
+    async def run_in_chunks(
+        self,
+        filters: dict[str, Any],
+        statements: Any,
+        authorization: str | None = None,
+        chunk_size: int = settings.DEFAULT_BULK_CHUNK_SIZE,
+        lock_timeout: int = settings.BULK_LOCK_TIMEOUT,
+        lock_retries: int = settings.BULK_LOCK_RETRIES,
+        where: Any | None = None,
+    ) -> list[Any]:
+        """
+        Runs set based statements on the rows matching the filters, one id range at a time.
+
+        Each chunk runs in its own transaction, which:
+            authorizes the user, if an authorization token is provided, as the writer role
+                (the row level security session variables are local to the transaction),
+            sets a lock_timeout of lock_timeout milliseconds,
+            selects and locks the next chunk_size ids after the previous chunk,
+            executes each of statements(ids), returning the affected ids.
+        A chunk that cannot acquire its locks within lock_timeout is retried, with an
+        exponential backoff, up to lock_retries times before the error is raised. Chunks
+        that were committed before the error remain committed.
+
+        Args:
+            filters (dict[str, Any]): The column names and values to filter by.
+            statements (Callable[[list[Any]], list[Any]]): Returns the statements to execute
+                for a chunk of ids, each statement must return the ids it affected.
+            authorization (str | None): The JWT token of the user. Defaults to None.
+            chunk_size (int): The number of rows per chunk.
+                Defaults to settings.DEFAULT_BULK_CHUNK_SIZE.
+            lock_timeout (int): The lock timeout of each chunk, in milliseconds.
+                Defaults to settings.BULK_LOCK_TIMEOUT.
+            lock_retries (int): The number of times a chunk is retried on a lock timeout.
+                Defaults to settings.BULK_LOCK_RETRIES.
+            where (Any | None): An additional sqlalchemy where clause. Defaults to None.
+
+        Returns:
+            list[Any]: The affected ids.
+        """
+        self.validate_columns(list(filters.keys()), list(self.db_table.columns.keys()))
+        affected_ids: list[Any] = []
+        after_id = None
+        while True:
+            for attempt in range(lock_retries + 1):
+                try:
+                    async with self.async_engine.begin() as conn:
+                        if authorization is not None:
+                            await conn.execute(
+                                select(func.un0.authorize_user(authorization, "writer"))
+                            )
+                        await conn.execute(
+                            text(f"SET LOCAL lock_timeout = {int(lock_timeout)}")
+                        )
+                        ids = (
+                            await conn.execute(
+                                self.chunk_ids_statement(
+                                    filters, after_id, chunk_size, where
+                                )
+                            )
+                        ).scalars().all()
+                        chunk_ids = []
+                        for stmt in statements(ids) if ids else []:
+                            chunk_ids.extend(
+                                (await conn.execute(stmt)).scalars().all()
+                            )
+                    # Only the ids of the committed attempt are affected
+                    affected_ids.extend(chunk_ids)
+                    break
+                except OperationalError as e:
+                    if not is_lock_timeout(e) or attempt == lock_retries:
+                        raise
+                    await asyncio.sleep(0.1 * 2**attempt)
+            if len(ids) < chunk_size:
+                return affected_ids
+            after_id = ids[-1]
+
+    async def update(
+        self,
+        values: dict[str, Any],
+        filters: dict[str, Any],
+        authorization: str | None = None,
+        chunk_size: int = settings.DEFAULT_BULK_CHUNK_SIZE,
+        lock_timeout: int = settings.BULK_LOCK_TIMEOUT,
+        where: Any | None = None,
+        include_deleted: bool = False,
+    ) -> list[Any]:
+        """
+        Updates the rows matching the filters in id range chunks, see run_in_chunks.
+
+        Soft deleted rows are neither locked nor updated unless include_deleted is set.
+
+        Args:
+            values (dict[str, Any]): The column names and values to set.
+            filters (dict[str, Any]): The column names and values to filter by.
+            include_deleted (bool): Whether soft deleted rows are updated. Defaults to False.
+
+        Returns:
+            list[Any]: The ids of the updated rows.
+        """
+        if not values:
+            raise ModelFieldListError("No values to update", "NO_VALUES")
+        self.validate_columns(list(values.keys()), list(self.db_table.columns.keys()))
+        id_column = self.db_table.c.id
+        where_live = live_rows(self.db_table)
+        if where_live is not None and not include_deleted:
+            where = where_live if where is None else and_(where, where_live)
+
+        def statements(ids: list[Any]) -> list[Any]:
+            return [
+                update(self.db_table)
+                .where(id_column.in_(ids))
+                .values(values)
+                .returning(id_column)
+            ]
+
+        return await self.run_in_chunks(
+            filters,
+            statements,
+            authorization=authorization,
+            chunk_size=chunk_size,
+            lock_timeout=lock_timeout,
+            where=where,
+        )
+
+    async def delete(
+        self,
+        filters: dict[str, Any],
+        authorization: str | None = None,
+        chunk_size: int = settings.DEFAULT_BULK_CHUNK_SIZE,
+        lock_timeout: int = settings.BULK_LOCK_TIMEOUT,
+        where: Any | None = None,
+    ) -> list[Any]:
+        """
+        Deletes the rows matching the filters in id range chunks, see run_in_chunks.
+
+        Tables with an is_deleted column (ActiveDeletedMixin) are soft deleted as the
+        SoftDelete triggers do, with explicit statements so that the ids of both kinds of
+        rows are returned: rows not yet deleted are marked deleted, rows already marked
+        deleted are removed.
+
+        Args:
+            filters (dict[str, Any]): The column names and values to filter by.
+
+        Returns:
+            list[Any]: The ids of the deleted rows.
+        """
+        id_column = self.db_table.c.id
+        user_id = func.current_setting("rls_var.user_id", True)
+
+        def statements(ids: list[Any]) -> list[Any]:
+            if "is_deleted" not in self.db_table.columns:
+                return [
+                    delete(self.db_table).where(id_column.in_(ids)).returning(id_column)
+                ]
+            # Rows already marked deleted are removed first, so the rows marked
+            # deleted by the update are not removed by the same chunk
+            return [
+                delete(self.db_table)
+                .where(id_column.in_(ids), self.db_table.c.is_deleted)
+                .returning(id_column),
+                update(self.db_table)
+                .where(id_column.in_(ids), not_(self.db_table.c.is_deleted))
+                .values(
+                    is_deleted=True,
+                    is_active=False,
+                    deleted_at=func.now(),
+                    deleted_by_id=user_id,
+                    modified_at=func.now(),
+                    modified_by_id=user_id,
+                )
+                .returning(id_column),
+            ]
+
+        return await self.run_in_chunks(
+            filters,
+            statements,
+            authorization=authorization,
+            chunk_size=chunk_size,
+            lock_timeout=lock_timeout,
+            where=where,
+        )
+
     """
     async def select(
         self,
         statement: Any | None = None,
         value: Any = None,
         field_name: str = "id",
-        result_type: UnoSelectResultType = UnoSelectResultType.FIRST,
+        result_type: SelectResultType = SelectResultType.FIRST,
         limit: int = settings.DEFAULT_LIMIT,
         offset: int = settings.DEFAULT_OFFSET,
         match: str = Match.AND,
@@ -270,16 +751,4 @@ class UnoDB:
             conn.execute(insert(self.db_table).values(values))
             conn.commit()
             conn.close()
-    
-    async def update(self, values: dict[str, Any], where: dict[str, Any]) -> None:
-        with engine.connect() as conn:
-            conn.execute(update(self.db_table).values(values).where(where))
-            conn.commit()
-            conn.close()
-
-    async def delete(self, where: dict[str, Any]) -> None:
-        with engine.connect() as conn:
-            conn.execute(delete(self.db_table).where(where))
-            conn.commit()
-            conn.close()
     """
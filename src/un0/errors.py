@@ -48,3 +48,19 @@ class UnauthorizedError(HTTPException):
 class ForbiddenError(HTTPException):
     status_code = status.HTTP_403_FORBIDDEN
     detail = "You do not have permission to access this resource."
+
+
+class QueryCompileError(Un0Error):
+    pass
+
+
+class AttachmentTooLargeError(Un0Error):
+    pass
+
+
+class ReportError(Un0Error):
+    pass
+
+
+class ExportError(Un0Error):
+    pass
@@ -0,0 +1,348 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+from collections import OrderedDict
+from typing import Any
+
+from pydantic.dataclasses import dataclass
+from sqlalchemy import (
+    ColumnElement,
+    Select,
+    Table,
+    and_,
+    or_,
+    not_,
+    true,
+    select,
+    bindparam,
+    any_,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, VARCHAR
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from un0.errors import QueryCompileError
+from un0.database.base import metadata
+from un0.filters.enums import Include, Match, Lookup
+from un0.filters.queries import (
+    FILTER_VALUE_COLUMNS,
+    Query,
+    FilterValue,
+    QueryFilterValue,
+    QuerySubquery,
+)
+from un0.relatedobjects.models import TableType
+
+
+# The number of compiled queries kept by a QueryCompiler
+QUERY_CACHE_SIZE = 512
+
+
+@dataclass(frozen=True)
+class FilterValueDefinition:
+    field_name: str
+    lookup: Lookup
+    include: Include
+    value: Any = None
+
+
+@dataclass(frozen=True)
+class QueryDefinition:
+    """The definition of a query, as loaded by QueryCompiler.load_definitions."""
+
+    id: str
+    version: int
+    table_type_id: int
+    include_values: Include = Include.INCLUDE
+    match_values: Match = Match.AND
+    include_subqueries: Include = Include.INCLUDE
+    match_subqueries: Match = Match.AND
+    filter_values: tuple[FilterValueDefinition, ...] = ()
+    subquery_ids: tuple[str, ...] = ()
+
+
+def combine(clauses: list[ColumnElement], match: Match) -> ColumnElement:
+    if match == Match.OR:
+        return or_(*clauses)
+    if match == Match.NOT:
+        return not_(and_(*clauses))
+    return and_(*clauses)
+
+
+def filter_value_predicate(table: Table, value: FilterValueDefinition) -> ColumnElement:
+    column = table.columns.get(value.field_name)
+    if column is None:
+        raise QueryCompileError(
+            f"{table.fullname} has no column {value.field_name}",
+            "UNKNOWN_FILTER_FIELD",
+        )
+    if value.lookup == Lookup.BETWEEN:
+        # A single value can not hold both bounds of the range
+        raise QueryCompileError(
+            "BETWEEN lookups can not be compiled", "UNSUPPORTED_LOOKUP"
+        )
+    if value.lookup in (Lookup.NULL, Lookup.NOT_NULL):
+        clause = getattr(column, value.lookup.value)(None)
+    elif value.lookup in (Lookup.IN, Lookup.NOT_IN):
+        clause = getattr(column, value.lookup.value)([value.value])
+    else:
+        clause = getattr(column, value.lookup.value)(value.value)
+    if value.include == Include.EXCLUDE:
+        return not_(clause)
+    return clause
+
+
+def compile_predicate(
+    table: Table,
+    definition: QueryDefinition,
+    definitions: dict[str, QueryDefinition],
+    _path: tuple[str, ...] = (),
+) -> ColumnElement:
+    """
+    Compiles a query into a predicate over the rows of table.
+
+    The filter values of the query are combined according to match_values, its
+    subqueries, compiled recursively against the same table, according to
+    match_subqueries, and each group is negated when its include is EXCLUDE.
+
+    Args:
+        table (Table): The table of the query's table type.
+        definition (QueryDefinition): The query to compile.
+        definitions (dict[str, QueryDefinition]): The definitions of the query's
+            subqueries, and of theirs, by id.
+
+    Raises:
+        QueryCompileError: If a query includes itself, a subquery is of another
+            table type or a filter value can not be compiled against table.
+    """
+    if definition.id in _path:
+        raise QueryCompileError(
+            f"Query {definition.id} includes itself as a subquery",
+            "QUERY_CYCLE",
+        )
+    path = (*_path, definition.id)
+    groups = []
+    if definition.filter_values:
+        values = combine(
+            [filter_value_predicate(table, value) for value in definition.filter_values],
+            definition.match_values,
+        )
+        if definition.include_values == Include.EXCLUDE:
+            values = not_(values)
+        groups.append(values)
+    if definition.subquery_ids:
+        subqueries = []
+        for subquery_id in definition.subquery_ids:
+            subquery = definitions.get(subquery_id)
+            if subquery is None:
+                raise QueryCompileError(
+                    f"Subquery {subquery_id} of query {definition.id} not found",
+                    "SUBQUERY_NOT_FOUND",
+                )
+            if subquery.table_type_id != definition.table_type_id:
+                raise QueryCompileError(
+                    f"Subquery {subquery_id} queries another table type than {definition.id}",
+                    "SUBQUERY_TABLE_TYPE_MISMATCH",
+                )
+            subqueries.append(compile_predicate(table, subquery, definitions, path))
+        included = combine(subqueries, definition.match_subqueries)
+        if definition.include_subqueries == Include.EXCLUDE:
+            included = not_(included)
+        groups.append(included)
+    if not groups:
+        return true()
+    return and_(*groups)
+
+
+def matching_ids_statement(table: Table, predicate: ColumnElement) -> Select:
+    """
+    Creates the statement selecting which of the ids bound to :ids match predicate,
+    reading only those rows by their primary key.
+    """
+    return select(table.c.id).where(
+        table.c.id == any_(bindparam("ids", type_=ARRAY(VARCHAR))),
+        predicate,
+    )
+
+
+def definitions_statement() -> Select:
+    """
+    Creates the statement selecting the query bound to :query_id and all of its
+    subqueries, recursively, with their filter values.
+    """
+    query = Query.table.__table__
+    query_subquery = QuerySubquery.table.__table__
+    query_filtervalue = QueryFilterValue.table.__table__
+    filtervalue = FilterValue.table.__table__
+    tree = (
+        select(query.c.id.label("id"))
+        .where(query.c.id == bindparam("query_id"))
+        .cte("tree", recursive=True)
+    )
+    tree = tree.union(
+        select(query_subquery.c.subquery_id).join(
+            tree, query_subquery.c.query_id == tree.c.id
+        )
+    )
+    return (
+        select(
+            query.c.id,
+            query.c.version,
+            query.c.queries_table_type_id,
+            query.c.include_values,
+            query.c.match_values,
+            query.c.include_subqueries,
+            query.c.match_subqueries,
+            query_subquery.c.subquery_id,
+            filtervalue.c.field_name,
+            filtervalue.c.lookup,
+            filtervalue.c.include,
+            *(filtervalue.c[column] for column in FILTER_VALUE_COLUMNS),
+        )
+        .join(tree, query.c.id == tree.c.id)
+        .outerjoin(query_subquery, query_subquery.c.query_id == query.c.id)
+        .outerjoin(query_filtervalue, query_filtervalue.c.query_id == query.c.id)
+        .outerjoin(
+            filtervalue, filtervalue.c.id == query_filtervalue.c.filtervalue_id
+        )
+    )
+
+
+class QueryCompiler:
+    """
+    Compiles saved queries into predicates, cached by query id and version.
+
+    The version of a query is incremented on any change to its definition or that
+    of its subqueries (see QueryVersionSQL), so a cached predicate is never stale,
+    the current version is read with a single indexed lookup before each use.
+    """
+
+    def __init__(self, cache_size: int = QUERY_CACHE_SIZE) -> None:
+        self.cache_size = cache_size
+        self.cache: OrderedDict[tuple[str, int], tuple[Table, ColumnElement]] = (
+            OrderedDict()
+        )
+        self.compiled = 0
+
+    async def predicate(
+        self, conn: AsyncConnection, query_id: str
+    ) -> tuple[Table, ColumnElement]:
+        """Returns the table queried by the query and the compiled predicate."""
+        version, table, predicate = await self.versioned_predicate(conn, query_id)
+        return table, predicate
+
+    async def versioned_predicate(
+        self, conn: AsyncConnection, query_id: str
+    ) -> tuple[int, Table, ColumnElement]:
+        """
+        Returns the current version of the query, the table it queries and the
+        compiled predicate, the version identifying the predicate, e.g. in the
+        keys of cached results.
+        """
+        query = Query.table.__table__
+        version = await conn.scalar(
+            select(query.c.version).where(query.c.id == query_id)
+        )
+        if version is None:
+            raise QueryCompileError(f"Query {query_id} not found", "QUERY_NOT_FOUND")
+        key = (query_id, version)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return (version, *self.cache[key])
+        definitions = await self.load_definitions(conn, query_id)
+        definition = definitions[query_id]
+        table = await self.load_table(conn, definition.table_type_id)
+        compiled = (table, compile_predicate(table, definition, definitions))
+        self.compiled += 1
+        self.cache[key] = compiled
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return (version, *compiled)
+
+    async def matching_ids(
+        self, conn: AsyncConnection, query_id: str, ids: list[str]
+    ) -> list[str]:
+        """Returns which of the ids are of rows matching the query."""
+        if not ids:
+            return []
+        table, predicate = await self.predicate(conn, query_id)
+        result = await conn.execute(
+            matching_ids_statement(table, predicate), {"ids": ids}
+        )
+        return list(result.scalars())
+
+    async def load_definitions(
+        self, conn: AsyncConnection, query_id: str
+    ) -> dict[str, QueryDefinition]:
+        rows = (
+            await conn.execute(definitions_statement(), {"query_id": query_id})
+        ).mappings()
+        queries: dict[str, dict[str, Any]] = {}
+        for row in rows:
+            query = queries.setdefault(
+                row["id"],
+                {
+                    "id": row["id"],
+                    "version": row["version"],
+                    "table_type_id": row["queries_table_type_id"],
+                    "include_values": row["include_values"],
+                    "match_values": row["match_values"],
+                    "include_subqueries": row["include_subqueries"],
+                    "match_subqueries": row["match_subqueries"],
+                    "filter_values": {},
+                    "subquery_ids": {},
+                },
+            )
+            if row["subquery_id"] is not None:
+                query["subquery_ids"][row["subquery_id"]] = None
+            if row["field_name"] is not None:
+                value = next(
+                    (
+                        row[column]
+                        for column in FILTER_VALUE_COLUMNS
+                        if row[column] is not None
+                    ),
+                    None,
+                )
+                query["filter_values"][
+                    (row["field_name"], row["lookup"], row["include"], value)
+                ] = None
+        if query_id not in queries:
+            raise QueryCompileError(f"Query {query_id} not found", "QUERY_NOT_FOUND")
+        return {
+            id: QueryDefinition(
+                **{
+                    **query,
+                    "filter_values": tuple(
+                        FilterValueDefinition(
+                            field_name=field_name,
+                            lookup=lookup,
+                            include=include,
+                            value=value,
+                        )
+                        for field_name, lookup, include, value in query[
+                            "filter_values"
+                        ]
+                    ),
+                    "subquery_ids": tuple(query["subquery_ids"]),
+                }
+            )
+            for id, query in queries.items()
+        }
+
+    async def load_table(self, conn: AsyncConnection, table_type_id: int) -> Table:
+        table_type = TableType.table.__table__
+        row = (
+            await conn.execute(
+                select(table_type.c.db_schema, table_type.c.name).where(
+                    table_type.c.id == table_type_id
+                )
+            )
+        ).one_or_none()
+        table = None if row is None else metadata.tables.get(f"{row[0]}.{row[1]}")
+        if table is None:
+            raise QueryCompileError(
+                f"Table Type {table_type_id} is not a known table",
+                "UNKNOWN_TABLE_TYPE",
+            )
+        return table
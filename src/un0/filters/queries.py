@@ -0,0 +1,289 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import datetime
+
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import Integer, BigInteger, text
+from sqlalchemy.dialects.postgresql import (
+    BOOLEAN,
+    DATE,
+    ENUM,
+    NUMERIC,
+    TEXT,
+    TIME,
+    TIMESTAMP,
+    VARCHAR,
+)
+
+from un0.database.fields import FKDefinition, CheckDefinition, FieldDefinition
+from un0.database.models import Model
+from un0.database.mixins import NameMixin
+from un0.relatedobjects.mixins import RelatedObjectIdMixin
+from un0.authorization.mixins import TenantMixin
+from un0.filters.enums import Include, Match, Lookup
+from un0.filters.sql_emitters import QueryVersionSQL
+
+
+# The columns of FilterValue that can hold the value, exactly one is set
+FILTER_VALUE_COLUMNS = [
+    "bigint_value",
+    "boolean_value",
+    "date_value",
+    "decimal_value",
+    "object_value_id",
+    "string_value",
+    "text_value",
+    "time_value",
+    "timestamp_value",
+]
+
+
+class Query(
+    Model,
+    RelatedObjectIdMixin,
+    NameMixin,
+    TenantMixin,
+    schema_name="un0",
+    table_name="query",
+):
+    """
+    User definable queries, of the rows of a Table Type matching the query's filter
+    values and subqueries.
+
+    The version is incremented whenever the definition of the query, or of one of
+    its subqueries, changes (see QueryVersionSQL).
+    """
+
+    # id: str <- RelatedObjectIdMixin
+    # name: str <- NameMixin
+    # tenant_id: str <- TenantMixin
+
+    sql_emitters = [QueryVersionSQL]
+    field_definitions = {
+        "queries_table_type_id": FieldDefinition(
+            data_type=Integer,
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.table_type.id",
+                ondelete="CASCADE",
+                edge_label="QUERIES_TABLE_TYPE",
+                reverse_edge_labels=["IS_QUERIED_BY"],
+            ),
+            nullable=False,
+            index=True,
+            doc="The Table Type of the rows queried",
+        ),
+        "show_results_with_object": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("false"),
+            doc="Indicates if the results of the query should be returned with objects from the queries table type.",
+        ),
+        "include_values": FieldDefinition(
+            data_type=ENUM(Include, name="include", create_type=True, schema="un0"),
+            nullable=False,
+            server_default=Include.INCLUDE.name,
+            doc="Indicate if the query should return records including or excluding the queries results.",
+        ),
+        "match_values": FieldDefinition(
+            data_type=ENUM(Match, name="match", create_type=True, schema="un0"),
+            nullable=False,
+            server_default=Match.AND.name,
+            doc="Indicate if the query should return records matching all or any of the filter values.",
+        ),
+        "include_subqueries": FieldDefinition(
+            data_type=ENUM(Include, name="include", create_type=True, schema="un0"),
+            nullable=False,
+            server_default=Include.INCLUDE.name,
+            doc="Indicate if the query should return records including or excluding the subqueries results.",
+        ),
+        "match_subqueries": FieldDefinition(
+            data_type=ENUM(Match, name="match", create_type=True, schema="un0"),
+            nullable=False,
+            server_default=Match.AND.name,
+            doc="Indicate if the query should return records matching all or any of the subquery values.",
+        ),
+        "version": FieldDefinition(
+            data_type=BigInteger,
+            nullable=False,
+            server_default=text("1"),
+            editable=False,
+            doc="Version of the query's definition",
+        ),
+    }
+
+    queries_table_type_id: Optional[int] = None
+    show_results_with_object: Optional[bool] = False
+    include_values: Optional[Include] = Include.INCLUDE
+    match_values: Optional[Match] = Match.AND
+    include_subqueries: Optional[Include] = Include.INCLUDE
+    match_subqueries: Optional[Match] = Match.AND
+    version: Optional[int] = None
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FilterValue(
+    Model,
+    RelatedObjectIdMixin,
+    TenantMixin,
+    schema_name="un0",
+    table_name="filtervalue",
+):
+    """
+    User definable values for use in queries, a lookup of a column of the queried
+    table and the value it is compared to.
+    """
+
+    # id: str <- RelatedObjectIdMixin
+    # tenant_id: str <- TenantMixin
+
+    sql_emitters = [QueryVersionSQL]
+    constraint_definitions = [
+        CheckDefinition(
+            expression=" OR ".join(
+                f"{column} IS NOT NULL" for column in FILTER_VALUE_COLUMNS
+            )
+            + " OR lookup IN ('NULL', 'NOT_NULL')",
+            name="ck_filtervalue",
+        )
+    ]
+    field_definitions = {
+        "field_name": FieldDefinition(
+            data_type=TEXT,
+            nullable=False,
+            doc="The column of the queried table that is filtered",
+        ),
+        "lookup": FieldDefinition(
+            data_type=ENUM(Lookup, name="lookup", create_type=True, schema="un0"),
+            nullable=False,
+            server_default=Lookup.EQUAL.name,
+            doc="The comparison of the column to the value",
+        ),
+        "include": FieldDefinition(
+            data_type=ENUM(Include, name="include", create_type=True, schema="un0"),
+            nullable=False,
+            server_default=Include.INCLUDE.name,
+            doc="Indicates if the rows matching the value are included or excluded",
+        ),
+        "bigint_value": FieldDefinition(data_type=BigInteger),
+        "boolean_value": FieldDefinition(data_type=BOOLEAN),
+        "date_value": FieldDefinition(data_type=DATE),
+        "decimal_value": FieldDefinition(data_type=NUMERIC),
+        "text_value": FieldDefinition(data_type=TEXT),
+        "time_value": FieldDefinition(data_type=TIME),
+        "timestamp_value": FieldDefinition(data_type=TIMESTAMP(timezone=True)),
+        "string_value": FieldDefinition(data_type=VARCHAR(255)),
+        "object_value_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.related_object.id",
+                ondelete="CASCADE",
+                edge_label="HAS_OBJECT_VALUE",
+                reverse_edge_labels=["IS_OBJECT_VALUE_OF"],
+            ),
+            index=True,
+        ),
+    }
+
+    field_name: Optional[str] = None
+    lookup: Optional[Lookup] = Lookup.EQUAL
+    include: Optional[Include] = Include.INCLUDE
+    bigint_value: Optional[int] = None
+    boolean_value: Optional[bool] = None
+    date_value: Optional[datetime.date] = None
+    decimal_value: Optional[Decimal] = None
+    text_value: Optional[str] = None
+    time_value: Optional[datetime.time] = None
+    timestamp_value: Optional[datetime.datetime] = None
+    string_value: Optional[str] = None
+    object_value_id: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.field_name} {self.lookup}"
+
+
+class QueryFilterValue(
+    Model,
+    schema_name="un0",
+    table_name="query_filtervalue",
+):
+    """The filter values associated with a query."""
+
+    sql_emitters = [QueryVersionSQL]
+    field_definitions = {
+        "query_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.query.id",
+                ondelete="CASCADE",
+                edge_label="IS_QUERIED_THROUGH",
+                reverse_edge_labels=["QUERIES_FILTERVALUE"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+        "filtervalue_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.filtervalue.id",
+                ondelete="CASCADE",
+                edge_label="QUERIES_FILTERVALUE",
+                reverse_edge_labels=["IS_QUERIED_THROUGH"],
+            ),
+            primary_key=True,
+            index=True,
+        ),
+    }
+
+    query_id: Optional[str] = None
+    filtervalue_id: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.query_id} - {self.filtervalue_id}"
+
+
+class QuerySubquery(
+    Model,
+    schema_name="un0",
+    table_name="query_subquery",
+):
+    """The subqueries associated with a query."""
+
+    sql_emitters = [QueryVersionSQL]
+    field_definitions = {
+        "query_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.query.id",
+                ondelete="CASCADE",
+                edge_label="HAS_SUBQUERY",
+                reverse_edge_labels=["HAS_PARENT_QUERY"],
+            ),
+            primary_key=True,
+            index=True,
+            doc="The query the subquery is associated with.",
+        ),
+        "subquery_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.query.id",
+                ondelete="CASCADE",
+                edge_label="HAS_PARENT_QUERY",
+                reverse_edge_labels=["HAS_SUBQUERY"],
+            ),
+            primary_key=True,
+            index=True,
+            doc="The subquery associated with the query.",
+        ),
+    }
+
+    query_id: Optional[str] = None
+    subquery_id: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.query_id} - {self.subquery_id}"
@@ -0,0 +1,82 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import textwrap
+
+from pydantic.dataclasses import dataclass
+
+from un0.database.sql_emitters import SQLEmitter
+
+
+@dataclass
+class QueryVersionSQL(SQLEmitter):
+    """
+    Emits the trigger that increments the version of the queries whose definition a
+    write changes, and of the queries that include them as subqueries, so compiled
+    queries are cached per version (see un0.filters.compiler).
+    """
+
+    def emit_sql(self) -> str:
+        function_string = """
+            DECLARE
+                changed_ids VARCHAR(26)[];
+            BEGIN
+                IF TG_TABLE_NAME = 'query' THEN
+                    changed_ids := ARRAY[NEW.id];
+                ELSIF TG_TABLE_NAME = 'filtervalue' THEN
+                    IF TG_OP = 'DELETE' THEN
+                        changed_ids := ARRAY(
+                            SELECT query_id FROM un0.query_filtervalue
+                            WHERE filtervalue_id = OLD.id
+                        );
+                    ELSE
+                        changed_ids := ARRAY(
+                            SELECT query_id FROM un0.query_filtervalue
+                            WHERE filtervalue_id = NEW.id
+                        );
+                    END IF;
+                ELSIF TG_OP = 'INSERT' THEN
+                    changed_ids := ARRAY[NEW.query_id];
+                ELSIF TG_OP = 'DELETE' THEN
+                    changed_ids := ARRAY[OLD.query_id];
+                ELSE
+                    changed_ids := ARRAY[OLD.query_id, NEW.query_id];
+                END IF;
+
+                WITH RECURSIVE affected(id) AS (
+                    SELECT unnest(changed_ids)
+                    UNION
+                    SELECT query_subquery.query_id
+                    FROM un0.query_subquery
+                    JOIN affected ON query_subquery.subquery_id = affected.id
+                )
+                UPDATE un0.query
+                SET version = version + 1
+                WHERE id IN (SELECT id FROM affected);
+                RETURN NULL;
+            END;
+            """
+        function_sql = self.create_sql_function(
+            "bump_query_version",
+            function_string,
+            security_definer="SECURITY DEFINER",
+        )
+        if self.table_name == "query":
+            # Only definition changes, version updates would otherwise recurse
+            operation = (
+                "UPDATE OF queries_table_type_id, include_values, match_values, "
+                "include_subqueries, match_subqueries"
+            )
+        else:
+            operation = "INSERT OR UPDATE OR DELETE"
+        trigger_sql = textwrap.dedent(
+            f"""
+            CREATE OR REPLACE TRIGGER {self.table_name}_bump_query_version_trigger
+                AFTER {operation}
+                ON {self.schema_name}.{self.table_name}
+                FOR EACH ROW
+                EXECUTE FUNCTION {self.schema_name}.bump_query_version();
+            """
+        )
+        return f"{function_sql}\n{trigger_sql}"
@@ -0,0 +1,190 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+from __future__ import annotations
+
+import decimal
+
+from contextvars import ContextVar
+from datetime import datetime, timedelta, date, timezone
+from functools import lru_cache
+from typing import Any, Callable, Iterable
+
+from babel import Locale, UnknownLocaleError, dates  # type: ignore
+from babel.numbers import parse_pattern as parse_number_pattern  # type: ignore
+
+from un0.config import settings  # type: ignore
+
+
+# The locale of the current request, settings.LOCALE is used when it is not set
+request_locale: ContextVar[str | None] = ContextVar("request_locale", default=None)
+
+
+def get_locale() -> str:
+    return request_locale.get() or settings.LOCALE
+
+
+def parse_accept_language(accept_language: str | None) -> str | None:
+    """
+    Returns the most preferred locale of an Accept-Language header that babel knows,
+    or None if there is none.
+    """
+    if not accept_language:
+        return None
+    languages = []
+    for index, language in enumerate(accept_language.split(",")):
+        tag, _, quality = language.strip().partition(";q=")
+        try:
+            languages.append((-float(quality or 1), index, tag.strip()))
+        except ValueError:
+            continue
+    for _, _, tag in sorted(languages):
+        if not tag or tag == "*":
+            continue
+        try:
+            return str(Locale.parse(tag, sep="-"))
+        except (UnknownLocaleError, ValueError):
+            continue
+    return None
+
+
+class LocaleFormatter:
+    """
+    Formats values as localized strings for a single locale.
+
+    The babel locale data is resolved and the date, datetime, and number patterns are
+    parsed once, when the formatter is created, rather than on every call. The output
+    is identical to the babel format_* functions with format="medium".
+
+    Use formatter() to get the cached formatter of a locale.
+    """
+
+    def __init__(self, locale: str, format: str = "medium") -> None:
+        self.locale = Locale.parse(locale)
+        self.format = format
+        date_pattern = dates.get_date_format(format, locale=self.locale).pattern
+        time_pattern = dates.get_time_format(format, locale=self.locale).pattern
+        self.date_pattern = dates.parse_pattern(date_pattern)
+        self.datetime_pattern = dates.parse_pattern(
+            dates.get_datetime_format(format, locale=self.locale)
+            .replace("{0}", time_pattern)
+            .replace("{1}", date_pattern)
+        )
+        self.decimal_pattern = parse_number_pattern(self.locale.decimal_formats[None])
+
+    def format_boolean(self, value: bool | None) -> str | None:
+        if value is None:
+            return None
+        return "Yes" if value is True else "No"
+
+    def format_date(self, value: date | None) -> str | None:
+        if not value:
+            return None
+        if isinstance(value, datetime):
+            value = value.date()
+        return self.date_pattern.apply(value, self.locale)
+
+    def format_datetime(self, value: datetime | None) -> str | None:
+        if not value:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return self.datetime_pattern.apply(value, self.locale)
+
+    def format_decimal(self, value: decimal.Decimal | float | int | None) -> str | None:
+        if not value:
+            return None
+        return self.decimal_pattern.apply(value, self.locale)
+
+    def format_timedelta(self, value: timedelta | None) -> str | None:
+        if not value:
+            return None
+        return dates.format_timedelta(value, locale=self.locale)
+
+    def formatter_for_type(self, python_type: type) -> Callable[[Any], str | None]:
+        """
+        Returns the format method for values of python_type, str() for types with none.
+        """
+        if not isinstance(python_type, type):
+            return format_object
+        if issubclass(python_type, bool):
+            return self.format_boolean
+        # datetime is a subclass of date, so it must be checked first
+        if issubclass(python_type, datetime):
+            return self.format_datetime
+        if issubclass(python_type, date):
+            return self.format_date
+        if issubclass(python_type, (decimal.Decimal, float, int)):
+            return self.format_decimal
+        if issubclass(python_type, timedelta):
+            return self.format_timedelta
+        return format_object
+
+    def format_column(
+        self,
+        values: Iterable[Any],
+        format_value: Callable[[Any], str | None],
+    ) -> list[str | None]:
+        """
+        Formats a column of values.
+
+        Dates, booleans, and timedeltas are only formatted once per distinct value.
+        Equal datetimes and decimals can format differently (timezone, precision).
+        """
+        if format_value not in (
+            self.format_date,
+            self.format_boolean,
+            self.format_timedelta,
+        ):
+            return [format_value(value) for value in values]
+        formatted: dict[Any, str | None] = {}
+        result = []
+        for value in values:
+            try:
+                result.append(formatted[value])
+            except KeyError:
+                result.append(formatted.setdefault(value, format_value(value)))
+        return result
+
+    def format_rows(
+        self,
+        rows: list[dict[str, Any]],
+        column_types: dict[str, type],
+    ) -> list[dict[str, Any]]:
+        """
+        Formats the columns of the rows, column by column.
+
+        Args:
+            rows (list[dict[str, Any]]): The rows to format.
+            column_types (dict[str, type]): The python type of each column to format,
+                columns not included are left as they are.
+
+        Returns:
+            list[dict[str, Any]]: New rows with the columns formatted.
+        """
+        formatted_rows = [dict(row) for row in rows]
+        for column_name, python_type in column_types.items():
+            values = self.format_column(
+                (row.get(column_name) for row in rows),
+                self.formatter_for_type(python_type),
+            )
+            for row, value in zip(formatted_rows, values):
+                if column_name in row:
+                    row[column_name] = value
+        return formatted_rows
+
+
+def format_object(value: Any) -> str | None:
+    return value.__str__() if value else None
+
+
+@lru_cache(maxsize=64)
+def _formatter(locale: str, format: str) -> LocaleFormatter:
+    return LocaleFormatter(locale, format)
+
+
+def formatter(locale: str | None = None, format: str = "medium") -> LocaleFormatter:
+    """
+    Returns the cached formatter for the locale, or for the current locale if not given.
+    """
+    return _formatter(locale or get_locale(), format)
@@ -2,6 +2,8 @@
 #
 # SPDX-License-Identifier: MIT
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request, Depends
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
@@ -9,10 +11,24 @@ from fastapi.templating import Jinja2Templates
 
 from un0.config import settings
 from un0.database.models import Model
+from un0.database.cache import table_versions
+from un0.database.metadata_cache import metadata_cache
+from un0.database.listener import NotificationListener
+from un0.formatters import request_locale, parse_accept_language
 
 # from un0.database.base import Base
 from un0.database.management.db_manager import DBManager
 import un0.authorization.models
+import un0.filters.queries
+import un0.workflows.models
+import un0.communications.models
+import un0.reports.models
+from un0.communications.routers import (
+    inbox_router,
+    thread_router,
+    attachment_router,
+)
+from un0.reports.routers import report_router
 
 # try:
 #    DBManager().drop_db()
@@ -39,7 +55,22 @@ tags_metadata = [
         },
     },
 ]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cached results are only served while table version notifications are received,
+    # and the metadata cache is refreshed when a schema change is notified
+    listener = NotificationListener()
+    table_versions.install(listener)
+    metadata_cache.install(listener)
+    listener.start()
+    yield
+    await listener.stop()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     openapi_tags=tags_metadata,
     title="Un0 is not an ORM",
     summary="fasterAPI.",
@@ -65,6 +96,18 @@ app = FastAPI(
 )
 templates = Jinja2Templates(directory="templates")
 
+
+@app.middleware("http")
+async def set_request_locale(request: Request, call_next):
+    # Localized (STRING mask) responses use the client's preferred locale
+    token = request_locale.set(
+        parse_accept_language(request.headers.get("accept-language"))
+    )
+    try:
+        return await call_next(request)
+    finally:
+        request_locale.reset(token)
+
 app.mount(
     "/static",
     StaticFiles(directory="static"),
@@ -89,3 +132,8 @@ async def app_base(
 for model_name, model in Model.registry.items():
     for router in model.routers:
         router.add_to_app(app=app)
+
+app.include_router(inbox_router)
+app.include_router(thread_router)
+app.include_router(attachment_router)
+app.include_router(report_router)
@@ -10,13 +10,15 @@ from sqlalchemy import FetchedValue
 from un0.database.models import Model
 from un0.database.mixins import ModelMixin
 from un0.database.fields import FieldDefinition, FKDefinition
+from un0.database.sql_emitters import WorkflowEventNotifySQL
 from un0.relatedobjects.sql_emitters import InsertRelatedObject
 
 
 class RelatedObjectIdMixin(ModelMixin):
     """ """
 
-    sql_emitters = [InsertRelatedObject]
+    # Related objects are the objects workflows are run for
+    sql_emitters = [InsertRelatedObject, WorkflowEventNotifySQL]
 
     field_definitions = {
         "id": FieldDefinition(
@@ -0,0 +1,370 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+from typing import Any
+
+from pydantic import ValidationError
+from pydantic.dataclasses import dataclass
+from sqlalchemy import BigInteger, ColumnElement, Select, Table, select, func
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from un0.errors import QueryCompileError, ReportError
+from un0.database.cache import PermissionContext, ResultCache, cache_key, result_cache
+from un0.database.un0db import live_rows
+from un0.filters.compiler import QueryCompiler
+from un0.reports.enums import Aggregate
+from un0.reports.models import Report
+from un0.reports.rollups import RollupDefinition, rollups, rollup_table
+from un0.config import settings
+
+
+@dataclass(frozen=True)
+class MeasureDefinition:
+    function: Aggregate
+    field_name: str | None = None
+    label: str | None = None
+
+    @property
+    def name(self) -> str:
+        """The name of the measure's column in the report's rows."""
+        if self.label:
+            return self.label
+        if self.field_name:
+            return f"{self.function.value}_{self.field_name}"
+        return self.function.value
+
+
+@dataclass(frozen=True)
+class ReportDefinition:
+    """The definition of a report, as loaded by ReportEngine.load_definition."""
+
+    id: str
+    table_type_id: int
+    query_id: str | None = None
+    group_by: tuple[str, ...] = ()
+    measures: tuple[MeasureDefinition, ...] = ()
+    run_in_background: bool = False
+    rollup_name: str | None = None
+
+
+def report_column(table: Table, field_name: str) -> ColumnElement:
+    column = table.columns.get(field_name)
+    if column is None:
+        raise ReportError(
+            f"{table.fullname} has no column {field_name}", "UNKNOWN_REPORT_FIELD"
+        )
+    return column
+
+
+def measure_column(table: Table, measure: MeasureDefinition) -> ColumnElement:
+    """Returns the aggregate of the measure, labeled with its name."""
+    if measure.field_name is None:
+        if measure.function != Aggregate.COUNT:
+            raise ReportError(
+                f"Measure {measure.name} requires a field", "MEASURE_FIELD_REQUIRED"
+            )
+        return func.count().label(measure.name)
+    column = report_column(table, measure.field_name)
+    if measure.function == Aggregate.COUNT_DISTINCT:
+        aggregate = func.count(column.distinct())
+    else:
+        aggregate = getattr(func, measure.function.value)(column)
+    return aggregate.label(measure.name)
+
+
+def report_statement(
+    table: Table,
+    definition: ReportDefinition,
+    predicate: ColumnElement | None = None,
+    params: dict[str, Any] | None = None,
+    max_rows: int = settings.REPORT_MAX_ROWS,
+) -> Select:
+    """
+    Compiles a report into a single aggregate statement over the rows of table.
+
+    The live rows matching predicate, and whose grouped columns equal the values
+    of params, are grouped by the report's group_by columns, and its measures
+    computed for each group. At most max_rows groups are selected, ordered by
+    the grouped columns.
+
+    Raises:
+        ReportError: If the report has no measure, a column is not in table, two
+            columns have the same name or a parameter is not a grouped column.
+    """
+    check_columns(definition)
+    groups = [report_column(table, field_name) for field_name in definition.group_by]
+    measures = [measure_column(table, measure) for measure in definition.measures]
+    stmt = select(*groups, *measures).select_from(table)
+    where_live = live_rows(table)
+    if where_live is not None:
+        stmt = stmt.where(where_live)
+    if predicate is not None:
+        stmt = stmt.where(predicate)
+    stmt = stmt.where(*param_predicates(table, definition, params))
+    if groups:
+        stmt = stmt.group_by(*groups).order_by(*groups)
+    return stmt.limit(max_rows)
+
+
+def check_columns(definition: ReportDefinition) -> None:
+    if not definition.measures:
+        raise ReportError(f"Report {definition.id} has no measure", "NO_MEASURE")
+    names = [*definition.group_by, *(measure.name for measure in definition.measures)]
+    if len(set(names)) != len(names):
+        raise ReportError(
+            f"Report {definition.id} has columns of the same name", "DUPLICATE_COLUMN"
+        )
+
+
+def param_predicates(
+    table: Table, definition: ReportDefinition, params: dict[str, Any] | None
+) -> list[ColumnElement]:
+    """Returns the predicates restricting the grouped columns to the values of params."""
+    predicates = []
+    for field_name, value in (params or {}).items():
+        if field_name not in definition.group_by:
+            raise ReportError(
+                f"Report {definition.id} is not grouped by {field_name}",
+                "UNKNOWN_REPORT_PARAMETER",
+            )
+        column = table.c[field_name]
+        predicates.append(column.is_(None) if value is None else column == value)
+    return predicates
+
+
+def rollup_measure_column(
+    table: Table, rollup: RollupDefinition, measure: MeasureDefinition
+) -> ColumnElement:
+    """
+    Returns the aggregate of the summary rows computing the measure, labeled with
+    its name. Only the measures that can be summed from the summary rows, counts,
+    sums and averages of the rollup's summed columns, are supported.
+    """
+    if measure.field_name is None and measure.function == Aggregate.COUNT:
+        return func.sum(table.c.row_count).cast(BigInteger).label(measure.name)
+    if measure.field_name not in rollup.sums:
+        raise ReportError(
+            f"Rollup {rollup.name} does not sum {measure.field_name}",
+            "UNKNOWN_ROLLUP_FIELD",
+        )
+    sums = table.c[f"sum_{measure.field_name}"]
+    counts = table.c[f"count_{measure.field_name}"]
+    if measure.function == Aggregate.COUNT:
+        aggregate = func.sum(counts).cast(BigInteger)
+    elif measure.function == Aggregate.SUM:
+        aggregate = func.sum(sums)
+    elif measure.function == Aggregate.AVG:
+        aggregate = func.sum(sums) / func.nullif(func.sum(counts), 0)
+    else:
+        raise ReportError(
+            f"Rollup {rollup.name} can not compute {measure.function.value}",
+            "UNSUPPORTED_ROLLUP_MEASURE",
+        )
+    return aggregate.label(measure.name)
+
+
+def rollup_report_statement(
+    rollup: RollupDefinition,
+    definition: ReportDefinition,
+    params: dict[str, Any] | None = None,
+    max_rows: int = settings.REPORT_MAX_ROWS,
+) -> Select:
+    """
+    Compiles a report into a statement aggregating the summary rows of the rollup,
+    rather than the rows of its source, grouped by some of the rollup's group
+    columns. Groups whose rows were all deleted are left out.
+
+    Raises:
+        ReportError: If the report has no measure, is grouped by a column that is
+            not a group column of the rollup, or a measure is not in the rollup.
+    """
+    check_columns(definition)
+    table = rollup_table(rollup)
+    for field_name in definition.group_by:
+        if field_name not in rollup.groups:
+            raise ReportError(
+                f"Rollup {rollup.name} is not grouped by {field_name}",
+                "UNKNOWN_REPORT_FIELD",
+            )
+    groups = [table.c[field_name] for field_name in definition.group_by]
+    measures = [
+        rollup_measure_column(table, rollup, measure) for measure in definition.measures
+    ]
+    stmt = (
+        select(*groups, *measures)
+        .select_from(table)
+        .where(*param_predicates(table, definition, params))
+        .having(func.sum(table.c.row_count) > 0)
+    )
+    if groups:
+        stmt = stmt.group_by(*groups).order_by(*groups)
+    return stmt.limit(max_rows)
+
+
+def report_cache_key(
+    definition: ReportDefinition,
+    query_version: int | None,
+    context: PermissionContext,
+    params: dict[str, Any] | None,
+) -> str:
+    """
+    Creates the cache key of a report's result, for the version of its query, the
+    permission context it runs under and its parameters.
+    """
+    return cache_key(
+        Report.__name__,
+        definition.id,
+        context,
+        {"query_version": query_version, "params": params or {}},
+    )
+
+
+class ReportEngine:
+    """
+    Compiles reports into aggregate statements, runs them and caches their results.
+
+    Results are cached by report_cache_key, which includes the permission context
+    of the session, so a result computed under one user's row level security is
+    never served to a session with other policies, and with the snapshot of the
+    versions of the aggregated table and of un0.report (see TableVersions), so a
+    write to either makes it stale. A change to the report's query changes its
+    version, and the key.
+    """
+
+    def __init__(
+        self,
+        compiler: QueryCompiler | None = None,
+        cache: ResultCache | None = result_cache,
+        max_rows: int = settings.REPORT_MAX_ROWS,
+    ) -> None:
+        self.compiler = compiler or QueryCompiler()
+        self.cache = cache
+        self.max_rows = max_rows
+
+    async def load_definition(
+        self, conn: AsyncConnection, report_id: str
+    ) -> ReportDefinition:
+        report = Report.table.__table__
+        row = (
+            await conn.execute(
+                select(
+                    report.c.id,
+                    report.c.reports_table_type_id,
+                    report.c.query_id,
+                    report.c.group_by,
+                    report.c.measures,
+                    report.c.run_in_background,
+                    report.c.rollup_name,
+                ).where(report.c.id == report_id)
+            )
+        ).mappings().one_or_none()
+        if row is None:
+            raise ReportError(f"Report {report_id} not found", "REPORT_NOT_FOUND")
+        try:
+            return ReportDefinition(
+                id=row["id"],
+                table_type_id=row["reports_table_type_id"],
+                query_id=row["query_id"],
+                group_by=tuple(row["group_by"] or ()),
+                measures=tuple(
+                    MeasureDefinition(**measure) for measure in row["measures"] or ()
+                ),
+                run_in_background=row["run_in_background"],
+                rollup_name=row["rollup_name"],
+            )
+        except (TypeError, ValidationError) as e:
+            raise ReportError(
+                f"Report {report_id} has invalid measures: {e}", "INVALID_MEASURE"
+            )
+
+    async def prepare(
+        self,
+        conn: AsyncConnection,
+        definition: ReportDefinition,
+        params: dict[str, Any] | None = None,
+    ) -> tuple[Select, Table, int | None]:
+        """
+        Compiles the report, against the summary table of its rollup if it names one.
+
+        Returns:
+            tuple[Select, Table, int | None]: The report's statement, the table it
+                aggregates and the version of its query, None if it has none.
+
+        Raises:
+            ReportError: If the report or its query can not be compiled.
+        """
+        if definition.rollup_name is not None:
+            return self.prepare_rollup(definition, params)
+        try:
+            table = await self.compiler.load_table(conn, definition.table_type_id)
+            predicate, query_version = None, None
+            if definition.query_id is not None:
+                query_version, query_table, predicate = (
+                    await self.compiler.versioned_predicate(conn, definition.query_id)
+                )
+                if query_table is not table:
+                    raise ReportError(
+                        f"Query {definition.query_id} queries another table type than report {definition.id}",
+                        "REPORT_TABLE_TYPE_MISMATCH",
+                    )
+        except QueryCompileError as e:
+            raise ReportError(e.message, e.error_code)
+        stmt = report_statement(table, definition, predicate, params, self.max_rows)
+        return stmt, table, query_version
+
+    def prepare_rollup(
+        self, definition: ReportDefinition, params: dict[str, Any] | None = None
+    ) -> tuple[Select, Table, None]:
+        rollup = rollups.get(f"{Report.schema_name}.{definition.rollup_name}")
+        if rollup is None:
+            raise ReportError(
+                f"Rollup {definition.rollup_name} not found", "ROLLUP_NOT_FOUND"
+            )
+        if definition.query_id is not None:
+            # The summary rows do not keep the columns the query filters on
+            raise ReportError(
+                f"Report {definition.id} reads a rollup, it can not have a query",
+                "ROLLUP_WITH_QUERY",
+            )
+        stmt = rollup_report_statement(rollup, definition, params, self.max_rows)
+        return stmt, rollup_table(rollup), None
+
+    async def run(
+        self,
+        conn: AsyncConnection,
+        definition: ReportDefinition,
+        params: dict[str, Any] | None = None,
+    ) -> list[dict[str, Any]]:
+        """Runs the report, under the row level security of the connection."""
+        stmt, table, query_version = await self.prepare(conn, definition, params)
+        result = await conn.execute(stmt)
+        return [dict(row) for row in result.mappings()]
+
+    async def cached_run(
+        self,
+        conn: AsyncConnection,
+        definition: ReportDefinition,
+        context: PermissionContext,
+        params: dict[str, Any] | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Runs the report, serving its result from the cache when possible.
+
+        Must be called after un0.authorize_user, with the permission context of
+        the connection.
+        """
+        stmt, table, query_version = await self.prepare(conn, definition, params)
+        if self.cache is None:
+            result = await conn.execute(stmt)
+            return [dict(row) for row in result.mappings()]
+        key = report_cache_key(definition, query_version, context, params)
+        # Taken before the report runs, a write committed meanwhile makes the result stale
+        snapshot = self.cache.snapshot([table.fullname, Report.table.__table__.fullname])
+        rows = await self.cache.get(key, snapshot)
+        if rows is not None:
+            return rows
+        result = await conn.execute(stmt)
+        rows = [dict(row) for row in result.mappings()]
+        await self.cache.set(key, rows, snapshot)
+        return rows
@@ -37,3 +37,19 @@ class WorkflowTrigger(str, enum.Enum):
     DB_EVENT = "DB Event"
     SCHEDULE = "Schedule"
     USER = "User"
+
+
+# Report Enums
+class Aggregate(str, enum.Enum):
+    COUNT = "count"
+    COUNT_DISTINCT = "count_distinct"
+    SUM = "sum"
+    AVG = "avg"
+    MIN = "min"
+    MAX = "max"
+
+
+class ReportRunStatus(str, enum.Enum):
+    PENDING = "Pending"
+    COMPLETE = "Complete"
+    FAILED = "Failed"
@@ -0,0 +1,361 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import datetime
+
+from typing import Any, Optional
+
+from sqlalchemy import BigInteger, Identity, Integer, text, func
+from sqlalchemy.dialects.postgresql import (
+    ARRAY,
+    BOOLEAN,
+    DATE,
+    ENUM,
+    JSONB,
+    TEXT,
+    TIMESTAMP,
+    VARCHAR,
+)
+
+from un0.database.base import LIVE_ROWS_WHERE
+from un0.database.fields import (
+    FKDefinition,
+    IndexDefinition,
+    UniqueDefinition,
+    FieldDefinition,
+)
+from un0.database.models import Model
+from un0.database.mixins import NameMixin
+from un0.relatedobjects.mixins import RelatedObjectIdMixin
+from un0.authorization.mixins import TenantMixin
+from un0.authorization.models import User
+from un0.workflows.enums import WorkflowRecordStatus
+from un0.workflows.models import WorkflowRecord
+from un0.reports.enums import ReportRunStatus
+from un0.reports.rollups import RollupDefinition, register_rollup
+from un0.reports.sql_emitters import RollupSQL, RollupRLSSQL
+
+
+class Report(
+    Model,
+    RelatedObjectIdMixin,
+    NameMixin,
+    TenantMixin,
+    schema_name="un0",
+    table_name="report",
+):
+    """
+    User definable reports, aggregating the rows of a Table Type.
+
+    A report groups the rows matching its query, all rows if it has none, by the
+    columns of group_by and computes its measures for each group, a list of
+    {"function": Aggregate, "field_name": column, "label": name} objects. Reports
+    are compiled by un0.reports.engine into a single aggregate statement, run
+    under the row level security of the user requesting them.
+
+    Reports that run_in_background are queued as a ReportRun and computed by the
+    report workers (see un0.reports.runner).
+
+    Reports that name a rollup read its summary table instead of the Table Type's
+    rows, grouped by the rollup's group columns (see un0.reports.rollups).
+    """
+
+    # id: str <- RelatedObjectIdMixin
+    # name: str <- NameMixin
+    # tenant_id: str <- TenantMixin
+
+    field_definitions = {
+        "reports_table_type_id": FieldDefinition(
+            data_type=Integer,
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.table_type.id",
+                ondelete="CASCADE",
+                edge_label="REPORTS_ON_TABLE_TYPE",
+                reverse_edge_labels=["IS_REPORTED_ON_BY"],
+            ),
+            nullable=False,
+            index=True,
+            doc="The Table Type of the rows aggregated",
+        ),
+        "query_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.query.id",
+                ondelete="CASCADE",
+                edge_label="IS_FILTERED_BY",
+                reverse_edge_labels=["FILTERS_REPORT"],
+            ),
+            index=True,
+            doc="The query selecting the rows aggregated, all rows if NULL",
+        ),
+        "group_by": FieldDefinition(
+            data_type=ARRAY(VARCHAR(255)),
+            nullable=False,
+            server_default=text("'{}'"),
+            doc="The columns the rows are grouped by",
+        ),
+        "measures": FieldDefinition(
+            data_type=JSONB,
+            nullable=False,
+            doc="The aggregates computed for each group",
+        ),
+        "run_in_background": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("false"),
+            doc="Indicates if the report is computed by the report workers",
+        ),
+        "rollup_name": FieldDefinition(
+            data_type=VARCHAR(63),
+            doc="The rollup whose summary table the report reads",
+        ),
+        "description": FieldDefinition(data_type=TEXT),
+    }
+
+    reports_table_type_id: Optional[int] = None
+    query_id: Optional[str] = None
+    group_by: Optional[list[str]] = []
+    measures: Optional[list[dict[str, Any]]] = None
+    run_in_background: Optional[bool] = False
+    rollup_name: Optional[str] = None
+    description: Optional[str] = None
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class ReportRun(
+    Model,
+    RelatedObjectIdMixin,
+    TenantMixin,
+    schema_name="un0",
+    table_name="report_run",
+):
+    """
+    Runs of the reports computed by the report workers.
+
+    A run keeps the permission context of the user that requested it, the report
+    is computed under the same row level security, and the parameters of the
+    report. A worker claims a run by setting locked_until, the end of its lease,
+    and completes it by setting completed_at, with its result or its error.
+    """
+
+    # id: str <- RelatedObjectIdMixin
+    # tenant_id: str <- TenantMixin
+
+    # Written by un0.reports.routers and the report workers
+    router_defs = {}
+    index_definitions = [
+        # The queue of the workers, only the pending runs are indexed
+        IndexDefinition(
+            name="ix_report_run_pending_requested_at",
+            columns=["requested_at"],
+            where="completed_at IS NULL",
+        )
+    ]
+    field_definitions = {
+        "report_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.report.id",
+                ondelete="CASCADE",
+                edge_label="IS_RUN_OF",
+                reverse_edge_labels=["HAS_RUN"],
+            ),
+            nullable=False,
+            index=True,
+        ),
+        "user_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.user.id",
+                ondelete="CASCADE",
+                edge_label="WAS_REQUESTED_BY",
+                reverse_edge_labels=["REQUESTED_REPORT_RUN"],
+            ),
+            nullable=False,
+            index=True,
+            doc="The user that requested the run",
+        ),
+        "is_superuser": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("false"),
+        ),
+        "is_tenant_admin": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("false"),
+        ),
+        "cache_key": FieldDefinition(
+            data_type=VARCHAR(64),
+            nullable=False,
+            index=True,
+            doc="The key of the result, identical runs pending at once are run once",
+        ),
+        "params": FieldDefinition(
+            data_type=JSONB,
+            nullable=False,
+            server_default=text("'{}'"),
+            doc="The values of the grouped columns the report is restricted to",
+        ),
+        "status": FieldDefinition(
+            data_type=ENUM(
+                ReportRunStatus,
+                name="reportrunstatus",
+                create_type=True,
+                schema="un0",
+            ),
+            nullable=False,
+            server_default=ReportRunStatus.PENDING.name,
+        ),
+        "requested_at": FieldDefinition(
+            data_type=TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=func.now(),
+        ),
+        "locked_until": FieldDefinition(
+            data_type=TIMESTAMP(timezone=True),
+            doc="End of the lease of the worker running the report",
+        ),
+        "completed_at": FieldDefinition(data_type=TIMESTAMP(timezone=True)),
+        "result": FieldDefinition(
+            data_type=JSONB,
+            doc="The rows of the report",
+        ),
+        "last_error": FieldDefinition(data_type=TEXT),
+    }
+
+    report_id: Optional[str] = None
+    user_id: Optional[str] = None
+    is_superuser: Optional[bool] = False
+    is_tenant_admin: Optional[bool] = False
+    cache_key: Optional[str] = None
+    params: Optional[dict[str, Any]] = None
+    status: Optional[ReportRunStatus] = ReportRunStatus.PENDING
+    requested_at: Optional[datetime.datetime] = None
+    locked_until: Optional[datetime.datetime] = None
+    completed_at: Optional[datetime.datetime] = None
+    result: Optional[list[dict[str, Any]]] = None
+    last_error: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.report_id} - {self.requested_at}"
+
+
+USER_TENANT_DAY = register_rollup(
+    RollupDefinition(
+        name="rollup_user_tenant_day",
+        source=User.table.__table__.fullname,
+        groups={
+            "tenant_id": "tenant_id",
+            "created_on": "(created_at AT TIME ZONE 'UTC')::DATE",
+        },
+        where=LIVE_ROWS_WHERE,
+    )
+)
+
+
+class UserTenantDayRollup(
+    Model,
+    schema_name="un0",
+    table_name="rollup_user_tenant_day",
+):
+    """The number of users created per tenant and day, see USER_TENANT_DAY."""
+
+    sql_emitters = [RollupSQL, RollupRLSSQL]
+    # Written only by the triggers of un0.user, read by reports
+    router_defs = {}
+    constraint_definitions = [
+        UniqueDefinition(
+            columns=["tenant_id", "created_on"],
+            name=USER_TENANT_DAY.constraint_name,
+            nulls_not_distinct=True,
+        )
+    ]
+    field_definitions = {
+        # The group columns may be NULL, the key is a surrogate
+        "id": FieldDefinition(
+            data_type=BigInteger,
+            fnct=Identity(start=1, cycle=False),
+            primary_key=True,
+            doc="Primary Key",
+        ),
+        # Not a foreign key, the summary rows of a deleted tenant are removed by
+        # the triggers of its users
+        "tenant_id": FieldDefinition(data_type=VARCHAR(26), index=True),
+        "created_on": FieldDefinition(data_type=DATE),
+        "row_count": FieldDefinition(
+            data_type=BigInteger,
+            nullable=False,
+            server_default=text("0"),
+        ),
+    }
+
+    id: Optional[int] = None
+    tenant_id: Optional[str] = None
+    created_on: Optional[datetime.date] = None
+    row_count: Optional[int] = 0
+
+    def __str__(self) -> str:
+        return f"{self.tenant_id} - {self.created_on}"
+
+
+WORKFLOW_RECORD_STATUS = register_rollup(
+    RollupDefinition(
+        name="rollup_workflowrecord_status",
+        source=WorkflowRecord.table.__table__.fullname,
+        groups={"tenant_id": "tenant_id", "status": "status"},
+    )
+)
+
+
+class WorkflowRecordStatusRollup(
+    Model,
+    schema_name="un0",
+    table_name="rollup_workflowrecord_status",
+):
+    """The number of workflow records per tenant and status, see WORKFLOW_RECORD_STATUS."""
+
+    sql_emitters = [RollupSQL, RollupRLSSQL]
+    # Written only by the triggers of un0.workflowrecord, read by reports
+    router_defs = {}
+    constraint_definitions = [
+        UniqueDefinition(
+            columns=["tenant_id", "status"],
+            name=WORKFLOW_RECORD_STATUS.constraint_name,
+            nulls_not_distinct=True,
+        )
+    ]
+    field_definitions = {
+        # The group columns may be NULL, the key is a surrogate
+        "id": FieldDefinition(
+            data_type=BigInteger,
+            fnct=Identity(start=1, cycle=False),
+            primary_key=True,
+            doc="Primary Key",
+        ),
+        "tenant_id": FieldDefinition(data_type=VARCHAR(26), index=True),
+        "status": FieldDefinition(
+            data_type=ENUM(
+                WorkflowRecordStatus,
+                name="workflowrecordstatus",
+                create_type=True,
+                schema="un0",
+            ),
+        ),
+        "row_count": FieldDefinition(
+            data_type=BigInteger,
+            nullable=False,
+            server_default=text("0"),
+        ),
+    }
+
+    id: Optional[int] = None
+    tenant_id: Optional[str] = None
+    status: Optional[WorkflowRecordStatus] = None
+    row_count: Optional[int] = 0
+
+    def __str__(self) -> str:
+        return f"{self.tenant_id} - {self.status}"
@@ -0,0 +1,210 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import logging
+
+from typing import Any
+
+from pydantic.dataclasses import dataclass
+from sqlalchemy import (
+    Delete,
+    Insert,
+    Select,
+    Table,
+    and_,
+    or_,
+    select,
+    delete,
+    insert,
+    func,
+    literal_column,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from un0.errors import ReportError
+from un0.database.base import engine as default_engine, metadata
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RollupDefinition:
+    """
+    A summary table of the rows of a source table, maintained as the source changes.
+
+    Attributes:
+        name (str): The name of the summary table, in schema_name.
+        source (str): The full name of the source table.
+        groups (dict[str, str]): The group columns of the summary table, each with
+            the SQL expression over a source row it holds, e.g. {"created_on":
+            "(created_at AT TIME ZONE 'UTC')::DATE"}. Must include tenant_id, the
+            summary rows are only readable by their tenant.
+        sums (tuple[str, ...]): The source columns summed, the summary table has a
+            sum_<column> and a count_<column>, of the non NULL values, for each.
+        where (str | None): The predicate of the source rows counted, e.g. "NOT
+            is_deleted", all rows if None.
+    """
+
+    name: str
+    source: str
+    groups: dict[str, str]
+    sums: tuple[str, ...] = ()
+    where: str | None = None
+    schema_name: str = "un0"
+
+    @property
+    def fullname(self) -> str:
+        return f"{self.schema_name}.{self.name}"
+
+    @property
+    def constraint_name(self) -> str:
+        return f"uq_{self.name}_groups"
+
+    @property
+    def measure_columns(self) -> list[str]:
+        return ["row_count"] + [
+            f"{prefix}_{column}" for column in self.sums for prefix in ("sum", "count")
+        ]
+
+
+# The rollups, by the full name of their summary table
+rollups: dict[str, RollupDefinition] = {}
+
+
+def register_rollup(rollup: RollupDefinition) -> RollupDefinition:
+    """Registers the rollup, maintained by the RollupSQL of its summary table's model."""
+    if "tenant_id" not in rollup.groups:
+        raise ReportError(
+            f"Rollup {rollup.name} is not grouped by tenant_id", "ROLLUP_WITHOUT_TENANT"
+        )
+    rollups[rollup.fullname] = rollup
+    return rollup
+
+
+def rollup_table(rollup: RollupDefinition) -> Table:
+    return metadata.tables[rollup.fullname]
+
+
+def base_statement(rollup: RollupDefinition) -> Select:
+    """
+    Creates the statement aggregating the source table as the rollup summarizes
+    it, reading every source row.
+    """
+    source = metadata.tables[rollup.source]
+    groups = [literal_column(expression) for expression in rollup.groups.values()]
+    measures = [func.count().label("row_count")]
+    for column in rollup.sums:
+        measures.append(func.sum(source.c[column]).label(f"sum_{column}"))
+        measures.append(func.count(source.c[column]).label(f"count_{column}"))
+    stmt = select(
+        *(group.label(name) for group, name in zip(groups, rollup.groups)),
+        *measures,
+    ).select_from(source)
+    if rollup.where:
+        stmt = stmt.where(text(rollup.where))
+    return stmt.group_by(*groups)
+
+
+def check_statement(rollup: RollupDefinition) -> Select:
+    """
+    Creates the statement selecting the groups whose summary row differs from the
+    aggregate of the source, compared by a full join on the group columns, with
+    the measures of both. Summary rows whose count fell to 0 are ignored.
+    """
+    table = rollup_table(rollup)
+    base = base_statement(rollup).subquery("base")
+    stored = (
+        select(table).where(table.c.row_count != 0).subquery("stored")
+    )
+    matched = and_(
+        *(base.c[name].is_not_distinct_from(stored.c[name]) for name in rollup.groups)
+    )
+    differs = [
+        base.c[name].is_distinct_from(stored.c[name])
+        for name in rollup.measure_columns
+    ]
+    return (
+        select(
+            *(
+                func.coalesce(base.c[name], stored.c[name]).label(name)
+                for name in rollup.groups
+            ),
+            *(base.c[name].label(f"base_{name}") for name in rollup.measure_columns),
+            *(
+                stored.c[name].label(f"rollup_{name}")
+                for name in rollup.measure_columns
+            ),
+        )
+        .select_from(base.outerjoin(stored, matched, full=True))
+        .where(or_(*differs))
+    )
+
+
+def rebuild_statements(rollup: RollupDefinition) -> tuple[Delete, Insert]:
+    """Creates the statements that replace the summary rows with the aggregate of the source."""
+    table = rollup_table(rollup)
+    columns = [*rollup.groups, *rollup.measure_columns]
+    return (
+        delete(table),
+        insert(table).from_select(columns, base_statement(rollup)),
+    )
+
+
+class RollupChecker:
+    """
+    Compares the summary tables of the rollups with the aggregate of their source,
+    and rebuilds those that differ.
+
+    The summary tables are kept current by the statement level triggers of their
+    source (see RollupSQL), a difference is only expected from writes made while
+    the triggers were disabled, or from a change to the rollup's definition.
+    """
+
+    def __init__(self, engine: AsyncEngine = default_engine) -> None:
+        self.engine = engine
+
+    async def check(self, rollup: RollupDefinition) -> list[dict[str, Any]]:
+        """Returns the groups whose summary row differs from the source."""
+        async with self.engine.begin() as conn:
+            await conn.execute(text(f"SET LOCAL ROLE {settings.DB_NAME}_admin"))
+            result = await conn.execute(check_statement(rollup))
+            return [dict(row) for row in result.mappings()]
+
+    async def repair(self, rollup: RollupDefinition) -> None:
+        """
+        Rebuilds the summary table from the source, which is locked against writes,
+        not reads, until the rebuilt summary is committed.
+        """
+        async with self.engine.begin() as conn:
+            await conn.execute(text(f"SET LOCAL ROLE {settings.DB_NAME}_admin"))
+            await conn.execute(text(f"LOCK TABLE {rollup.source} IN SHARE MODE"))
+            for stmt in rebuild_statements(rollup):
+                await conn.execute(stmt)
+
+    async def check_all(self, repair: bool = False) -> dict[str, int]:
+        """
+        Checks every rollup, rebuilding those that differ if repair.
+
+        Returns:
+            dict[str, int]: The number of groups that differed, by rollup.
+        """
+        differences = {}
+        for name, rollup in rollups.items():
+            groups = await self.check(rollup)
+            differences[name] = len(groups)
+            if not groups:
+                continue
+            logger.warning(
+                "Rollup %s differs from %s in %d groups, e.g. %s",
+                name,
+                rollup.source,
+                len(groups),
+                groups[0],
+            )
+            if repair:
+                await self.repair(rollup)
+        return differences
@@ -0,0 +1,164 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+from typing import Annotated, Any
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException
+from sqlalchemy import Insert, Select, select, insert, func, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from un0.errors import ReportError
+from un0.database.base import get_db
+from un0.database.cache import PermissionContext
+from un0.reports.engine import ReportEngine, report_cache_key
+from un0.reports.models import ReportRun
+
+
+report_router = APIRouter(prefix="/api/report", tags=["Report"])
+
+report_engine = ReportEngine()
+
+
+def report_http_error(e: ReportError) -> HTTPException:
+    if e.error_code in ("REPORT_NOT_FOUND", "QUERY_NOT_FOUND"):
+        return HTTPException(status_code=404, detail=e.message)
+    return HTTPException(status_code=400, detail=e.message)
+
+
+def pending_run_statement() -> Select:
+    """
+    Creates the statement selecting the pending run of the report bound to
+    :report_id with the cache key bound to :cache_key, identical runs requested
+    while one is pending are not queued again.
+    """
+    run = ReportRun.table.__table__
+    return (
+        select(run.c.id)
+        .where(
+            run.c.report_id == bindparam("report_id"),
+            run.c.cache_key == bindparam("cache_key"),
+            run.c.completed_at.is_(None),
+        )
+        .limit(1)
+    )
+
+
+def run_insert_statement() -> Insert:
+    """Creates the statement queuing a run of the report, for the session user."""
+    run = ReportRun.table.__table__
+    return (
+        insert(run)
+        .values(
+            report_id=bindparam("report_id"),
+            cache_key=bindparam("cache_key"),
+            params=bindparam("params", type_=run.c.params.type),
+            user_id=func.current_setting("rls_var.user_id", True),
+            tenant_id=func.current_setting("rls_var.tenant_id", True),
+            is_superuser=func.current_setting("rls_var.is_superuser", True).cast(
+                run.c.is_superuser.type
+            ),
+            is_tenant_admin=func.current_setting(
+                "rls_var.is_tenant_admin", True
+            ).cast(run.c.is_tenant_admin.type),
+        )
+        .returning(run.c.id)
+    )
+
+
+def run_statement() -> Select:
+    """
+    Creates the statement selecting the report run bound to :run_id, if it was
+    requested by the session user.
+    """
+    run = ReportRun.table.__table__
+    return select(
+        run.c.id,
+        run.c.report_id,
+        run.c.params,
+        run.c.status,
+        run.c.requested_at,
+        run.c.completed_at,
+        run.c.result,
+        run.c.last_error,
+    ).where(
+        run.c.id == bindparam("run_id"),
+        run.c.user_id == func.current_setting("rls_var.user_id", True),
+    )
+
+
+@report_router.post("/{report_id}/results")
+async def report_results(
+    report_id: str,
+    authorization: Annotated[str, Header()],
+    params: Annotated[dict[str, Any] | None, Body()] = None,
+    db: AsyncSession = Depends(get_db),
+) -> list[dict[str, Any]]:
+    """
+    Returns the rows of the report, one per group, restricted to the groups whose
+    columns have the values of params.
+
+    The report is computed by a single aggregate statement in the database, under
+    the user's row level security, and its result is cached until a write to the
+    aggregated table or to the report. Reports that run in the background are
+    requested with the runs endpoint instead.
+    """
+    await db.execute(func.un0.authorize_user(authorization))
+    conn = await db.connection()
+    try:
+        definition = await report_engine.load_definition(conn, report_id)
+        if definition.run_in_background:
+            raise HTTPException(
+                status_code=409,
+                detail="The report runs in the background, request a run",
+            )
+        context = await PermissionContext.from_session(db)
+        return await report_engine.cached_run(conn, definition, context, params)
+    except ReportError as e:
+        raise report_http_error(e)
+
+
+@report_router.post("/{report_id}/runs", status_code=202)
+async def request_report_run(
+    report_id: str,
+    authorization: Annotated[str, Header()],
+    params: Annotated[dict[str, Any] | None, Body()] = None,
+    db: AsyncSession = Depends(get_db),
+) -> dict[str, str]:
+    """
+    Queues a run of the report, computed by the report workers, and returns its
+    id. A run of the report with the same parameters that is still pending is
+    returned rather than queued again.
+    """
+    await db.execute(func.un0.authorize_user(authorization, "writer"))
+    conn = await db.connection()
+    try:
+        definition = await report_engine.load_definition(conn, report_id)
+        # Compiled now, a report that can not be compiled is rejected rather than queued
+        stmt, table, query_version = await report_engine.prepare(
+            conn, definition, params
+        )
+    except ReportError as e:
+        raise report_http_error(e)
+    context = await PermissionContext.from_session(db, "writer")
+    key = report_cache_key(definition, query_version, context, params)
+    values = {"report_id": report_id, "cache_key": key}
+    run_id = await db.scalar(pending_run_statement(), values)
+    if run_id is None:
+        run_id = await db.scalar(run_insert_statement(), {**values, "params": params or {}})
+        await db.commit()
+    return {"id": run_id}
+
+
+@report_router.get("/run/{run_id}")
+async def report_run(
+    run_id: str,
+    authorization: Annotated[str, Header()],
+    db: AsyncSession = Depends(get_db),
+) -> dict[str, Any]:
+    """Returns the status of one of the user's report runs, and its result once complete."""
+    await db.execute(func.un0.authorize_user(authorization))
+    row = (await db.execute(run_statement(), {"run_id": run_id})).mappings().one_or_none()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Object not found")
+    return dict(row)
@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import datetime
+import logging
+import random
+
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import Update, select, update, func, literal, or_, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from un0.database.base import engine as default_engine
+from un0.authorization.models import User
+from un0.reports.engine import ReportEngine
+from un0.reports.enums import ReportRunStatus
+from un0.reports.models import ReportRun
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def claim_statement(lease_seconds: int) -> Update:
+    """
+    Creates the statement that claims the oldest pending report run, whose lease
+    expired if it was claimed before, locked with FOR UPDATE SKIP LOCKED so
+    concurrent workers claim different runs.
+
+    Returns:
+        Update: An UPDATE returning the run, with the email of its user.
+    """
+    run = ReportRun.table.__table__
+    user = User.table.__table__
+    now = func.now()
+    claimed = (
+        select(run.c.id)
+        .where(
+            run.c.completed_at.is_(None),
+            or_(run.c.locked_until.is_(None), run.c.locked_until <= now),
+        )
+        .order_by(run.c.requested_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .cte("claimed")
+    )
+    return (
+        update(run)
+        .where(run.c.id == claimed.c.id)
+        .values(locked_until=now + literal(datetime.timedelta(seconds=lease_seconds)))
+        .returning(
+            run.c.id,
+            run.c.report_id,
+            run.c.tenant_id,
+            run.c.user_id,
+            run.c.is_superuser,
+            run.c.is_tenant_admin,
+            run.c.params,
+            select(user.c.email)
+            .where(user.c.id == run.c.user_id)
+            .scalar_subquery()
+            .label("email"),
+        )
+    )
+
+
+class ReportRunner:
+    """
+    Computes the report runs queued by un0.reports.routers, one at a time, several
+    runners (processes, on one or many nodes) share the queue, see claim_statement.
+
+    A run is computed in a transaction set to the reader role and to the row level
+    security variables of the user that requested it, as un0.authorize_user set
+    them, so the report sees the rows that user would see. Its result, or error,
+    is then written as the admin role.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine = default_engine,
+        reports: ReportEngine | None = None,
+        lease_seconds: int = settings.REPORT_LEASE_SECONDS,
+        poll_interval: float = settings.REPORT_POLL_INTERVAL,
+    ) -> None:
+        self.engine = engine
+        # Runs are computed for many users, their results are not cached
+        self.reports = reports or ReportEngine(cache=None)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+    async def set_role(self, conn: AsyncConnection) -> None:
+        await conn.execute(text(f"SET LOCAL ROLE {settings.DB_NAME}_admin"))
+
+    async def set_context(self, conn: AsyncConnection, run: dict[str, Any]) -> None:
+        """Sets the role and row level security variables of the run's user."""
+        await conn.execute(text(f"SET LOCAL ROLE {settings.DB_NAME}_reader"))
+        await conn.execute(
+            select(
+                func.set_config("rls_var.email", run["email"] or "", True),
+                func.set_config("rls_var.user_id", run["user_id"], True),
+                func.set_config(
+                    "rls_var.is_superuser", str(run["is_superuser"]).lower(), True
+                ),
+                func.set_config(
+                    "rls_var.is_tenant_admin", str(run["is_tenant_admin"]).lower(), True
+                ),
+                func.set_config("rls_var.tenant_id", run["tenant_id"], True),
+            )
+        )
+
+    async def run(self, stop: asyncio.Event | None = None) -> None:
+        """Computes the pending runs until stop is set."""
+        stop = stop or asyncio.Event()
+        while not stop.is_set():
+            try:
+                if await self.run_once():
+                    continue
+            except DBAPIError as e:
+                logger.warning("Report runner database error: %s", e)
+            # Jitter keeps idle runners from polling in step
+            try:
+                await asyncio.wait_for(
+                    stop.wait(), self.poll_interval * random.uniform(0.5, 1.0)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_once(self) -> bool:
+        """Claims and computes one run, returns whether there was one."""
+        async with self.engine.begin() as conn:
+            await self.set_role(conn)
+            row = (
+                await conn.execute(claim_statement(self.lease_seconds))
+            ).mappings().one_or_none()
+        if row is None:
+            return False
+        try:
+            async with self.engine.begin() as conn:
+                await self.set_context(conn, row)
+                definition = await self.reports.load_definition(conn, row["report_id"])
+                rows = await self.reports.run(conn, definition, row["params"])
+            values = {
+                "status": ReportRunStatus.COMPLETE,
+                "result": jsonable_encoder(rows),
+            }
+        except Exception as e:
+            logger.exception("Report run %s failed", row["id"])
+            values = {"status": ReportRunStatus.FAILED, "last_error": str(e)}
+        run = ReportRun.table.__table__
+        async with self.engine.begin() as conn:
+            await self.set_role(conn)
+            await conn.execute(
+                update(run)
+                .where(run.c.id == row["id"])
+                .values(completed_at=func.now(), locked_until=None, **values)
+            )
+        return True
@@ -0,0 +1,150 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import textwrap
+
+from typing import Callable
+
+from pydantic.dataclasses import dataclass
+
+from un0.database.sql_emitters import SQLEmitter
+from un0.authorization.rls_sql_emitters import RLSSQL
+from un0.reports.rollups import RollupDefinition, rollups
+
+
+def delta_sql(rollup: RollupDefinition, rows: str, sign: int) -> str:
+    """
+    Returns the select of the contributions of the transition table rows to the
+    summary rows, added if sign is 1, removed if -1.
+    """
+    columns = [f"{expression} AS {name}" for name, expression in rollup.groups.items()]
+    columns.append(f"{sign} AS row_count")
+    for column in rollup.sums:
+        columns.append(f"{sign} * {column} AS sum_{column}")
+        columns.append(
+            f"CASE WHEN {column} IS NULL THEN 0 ELSE {sign} END AS count_{column}"
+        )
+    where = f" WHERE {rollup.where}" if rollup.where else ""
+    return f"SELECT {', '.join(columns)} FROM {rows}{where}"
+
+
+def upsert_sql(rollup: RollupDefinition, *deltas: str) -> str:
+    """
+    Returns the statement adding the deltas to the summary rows, grouped, upserted
+    in the order of the groups, so concurrent statements lock them in the same
+    order. Groups whose measures are unchanged, e.g. by updates of columns the
+    rollup does not read, are not written.
+    """
+    groups = ", ".join(rollup.groups)
+    measures = rollup.measure_columns
+    changed = " OR ".join(f"coalesce(sum({name}), 0) <> 0" for name in measures)
+    updates = ",\n    ".join(
+        f"{name} = coalesce({rollup.name}.{name}, 0) + coalesce(EXCLUDED.{name}, 0)"
+        for name in measures
+    )
+    union = "\n    UNION ALL\n    ".join(deltas)
+    return "\n".join(
+        [
+            f"INSERT INTO {rollup.fullname} ({groups}, {', '.join(measures)})",
+            f"SELECT {groups}, {', '.join(f'sum({name})' for name in measures)}",
+            "FROM (",
+            f"    {union}",
+            ") AS changed",
+            f"GROUP BY {groups}",
+            f"HAVING {changed}",
+            f"ORDER BY {groups}",
+            f"ON CONFLICT ON CONSTRAINT {rollup.constraint_name} DO UPDATE SET",
+            f"    {updates};",
+        ]
+    )
+
+
+@dataclass
+class RollupSQL(SQLEmitter):
+    def emit_sql(self) -> str:
+        """
+        Emits the statement level triggers on the source of the rollup summarized
+        by the table, which apply the rows changed by each statement to the
+        summary, read from the statement's transition tables, so the summary is
+        current without rescanning the source.
+
+        Returns:
+            str: The SQL statements to create the function and its triggers.
+        """
+        rollup = rollups[f"{self.schema_name}.{self.table_name}"]
+        function_string = f"""
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    {upsert_sql(rollup, delta_sql(rollup, 'new_rows', 1))}
+                ELSIF TG_OP = 'UPDATE' THEN
+                    {upsert_sql(rollup, delta_sql(rollup, 'new_rows', 1), delta_sql(rollup, 'old_rows', -1))}
+                ELSE
+                    {upsert_sql(rollup, delta_sql(rollup, 'old_rows', -1))}
+                END IF;
+                RETURN NULL;
+            END;
+            """
+        function_name = f"maintain_{self.table_name}"
+        function_sql = self.create_sql_function(
+            function_name,
+            function_string,
+            security_definer="SECURITY DEFINER",
+        )
+        source_table = rollup.source.rpartition(".")[2]
+        triggers = textwrap.dedent(
+            f"""
+            CREATE OR REPLACE TRIGGER {source_table}_{function_name}_insert_trigger
+                AFTER INSERT
+                ON {rollup.source}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {self.schema_name}.{function_name}();
+            CREATE OR REPLACE TRIGGER {source_table}_{function_name}_update_trigger
+                AFTER UPDATE
+                ON {rollup.source}
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {self.schema_name}.{function_name}();
+            CREATE OR REPLACE TRIGGER {source_table}_{function_name}_delete_trigger
+                AFTER DELETE
+                ON {rollup.source}
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION {self.schema_name}.{function_name}();
+            """
+        )
+        return f"{function_sql}\n{triggers}"
+
+
+def rollup_select_policy_sql(schema_name, table_name):
+    return textwrap.dedent(
+        f"""
+        /*
+        The policy to allow:
+            Superusers to select all records;
+            All other users to select only the records of their tenant;
+        */
+        CREATE POLICY rollup_select_policy
+        ON {schema_name}.{table_name} FOR SELECT
+        USING (
+            current_setting('rls_var.is_superuser', true)::BOOLEAN OR
+            tenant_id = current_setting('rls_var.tenant_id', true)::TEXT
+        );
+        """
+    )
+
+
+@dataclass
+class RollupRLSSQL(RLSSQL):
+    """
+    Users read the summary rows of their tenant. Summaries are written only by the
+    triggers of their source, which run as the table owner, so no write policy is
+    created and RLS is not forced on the owner.
+    """
+
+    select_policy: Callable = rollup_select_policy_sql
+    insert_policy: str = ""
+    update_policy: str = ""
+    delete_policy: str = ""
+    force_rls: bool = False
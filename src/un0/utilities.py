@@ -6,9 +6,7 @@ from typing import Any
 import decimal
 from datetime import datetime, timedelta, date
 
-from babel import dates, numbers  # type: ignore
-
-from un0.config import settings  # type: ignore
+from un0.formatters import formatter  # type: ignore
 
 
 def convert_snake_to_capital_word(snake_str: str) -> str:
@@ -32,19 +30,15 @@ def boolean_to_string(boolean: bool) -> str:
 
 
 def date_to_string(date: date | None) -> str | None:
-    return dates.format_date(date, format="medium", locale="en_US") if date else None
+    return formatter().format_date(date)
 
 
 def datetime_to_string(datetime: datetime | None) -> str | None:
-    return (
-        dates.format_datetime(datetime, format="medium", locale=settings.LOCALE)
-        if datetime
-        else None
-    )
+    return formatter().format_datetime(datetime)
 
 
 def decimal_to_string(dec: decimal.Decimal | None) -> str | None:
-    return numbers.format_decimal(dec, locale="en_US") if dec else None
+    return formatter().format_decimal(dec)
 
 
 def obj_to_string(model: Any) -> str | None:
@@ -52,7 +46,7 @@ def obj_to_string(model: Any) -> str | None:
 
 
 def timedelta_to_string(time_delta: timedelta | None) -> str | None:
-    return dates.format_timedelta(time_delta, locale="en_US") if time_delta else None
+    return formatter().format_timedelta(time_delta)
 
 
 def boolean_to_okui(boolean: bool) -> dict[str, Any] | None:
@@ -67,15 +61,11 @@ def boolean_to_okui(boolean: bool) -> dict[str, Any] | None:
 
 
 def date_to_okui(date: date | None) -> str | None:
-    return dates.format_date(date, format="medium", locale="en_US") if date else None
+    return formatter().format_date(date)
 
 
 def datetime_to_okui(datetime: datetime | None) -> str | None:
-    return (
-        dates.format_datetime(datetime, format="medium", locale="en_US")
-        if datetime
-        else None
-    )
+    return formatter().format_datetime(datetime)
 
 
 def decimal_to_okui(dec: decimal.Decimal | None) -> dict[str, Any] | None:
@@ -87,8 +77,4 @@ def obj_to_okui(model: Any) -> str | None:
 
 
 def timedelta_to_okui(time_delta: timedelta | None) -> str | None:
-    return (
-        dates.format_timedelta(time_delta, locale=settings.LOCALE)
-        if time_delta
-        else None
-    )
+    return formatter().format_timedelta(time_delta)
@@ -0,0 +1,287 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import json
+import logging
+
+from typing import Any
+
+from sqlalchemy import Insert, Select, select, insert, bindparam, func, text
+from sqlalchemy.dialects.postgresql import ARRAY, VARCHAR
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
+
+from un0.errors import QueryCompileError
+from un0.database.base import engine as default_engine
+from un0.database.listener import NotificationListener
+from un0.filters.compiler import QueryCompiler
+from un0.workflows.enums import WorkflowDBEvent, WorkflowTrigger
+from un0.workflows.models import Workflow, WorkflowEvent
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch_statement(limited: bool = False) -> Insert:
+    """
+    Creates the statement that inserts the events of the DB_EVENT workflows of a
+    table type and operation, for changed rows given as arrays of ids and tenant ids.
+
+    Child workflows are not dispatched, their events are created when their parent
+    completes (see WorkflowWorker.complete).
+
+    Args:
+        limited (bool): If True, creates the events of the single workflow bound to
+            :workflow_id, for rows already matched against its limiting query.
+            Otherwise, creates the events of every workflow without a limiting query.
+    """
+    workflow = Workflow.table.__table__
+    event = WorkflowEvent.table.__table__
+    changed = (
+        func.unnest(
+            bindparam("ids", type_=ARRAY(VARCHAR)),
+            bindparam("tenant_ids", type_=ARRAY(VARCHAR)),
+        )
+        .table_valued("id", "tenant_id")
+        .render_derived("changed")
+    )
+    events = select(
+        workflow.c.id,
+        changed.c.tenant_id,
+        changed.c.id,
+        func.current_date() + workflow.c.due_within,
+    ).where(
+        workflow.c.applicable_table_type_id == bindparam("table_type_id"),
+        workflow.c.trigger == WorkflowTrigger.DB_EVENT,
+        workflow.c.db_event == bindparam("operation", type_=workflow.c.db_event.type),
+        workflow.c.parent_id.is_(None),
+        (
+            workflow.c.id == bindparam("workflow_id")
+            if limited
+            else workflow.c.limiting_query_id.is_(None)
+        ),
+    )
+    return insert(event).from_select(
+        ["workflow_id", "tenant_id", "workflow_object_id", "date_due"], events
+    )
+
+
+def limited_workflows_statement() -> Select:
+    """
+    Creates the statement selecting the DB_EVENT workflows of a table type and
+    operation that have a limiting query, with the query.
+    """
+    workflow = Workflow.table.__table__
+    return select(workflow.c.id, workflow.c.limiting_query_id).where(
+        workflow.c.applicable_table_type_id == bindparam("table_type_id"),
+        workflow.c.trigger == WorkflowTrigger.DB_EVENT,
+        workflow.c.db_event == bindparam("operation", type_=workflow.c.db_event.type),
+        workflow.c.parent_id.is_(None),
+        workflow.c.limiting_query_id.is_not(None),
+    )
+
+
+class WorkflowDispatcher:
+    """
+    Creates the events of DB_EVENT workflows from the changes published by
+    un0.notify_workflow_event (see WorkflowEventNotifySQL).
+
+    Notifications are coalesced for window seconds, the rows changed more than once
+    in the window get a single event per workflow, and the events of the window are
+    inserted by one executemany in one transaction, after which the workers are woken
+    via settings.WORKFLOW_READY_CHANNEL.
+
+    Workflows with a limiting query only get the events of the changed rows that
+    match it. The query is compiled once per version (see QueryCompiler) and
+    evaluated against the changed ids only, never against the whole table. The rows
+    of DELETE operations no longer exist to be matched, so workflows with a limiting
+    query are not dispatched for them.
+
+    Run a single dispatcher per database, each dispatcher creates events for every
+    notification it receives. Notifications sent while it is not listening are lost.
+
+    Changes whose events could not be created because the connection was lost are
+    flushed again. When a flush fails otherwise, the changes of each table type and
+    operation are flushed on their own, so the others are not held back, and those
+    failing max_failures times are dropped and logged with their ids.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine = default_engine,
+        window: float = settings.WORKFLOW_DISPATCH_WINDOW,
+        max_failures: int = settings.WORKFLOW_DISPATCH_MAX_FAILURES,
+    ) -> None:
+        self.engine = engine
+        self.window = window
+        self.max_failures = max_failures
+        # The tenant of each changed id, by table type id and operation
+        self.pending: dict[tuple[int, WorkflowDBEvent], dict[str, str]] = {}
+        # The failed flushes of the pending changes, by table type id and operation
+        self.failures: dict[tuple[int, WorkflowDBEvent], int] = {}
+        self.compiler = QueryCompiler()
+        self.dispatched = 0
+        self._flush_task: asyncio.Task | None = None
+
+    def install(self, listener: NotificationListener) -> None:
+        listener.subscribe(settings.WORKFLOW_NOTIFY_CHANNEL, self.notify)
+        listener.on_disconnect.append(self.disconnected)
+
+    def disconnected(self) -> None:
+        logger.warning(
+            "Workflow dispatcher disconnected, DB_EVENT notifications may be lost"
+        )
+
+    def notify(self, payload: str) -> None:
+        change = json.loads(payload)
+        key = (change["table_type_id"], WorkflowDBEvent[change["operation"]])
+        rows = self.pending.setdefault(key, {})
+        for id in change["ids"]:
+            rows[id] = change["tenant_id"]
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self) -> None:
+        # Changes notified during a flush, or put back by a failed one, are
+        # flushed by the same task, notify only starts one when none is running
+        while self.pending:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Workflow events could not be created")
+
+    def take_pending(self) -> list[dict[str, Any]]:
+        """Returns the parameters of the dispatch statement for the pending changes."""
+        pending, self.pending = self.pending, {}
+        return [
+            {
+                "table_type_id": table_type_id,
+                "operation": operation,
+                "ids": list(rows.keys()),
+                "tenant_ids": list(rows.values()),
+            }
+            for (table_type_id, operation), rows in pending.items()
+        ]
+
+    def restore_pending(self, params: list[dict[str, Any]]) -> None:
+        """
+        Puts the changes taken by take_pending back, before the changes notified
+        since, so the tenant of an id changed again is the latest one.
+        """
+        for param in params:
+            key = (param["table_type_id"], param["operation"])
+            rows = dict(zip(param["ids"], param["tenant_ids"]))
+            rows.update(self.pending.get(key, {}))
+            self.pending[key] = rows
+
+    async def flush(self) -> None:
+        """
+        Creates the events of the pending changes, or puts the changes back to be
+        flushed again if the connection was lost.
+        """
+        params = self.take_pending()
+        if not params:
+            return
+        try:
+            await self.dispatch(params)
+        except (OperationalError, InterfaceError):
+            self.restore_pending(params)
+            raise
+        except Exception:
+            logger.warning(
+                "Workflow events could not be created, dispatching each change apart",
+                exc_info=True,
+            )
+            await self.dispatch_apart(params)
+        except BaseException:
+            self.restore_pending(params)
+            raise
+
+    async def dispatch_apart(self, params: list[dict[str, Any]]) -> None:
+        """
+        Creates the events of the changes of each table type and operation in their
+        own transaction. The changes that fail are put back, or dropped once they
+        failed max_failures times.
+        """
+        for i, param in enumerate(params):
+            key = (param["table_type_id"], param["operation"])
+            try:
+                await self.dispatch([param])
+            except (OperationalError, InterfaceError):
+                self.restore_pending(params[i:])
+                raise
+            except Exception:
+                failures = self.failures.get(key, 0) + 1
+                if failures < self.max_failures:
+                    self.failures[key] = failures
+                    self.restore_pending([param])
+                    continue
+                self.failures.pop(key, None)
+                logger.exception(
+                    "Workflow events of table type %s %s dropped after %s failures, "
+                    "ids: %s",
+                    param["table_type_id"],
+                    param["operation"].name,
+                    failures,
+                    param["ids"],
+                )
+            else:
+                self.failures.pop(key, None)
+
+    async def dispatch(self, params: list[dict[str, Any]]) -> None:
+        """Creates the events of the changes, in one transaction."""
+        async with self.engine.begin() as conn:
+            await conn.execute(text(f"SET LOCAL ROLE {settings.DB_NAME}_admin"))
+            await conn.execute(dispatch_statement(), params)
+            limited = await self.limited_params(conn, params)
+            if limited:
+                await conn.execute(dispatch_statement(limited=True), limited)
+            await conn.execute(
+                select(func.pg_notify(settings.WORKFLOW_READY_CHANNEL, ""))
+            )
+        self.dispatched += sum(len(param["ids"]) for param in params)
+
+    async def limited_params(
+        self, conn: AsyncConnection, params: list[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        """
+        Returns the parameters of the limited dispatch statement, for each workflow
+        with a limiting query and the changed rows matching it.
+        """
+        limited = []
+        for param in params:
+            if param["operation"] == WorkflowDBEvent.DELETE:
+                continue
+            workflows = await conn.execute(
+                limited_workflows_statement(),
+                {
+                    "table_type_id": param["table_type_id"],
+                    "operation": param["operation"],
+                },
+            )
+            tenants = dict(zip(param["ids"], param["tenant_ids"]))
+            for workflow_id, query_id in workflows.all():
+                try:
+                    ids = await self.compiler.matching_ids(
+                        conn, query_id, param["ids"]
+                    )
+                except QueryCompileError:
+                    logger.exception(
+                        "Limiting query of workflow %s could not be compiled",
+                        workflow_id,
+                    )
+                    continue
+                if ids:
+                    limited.append(
+                        {
+                            **param,
+                            "workflow_id": workflow_id,
+                            "ids": ids,
+                            "tenant_ids": [tenants[id] for id in ids],
+                        }
+                    )
+        return limited
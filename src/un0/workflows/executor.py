@@ -0,0 +1,570 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import datetime
+import logging
+import random
+import time
+
+from typing import Any
+
+from pydantic.dataclasses import dataclass
+from sqlalchemy import (
+    Update,
+    TableValuedAlias,
+    BOOLEAN,
+    TEXT,
+    Integer,
+    select,
+    update,
+    insert,
+    bindparam,
+    column,
+    literal,
+    func,
+    or_,
+    text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, INTERVAL
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from un0.database.base import engine as default_engine
+from un0.database.listener import NotificationListener
+from un0.workflows.enums import (
+    WorkflowRecordStatus,
+    WorkflowRecordState,
+    WorkflowTrigger,
+)
+from un0.workflows.models import (
+    Workflow,
+    WorkflowEvent,
+    WorkflowRecord,
+    ObjectFunction,
+)
+from un0.workflows.runtime import (  # noqa: F401 Registry of the object functions
+    ObjectFunctionRuntime,
+    object_function,
+    object_functions,
+)
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class WorkflowJob:
+    """A workflow event claimed by a worker."""
+
+    id: str
+    workflow_id: int
+    tenant_id: str
+    workflow_object_id: str | None
+    date_due: datetime.date
+    run_at: datetime.datetime
+    attempts: int
+
+
+@dataclass(frozen=True)
+class WorkflowDefinition:
+    """The attributes of a workflow needed to run its events."""
+
+    id: int
+    trigger: WorkflowTrigger
+    repeat_every: int
+    due_within: int
+    record_required: bool
+    process_child_value: bool
+    objectfunction_name: str | None = None
+
+
+def claim_statement(
+    batch_size: int,
+    tenant_concurrency: int,
+    lease_seconds: int,
+) -> Update:
+    """
+    Creates the statement that claims the next due events, oldest first.
+
+    The candidate events are locked with FOR UPDATE SKIP LOCKED, so concurrent
+    workers claim different events without waiting on each other. An event is
+    claimed by setting locked_until, the end of the worker's lease, in the same
+    statement, after which the transaction ends and the row lock is released.
+    Events whose lease expired (their worker stopped) are claimed again.
+
+    Each claim gives a tenant at most tenant_concurrency events, counting the
+    events leased by every worker. This is a soft limit: the leases of concurrent
+    claims are not committed when the running events are counted, so a tenant may
+    briefly hold up to tenant_concurrency events per claiming worker.
+
+    Returns:
+        Update: An UPDATE returning the columns of WorkflowJob.
+    """
+    event = WorkflowEvent.table.__table__
+    now = func.now()
+    running = (
+        select(event.c.tenant_id, func.count().label("running"))
+        .where(event.c.completed_at.is_(None), event.c.locked_until > now)
+        .group_by(event.c.tenant_id)
+        .cte("running")
+    )
+    candidates = (
+        select(event.c.id, event.c.tenant_id, event.c.run_at)
+        .where(
+            event.c.completed_at.is_(None),
+            event.c.run_at <= now,
+            or_(event.c.locked_until.is_(None), event.c.locked_until <= now),
+        )
+        .order_by(event.c.run_at)
+        # Scan past the events of tenants at their limit
+        .limit(batch_size * 4)
+        .with_for_update(skip_locked=True)
+        .cte("candidates")
+    )
+    slot = func.row_number().over(
+        partition_by=candidates.c.tenant_id, order_by=candidates.c.run_at
+    ) + func.coalesce(running.c.running, 0)
+    ranked = (
+        select(candidates.c.id, candidates.c.run_at, slot.label("slot"))
+        .select_from(
+            candidates.outerjoin(running, candidates.c.tenant_id == running.c.tenant_id)
+        )
+        .cte("ranked")
+    )
+    claimed = (
+        select(ranked.c.id)
+        .where(ranked.c.slot <= tenant_concurrency)
+        .order_by(ranked.c.run_at)
+        .limit(batch_size)
+        .cte("claimed")
+    )
+    return (
+        update(event)
+        .where(event.c.id == claimed.c.id)
+        .values(
+            locked_until=now + literal(datetime.timedelta(seconds=lease_seconds)),
+            attempts=event.c.attempts + 1,
+        )
+        .returning(
+            event.c.id,
+            event.c.workflow_id,
+            event.c.tenant_id,
+            event.c.workflow_object_id,
+            event.c.date_due,
+            event.c.run_at,
+            event.c.attempts,
+        )
+    )
+
+
+def outcome_table(rows: list[dict[str, Any]], **types: Any) -> TableValuedAlias:
+    """
+    Returns the outcomes of a batch of jobs as a table, outcome, of the id and
+    attempts of each job followed by the given columns, unnested from one array
+    parameter per column.
+    """
+    types = {"id": TEXT(), "attempts": Integer(), **types}
+    return (
+        func.unnest(
+            *[
+                bindparam(
+                    f"outcome_{name}", [row[name] for row in rows], type_=ARRAY(type_)
+                )
+                for name, type_ in types.items()
+            ]
+        )
+        .table_valued(*[column(name, type_) for name, type_ in types.items()])
+        .render_derived(name="outcome")
+    )
+
+
+def outcome_statement(outcome: TableValuedAlias, **values: Any) -> Update:
+    """
+    Creates the statement that writes the outcomes of a batch of jobs to their
+    events, those still leased by the attempt that ran them. An event whose lease
+    expired, and was claimed again, has more attempts, and an event already
+    completed by another worker is left unchanged.
+
+    Returns:
+        Update: An UPDATE returning the ids of the events written.
+    """
+    event = WorkflowEvent.table.__table__
+    return (
+        update(event)
+        .where(
+            event.c.id == outcome.c.id,
+            event.c.attempts == outcome.c.attempts,
+            event.c.completed_at.is_(None),
+        )
+        .values(locked_until=None, last_error=outcome.c.error, **values)
+        .returning(event.c.id)
+    )
+
+
+def complete_statement(completed: list[dict[str, Any]]) -> Update:
+    """Creates the statement that completes the events of the jobs that ran."""
+    outcome = outcome_table(completed, value=BOOLEAN(), error=TEXT())
+    return outcome_statement(
+        outcome, completed_at=func.now(), objectfunction_return_value=outcome.c.value
+    )
+
+
+def retry_statement(retried: list[dict[str, Any]]) -> Update:
+    """Creates the statement that runs the events of the failed jobs again later."""
+    outcome = outcome_table(retried, delay=INTERVAL(), error=TEXT())
+    return outcome_statement(outcome, run_at=func.now() + outcome.c.delay)
+
+
+def retry_delay(attempts: int, base: float, maximum: float) -> float:
+    """Returns the seconds before an event that failed attempts times is run again."""
+    return min(base * 2 ** (attempts - 1), maximum)
+
+
+class WorkerMetrics:
+    """Counts the events processed by a worker, and their throughput."""
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.batches = 0
+        self.claimed = 0
+        self.completed = 0
+        self.retried = 0
+        self.abandoned = 0
+        self.lost = 0
+        self.run_seconds = 0.0
+
+    def throughput(self) -> float:
+        """Returns the events completed per second since the worker started."""
+        elapsed = time.monotonic() - self.started
+        return self.completed / elapsed if elapsed else 0.0
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "claimed": self.claimed,
+            "completed": self.completed,
+            "retried": self.retried,
+            "abandoned": self.abandoned,
+            "lost": self.lost,
+            "events_per_second": round(self.throughput(), 2),
+            "mean_run_ms": round(
+                1000 * self.run_seconds / self.claimed if self.claimed else 0.0, 2
+            ),
+        }
+
+
+class WorkflowWorker:
+    """
+    Runs the due workflow events, several workers (processes, on one or many nodes)
+    share the queue without running an event twice, see claim_statement.
+
+    Each batch of events is claimed in one transaction, the events' object functions
+    are run concurrently outside of any transaction, by the worker's runtime (see
+    ObjectFunctionRuntime), and the outcomes are written in one transaction:
+        completed events are closed, a WorkflowRecord is written for the workflows
+            that require one, the next event of repeating scheduled workflows, and
+            the events of the child workflows, are created,
+        failed events are run again after an exponential backoff, or abandoned
+            after max_attempts.
+    When no event is due the worker polls with an increasing interval, up to
+    max_poll_interval, which wake() cuts short.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine = default_engine,
+        batch_size: int = settings.WORKFLOW_BATCH_SIZE,
+        tenant_concurrency: int = settings.WORKFLOW_TENANT_CONCURRENCY,
+        lease_seconds: int = settings.WORKFLOW_LEASE_SECONDS,
+        max_attempts: int = settings.WORKFLOW_MAX_ATTEMPTS,
+        retry_backoff: float = settings.WORKFLOW_RETRY_BACKOFF,
+        poll_interval: float = settings.WORKFLOW_POLL_INTERVAL,
+        max_poll_interval: float = settings.WORKFLOW_MAX_POLL_INTERVAL,
+        definitions_ttl: float = 60.0,
+        runtime: ObjectFunctionRuntime | None = None,
+    ) -> None:
+        self.engine = engine
+        self.batch_size = batch_size
+        self.tenant_concurrency = tenant_concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.definitions_ttl = definitions_ttl
+        self.metrics = WorkerMetrics()
+        self.runtime = runtime or ObjectFunctionRuntime()
+        self.definitions: dict[int, WorkflowDefinition] = {}
+        self.children: dict[int, list[int]] = {}
+        self.definitions_loaded = 0.0
+        self._wake = asyncio.Event()
+
+    def wake(self) -> None:
+        """Ends the current poll interval, e.g. when events were created."""
+        self._wake.set()
+
+    def install(self, listener: NotificationListener) -> None:
+        # Events created by the dispatcher are run without waiting for the next poll
+        listener.subscribe(settings.WORKFLOW_READY_CHANNEL, lambda payload: self.wake())
+
+    async def set_role(self, conn: AsyncConnection) -> None:
+        await conn.execute(text(f"SET LOCAL ROLE {settings.DB_NAME}_admin"))
+
+    async def run(self, stop: asyncio.Event | None = None) -> None:
+        """Processes the due events until stop is set."""
+        stop = stop or asyncio.Event()
+        interval = self.poll_interval
+        try:
+            while not stop.is_set():
+                try:
+                    processed = await self.run_once()
+                except DBAPIError as e:
+                    logger.warning("Workflow worker database error: %s", e)
+                    processed = 0
+                if processed:
+                    interval = self.poll_interval
+                    continue
+                await self.sleep(interval, stop)
+                interval = min(interval * 2, self.max_poll_interval)
+        finally:
+            self.runtime.close()
+
+    async def sleep(self, interval: float, stop: asyncio.Event) -> None:
+        # Jitter keeps idle workers from polling in step
+        timeout = interval * random.uniform(0.5, 1.0)
+        self._wake.clear()
+        waiters = [
+            asyncio.ensure_future(self._wake.wait()),
+            asyncio.ensure_future(stop.wait()),
+        ]
+        try:
+            await asyncio.wait(
+                waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def run_once(self) -> int:
+        """Claims, runs and completes one batch of events, returns its size."""
+        jobs = await self.claim()
+        if not jobs:
+            return 0
+        await self.load_definitions()
+        if any(job.workflow_id not in self.definitions for job in jobs):
+            # The workflow was created since the definitions were loaded
+            self.definitions_loaded = 0.0
+            await self.load_definitions()
+        start = time.monotonic()
+        outcomes = await self.run_jobs(jobs)
+        self.metrics.run_seconds += time.monotonic() - start
+        await self.complete(list(zip(jobs, outcomes)))
+        self.metrics.batches += 1
+        if self.metrics.batches % 100 == 0:
+            logger.info("Workflow worker metrics: %s", self.metrics.snapshot())
+            logger.info("Object function metrics: %s", self.runtime.snapshot())
+        return len(jobs)
+
+    async def claim(self) -> list[WorkflowJob]:
+        stmt = claim_statement(
+            self.batch_size, self.tenant_concurrency, self.lease_seconds
+        )
+        async with self.engine.begin() as conn:
+            await self.set_role(conn)
+            rows = (await conn.execute(stmt)).mappings().all()
+        self.metrics.claimed += len(rows)
+        return [WorkflowJob(**row) for row in rows]
+
+    async def load_definitions(self) -> None:
+        """Loads the workflows, at most once every definitions_ttl seconds."""
+        if time.monotonic() - self.definitions_loaded < self.definitions_ttl:
+            return
+        workflow = Workflow.table.__table__
+        objectfunction = ObjectFunction.table.__table__
+        stmt = select(
+            workflow.c.id,
+            workflow.c.trigger,
+            workflow.c.repeat_every,
+            workflow.c.due_within,
+            workflow.c.record_required,
+            workflow.c.process_child_value,
+            workflow.c.parent_id,
+            objectfunction.c.name.label("objectfunction_name"),
+        ).select_from(
+            workflow.outerjoin(
+                objectfunction, workflow.c.objectfunction_id == objectfunction.c.id
+            )
+        )
+        async with self.engine.begin() as conn:
+            await self.set_role(conn)
+            rows = (await conn.execute(stmt)).mappings().all()
+        self.definitions = {}
+        self.children = {}
+        for row in rows:
+            row = dict(row)
+            parent_id = row.pop("parent_id")
+            self.definitions[row["id"]] = WorkflowDefinition(**row)
+            if parent_id is not None:
+                self.children.setdefault(parent_id, []).append(row["id"])
+        self.definitions_loaded = time.monotonic()
+
+    async def run_job(self, job: WorkflowJob) -> bool | None | BaseException:
+        """
+        Runs the object function of the job's workflow, returning its result,
+        None if the workflow has no object function, or the exception raised,
+        a LookupError if the workflow is not loaded.
+        """
+        return (await self.run_jobs([job]))[0]
+
+    async def run_jobs(
+        self, jobs: list[WorkflowJob]
+    ) -> list[bool | None | BaseException]:
+        """
+        Runs the object functions of the jobs' workflows, the jobs of each function
+        together, see ObjectFunctionRuntime, returning the outcome of each job.
+        """
+        outcomes: list[bool | None | BaseException] = [None] * len(jobs)
+        by_function: dict[str, list[int]] = {}
+        for i, job in enumerate(jobs):
+            definition = self.definitions.get(job.workflow_id)
+            if definition is None:
+                # Failed, so the event is run again, never completed unprocessed
+                outcomes[i] = LookupError(f"Workflow {job.workflow_id} not found")
+                continue
+            if definition.objectfunction_name is None:
+                continue
+            by_function.setdefault(definition.objectfunction_name, []).append(i)
+        names = list(by_function)
+        results = await asyncio.gather(
+            *[
+                self.runtime.run(name, [jobs[i] for i in by_function[name]])
+                for name in names
+            ]
+        )
+        for name, result in zip(names, results):
+            for i, outcome in zip(by_function[name], result):
+                outcomes[i] = outcome
+        return outcomes
+
+    async def complete(
+        self, outcomes: list[tuple[WorkflowJob, bool | None | BaseException]]
+    ) -> None:
+        """
+        Writes the outcomes of a batch of jobs in one transaction.
+
+        Only the events still leased by the jobs are written, see outcome_statement,
+        and the records and events that follow a job are created only if its event
+        was completed. The outcomes of the jobs that lost their lease are dropped,
+        the event is run, or was completed, by the worker that claimed it again.
+        """
+        record = WorkflowRecord.table.__table__
+        event = WorkflowEvent.table.__table__
+        completed, retried, records, next_events = [], [], [], []
+        today = datetime.date.today()
+        for job, outcome in outcomes:
+            definition = self.definitions.get(job.workflow_id)
+            lease = {"id": job.id, "attempts": job.attempts}
+            if isinstance(outcome, BaseException):
+                error = f"{type(outcome).__name__}: {outcome}"
+                if job.attempts < self.max_attempts:
+                    retried.append(
+                        {
+                            **lease,
+                            "delay": datetime.timedelta(
+                                seconds=retry_delay(
+                                    job.attempts, self.retry_backoff, 3600.0
+                                )
+                            ),
+                            "error": error,
+                        }
+                    )
+                    continue
+                self.metrics.abandoned += 1
+                completed.append({**lease, "value": None, "error": error})
+                continue
+            completed.append({**lease, "value": outcome, "error": None})
+            if definition is None:
+                continue
+            if definition.record_required:
+                records.append((job.id, self.record_values(job, outcome)))
+            if (
+                definition.trigger == WorkflowTrigger.SCHEDULE
+                and definition.repeat_every > 0
+            ):
+                next_events.append(
+                    (
+                        job.id,
+                        self.event_values(
+                            definition,
+                            job,
+                            job.run_at
+                            + datetime.timedelta(days=definition.repeat_every),
+                        ),
+                    )
+                )
+            if outcome is None or outcome == definition.process_child_value:
+                for child_id in self.children.get(definition.id, []):
+                    child = self.definitions[child_id]
+                    next_events.append(
+                        (
+                            job.id,
+                            self.event_values(
+                                child, job, datetime.datetime.now(datetime.UTC), today
+                            ),
+                        )
+                    )
+
+        done, retrying = set(), set()
+        async with self.engine.begin() as conn:
+            await self.set_role(conn)
+            if completed:
+                result = await conn.execute(complete_statement(completed))
+                done = set(result.scalars())
+            if retried:
+                result = await conn.execute(retry_statement(retried))
+                retrying = set(result.scalars())
+            records = [values for id, values in records if id in done]
+            if records:
+                await conn.execute(insert(record), records)
+            next_events = [values for id, values in next_events if id in done]
+            if next_events:
+                await conn.execute(insert(event), next_events)
+        self.metrics.completed += len(done)
+        self.metrics.retried += len(retrying)
+        self.metrics.lost += len(completed) + len(retried) - len(done) - len(retrying)
+
+    @staticmethod
+    def record_values(job: WorkflowJob, outcome: bool | None) -> dict[str, Any]:
+        """Returns the WorkflowRecord of a completed job."""
+        if outcome:
+            status, state = WorkflowRecordStatus.CLOSED, WorkflowRecordState.COMPLETE
+        else:
+            status, state = WorkflowRecordStatus.OPEN, WorkflowRecordState.PENDING
+        return {
+            "workflowevent_id": job.id,
+            "tenant_id": job.tenant_id,
+            "status": status.name,
+            "date_due": job.date_due,
+            "state": state.name,
+            "comment": "Completed by the object function" if outcome else None,
+        }
+
+    @staticmethod
+    def event_values(
+        definition: WorkflowDefinition,
+        job: WorkflowJob,
+        run_at: datetime.datetime,
+        today: datetime.date | None = None,
+    ) -> dict[str, Any]:
+        """Returns the event of the workflow following a job, run at run_at."""
+        start = today or run_at.date()
+        return {
+            "workflow_id": definition.id,
+            "tenant_id": job.tenant_id,
+            "workflow_object_id": job.workflow_object_id,
+            "run_at": run_at,
+            "date_due": start + datetime.timedelta(days=definition.due_within),
+        }
@@ -0,0 +1,452 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import datetime
+
+from typing import Optional
+
+from sqlalchemy import Identity, Integer, text, func
+from sqlalchemy.dialects.postgresql import (
+    BOOLEAN,
+    DATE,
+    ENUM,
+    TEXT,
+    TIMESTAMP,
+    VARCHAR,
+)
+
+from un0.database.fields import (
+    FKDefinition,
+    UniqueDefinition,
+    IndexDefinition,
+    FieldDefinition,
+)
+from un0.database.models import Model
+from un0.database.mixins import NameMixin
+from un0.relatedobjects.mixins import RelatedObjectIdMixin
+from un0.authorization.mixins import TenantMixin
+from un0.workflows.enums import (
+    WorkflowRecordStatus,
+    WorkflowRecordState,
+    WorkflowFlag,
+    WorkflowDBEvent,
+    WorkflowTrigger,
+)
+
+
+class ObjectFunction(
+    Model,
+    schema_name="un0",
+    table_name="objectfunction",
+):
+    """
+    Functions that can be called by user-defined workflows and reports.
+
+    The name is the name the function is registered under in the application,
+    see un0.workflows.executor.object_function.
+    """
+
+    constraint_definitions = [
+        UniqueDefinition(columns=["name"], name="uq_objectfunction_name")
+    ]
+    field_definitions = {
+        "id": FieldDefinition(
+            data_type=Integer,
+            fnct=Identity(start=1, cycle=False),
+            primary_key=True,
+            index=True,
+            doc="Primary Key",
+        ),
+        "label": FieldDefinition(
+            data_type=TEXT,
+            nullable=False,
+            doc="Label of the function",
+        ),
+        "documentation": FieldDefinition(
+            data_type=TEXT,
+            doc="Documentation of the function",
+        ),
+        "name": FieldDefinition(
+            data_type=TEXT,
+            nullable=False,
+            doc="Name of the function",
+        ),
+        "function_table_type_id": FieldDefinition(
+            data_type=Integer,
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.table_type.id",
+                ondelete="CASCADE",
+                edge_label="IS_OF_TABLE_TYPE",
+                reverse_edge_labels=["HAS_OBJECT_FUNCTION"],
+            ),
+            nullable=False,
+            index=True,
+            doc="The Table Type of the objects the function is called for",
+        ),
+    }
+
+    id: Optional[int] = None
+    label: Optional[str] = None
+    documentation: Optional[str] = None
+    name: Optional[str] = None
+    function_table_type_id: Optional[int] = None
+
+    def __str__(self) -> str:
+        return self.label
+
+
+class Workflow(
+    Model,
+    NameMixin,
+    schema_name="un0",
+    table_name="workflow",
+):
+    """User-defined workflows."""
+
+    # name: str <- NameMixin
+
+    field_definitions = {
+        "id": FieldDefinition(
+            data_type=Integer,
+            fnct=Identity(start=1, cycle=False),
+            primary_key=True,
+            index=True,
+            doc="Primary Key",
+        ),
+        "explanation": FieldDefinition(
+            data_type=TEXT,
+            nullable=False,
+            doc="Explanation of the workflow indicating the purpose and the expected outcome",
+        ),
+        "trigger": FieldDefinition(
+            data_type=ENUM(
+                WorkflowTrigger,
+                name="workflowtrigger",
+                create_type=True,
+                schema="un0",
+            ),
+            nullable=False,
+            server_default=WorkflowTrigger.DB_EVENT.name,
+            doc="The type of event that triggers execution of the workflow",
+        ),
+        "repeat_every": FieldDefinition(
+            data_type=Integer,
+            nullable=False,
+            server_default=text("0"),
+            doc="Repeat every x days",
+        ),
+        "flag": FieldDefinition(
+            data_type=ENUM(
+                WorkflowFlag,
+                name="workflowflag",
+                create_type=True,
+                schema="un0",
+            ),
+            nullable=False,
+            server_default=WorkflowFlag.MEDIUM.name,
+            doc="Flag indicating the importance of the workflow",
+        ),
+        "due_within": FieldDefinition(
+            data_type=Integer,
+            nullable=False,
+            server_default=text("7"),
+            doc="Due within x days",
+        ),
+        "db_event": FieldDefinition(
+            data_type=ENUM(
+                WorkflowDBEvent,
+                name="workflowdbevent",
+                create_type=True,
+                schema="un0",
+            ),
+            nullable=False,
+            server_default=WorkflowDBEvent.INSERT.name,
+            doc="The database event that triggers the workflow, if applicable",
+        ),
+        "auto_run": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("false"),
+            doc="Indicates if the workflow should be run automatically",
+        ),
+        "record_required": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("false"),
+            doc="Indicates if a Workflow Record is required",
+        ),
+        "parent_id": FieldDefinition(
+            data_type=Integer,
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.workflow.id",
+                ondelete="CASCADE",
+                edge_label="IS_CHILD_OF_WORKFLOW",
+                reverse_edge_labels=["IS_PARENT_OF_WORKFLOW"],
+            ),
+            index=True,
+            doc="The workflow processed before this one",
+        ),
+        "applicable_table_type_id": FieldDefinition(
+            data_type=Integer,
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.table_type.id",
+                ondelete="CASCADE",
+                edge_label="IS_WORKFLOW_FOR_TABLE_TYPE",
+                reverse_edge_labels=["HAS_WORKFLOW"],
+            ),
+            nullable=False,
+            index=True,
+            doc="The Table Type of the objects the workflow applies to",
+        ),
+        "record_table_type_id": FieldDefinition(
+            data_type=Integer,
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.table_type.id",
+                ondelete="CASCADE",
+                edge_label="HAS_WORKFLOW_RECORD_OF_TABLE_TYPE",
+                reverse_edge_labels=["IS_WORKFLOW_RECORD_TABLE_TYPE_OF"],
+            ),
+            index=True,
+            doc="The Table Type of the records of the workflow's execution",
+        ),
+        "objectfunction_id": FieldDefinition(
+            data_type=Integer,
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.objectfunction.id",
+                ondelete="SET NULL",
+                edge_label="IS_COMPLETED_BY_OBJECT_FUNCTION",
+                reverse_edge_labels=["COMPLETES_WORKFLOW"],
+            ),
+            index=True,
+            doc="The Object Function run to complete the workflow",
+        ),
+        "limiting_query_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.query.id",
+                ondelete="SET NULL",
+                edge_label="IS_LIMITED_BY_QUERY",
+                reverse_edge_labels=["LIMITS_WORKFLOW"],
+            ),
+            index=True,
+            doc="The query the changed objects must match for the workflow to apply",
+        ),
+        "process_child_value": FieldDefinition(
+            data_type=BOOLEAN,
+            nullable=False,
+            server_default=text("true"),
+            doc="The value returned by the Object Function that indicates that any child Workflows must be processed",
+        ),
+    }
+
+    id: Optional[int] = None
+    explanation: Optional[str] = None
+    trigger: Optional[WorkflowTrigger] = WorkflowTrigger.DB_EVENT
+    repeat_every: Optional[int] = 0
+    flag: Optional[WorkflowFlag] = WorkflowFlag.MEDIUM
+    due_within: Optional[int] = 7
+    db_event: Optional[WorkflowDBEvent] = WorkflowDBEvent.INSERT
+    auto_run: Optional[bool] = False
+    record_required: Optional[bool] = False
+    parent_id: Optional[int] = None
+    applicable_table_type_id: Optional[int] = None
+    record_table_type_id: Optional[int] = None
+    objectfunction_id: Optional[int] = None
+    limiting_query_id: Optional[str] = None
+    process_child_value: Optional[bool] = True
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class WorkflowEvent(
+    Model,
+    RelatedObjectIdMixin,
+    TenantMixin,
+    schema_name="un0",
+    table_name="workflowevent",
+):
+    """
+    Manually created or trigger created workflow activities.
+
+    Events are run by the workflow workers (see un0.workflows.executor) once run_at
+    has passed. A worker claims an event by setting locked_until, the end of its
+    lease, and completes it by setting completed_at.
+    """
+
+    # id: str <- RelatedObjectIdMixin
+    # tenant_id: str <- TenantMixin
+
+    index_definitions = [
+        # The queue of the workers, only the pending events are indexed
+        IndexDefinition(
+            name="ix_workflowevent_pending_run_at",
+            columns=["run_at"],
+            where="completed_at IS NULL",
+        )
+    ]
+    field_definitions = {
+        "workflow_id": FieldDefinition(
+            data_type=Integer,
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.workflow.id",
+                ondelete="CASCADE",
+                edge_label="IS_TYPE_OF",
+                reverse_edge_labels=["HAS_EVENT"],
+            ),
+            nullable=False,
+            index=True,
+            doc="The workflow of the event",
+        ),
+        "date_due": FieldDefinition(
+            data_type=DATE,
+            nullable=False,
+            doc="Date the workflow is due",
+        ),
+        "workflow_object_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.related_object.id",
+                ondelete="CASCADE",
+                edge_label="IS_EVENT_FOR",
+                reverse_edge_labels=["HAS_WORKFLOW_EVENT"],
+            ),
+            index=True,
+            doc="The object the workflow is run for",
+        ),
+        "objectfunction_return_value": FieldDefinition(
+            data_type=BOOLEAN,
+            doc="Value returned by the Object Function to indicate the workflow is complete",
+        ),
+        "run_at": FieldDefinition(
+            data_type=TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=func.now(),
+            doc="Time after which the event is run",
+        ),
+        "locked_until": FieldDefinition(
+            data_type=TIMESTAMP(timezone=True),
+            doc="End of the lease of the worker running the event",
+        ),
+        "attempts": FieldDefinition(
+            data_type=Integer,
+            nullable=False,
+            server_default=text("0"),
+            doc="Number of times the event was claimed by a worker",
+        ),
+        "completed_at": FieldDefinition(
+            data_type=TIMESTAMP(timezone=True),
+            doc="Time the event was run, or abandoned after its last attempt",
+        ),
+        "last_error": FieldDefinition(
+            data_type=TEXT,
+            doc="Error raised by the last attempt to run the event",
+        ),
+    }
+
+    workflow_id: Optional[int] = None
+    workflow: Optional[Workflow] = None
+    date_due: Optional[datetime.date] = None
+    workflow_object_id: Optional[str] = None
+    objectfunction_return_value: Optional[bool] = None
+    run_at: Optional[datetime.datetime] = None
+    locked_until: Optional[datetime.datetime] = None
+    attempts: Optional[int] = 0
+    completed_at: Optional[datetime.datetime] = None
+    last_error: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.workflow_id} - {self.date_due}"
+
+
+class WorkflowRecord(
+    Model,
+    RelatedObjectIdMixin,
+    TenantMixin,
+    schema_name="un0",
+    table_name="workflowrecord",
+):
+    """
+    Records of workflow events.
+
+    The status of the open records is recomputed from their date_due, copied from
+    their event, by the WorkflowStatusUpdater (see un0.workflows.status).
+    """
+
+    # id: str <- RelatedObjectIdMixin
+    # tenant_id: str <- TenantMixin
+
+    index_definitions = [
+        # The records whose status changes are found by status and date range
+        IndexDefinition(
+            name="ix_workflowrecord_status_date_due",
+            columns=["status", "date_due"],
+        )
+    ]
+    field_definitions = {
+        "workflowevent_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.workflowevent.id",
+                ondelete="CASCADE",
+                edge_label="IS_RECORD_OF",
+                reverse_edge_labels=["HAS_RECORD"],
+            ),
+            nullable=False,
+            index=True,
+            doc="The workflow event recorded",
+        ),
+        "status": FieldDefinition(
+            data_type=ENUM(
+                WorkflowRecordStatus,
+                name="workflowrecordstatus",
+                create_type=True,
+                schema="un0",
+            ),
+            nullable=False,
+            server_default=WorkflowRecordStatus.OPEN.name,
+            doc="Status of the workflow record",
+        ),
+        "date_due": FieldDefinition(
+            data_type=DATE,
+            doc="Date the workflow event recorded is due",
+        ),
+        "state": FieldDefinition(
+            data_type=ENUM(
+                WorkflowRecordState,
+                name="workflowrecordstate",
+                create_type=True,
+                schema="un0",
+            ),
+            nullable=False,
+            server_default=WorkflowRecordState.PENDING.name,
+            doc="State of the workflow record",
+        ),
+        "comment": FieldDefinition(
+            data_type=TEXT,
+            doc="User defined or auto-generated comment on the workflow execution",
+        ),
+        "workflowrecord_id": FieldDefinition(
+            data_type=VARCHAR(26),
+            foreign_key_definition=FKDefinition(
+                target_column_name="un0.related_object.id",
+                ondelete="CASCADE",
+                edge_label="RECORDS_EXECUTION",
+                reverse_edge_labels=["IS_EXECUTION_RECORDED_BY"],
+            ),
+            index=True,
+            doc="The object recording the execution, of the workflow's record Table Type",
+        ),
+    }
+
+    workflowevent_id: Optional[str] = None
+    workflowevent: Optional[WorkflowEvent] = None
+    status: Optional[WorkflowRecordStatus] = WorkflowRecordStatus.OPEN
+    date_due: Optional[datetime.date] = None
+    state: Optional[WorkflowRecordState] = WorkflowRecordState.PENDING
+    comment: Optional[str] = None
+    workflowrecord_id: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.workflowevent_id} - {self.status}"
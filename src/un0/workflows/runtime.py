@@ -0,0 +1,275 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import importlib
+import inspect
+import logging
+import multiprocessing
+import pickle
+import signal
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Callable
+
+from pydantic.dataclasses import dataclass
+
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ObjectFunctionOptions:
+    """
+    How an object function is run.
+
+    Attributes:
+        cpu_bound (bool): If True, the function is run in the runtime's process
+            pool, otherwise coroutine functions are awaited on the event loop and
+            other functions run in a thread.
+        timeout (float | None): Seconds after which a call fails with a
+            TimeoutError, the runtime's timeout if None.
+    """
+
+    cpu_bound: bool = False
+    timeout: float | None = None
+
+
+# The object functions, by name, run by the workflows whose ObjectFunction has that name
+object_functions: dict[str, Callable[[Any], bool | Awaitable[bool]]] = {}
+object_function_options: dict[str, ObjectFunctionOptions] = {}
+
+
+def object_function(
+    name: str, cpu_bound: bool = False, timeout: float | None = None
+) -> Callable:
+    """
+    Registers a function as the object function with the name, returns the function.
+
+    The function is called with the WorkflowJob of each event, and returns whether
+    the workflow is complete. Coroutine functions are awaited, other functions run
+    in a thread, or, if cpu_bound, in a separate process (see ObjectFunctionRuntime).
+
+    CPU bound functions must be defined at the top level of a module, they are
+    pickled by reference to be run in the pool's processes.
+    """
+
+    def register(fnct: Callable) -> Callable:
+        if cpu_bound and inspect.iscoroutinefunction(fnct):
+            raise TypeError(f"CPU bound object function {name} must not be async")
+        object_functions[name] = fnct
+        object_function_options[name] = ObjectFunctionOptions(
+            cpu_bound=cpu_bound, timeout=timeout
+        )
+        return fnct
+
+    return register
+
+
+class FunctionMetrics:
+    """Counts the calls of an object function, and their execution time."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float, outcome: Any) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        if isinstance(outcome, TimeoutError):
+            self.timeouts += 1
+        elif isinstance(outcome, BaseException):
+            self.failures += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "mean_ms": round(1000 * self.seconds / self.calls if self.calls else 0.0, 2),
+            "max_ms": round(1000 * self.max_seconds, 2),
+        }
+
+
+def import_modules(modules: list[str]) -> None:
+    """Imports the modules registering object functions, in a worker or pool process."""
+    for module in modules:
+        importlib.import_module(module)
+
+
+def _raise_timeout(signum: int, frame: Any) -> None:
+    raise TimeoutError("Object function timed out")
+
+
+def _picklable(e: BaseException) -> BaseException:
+    try:
+        pickle.dumps(e)
+        return e
+    except Exception:
+        return RuntimeError(f"{type(e).__name__}: {e}")
+
+
+def run_batch(
+    fnct: Callable, jobs: list[Any], timeout: float
+) -> list[tuple[bool | BaseException, float]]:
+    """
+    Runs fnct for each of the jobs, in a pool process, returning the outcome and
+    execution time of each call.
+
+    Each call is interrupted by a SIGALRM after timeout seconds where the platform
+    supports interval timers, a call that overruns elsewhere is only detected by
+    the runtime's batch deadline.
+    """
+    timed = hasattr(signal, "setitimer")
+    if timed:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+    results: list[tuple[bool | BaseException, float]] = []
+    for job in jobs:
+        start = time.monotonic()
+        try:
+            if timed:
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            outcome: bool | BaseException = bool(fnct(job))
+        except Exception as e:
+            outcome = _picklable(e)
+        finally:
+            if timed:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        results.append((outcome, time.monotonic() - start))
+    return results
+
+
+class ObjectFunctionRuntime:
+    """
+    Runs object functions without blocking the event loop.
+
+    Coroutine functions are awaited on the loop and other functions run in a thread,
+    these are expected to wait on I/O. Functions registered as cpu_bound run in a
+    pool of max_processes processes, created on first use. The jobs of a function
+    are sent to the pool in batches of batch_size, one pool task per batch, so the
+    cost of pickling and of the round trip is shared by the batch.
+
+    The pool's processes import modules when they start, see import_modules.
+
+    Every call fails with a TimeoutError after the function's timeout. A batch that
+    does not return by the sum of the timeouts of its calls, plus a grace period,
+    fails as a whole and the pool is replaced, the overrunning process is left to
+    finish on its own.
+    """
+
+    def __init__(
+        self,
+        max_processes: int | None = settings.OBJECT_FUNCTION_PROCESSES,
+        batch_size: int = settings.OBJECT_FUNCTION_BATCH_SIZE,
+        timeout: float = settings.OBJECT_FUNCTION_TIMEOUT,
+        modules: list[str] = settings.OBJECT_FUNCTION_MODULES,
+    ) -> None:
+        self.max_processes = max_processes
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.modules = list(modules)
+        self.metrics: dict[str, FunctionMetrics] = {}
+        self._pool: ProcessPoolExecutor | None = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=import_modules,
+                initargs=(self.modules,),
+            )
+        return self._pool
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        return {name: metrics.snapshot() for name, metrics in self.metrics.items()}
+
+    def record(self, name: str, seconds: float, outcome: Any) -> None:
+        self.metrics.setdefault(name, FunctionMetrics()).record(seconds, outcome)
+
+    async def run(self, name: str, jobs: list[Any]) -> list[bool | BaseException]:
+        """
+        Runs the object function with the name for each of the jobs, returning the
+        outcome of each, the function's result or the exception it raised.
+        """
+        fnct = object_functions.get(name)
+        if fnct is None:
+            error = LookupError(f"Object function not registered: {name}")
+            return [error for _ in jobs]
+        options = object_function_options.get(name, ObjectFunctionOptions())
+        timeout = options.timeout or self.timeout
+        if options.cpu_bound:
+            batches = await asyncio.gather(
+                *[
+                    self.run_in_pool(name, fnct, jobs[i : i + self.batch_size], timeout)
+                    for i in range(0, len(jobs), self.batch_size)
+                ]
+            )
+            return [outcome for batch in batches for outcome in batch]
+        return list(
+            await asyncio.gather(
+                *[self.run_on_loop(name, fnct, job, timeout) for job in jobs]
+            )
+        )
+
+    async def run_on_loop(
+        self, name: str, fnct: Callable, job: Any, timeout: float
+    ) -> bool | BaseException:
+        start = time.monotonic()
+        try:
+            if inspect.iscoroutinefunction(fnct):
+                outcome: bool | BaseException = bool(
+                    await asyncio.wait_for(fnct(job), timeout)
+                )
+            else:
+                outcome = bool(
+                    await asyncio.wait_for(asyncio.to_thread(fnct, job), timeout)
+                )
+        except Exception as e:
+            outcome = e
+        self.record(name, time.monotonic() - start, outcome)
+        return outcome
+
+    async def run_in_pool(
+        self, name: str, fnct: Callable, jobs: list[Any], timeout: float
+    ) -> list[bool | BaseException]:
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        deadline = timeout * len(jobs) + max(timeout, 5.0)
+        try:
+            results = await asyncio.wait_for(
+                loop.run_in_executor(pool, run_batch, fnct, jobs, timeout), deadline
+            )
+        except TimeoutError:
+            logger.warning(
+                "Object function %s overran its batch deadline, replacing the pool",
+                name,
+            )
+            if self._pool is pool:
+                self.close()
+            results = [(TimeoutError("Object function timed out"), timeout)] * len(jobs)
+        except BrokenProcessPool as e:
+            # The pool is unusable after one of its processes died
+            if self._pool is pool:
+                self.close()
+            results = [(e, 0.0)] * len(jobs)
+        except Exception as e:
+            results = [(e, 0.0)] * len(jobs)
+        for outcome, seconds in results:
+            self.record(name, seconds, outcome)
+        return [outcome for outcome, seconds in results]
@@ -0,0 +1,128 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import datetime
+import logging
+
+from sqlalchemy import Select, select, update, func, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from un0.database.base import engine as default_engine
+from un0.workflows.enums import WorkflowRecordStatus
+from un0.workflows.models import WorkflowRecord
+from un0.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# The statuses recomputed, each with the statuses it replaces
+TRANSITIONS = {
+    WorkflowRecordStatus.OVERDUE: [
+        WorkflowRecordStatus.OPEN,
+        WorkflowRecordStatus.AT_RISK,
+    ],
+    WorkflowRecordStatus.AT_RISK: [
+        WorkflowRecordStatus.OPEN,
+        WorkflowRecordStatus.OVERDUE,
+    ],
+    WorkflowRecordStatus.OPEN: [
+        WorkflowRecordStatus.AT_RISK,
+        WorkflowRecordStatus.OVERDUE,
+    ],
+}
+
+
+def status_statement(status: WorkflowRecordStatus) -> Select:
+    """
+    Creates the statement that sets status on the records whose date_due requires
+    it, given the bounds :today and :at_risk_until, and selects the number of
+    records changed per tenant.
+
+    Only the records of the statuses replaced are read, by the index on
+    (status, date_due), so records already in status, and closed records, are
+    neither read nor written.
+    """
+    record = WorkflowRecord.table.__table__
+    today = bindparam("today", type_=record.c.date_due.type)
+    at_risk_until = bindparam("at_risk_until", type_=record.c.date_due.type)
+    if status == WorkflowRecordStatus.OVERDUE:
+        due = [record.c.date_due < today]
+    elif status == WorkflowRecordStatus.AT_RISK:
+        due = [record.c.date_due >= today, record.c.date_due <= at_risk_until]
+    else:
+        due = [record.c.date_due > at_risk_until]
+    changed = (
+        update(record)
+        .where(record.c.status.in_(TRANSITIONS[status]), *due)
+        .values(status=status)
+        .returning(record.c.tenant_id)
+        .cte("changed")
+    )
+    return select(changed.c.tenant_id, func.count()).group_by(changed.c.tenant_id)
+
+
+class WorkflowStatusUpdater:
+    """
+    Keeps the status of the open workflow records current: OVERDUE once their
+    date_due has passed, AT_RISK within at_risk_days of it, and OPEN otherwise.
+
+    Each run recomputes the statuses with one set based UPDATE per status, in a
+    single transaction, and logs the number of records changed per tenant.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine = default_engine,
+        at_risk_days: int = settings.WORKFLOW_AT_RISK_DAYS,
+        interval: float = settings.WORKFLOW_STATUS_INTERVAL,
+    ) -> None:
+        self.engine = engine
+        self.at_risk_days = at_risk_days
+        self.interval = interval
+
+    def params(self, today: datetime.date) -> dict[str, datetime.date]:
+        return {
+            "today": today,
+            "at_risk_until": today + datetime.timedelta(days=self.at_risk_days),
+        }
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Recomputes the statuses every interval seconds until stop is set."""
+        while not stop.is_set():
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Workflow record statuses could not be recomputed")
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_once(
+        self, today: datetime.date | None = None
+    ) -> dict[str, dict[WorkflowRecordStatus, int]]:
+        """
+        Recomputes the statuses of the records as of today.
+
+        Returns:
+            dict[str, dict[WorkflowRecordStatus, int]]: The number of records set to
+                each status, by tenant id.
+        """
+        params = self.params(today or datetime.date.today())
+        counts: dict[str, dict[WorkflowRecordStatus, int]] = {}
+        async with self.engine.begin() as conn:
+            await conn.execute(text(f"SET LOCAL ROLE {settings.DB_NAME}_admin"))
+            for status in TRANSITIONS:
+                result = await conn.execute(status_statement(status), params)
+                for tenant_id, count in result:
+                    counts.setdefault(tenant_id, {})[status] = count
+        for tenant_id, changed in counts.items():
+            logger.info(
+                "Workflow record statuses of tenant %s: %s",
+                tenant_id,
+                ", ".join(f"{count} {status.name}" for status, count in changed.items()),
+            )
+        return counts
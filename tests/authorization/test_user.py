@@ -188,14 +188,20 @@ class TestUser:
                 "unique": True,
                 "column_names": ["email"],
                 "include_columns": [],
-                "dialect_options": {"postgresql_include": []},
+                "dialect_options": {
+                    "postgresql_include": [],
+                    "postgresql_where": "(NOT is_deleted)",
+                },
             },
             {
                 "name": "ix_un0_user_handle",
                 "unique": False,
                 "column_names": ["handle"],
                 "include_columns": [],
-                "dialect_options": {"postgresql_include": []},
+                "dialect_options": {
+                    "postgresql_include": [],
+                    "postgresql_where": "(NOT is_deleted)",
+                },
             },
             {
                 "name": "ix_un0_user_id",
@@ -204,6 +210,16 @@ class TestUser:
                 "include_columns": [],
                 "dialect_options": {"postgresql_include": []},
             },
+            {
+                "name": "ix_un0_user_import_key",
+                "unique": False,
+                "column_names": ["import_key"],
+                "include_columns": [],
+                "dialect_options": {
+                    "postgresql_include": [],
+                    "postgresql_where": "(NOT is_deleted)",
+                },
+            },
             {
                 "name": "ix_un0_user_modified_by_id",
                 "unique": False,
@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import datetime
+
+from un0.communications.models import InboxItem, InboxUnread
+from un0.communications.routers import inbox_statement, unread_statement
+from un0.communications.sql_emitters import InboxItemSQL, InboxUnreadSQL
+
+from tests.conftest import compiled
+
+
+class TestInboxStatements:
+    def test_first_page(self):
+        sql = compiled(inbox_statement(50))
+        assert "un0.inbox_item.user_id = current_setting(" in sql
+        assert (
+            "ORDER BY un0.inbox_item.sent_at DESC, un0.inbox_item.message_id DESC"
+            in sql
+        )
+        assert "LIMIT %(param_1)s" in sql
+        assert "JOIN" not in sql
+
+    def test_keyset_page(self):
+        sql = compiled(
+            inbox_statement(
+                50,
+                datetime.datetime(2024, 5, 1, tzinfo=datetime.UTC),
+                "01J0000000000000000000000M",
+            )
+        )
+        assert "(un0.inbox_item.sent_at, un0.inbox_item.message_id) < (" in sql
+
+    def test_unread(self):
+        sql = compiled(unread_statement())
+        assert sql.startswith("SELECT un0.inbox_unread.unread_count")
+
+    def test_keyset_index(self):
+        indexes = {
+            index.name: [column.name for column in index.columns]
+            for index in InboxItem.table.__table__.indexes
+        }
+        assert indexes["ix_inbox_item_user_id_sent_at"] == [
+            "user_id",
+            "sent_at",
+            "message_id",
+        ]
+
+    def test_projections_have_no_generic_routers(self):
+        assert InboxItem.routers == []
+        assert InboxUnread.routers == []
+
+
+class TestInboxTriggers:
+    def test_inbox_item(self):
+        sql = InboxItemSQL(
+            table_name="message_copied_to", schema_name="un0"
+        ).emit_sql()
+        assert "FUNCTION un0.message_copied_to_maintain_inbox()" in sql
+        assert "changed.copied_to_id" in sql
+        assert "ON CONFLICT (user_id, message_id) DO NOTHING" in sql
+        assert sql.count("FOR EACH STATEMENT") == 3
+        assert "FOR EACH ROW" not in sql
+
+    def test_unread_counter(self):
+        sql = InboxUnreadSQL(table_name="inbox_item", schema_name="un0").emit_sql()
+        assert "FUNCTION un0.count_inbox_unread()" in sql
+        assert "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows" in sql
+        assert "HAVING sum(delta) <> 0" in sql
+        assert "ORDER BY user_id" in sql
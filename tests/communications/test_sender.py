@@ -0,0 +1,45 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+from un0.communications.models import (
+    Message,
+    MessageAddressedTo,
+    MessageCopiedTo,
+)
+from un0.communications.sender import audience_statement, recipients_statement
+from un0.relatedobjects.sql_emitters import InsertRelatedObject
+
+from tests.conftest import compiled
+
+
+class TestRecipientsStatement:
+    def test_addressed_to(self):
+        sql = compiled(recipients_statement())
+        assert sql.startswith(
+            "INSERT INTO un0.message_addressed_to (message_id, addressed_to_id) SELECT"
+        )
+        assert "unnest(%(user_ids)s::VARCHAR[])" in sql
+        assert "JOIN un0.message_group_recipient" in sql
+        assert "un0.message_group_recipient.copied IS false" in sql
+        assert sql.endswith("ON CONFLICT DO NOTHING")
+        assert "message_addressed_to.addressed_to_id = users.user_id" not in sql
+
+    def test_copied_to_excludes_addressed(self):
+        sql = compiled(recipients_statement(copied=True))
+        assert sql.startswith("INSERT INTO un0.message_copied_to")
+        assert "un0.message_group_recipient.copied IS true" in sql
+        assert "NOT (EXISTS (SELECT" in sql
+        assert "un0.message_addressed_to.addressed_to_id = users.user_id" in sql
+
+    def test_audience_statement(self):
+        sql = compiled(audience_statement())
+        assert "count(DISTINCT un0.user_group_role.user_id)" in sql
+
+
+class TestRecipientTables:
+    def test_join_rows_have_no_row_triggers(self):
+        assert InsertRelatedObject in Message.sql_emitters
+        for model in (MessageAddressedTo, MessageCopiedTo):
+            assert InsertRelatedObject not in model.sql_emitters
+            assert "FOR EACH ROW" not in model.emit_sql()
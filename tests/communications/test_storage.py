@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import hashlib
+
+import pytest
+
+from un0.communications.models import Attachment
+from un0.communications.routers import attachment_statement
+from un0.communications.storage import ContentStore
+from un0.errors import AttachmentTooLargeError
+
+from tests.conftest import compiled
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+class TestContentStore:
+    def test_write_hashes_content(self, tmp_path):
+        store = ContentStore(tmp_path, max_size=None)
+        content_hash, size = asyncio.run(store.write(stream(b"hello ", b"", b"world")))
+        assert content_hash == hashlib.sha256(b"hello world").hexdigest()
+        assert size == 11
+        path = store.path(content_hash)
+        assert path == tmp_path / content_hash[:2] / content_hash[2:4] / content_hash
+        assert path.read_bytes() == b"hello world"
+        assert list((tmp_path / "tmp").iterdir()) == []
+
+    def test_write_deduplicates(self, tmp_path):
+        store = ContentStore(tmp_path, max_size=None)
+        first, _ = asyncio.run(store.write(stream(b"same content")))
+        mtime = store.path(first).stat().st_mtime_ns
+        second, _ = asyncio.run(store.write(stream(b"same ", b"content")))
+        assert first == second
+        assert store.path(first).stat().st_mtime_ns == mtime
+        stored = [path for path in tmp_path.rglob("*") if path.is_file()]
+        assert stored == [store.path(first)]
+
+    def test_write_too_large(self, tmp_path):
+        store = ContentStore(tmp_path, max_size=8)
+        with pytest.raises(AttachmentTooLargeError):
+            asyncio.run(store.write(stream(b"12345", b"67890")))
+        assert [path for path in tmp_path.rglob("*") if path.is_file()] == []
+
+    def test_attachment_columns(self):
+        columns = Attachment.table.__table__.columns
+        assert columns["content_hash"].index
+        assert not columns["content_hash"].nullable
+        assert str(columns["size"].type) == "BIGINT"
+
+    def test_attachment_is_read_in_the_session_tenant(self):
+        sql = compiled(attachment_statement())
+        assert "un0.attachment.id = %(attachment_id)s" in sql
+        assert "un0.attachment.tenant_id = current_setting(" in sql
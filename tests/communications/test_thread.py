@@ -0,0 +1,48 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+from sqlalchemy.dialects import postgresql
+
+from un0.communications.models import Message
+from un0.communications.routers import thread_statement
+from un0.communications.sql_emitters import MessageThreadRootSQL
+
+
+class TestThread:
+    def test_thread_statement(self):
+        statement = thread_statement(10).compile(dialect=postgresql.dialect())
+        sql = str(statement)
+        assert sql.startswith("WITH RECURSIVE thread(id, depth, path)")
+        assert "JOIN thread ON reply.previous_message_id = thread.id" in sql
+        assert "reply.thread_root_id = (SELECT un0.message.thread_root_id" in sql
+        assert "thread.depth < %(depth_2)s" in sql
+        assert statement.params["depth_2"] == 10
+        assert sql.endswith("ORDER BY thread.path")
+
+    def test_thread_is_read_in_the_session_tenant(self):
+        sql = str(thread_statement(10).compile(dialect=postgresql.dialect()))
+        # The message, the root (selected in the anchor and each reply) and each
+        # reply are of the session tenant
+        assert "un0.message.tenant_id = current_setting(" in sql
+        assert "reply.tenant_id = current_setting(" in sql
+        assert sql.count(".tenant_id = current_setting(") == 4
+
+    def test_thread_root_trigger(self):
+        sql = MessageThreadRootSQL(table_name="message", schema_name="un0").emit_sql()
+        assert "NEW.thread_root_id := NEW.id;" in sql
+        assert "BEFORE INSERT" in sql
+        # Fires after the trigger assigning the id, triggers fire in name order
+        assert "message_insert_related_object_trigger" < "message_set_thread_root_trigger"
+        assert "message_set_thread_root_trigger" in sql
+
+    def test_thread_index(self):
+        indexes = {
+            index.name: [column.name for column in index.columns]
+            for index in Message.table.__table__.indexes
+        }
+        assert indexes["ix_message_thread_root_id_sent_at"] == [
+            "thread_root_id",
+            "sent_at",
+            "id",
+        ]
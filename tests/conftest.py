@@ -11,6 +11,7 @@ import textwrap
 import pytest
 
 from sqlalchemy import func, select, delete, text, create_engine, Inspector, Column
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.asyncio import create_async_engine
 
@@ -147,6 +148,16 @@ def mock_rls_vars(
     return (id, email, is_superuser, is_tenant_admin, tenant_id, role_name)
 
 
+def compiled(statement, literal_binds: bool = False) -> str:
+    """Returns the SQL of the statement as compiled for postgres."""
+    return str(
+        statement.compile(
+            dialect=postgresql.dialect(),
+            compile_kwargs={"literal_binds": literal_binds},
+        )
+    )
+
+
 def db_column(
     db_inspector, table_name: str, col_name: str, schema: str = settings.DB_SCHEMA
 ) -> Column | None:
@@ -0,0 +1,128 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import csv
+import datetime
+import gzip
+import importlib.util
+
+import pytest
+
+from un0.errors import Un0Error
+from un0.database.management import audit_export
+from un0.database.management.audit_export import (
+    AuditExporter,
+    CSVPartitionWriter,
+    ParquetPartitionWriter,
+    export_units,
+    month_range,
+    previous_month,
+)
+
+
+class TestMonths:
+    def test_month_range(self):
+        assert month_range(datetime.date(2023, 11, 15), datetime.date(2024, 2, 1)) == [
+            datetime.date(2023, 11, 1),
+            datetime.date(2023, 12, 1),
+            datetime.date(2024, 1, 1),
+            datetime.date(2024, 2, 1),
+        ]
+
+    def test_previous_month(self):
+        assert previous_month(datetime.date(2024, 1, 20)) == datetime.date(2023, 12, 1)
+
+
+class TestExportUnits:
+    def test_record_version_units(self):
+        units = export_units([datetime.date(2023, 12, 1)])
+        unit = next(u for u in units if u.source == "record_version_un0_user_group_role")
+        assert unit.name == "record_version_un0_user_group_role_2023-12"
+        assert "FROM audit.record_version" in unit.statement
+        assert "AS export_tenant_id" in unit.statement
+        table_name, start, end = unit.params
+        assert table_name == "un0.user_group_role"
+        assert start == datetime.datetime(2023, 12, 1, tzinfo=datetime.UTC)
+        assert end == datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+
+
+class TestAuditExporter:
+    def test_unknown_format(self, tmp_path):
+        with pytest.raises(Un0Error):
+            AuditExporter(None, directory=tmp_path, file_format="xlsx")
+
+    def test_partition_path(self, tmp_path):
+        exporter = AuditExporter(None, directory=tmp_path)
+        unit = export_units([datetime.date(2024, 3, 1)])[0]
+        path = exporter.partition_path(unit, None)
+        assert path == (
+            tmp_path / unit.source / "tenant_id=none" / "month=2024-03" / "part.csv.gz"
+        )
+
+    def test_completed_units_are_skipped(self, tmp_path):
+        exporter = AuditExporter(None, directory=tmp_path)
+        months = [datetime.date(2024, 3, 1)]
+        (tmp_path / "_done").mkdir()
+        for unit in export_units(months):
+            exporter.marker(unit).touch()
+        # No unit is left to run, so the database is never connected to
+        assert exporter.export(months) == {}
+
+    def test_one_partition_open_at_a_time(self, tmp_path):
+        exporter = AuditExporter(None, directory=tmp_path)
+        unit = export_units([datetime.date(2024, 3, 1)])[0]
+        opened = []
+        open_writers = set()
+
+        class RecordingWriter(CSVPartitionWriter):
+            def __init__(self, path, columns, types):
+                super().__init__(path, columns, types)
+                opened.append(path)
+                open_writers.add(self)
+                assert len(open_writers) == 1
+
+            def close(self):
+                super().close()
+                open_writers.discard(self)
+
+        exporter.writer_class = RecordingWriter
+        # The rows of the COPY, ordered by their last column, the tenant
+        rows = [(1, "a"), (2, "a"), (3, "b"), (4, None)]
+        count, paths = exporter.write_partitions(unit, rows, ["id", "tenant"], [20, 25])
+        assert count == 4
+        assert not open_writers
+        assert paths == [
+            exporter.partition_path(unit, tenant) for tenant in ["a", "b", None]
+        ]
+        assert opened == [exporter.temporary_path(path) for path in paths]
+        with gzip.open(opened[0], "rt", newline="") as f:
+            assert list(csv.reader(f)) == [["id"], ["1"], ["2"]]
+
+    def test_csv_writer(self, tmp_path):
+        path = tmp_path / "part.csv.gz"
+        writer = CSVPartitionWriter(path, ["id", "record"], [20, 3802])
+        writer.write((1, {"name": "a"}))
+        writer.close()
+        with gzip.open(path, "rt", newline="") as f:
+            assert list(csv.reader(f)) == [["id", "record"], ["1", '{"name": "a"}']]
+
+    @pytest.mark.skipif(
+        importlib.util.find_spec("pyarrow") is None, reason="pyarrow not installed"
+    )
+    def test_parquet_writer_null_first_row_group(self, tmp_path, monkeypatch):
+        import pyarrow
+        import pyarrow.parquet
+
+        monkeypatch.setattr(audit_export, "PARQUET_ROW_GROUP_SIZE", 2)
+        path = tmp_path / "part.parquet"
+        # The oids of int8 and jsonb, the record is NULL in the whole first group
+        writer = ParquetPartitionWriter(path, ["id", "record"], [20, 3802])
+        writer.write((1, None))
+        writer.write((2, None))
+        writer.write((3, {"name": "a"}))
+        writer.close()
+        table = pyarrow.parquet.read_table(path)
+        assert table.schema.field("record").type == pyarrow.string()
+        assert table.column("record").to_pylist() == [None, None, '{"name": "a"}']
+        assert pyarrow.parquet.ParquetFile(path).num_row_groups == 2
@@ -0,0 +1,259 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import os
+import stat
+import sys
+import textwrap
+
+import pytest
+
+from un0.database.cache import (
+    PermissionContext,
+    TableVersions,
+    LRUCache,
+    SocketCache,
+    serve_cache,
+    cache_key,
+)
+
+
+TENANT_A_USER = PermissionContext(user_id="user_a", tenant_id="tenant_a")
+TENANT_B_USER = PermissionContext(user_id="user_b", tenant_id="tenant_b")
+
+
+class TestCacheKey:
+    def test_cache_key_is_stable(self):
+        assert cache_key("User", "List", TENANT_A_USER, {"a": 1, "b": 2}) == cache_key(
+            "User", "List", TENANT_A_USER, {"b": 2, "a": 1}
+        )
+
+    def test_cache_key_differs_by_permission_context(self):
+        assert cache_key("User", "List", TENANT_A_USER) != cache_key(
+            "User", "List", TENANT_B_USER
+        )
+        assert cache_key("User", "List", TENANT_A_USER) != cache_key(
+            "User",
+            "List",
+            PermissionContext(user_id="user_a", tenant_id="tenant_a", role_name="writer"),
+        )
+
+    def test_cache_key_differs_by_mask_and_params(self):
+        assert cache_key("User", "List", TENANT_A_USER) != cache_key(
+            "User", "Select", TENANT_A_USER
+        )
+        assert cache_key("User", "Select", TENANT_A_USER, {"id": "1"}) != cache_key(
+            "User", "Select", TENANT_A_USER, {"id": "2"}
+        )
+
+
+class TestTableVersions:
+    def test_snapshot_disabled_until_connected(self):
+        versions = TableVersions()
+        assert versions.snapshot(["un0.user"]) is None
+        versions.connected()
+        assert versions.snapshot(["un0.user"]) is not None
+        versions.disconnected()
+        assert versions.snapshot(["un0.user"]) is None
+
+    def test_notify_changes_snapshot(self):
+        versions = TableVersions()
+        versions.connected()
+        snapshot = versions.snapshot(["un0.tenant"])
+        versions.notify("un0.tenant:5")
+        assert versions.snapshot(["un0.tenant"]) != snapshot
+        assert versions.versions["un0.tenant"] == 5
+        # Out of order notifications never lower the version
+        versions.notify("un0.tenant:3")
+        assert versions.versions["un0.tenant"] == 5
+
+    def test_rls_tables_are_dependencies(self):
+        versions = TableVersions()
+        versions.connected()
+        snapshot = versions.snapshot(["un0.tenant"])
+        versions.notify("un0.user_group_role:1")
+        assert versions.snapshot(["un0.tenant"]) != snapshot
+
+    def test_reconnect_reads_new_floor(self):
+        versions = TableVersions()
+        versions.connected(10)
+        snapshot = versions.snapshot(["un0.tenant"])
+        versions.disconnected()
+        # un0.tenant was written while disconnected
+        versions.connected(12)
+        assert versions.snapshot(["un0.tenant"]) != snapshot
+
+    def test_reconnect_without_writes_keeps_snapshot(self):
+        versions = TableVersions()
+        versions.connected(10)
+        snapshot = versions.snapshot(["un0.tenant"])
+        versions.disconnected()
+        versions.connected(10)
+        assert versions.snapshot(["un0.tenant"]) == snapshot
+
+    def test_floor_is_the_version_of_unseen_tables(self):
+        versions = TableVersions()
+        versions.connected(10)
+        versions.notify("un0.tenant:8")
+        versions.notify("un0.group:11")
+        assert versions.version("un0.tenant") == 10
+        assert versions.version("un0.group") == 11
+        assert versions.version("un0.user") == 10
+
+    def test_out_of_order_commit_matches_no_snapshot(self):
+        versions = TableVersions()
+        versions.connected(10)
+        versions.notify("un0.tenant:12")
+        snapshot = versions.snapshot(["un0.tenant"])
+        # Version 11 was taken before 12, and committed after it
+        versions.notify("un0.tenant:11")
+        reordered = versions.snapshot(["un0.tenant"])
+        assert reordered != snapshot
+        assert min(reordered) < 0
+        versions.notify("un0.tenant:13")
+        assert versions.version("un0.tenant") == 13
+        assert min(versions.snapshot(["un0.tenant"])) > 0
+
+    def test_invalid_notification_is_ignored(self):
+        versions = TableVersions()
+        versions.connected()
+        versions.notify("un0.tenant:not_a_version")
+        assert versions.versions == {}
+
+
+class TestLRUCache:
+    @pytest.mark.asyncio
+    async def test_get_set(self):
+        versions = TableVersions()
+        versions.connected()
+        cache = LRUCache(versions)
+        snapshot = cache.snapshot(["un0.tenant"])
+        await cache.set("key", [{"id": "1"}], snapshot)
+        assert await cache.get("key", cache.snapshot(["un0.tenant"])) == [{"id": "1"}]
+
+    @pytest.mark.asyncio
+    async def test_write_invalidates(self):
+        versions = TableVersions()
+        versions.connected()
+        cache = LRUCache(versions)
+        await cache.set("key", [{"id": "1"}], cache.snapshot(["un0.tenant"]))
+        versions.notify("un0.tenant:1")
+        assert await cache.get("key", cache.snapshot(["un0.tenant"])) is None
+
+    @pytest.mark.asyncio
+    async def test_write_during_query_is_not_served(self):
+        versions = TableVersions()
+        versions.connected()
+        cache = LRUCache(versions)
+        snapshot = cache.snapshot(["un0.tenant"])
+        versions.notify("un0.tenant:1")
+        await cache.set("key", [{"id": "1"}], snapshot)
+        assert await cache.get("key", cache.snapshot(["un0.tenant"])) is None
+
+    @pytest.mark.asyncio
+    async def test_disabled_while_disconnected(self):
+        cache = LRUCache(TableVersions())
+        snapshot = cache.snapshot(["un0.tenant"])
+        await cache.set("key", [{"id": "1"}], snapshot)
+        assert await cache.get("key", snapshot) is None
+        assert cache.store.entries == {}
+
+    @pytest.mark.asyncio
+    async def test_evicts_least_recently_used(self):
+        versions = TableVersions()
+        versions.connected()
+        cache = LRUCache(versions, max_entries=2)
+        snapshot = cache.snapshot(["un0.tenant"])
+        await cache.set("a", 1, snapshot)
+        await cache.set("b", 2, snapshot)
+        await cache.get("a", snapshot)
+        await cache.set("c", 3, snapshot)
+        assert await cache.get("a", snapshot) == 1
+        assert await cache.get("b", snapshot) is None
+        assert await cache.get("c", snapshot) == 3
+
+
+class TestSocketCache:
+    @pytest.mark.asyncio
+    async def test_get_set(self, tmp_path):
+        path = str(tmp_path / "cache.sock")
+        server = await serve_cache(path)
+        try:
+            versions = TableVersions()
+            versions.connected()
+            cache = SocketCache(versions, path)
+            snapshot = cache.snapshot(["un0.tenant"])
+            await cache.set("key", [{"id": "1"}], snapshot)
+            assert await cache.get("key", snapshot) == [{"id": "1"}]
+            versions.notify("un0.tenant:1")
+            assert await cache.get("key", cache.snapshot(["un0.tenant"])) is None
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    @pytest.mark.asyncio
+    async def test_socket_is_private(self, tmp_path):
+        path = str(tmp_path / "cache.sock")
+        umask = os.umask(0o022)
+        try:
+            server = await serve_cache(path)
+        finally:
+            # The umask of the process is restored after the socket is bound
+            assert os.umask(umask) == 0o022
+        try:
+            assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    @pytest.mark.asyncio
+    async def test_processes_share_only_equal_states(self, tmp_path):
+        path = str(tmp_path / "cache.sock")
+        server = await serve_cache(path)
+        try:
+            # This process connected when the sequence was at 100
+            versions = TableVersions()
+            versions.connected(100)
+            cache = SocketCache(versions, path)
+            await cache.set("key", [{"id": "1"}], cache.snapshot(["un0.tenant"]))
+            # A process connected at the same point reads the entry, one that
+            # connected after un0.tenant was written (version 101) does not
+            assert await self.get_in_process(path, 100) == "[{'id': '1'}]"
+            assert await self.get_in_process(path, 101) == "None"
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    @staticmethod
+    async def get_in_process(path: str, floor: int) -> str:
+        code = textwrap.dedent(
+            f"""
+            import asyncio
+            from un0.database.cache import TableVersions, SocketCache
+
+            async def main():
+                versions = TableVersions()
+                versions.connected({floor})
+                cache = SocketCache(versions, {path!r})
+                print(await cache.get("key", cache.snapshot(["un0.tenant"])))
+
+            asyncio.run(main())
+            """
+        )
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", code, stdout=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await process.communicate()
+        assert process.returncode == 0
+        return stdout.decode().strip()
+
+    @pytest.mark.asyncio
+    async def test_unavailable_server_is_a_miss(self, tmp_path):
+        versions = TableVersions()
+        versions.connected()
+        cache = SocketCache(versions, str(tmp_path / "missing.sock"))
+        snapshot = cache.snapshot(["un0.tenant"])
+        await cache.set("key", [{"id": "1"}], snapshot)
+        assert await cache.get("key", snapshot) is None
@@ -0,0 +1,202 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import datetime
+import importlib.util
+import io
+
+import pytest
+
+from un0.errors import ExportError
+from un0.database.base import engine
+from un0.database.enums import ExportFormat
+from un0.database.export import (
+    ExportSink,
+    Exporter,
+    ParquetStreamWriter,
+    arrow_schema,
+    copy_source,
+    copy_statement,
+    export_value,
+)
+from un0.authorization.models import User
+
+
+requires_pyarrow = pytest.mark.skipif(
+    importlib.util.find_spec("pyarrow") is None, reason="pyarrow not installed"
+)
+
+# The oids of int8, timestamptz, jsonb and of a type unknown to psycopg (an enum)
+INT8, TIMESTAMPTZ, JSONB, ENUM = 20, 1184, 3802, 99999
+
+
+class FakeCopy:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.types = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def __aiter__(self):
+        return self.iter_chunks()
+
+    async def iter_chunks(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    def set_types(self, types):
+        self.types = types
+
+    async def rows(self):
+        for chunk in self.chunks:
+            yield (chunk,)
+
+
+class FakeCursor:
+    def __init__(self, chunks):
+        self.copies = []
+        self.chunks = chunks
+
+    def copy(self, statement, params):
+        self.copies.append((statement, params))
+        return FakeCopy(self.chunks)
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+class TestCopyStatement:
+    def test_copy_source_binds_parameters(self):
+        table = User.table.__table__
+        stmt = (
+            table.select()
+            .with_only_columns(table.c.id, table.c.email)
+            .where(table.c.id.in_(["a", "b"]))
+        )
+        sql, params = copy_source(stmt, engine.dialect)
+        assert "%(id_1_1)s" in sql and "%(id_1_2)s" in sql
+        assert params == {"id_1_1": "a", "id_1_2": "b"}
+
+    def test_csv(self):
+        assert (
+            copy_statement("SELECT 1", ExportFormat.CSV)
+            == "COPY (SELECT 1) TO STDOUT (FORMAT CSV, HEADER)"
+        )
+
+    def test_ndjson_rows_are_encoded_by_the_database(self):
+        sql = copy_statement("SELECT 1", ExportFormat.NDJSON)
+        assert "row_to_json(export)" in sql
+        assert sql.endswith("FROM (SELECT 1) AS export) TO STDOUT (FORMAT BINARY)")
+
+    def test_parquet_reads_binary_rows(self):
+        assert (
+            copy_statement("SELECT 1", ExportFormat.PARQUET)
+            == "COPY (SELECT 1) TO STDOUT (FORMAT BINARY)"
+        )
+
+
+class TestExporter:
+    def test_csv_is_sent_in_chunks(self):
+        exporter = Exporter(chunk_size=10)
+        cursor = FakeCursor([b"id,email\n", b"1,a@b.c\n", b"2,d@e.f\n"])
+        chunks = asyncio.run(
+            collect(exporter.copy_chunks(cursor, "SELECT 1", {}, ExportFormat.CSV))
+        )
+        assert chunks == [b"id,email\n1,a@b.c\n", b"2,d@e.f\n"]
+        assert cursor.copies == [
+            ("COPY (SELECT 1) TO STDOUT (FORMAT CSV, HEADER)", {})
+        ]
+
+    def test_ndjson_lines(self):
+        exporter = Exporter(chunk_size=1024)
+        cursor = FakeCursor([b'{"id": 1}\n', b'{"id": 2}\n'])
+        chunks = asyncio.run(
+            collect(exporter.copy_chunks(cursor, "SELECT 1", {}, ExportFormat.NDJSON))
+        )
+        assert chunks == [b'{"id": 1}\n{"id": 2}\n']
+
+    def test_empty_export(self):
+        exporter = Exporter()
+        cursor = FakeCursor([])
+        chunks = asyncio.run(
+            collect(exporter.copy_chunks(cursor, "SELECT 1", {}, ExportFormat.CSV))
+        )
+        assert chunks == []
+
+    @pytest.mark.skipif(
+        importlib.util.find_spec("pyarrow") is not None, reason="pyarrow installed"
+    )
+    def test_parquet_requires_pyarrow(self):
+        with pytest.raises(ExportError):
+            Exporter().check_format(ExportFormat.PARQUET)
+
+    def test_csv_requires_nothing(self):
+        Exporter().check_format(ExportFormat.CSV)
+
+
+class TestExportSink:
+    def test_drain_keeps_position(self):
+        sink = ExportSink()
+        sink.write(b"PAR1")
+        assert sink.drain() == b"PAR1"
+        sink.write(memoryview(b"data"))
+        assert sink.tell() == 8
+        assert sink.drain() == b"data"
+        assert sink.drain() == b""
+
+    def test_export_value(self):
+        assert export_value({"a": [1]}) == '{"a": [1]}'
+        assert export_value(1) == 1
+
+
+@requires_pyarrow
+class TestParquetStreamWriter:
+    def test_schema_from_types(self):
+        import pyarrow
+
+        schema = arrow_schema(
+            ["id", "at", "doc", "status"], [INT8, TIMESTAMPTZ, JSONB, ENUM]
+        )
+        assert schema.types == [
+            pyarrow.int64(),
+            pyarrow.timestamp("us", "UTC"),
+            pyarrow.string(),
+            pyarrow.string(),
+        ]
+
+    def test_null_first_row_group(self):
+        import pyarrow.parquet
+
+        writer = ParquetStreamWriter(["id", "at", "doc"], [INT8, TIMESTAMPTZ, JSONB])
+        at = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+        data = writer.write([(1, None, None), (2, None, None)])
+        data += writer.write([(3, at, {"a": [1]})])
+        data += writer.close()
+        table = pyarrow.parquet.read_table(io.BytesIO(data))
+        assert table.schema.field("at").type == pyarrow.timestamp("us", "UTC")
+        assert table.column("at").to_pylist() == [None, None, at]
+        assert table.column("doc").to_pylist() == [None, None, '{"a": [1]}']
+
+    def test_no_rows(self):
+        import pyarrow.parquet
+
+        writer = ParquetStreamWriter(["id"], [INT8])
+        table = pyarrow.parquet.read_table(io.BytesIO(writer.close()))
+        assert table.num_rows == 0
+        assert table.schema.field("id").type == pyarrow.int64()
+
+
+class TestExportRouter:
+    def test_export_route_precedes_object_routes(self):
+        endpoints = [router.endpoint for router in User.routers]
+        assert endpoints.index("export") < endpoints.index("get_by_id")
+        router = User.routers[endpoints.index("export")]
+        assert router.path == "/api/user/export"
+        assert router.mask == "List"
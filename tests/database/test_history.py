@@ -0,0 +1,233 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import datetime
+
+import pytest
+
+from sqlalchemy import create_engine, func, text, update
+
+from un0.authorization.models import User
+from un0.authorization.rls_sql_emitters import UserRLSSQL
+from un0.database.enums import HistorySource
+from un0.database.history import as_of_statement, history_source
+from un0.database.sql_emitters import (
+    HistoryTableAuditSQL,
+    RecordVersionAuditSQL,
+    AlterGrantSQL,
+)
+from un0.database.management.sql_emitters import CreateHistoryPartitionSQL
+from un0.config import settings
+
+from tests.conftest import compiled, mock_rls_vars
+
+
+class TestHistoryTableAuditSQL:
+    emitter = HistoryTableAuditSQL(table_name="role", schema_name="un0")
+
+    def test_partitioned_table(self):
+        sql = self.emitter.emit_create_history_table_sql()
+        assert "LIKE un0.role," in sql
+        assert "PRIMARY KEY (pk, modified_at)" in sql
+        assert "PARTITION BY RANGE (modified_at)" in sql
+        assert "USING BRIN (modified_at)" in sql
+        assert "audit.prevent_history_change()" in sql
+        assert "SELECT audit.maintain_history_partitions(" in sql
+
+    def test_statement_level_triggers(self):
+        sql = self.emitter.emit_create_history_function_and_trigger_sql()
+        assert sql.count("REFERENCING NEW TABLE AS new_rows") == 2
+        assert sql.count("FOR EACH STATEMENT") == 2
+        assert "audit.create_history_partition('un0_role', month)" in sql
+        assert "SELECT * FROM new_rows" in sql
+        # Rows are written from the transition table, never read back from the table
+        assert "NEW.id" not in sql
+        assert "DROP TRIGGER IF EXISTS role_history_trigger" in sql
+
+    def test_emit_sql(self):
+        sql = self.emitter.emit_sql()
+        assert "CREATE TABLE audit.un0_role" in sql
+        assert "CREATE OR REPLACE FUNCTION un0.role_history()" in sql
+
+    def test_policies(self):
+        sql = self.emitter.emit_create_history_table_sql()
+        assert "GRANT SELECT ON audit.un0_role TO" in sql
+        assert "SELECT audit.copy_history_policies('un0.role'::regclass);" in sql
+        # The policies are copied whichever of the two emitters runs last
+        sql = UserRLSSQL(table_name="user", schema_name="un0").emit_sql()
+        assert "SELECT audit.copy_history_policies('un0.user'::regclass);" in sql
+
+
+class TestCreateHistoryPartitionSQL:
+    def test_emit_sql(self):
+        sql = CreateHistoryPartitionSQL().emit_sql()
+        assert "CREATE TABLE IF NOT EXISTS audit.history_policy" in sql
+        assert "FUNCTION audit.create_history_partition(" in sql
+        assert "FUNCTION audit.maintain_history_partitions(months_ahead INT)" in sql
+        assert "DETACH PARTITION" in sql
+        assert "pg_advisory_xact_lock" in sql
+        assert "FUNCTION audit.copy_history_policies(source REGCLASS)" in sql
+        assert "FOR SELECT TO %s USING (%s)" in sql
+
+
+class TestAsOf:
+    table = User.table.__table__
+    as_of = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+
+    def test_history_source(self):
+        assert history_source([AlterGrantSQL]) is None
+        assert history_source([RecordVersionAuditSQL]) == HistorySource.RECORD_VERSION
+        assert (
+            history_source([RecordVersionAuditSQL, HistoryTableAuditSQL])
+            == HistorySource.HISTORY_TABLE
+        )
+
+    def test_history_table(self):
+        sql = compiled(
+            as_of_statement(self.table, [self.table.c.id, self.table.c.email], self.as_of)
+        )
+        assert "FROM audit.un0_user" in sql
+        assert "SELECT DISTINCT ON (audit.un0_user.id)" in sql
+        # Latest version first, in the order of the (id, modified_at) index
+        assert (
+            "ORDER BY audit.un0_user.id, audit.un0_user.modified_at DESC, "
+            "audit.un0_user.pk DESC" in sql
+        )
+        assert "audit.un0_user.modified_at <= " in sql
+        assert "WHERE NOT as_of.is_deleted" in sql
+        assert sql.startswith("SELECT as_of.id, as_of.email")
+
+    def test_history_table_ids(self):
+        stmt = as_of_statement(
+            self.table, [self.table.c.id], self.as_of, ids=["a", "b"]
+        )
+        sql = compiled(stmt)
+        assert "audit.un0_user.id = any(%(as_of_ids)s::TEXT[])" in sql
+        assert stmt.compile().params["as_of_ids"] == ["a", "b"]
+
+    def test_record_version(self):
+        sql = compiled(
+            as_of_statement(
+                self.table,
+                [self.table.c.id, self.table.c.email],
+                self.as_of,
+                ids=["a"],
+                history=HistorySource.RECORD_VERSION,
+            )
+        )
+        assert "FROM audit.record_version" in sql
+        assert "DISTINCT ON (coalesce(audit.record_version.record_id, " in sql
+        assert "audit.record_version.ts DESC, audit.record_version.id DESC" in sql
+        assert "audit.to_record_id(" in sql
+        assert "as_of.op != " in sql
+        assert "CAST(as_of.record ->> " in sql
+
+
+@pytest.fixture(scope="class")
+def audited_user(data_dict):
+    """
+    Audits un0.user, both with a history table and with supa_audit, for the duration
+    of the class, and updates the users of Acme so they have a version.
+    """
+    eng = create_engine(
+        f"{settings.DB_DRIVER}://{settings.DB_NAME}_login:{settings.DB_USER_PW}@{settings.DB_HOST}/{settings.DB_NAME}"
+    )
+    with eng.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"SET ROLE {settings.DB_NAME}_admin"))
+        conn.execute(
+            text(HistoryTableAuditSQL(table_name="user", schema_name="un0").emit_sql())
+        )
+        conn.execute(text("SELECT audit.enable_tracking('un0.user'::regclass)"))
+    yield
+    with eng.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"SET ROLE {settings.DB_NAME}_admin"))
+        conn.execute(text("SELECT audit.disable_tracking('un0.user'::regclass)"))
+        conn.execute(
+            text(
+                """
+                DROP TRIGGER user_history_insert_trigger ON un0.user;
+                DROP TRIGGER user_history_update_trigger ON un0.user;
+                DROP FUNCTION un0.user_history();
+                DROP TABLE audit.un0_user;
+                DELETE FROM audit.history_policy WHERE table_name = 'un0_user';
+                """
+            )
+        )
+    eng.dispose()
+
+
+class TestAsOfRowLevelSecurity:
+    table = User.table.__table__
+
+    @pytest.fixture(scope="class")
+    def as_of(self, session, superuser_id, data_dict, audited_user):
+        acme_ids = [
+            user["id"]
+            for email, user in data_dict["users"].items()
+            if email.endswith("@acme.com")
+        ]
+        with session.begin():
+            session.execute(func.un0.mock_authorize_user(*mock_rls_vars(superuser_id)))
+            session.execute(func.un0.mock_role("writer"))
+            session.execute(
+                update(self.table)
+                .where(self.table.c.id.in_(acme_ids))
+                .values(full_name=self.table.c.full_name)
+            )
+        yield datetime.datetime.now(datetime.timezone.utc)
+
+    def read_as_of(self, session, user, as_of, ids, history):
+        with session.begin():
+            session.execute(
+                func.un0.mock_authorize_user(
+                    *mock_rls_vars(
+                        user["id"],
+                        email=user["email"],
+                        is_superuser="false",
+                        tenant_id=user["tenant_id"],
+                    )
+                )
+            )
+            stmt = as_of_statement(
+                self.table,
+                [self.table.c.id, self.table.c.email],
+                as_of,
+                ids=ids,
+                history=history,
+            )
+            return session.execute(stmt).all()
+
+    def test_history_table_rows_of_another_tenant(self, session, data_dict, as_of):
+        users = data_dict["users"]
+        ids = [users["user1@acme.com"]["id"], users["user2@acme.com"]["id"]]
+        rows = self.read_as_of(
+            session, users["user1@nacme.com"], as_of, ids, HistorySource.HISTORY_TABLE
+        )
+        assert rows == []
+        rows = self.read_as_of(
+            session, users["user3@acme.com"], as_of, ids, HistorySource.HISTORY_TABLE
+        )
+        assert sorted(row.id for row in rows) == sorted(ids)
+
+    def test_record_versions_of_another_tenant(
+        self, session, superuser_id, data_dict, as_of
+    ):
+        users = data_dict["users"]
+        ids = [users["user1@acme.com"]["id"]]
+        # The versions of a table with row level security are read by superusers only
+        for email in ["user1@nacme.com", "user3@acme.com"]:
+            rows = self.read_as_of(
+                session, users[email], as_of, ids, HistorySource.RECORD_VERSION
+            )
+            assert rows == []
+        with session.begin():
+            session.execute(func.un0.mock_authorize_user(*mock_rls_vars(superuser_id)))
+            stmt = as_of_statement(
+                self.table,
+                [self.table.c.id],
+                as_of,
+                ids=ids,
+                history=HistorySource.RECORD_VERSION,
+            )
+            assert session.execute(stmt).scalars().all() == ids
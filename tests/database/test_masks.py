@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+from un0.errors import ModelFieldListError
+from un0.database.masks import MaskDef, ViewSQL
+from un0.database.enums import SQLOperation
+from un0.authorization.models import User
+
+
+class TestMaskDef:
+    def test_name_defaults_to_operation(self):
+        mask_def = MaskDef(operation=[SQLOperation.SELECT])
+        assert mask_def.name == "Select"
+
+    def test_include_and_exclude_fields(self):
+        with pytest.raises(ValueError):
+            MaskDef(name="Bad", include_fields={"id"}, exclude_fields={"email"})
+
+    def test_include_fields(self):
+        mask = MaskDef(name="Summary", include_fields={"id", "email"}).create_mask(
+            User.table.__table__, "User", User.field_definitions
+        )
+        assert mask.field_list == ["email", "id"]
+        assert list(mask.response_model.model_fields.keys()) == ["email", "id"]
+
+    def test_exclude_fields(self):
+        mask = MaskDef(name="Summary", exclude_fields={"email"}).create_mask(
+            User.table.__table__, "User", User.field_definitions
+        )
+        assert "email" not in mask.field_list
+        assert "handle" in mask.field_list
+
+    def test_unknown_field(self):
+        with pytest.raises(ModelFieldListError):
+            MaskDef(name="Bad", include_fields={"not_a_field"}).create_mask(
+                User.table.__table__, "User", User.field_definitions
+            )
+
+
+class TestMask:
+    def test_model_masks_are_compiled(self):
+        assert set(User.masks.keys()) == {"Select", "List", "Insert", "Update"}
+        mask = User.masks["List"]
+        assert mask.field_list == [column.name for column in mask.columns]
+        assert mask.response_model(email="a@b.c").email == "a@b.c"
+
+    def test_select_columns(self):
+        mask = User.masks["List"]
+        assert [column.name for column in mask.select_columns(["id", "email"])] == [
+            "email",
+            "id",
+        ]
+        assert mask.select_columns() == mask.columns
+        with pytest.raises(ModelFieldListError):
+            mask.select_columns(["not_a_field"])
+
+    def test_routers_use_masks(self):
+        assert {router.endpoint: router.mask for router in User.routers}["get"] == "List"
+        assert len(User.routers) == len(User.router_defs)
+
+    def test_view_sql(self):
+        sql = ViewSQL(
+            schema_name="un0",
+            table_name="user",
+            mask_name="List",
+            field_list=["id", "email"],
+        ).emit_sql()
+        assert "CREATE OR REPLACE VIEW un0.user_list" in sql
+        assert "security_invoker" in sql
+        assert "SELECT id, email" in sql
+
+
+class TestMaskSerializer:
+    def test_dump_json(self):
+        mask = User.masks["List"]
+        assert mask.dump_json([{"id": "1", "email": "a@b.c"}]) == (
+            b'[{"id":"1","email":"a@b.c"}]'
+        )
+        assert mask.dump_json_row({"id": "1"}) == b'{"id":"1"}'
+
+    def test_iter_json(self):
+        mask = User.masks["List"]
+        rows = [{"handle": str(i)} for i in range(5)]
+        chunks = list(mask.iter_json(rows, batch_size=2))
+        assert len(chunks) == 5
+        assert b"".join(chunks) == mask.dump_json(rows)
+        assert b"".join(mask.iter_json([])) == b"[]"
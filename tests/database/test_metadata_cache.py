@@ -0,0 +1,78 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+
+import pytest
+
+from un0.authorization.models import User, UserGroupRole, Tenant
+from un0.database.metadata_cache import MetadataCache, TableMetadata
+from un0.database.management.sql_emitters import CreateSchemaChangeEventTriggerSQL
+from un0.database.un0db import UnoDB
+from un0.config import settings
+
+
+class CountingMetadataCache(MetadataCache):
+    def __init__(self):
+        super().__init__()
+        self.refreshes = 0
+
+    async def refresh(self):
+        self.refreshes += 1
+        await asyncio.sleep(0)
+
+
+class TestTableMetadata:
+    def test_from_table(self):
+        table_metadata = TableMetadata.from_table(User.table.__table__)
+        assert table_metadata.table_name == "un0.user"
+        assert table_metadata.pk_columns == ["id"]
+        assert ["email"] not in table_metadata.unique_constraints
+        assert ["email"] in table_metadata.live_unique_constraints
+        assert "id" in table_metadata.server_default_columns
+        assert table_metadata.foreign_keys["id"] == "un0.related_object.id"
+        assert table_metadata.foreign_keys["tenant_id"] == "un0.tenant.id"
+
+    def test_composite_primary_key(self):
+        table_metadata = TableMetadata.from_table(UserGroupRole.table.__table__)
+        assert table_metadata.pk_columns == ["group_id", "role_id"]
+
+    def test_named_unique_constraint(self):
+        table_metadata = TableMetadata.from_table(Tenant.table.__table__)
+        # Unique constraints of soft deleting models are partial unique indexes
+        assert ["name"] in table_metadata.live_unique_constraints
+
+
+class TestMetadataCache:
+    def test_loaded_from_registry(self):
+        cache = MetadataCache()
+        assert cache.get("un0.user").pk_columns == ["id"]
+        assert cache.loaded
+        with pytest.raises(KeyError):
+            cache.get("un0.not_a_table")
+
+    @pytest.mark.asyncio
+    async def test_refreshes_are_coalesced(self):
+        cache = CountingMetadataCache()
+        cache.schedule_refresh("ALTER TABLE")
+        await asyncio.sleep(0)
+        # Requests made while a refresh runs result in a single further refresh
+        for _ in range(5):
+            cache.schedule_refresh("ALTER TABLE")
+        await cache._refresh_task
+        assert cache.refreshes == 2
+
+    def test_uno_db_uses_cache(self):
+        db = UnoDB("un0.user")
+        assert db.pk_fields == ["id"]
+        assert db.server_default_columns() == db.table_metadata.server_default_columns
+        assert "email" in db.unique_constraints()
+        assert "id" not in db.unique_constraints()
+
+
+class TestSchemaChangeEventTriggerSQL:
+    def test_emit_sql(self):
+        sql = CreateSchemaChangeEventTriggerSQL().emit_sql()
+        assert "CREATE EVENT TRIGGER un0_schema_change" in sql
+        assert f"pg_notify('{settings.SCHEMA_NOTIFY_CHANNEL}', tg_tag)" in sql
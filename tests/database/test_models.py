@@ -0,0 +1,40 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+from sqlalchemy import UniqueConstraint
+
+from un0.authorization.models import User, Tenant, UserGroupRole
+from un0.database.base import LIVE_ROWS_WHERE
+
+
+def index_where(table, name):
+    index = next(index for index in table.indexes if index.name == name)
+    where = index.dialect_options["postgresql"].get("where")
+    return str(where) if where is not None else None
+
+
+class TestPartialIndexes:
+    def test_indexed_columns(self):
+        table = User.table.__table__
+        assert index_where(table, "ix_un0_user_email") == LIVE_ROWS_WHERE
+        assert index_where(table, "ix_un0_user_handle") == LIVE_ROWS_WHERE
+        assert index_where(table, "ix_un0_user_import_key") == LIVE_ROWS_WHERE
+        assert not table.c.email.unique
+
+    def test_keys_keep_full_indexes(self):
+        table = User.table.__table__
+        assert index_where(table, "ix_un0_user_id") is None
+        assert index_where(table, "ix_un0_user_tenant_id") is None
+
+    def test_unique_definition(self):
+        table = Tenant.table.__table__
+        assert index_where(table, "uq_tenant_name") == LIVE_ROWS_WHERE
+        assert not any(
+            isinstance(constraint, UniqueConstraint)
+            for constraint in table.constraints
+        )
+
+    def test_model_without_soft_delete(self):
+        table = UserGroupRole.table.__table__
+        assert all(index_where(table, index.name) is None for index in table.indexes)
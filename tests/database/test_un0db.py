@@ -0,0 +1,179 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import threading
+
+import pytest
+
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects import postgresql
+
+from un0.authorization.models import User
+from un0.errors import ModelFieldListError
+from un0.database.un0db import UnoDB
+from un0.config import settings
+from tests.pgjwt.test_pgjwt import encode_test_token
+
+
+class TestUnoDBSelectStatement:
+    def test_select_all_columns(self):
+        stmt = UnoDB("un0.user").select_statement()
+        assert [column.name for column in stmt.selected_columns] == list(
+            User.table.__table__.columns.keys()
+        )
+        assert str(stmt.whereclause) == 'NOT un0."user".is_deleted'
+
+    def test_include_deleted(self):
+        stmt = UnoDB("un0.user").select_statement(include_deleted=True)
+        assert stmt.whereclause is None
+
+    def test_select_columns_and_values(self):
+        stmt = UnoDB("un0.user").select_statement(
+            {"email": "admin@acme.com"}, ["id", "handle"]
+        )
+        assert [column.name for column in stmt.selected_columns] == ["id", "handle"]
+        assert "WHERE un0.\"user\".email = :email_1" in str(stmt)
+
+    def test_filter_on_unselected_column(self):
+        stmt = UnoDB("un0.user").select_statement({"email": "admin@acme.com"}, ["id"])
+        assert [column.name for column in stmt.selected_columns] == ["id"]
+
+    def test_invalid_column(self):
+        with pytest.raises(Exception):
+            UnoDB("un0.user").select_statement(column_names=["not_a_column"])
+        with pytest.raises(Exception):
+            UnoDB("un0.user").select_statement({"not_a_column": 1})
+
+
+class TestUnoDBBulkExists:
+    records = [
+        {"email": "a@acme.com", "import_key": "a"},
+        {"email": "b@acme.com", "import_key": "b"},
+    ]
+
+    def test_key_sets_default_to_unique_constraints(self):
+        assert UnoDB("un0.user").key_sets(self.records) == [["email"]]
+
+    def test_key_columns(self):
+        assert UnoDB("un0.user").key_sets(self.records, ["import_key"]) == [
+            ["import_key"]
+        ]
+        with pytest.raises(Exception):
+            UnoDB("un0.user").key_sets(self.records, ["not_a_column"])
+
+    def test_no_key(self):
+        with pytest.raises(Exception):
+            UnoDB("un0.user").key_sets([{"handle": "a"}])
+
+    def test_bulk_exists_statement(self):
+        db = UnoDB("un0.user")
+        sql = str(
+            db.bulk_exists_statement(self.records, [["email"], ["import_key"]]).compile(
+                dialect=postgresql.psycopg.dialect()
+            )
+        )
+        assert "unnest(%(candidate_ordinal)s::INTEGER[]" in sql
+        assert "un0.\"user\".email = candidates.email" in sql
+        assert "UNION ALL" in sql
+        assert "un0.\"user\".import_key = candidates.import_key" in sql
+        # email is unique among the users not deleted, its key set states the predicate
+        assert sql.count("NOT un0.\"user\".is_deleted") == 2
+
+    def test_primary_key_matches_deleted_rows(self):
+        sql = str(
+            UnoDB("un0.user")
+            .bulk_exists_statement([{"id": "a"}], [["id"]])
+            .compile(dialect=postgresql.psycopg.dialect())
+        )
+        assert "is_deleted" not in sql
+
+    def test_import_key_is_indexed(self):
+        assert "ix_un0_user_import_key" in {
+            index.name for index in User.table.__table__.indexes
+        }
+
+
+class TestUnoDBChunks:
+    def test_chunk_ids_statement(self):
+        sql = str(
+            UnoDB("un0.user")
+            .chunk_ids_statement({"tenant_id": "tenant"}, "01J", 500)
+            .compile(dialect=postgresql.psycopg.dialect())
+        )
+        assert 'un0."user".tenant_id = %(tenant_id_1)s' in sql
+        assert 'un0."user".id > %(id_1)s' in sql
+        assert 'ORDER BY un0."user".id' in sql
+        assert "LIMIT" in sql
+        assert sql.endswith("FOR UPDATE")
+
+    def test_first_chunk_has_no_lower_bound(self):
+        sql = str(UnoDB("un0.user").chunk_ids_statement({}, None, 500))
+        assert "WHERE" not in sql
+
+    @pytest.mark.asyncio
+    async def test_update_skips_soft_deleted_rows(self, monkeypatch):
+        wheres = []
+
+        async def run_in_chunks(self, filters, statements, **kwargs):
+            wheres.append(kwargs["where"])
+            return []
+
+        monkeypatch.setattr(UnoDB, "run_in_chunks", run_in_chunks)
+        db = UnoDB("un0.user")
+        await db.update({"handle": "a"}, {})
+        await db.update({"handle": "a"}, {}, where=db.db_table.c.handle == "b")
+        await db.update({"handle": "a"}, {}, include_deleted=True)
+        sql = [str(where) if where is not None else None for where in wheres]
+        assert sql[0] == 'NOT un0."user".is_deleted'
+        assert sql[1] == 'un0."user".handle = :handle_1 AND NOT un0."user".is_deleted'
+        assert sql[2] is None
+
+    @pytest.mark.asyncio
+    async def test_invalid_filters_and_values(self):
+        with pytest.raises(ModelFieldListError):
+            await UnoDB("un0.user").update({"handle": "a"}, {"not_a_column": 1})
+        with pytest.raises(ModelFieldListError):
+            await UnoDB("un0.user").update({"not_a_column": 1}, {})
+        with pytest.raises(ModelFieldListError):
+            await UnoDB("un0.user").update({}, {})
+
+
+class TestUnoDBChunkRetries:
+    @pytest.mark.asyncio
+    async def test_retried_chunk_reports_its_ids_once(self, engine, data_dict):
+        users = data_dict["users"]
+        target_id = users["user1@acme.com"]["id"]
+        blocker_id = users["user2@acme.com"]["id"]
+        user = User.table.__table__
+
+        def statements(ids):
+            return [
+                update(user)
+                .where(user.c.id.in_(ids))
+                .values(full_name=user.c.full_name)
+                .returning(user.c.id),
+                # Waits for the lock held below, the first attempts time out
+                select(user.c.id).where(user.c.id == blocker_id).with_for_update(),
+            ]
+
+        blocker = engine.connect()
+        blocker.begin()
+        blocker.execute(text(f"SET ROLE {settings.DB_NAME}_admin"))
+        blocker.execute(
+            select(user.c.id).where(user.c.id == blocker_id).with_for_update()
+        )
+        release = threading.Timer(0.3, blocker.rollback)
+        release.start()
+        try:
+            ids = await UnoDB("un0.user").run_in_chunks(
+                {"email": "user1@acme.com"},
+                statements,
+                authorization=encode_test_token(),
+                lock_timeout=100,
+                lock_retries=5,
+            )
+        finally:
+            release.join()
+            blocker.close()
+        assert ids == [target_id, blocker_id]
@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+from sqlalchemy import Column, MetaData, Table, Integer, TEXT, VARCHAR
+from sqlalchemy.dialects import postgresql
+
+from un0.errors import QueryCompileError
+from un0.filters.enums import Include, Match, Lookup
+from un0.filters.sql_emitters import QueryVersionSQL
+from un0.filters.compiler import (
+    FilterValueDefinition,
+    QueryDefinition,
+    compile_predicate,
+    matching_ids_statement,
+)
+
+from tests.conftest import compiled
+
+
+table = Table(
+    "item",
+    MetaData(),
+    Column("id", VARCHAR(26), primary_key=True),
+    Column("name", TEXT),
+    Column("quantity", Integer),
+    schema="un0",
+)
+
+
+def query(id: str, *values: FilterValueDefinition, **kwargs) -> QueryDefinition:
+    return QueryDefinition(
+        id=id, version=1, table_type_id=1, filter_values=values, **kwargs
+    )
+
+
+class TestCompilePredicate:
+    def test_filter_values(self):
+        definition = query(
+            "q1",
+            FilterValueDefinition(
+                field_name="name", lookup=Lookup.EQUAL, include=Include.INCLUDE, value="a"
+            ),
+            FilterValueDefinition(
+                field_name="quantity",
+                lookup=Lookup.GREATER_THAN,
+                include=Include.EXCLUDE,
+                value=3,
+            ),
+        )
+        sql = compiled(compile_predicate(table, definition, {}), literal_binds=True)
+        assert sql == "un0.item.name = 'a' AND un0.item.quantity <= 3"
+
+    def test_match_or_and_null(self):
+        definition = query(
+            "q1",
+            FilterValueDefinition(
+                field_name="name", lookup=Lookup.NULL, include=Include.INCLUDE
+            ),
+            FilterValueDefinition(
+                field_name="quantity", lookup=Lookup.IN, include=Include.INCLUDE, value=2
+            ),
+            match_values=Match.OR,
+        )
+        sql = compiled(compile_predicate(table, definition, {}), literal_binds=True)
+        assert sql == "un0.item.name IS NULL OR un0.item.quantity IN (2)"
+
+    def test_subqueries(self):
+        subquery = query(
+            "q2",
+            FilterValueDefinition(
+                field_name="quantity", lookup=Lookup.EQUAL, include=Include.INCLUDE, value=1
+            ),
+        )
+        definition = query(
+            "q1", subquery_ids=("q2",), include_subqueries=Include.EXCLUDE
+        )
+        sql = compiled(
+            compile_predicate(table, definition, {"q2": subquery}), literal_binds=True
+        )
+        assert sql == "un0.item.quantity != 1"
+
+    def test_empty_query_matches_everything(self):
+        predicate = compile_predicate(table, query("q1"), {})
+        assert compiled(predicate, literal_binds=True) == "true"
+
+    def test_cycle(self):
+        definitions = {
+            "q1": query("q1", subquery_ids=("q2",)),
+            "q2": query("q2", subquery_ids=("q1",)),
+        }
+        with pytest.raises(QueryCompileError):
+            compile_predicate(table, definitions["q1"], definitions)
+
+    def test_unknown_column(self):
+        definition = query(
+            "q1",
+            FilterValueDefinition(
+                field_name="missing", lookup=Lookup.EQUAL, include=Include.INCLUDE, value=1
+            ),
+        )
+        with pytest.raises(QueryCompileError):
+            compile_predicate(table, definition, {})
+
+    def test_matching_ids_statement(self):
+        definition = query(
+            "q1",
+            FilterValueDefinition(
+                field_name="name", lookup=Lookup.EQUAL, include=Include.INCLUDE, value="a"
+            ),
+        )
+        statement = matching_ids_statement(
+            table, compile_predicate(table, definition, {})
+        )
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        assert "un0.item.id = ANY (%(ids)s::VARCHAR[])" in sql
+        assert "un0.item.name = %(name_1)s" in sql
+
+
+class TestQueryVersionSQL:
+    def test_query_trigger_ignores_version_updates(self):
+        sql = QueryVersionSQL(table_name="query", schema_name="un0").emit_sql()
+        assert "CREATE OR REPLACE FUNCTION un0.bump_query_version()" in sql
+        assert "AFTER UPDATE OF queries_table_type_id" in sql
+
+    def test_association_trigger(self):
+        sql = QueryVersionSQL(table_name="query_subquery", schema_name="un0").emit_sql()
+        assert "AFTER INSERT OR UPDATE OR DELETE" in sql
+        assert "WITH RECURSIVE affected" in sql
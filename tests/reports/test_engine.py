@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+
+import pytest
+
+from sqlalchemy import Column, MetaData, Table, Integer, BOOLEAN, TEXT, VARCHAR
+from un0.errors import ReportError
+from un0.database.cache import LRUCache, PermissionContext, TableVersions
+from un0.filters.compiler import QueryCompiler
+from un0.reports.enums import Aggregate
+from un0.reports.engine import (
+    MeasureDefinition,
+    ReportDefinition,
+    ReportEngine,
+    report_statement,
+)
+
+from tests.conftest import compiled
+
+
+table = Table(
+    "item",
+    MetaData(),
+    Column("id", VARCHAR(26), primary_key=True),
+    Column("category", TEXT),
+    Column("quantity", Integer),
+    Column("is_deleted", BOOLEAN),
+    schema="un0",
+)
+
+
+def report(*measures: MeasureDefinition, **kwargs) -> ReportDefinition:
+    return ReportDefinition(id="r1", table_type_id=1, measures=measures, **kwargs)
+
+
+class TestReportStatement:
+    def test_grouped_measures(self):
+        definition = report(
+            MeasureDefinition(function=Aggregate.COUNT),
+            MeasureDefinition(function="sum", field_name="quantity"),
+            MeasureDefinition(
+                function=Aggregate.COUNT_DISTINCT, field_name="id", label="items"
+            ),
+            group_by=("category",),
+        )
+        sql = compiled(
+            report_statement(table, definition, max_rows=100), literal_binds=True
+        )
+        assert sql.startswith(
+            "SELECT un0.item.category, count(*) AS count, "
+            "sum(un0.item.quantity) AS sum_quantity, "
+            "count(DISTINCT un0.item.id) AS items"
+        )
+        assert "WHERE NOT un0.item.is_deleted" in sql
+        assert sql.endswith(
+            "GROUP BY un0.item.category ORDER BY un0.item.category \n LIMIT 100"
+        )
+
+    def test_params(self):
+        definition = report(
+            MeasureDefinition(function=Aggregate.COUNT), group_by=("category",)
+        )
+        sql = compiled(
+            report_statement(table, definition, params={"category": "a"}),
+            literal_binds=True,
+        )
+        assert "un0.item.category = 'a'" in sql
+        sql = compiled(
+            report_statement(table, definition, params={"category": None}),
+            literal_binds=True,
+        )
+        assert "un0.item.category IS NULL" in sql
+
+    def test_ungrouped(self):
+        definition = report(MeasureDefinition(function=Aggregate.MAX, field_name="quantity"))
+        sql = compiled(report_statement(table, definition), literal_binds=True)
+        assert "GROUP BY" not in sql
+        assert "max(un0.item.quantity) AS max_quantity" in sql
+
+    @pytest.mark.parametrize(
+        "definition, params, error_code",
+        [
+            (report(), None, "NO_MEASURE"),
+            (
+                report(MeasureDefinition(function=Aggregate.SUM, field_name="price")),
+                None,
+                "UNKNOWN_REPORT_FIELD",
+            ),
+            (report(MeasureDefinition(function=Aggregate.SUM)), None, "MEASURE_FIELD_REQUIRED"),
+            (
+                report(
+                    MeasureDefinition(function=Aggregate.COUNT, label="category"),
+                    group_by=("category",),
+                ),
+                None,
+                "DUPLICATE_COLUMN",
+            ),
+            (
+                report(MeasureDefinition(function=Aggregate.COUNT)),
+                {"category": "a"},
+                "UNKNOWN_REPORT_PARAMETER",
+            ),
+        ],
+    )
+    def test_errors(self, definition, params, error_code):
+        with pytest.raises(ReportError) as e:
+            report_statement(table, definition, params=params)
+        assert e.value.error_code == error_code
+
+
+class Compiler(QueryCompiler):
+    async def load_table(self, conn, table_type_id):
+        return table
+
+
+class Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def mappings(self):
+        return self.rows
+
+
+class Connection:
+    def __init__(self):
+        self.executed = 0
+
+    async def execute(self, statement):
+        self.executed += 1
+        return Result([{"category": "a", "count": self.executed}])
+
+
+class TestReportEngine:
+    def test_cached_run(self):
+        versions = TableVersions()
+        versions.connected()
+        engine = ReportEngine(compiler=Compiler(), cache=LRUCache(versions))
+        conn = Connection()
+        definition = report(
+            MeasureDefinition(function=Aggregate.COUNT), group_by=("category",)
+        )
+        context = PermissionContext(user_id="u1", tenant_id="t1")
+
+        def run(context, params=None):
+            return asyncio.run(engine.cached_run(conn, definition, context, params))
+
+        assert run(context) == [{"category": "a", "count": 1}]
+        assert run(context) == [{"category": "a", "count": 1}]
+        # Another tenant, other parameters, are other results
+        assert run(PermissionContext(user_id="u2", tenant_id="t2"))[0]["count"] == 2
+        assert run(context, {"category": "a"})[0]["count"] == 3
+        # A write to the aggregated table makes the results stale
+        versions.notify("un0.item:1")
+        assert run(context)[0]["count"] == 4
+        # As does a change to a report
+        versions.notify("un0.report:1")
+        assert run(context)[0]["count"] == 5
+        assert conn.executed == 5
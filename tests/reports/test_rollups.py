@@ -0,0 +1,151 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+from sqlalchemy import Column, MetaData, Table, BigInteger, NUMERIC, VARCHAR
+from un0.errors import ReportError
+from un0.reports.enums import Aggregate
+from un0.reports.engine import (
+    MeasureDefinition,
+    ReportDefinition,
+    rollup_measure_column,
+    rollup_report_statement,
+)
+from un0.reports.models import USER_TENANT_DAY, WORKFLOW_RECORD_STATUS
+from un0.reports.rollups import (
+    RollupDefinition,
+    register_rollup,
+    check_statement,
+    rebuild_statements,
+)
+from un0.reports.sql_emitters import RollupSQL, delta_sql, upsert_sql
+
+from tests.conftest import compiled
+
+
+ORDER_ROLLUP = RollupDefinition(
+    name="rollup_order",
+    source="un0.order",
+    groups={"tenant_id": "tenant_id"},
+    sums=("amount",),
+)
+
+order_rollup_table = Table(
+    "rollup_order",
+    MetaData(),
+    Column("tenant_id", VARCHAR(26)),
+    Column("row_count", BigInteger),
+    Column("sum_amount", NUMERIC),
+    Column("count_amount", BigInteger),
+    schema="un0",
+)
+
+
+def report(*measures: MeasureDefinition, **kwargs) -> ReportDefinition:
+    return ReportDefinition(id="r1", table_type_id=1, measures=measures, **kwargs)
+
+
+class TestRollupSQL:
+    def test_delta_sql(self):
+        sql = delta_sql(ORDER_ROLLUP, "old_rows", -1)
+        assert sql == (
+            "SELECT tenant_id AS tenant_id, -1 AS row_count, "
+            "-1 * amount AS sum_amount, "
+            "CASE WHEN amount IS NULL THEN 0 ELSE -1 END AS count_amount "
+            "FROM old_rows"
+        )
+        assert delta_sql(USER_TENANT_DAY, "new_rows", 1).endswith(
+            "FROM new_rows WHERE NOT is_deleted"
+        )
+
+    def test_upsert_sql(self):
+        sql = upsert_sql(ORDER_ROLLUP, "SELECT 1", "SELECT 2")
+        assert "INSERT INTO un0.rollup_order (tenant_id, row_count, sum_amount, count_amount)" in sql
+        assert "SELECT 1\n    UNION ALL\n    SELECT 2" in sql
+        # Updates that change no measure write nothing
+        assert "HAVING coalesce(sum(row_count), 0) <> 0 OR coalesce(sum(sum_amount), 0) <> 0" in sql
+        assert "ORDER BY tenant_id" in sql
+        assert "ON CONFLICT ON CONSTRAINT uq_rollup_order_groups DO UPDATE" in sql
+        assert "sum_amount = coalesce(rollup_order.sum_amount, 0) + coalesce(EXCLUDED.sum_amount, 0)" in sql
+
+    def test_triggers(self):
+        sql = RollupSQL(
+            table_name="rollup_workflowrecord_status", schema_name="un0"
+        ).emit_sql()
+        assert "CREATE OR REPLACE FUNCTION un0.maintain_rollup_workflowrecord_status()" in sql
+        assert "ON un0.workflowrecord" in sql
+        assert "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows" in sql
+        assert "FOR EACH STATEMENT" in sql
+
+    def test_register_without_tenant(self):
+        with pytest.raises(ReportError):
+            register_rollup(
+                RollupDefinition(name="rollup_x", source="un0.x", groups={"a": "a"})
+            )
+
+
+class TestRollupStatements:
+    def test_check_statement(self):
+        sql = compiled(check_statement(USER_TENANT_DAY), literal_binds=True)
+        assert "FULL OUTER JOIN" in sql
+        assert "base.tenant_id IS NOT DISTINCT FROM stored.tenant_id" in sql
+        assert "base.row_count IS DISTINCT FROM stored.row_count" in sql
+        assert "FROM un0.\"user\" \nWHERE NOT is_deleted GROUP BY tenant_id" in sql
+
+    def test_rebuild_statements(self):
+        delete, insert = rebuild_statements(WORKFLOW_RECORD_STATUS)
+        assert (
+            compiled(delete, literal_binds=True)
+            == "DELETE FROM un0.rollup_workflowrecord_status"
+        )
+        sql = compiled(insert, literal_binds=True)
+        assert sql.startswith(
+            "INSERT INTO un0.rollup_workflowrecord_status (tenant_id, status, row_count)"
+        )
+        assert "count(*) AS row_count" in sql
+
+    def test_rollup_report_statement(self):
+        definition = report(
+            MeasureDefinition(function=Aggregate.COUNT, label="users"),
+            group_by=("created_on",),
+        )
+        sql = compiled(
+            rollup_report_statement(
+                USER_TENANT_DAY, definition, params={"created_on": None}
+            ),
+            literal_binds=True,
+        )
+        assert sql.startswith(
+            "SELECT un0.rollup_user_tenant_day.created_on, "
+            "CAST(sum(un0.rollup_user_tenant_day.row_count) AS BIGINT) AS users"
+        )
+        assert "WHERE un0.rollup_user_tenant_day.created_on IS NULL" in sql
+        assert "HAVING sum(un0.rollup_user_tenant_day.row_count) > 0" in sql
+
+    def test_rollup_measures(self):
+        average = rollup_measure_column(
+            order_rollup_table,
+            ORDER_ROLLUP,
+            MeasureDefinition(function=Aggregate.AVG, field_name="amount"),
+        )
+        assert compiled(average, literal_binds=True) == (
+            "sum(un0.rollup_order.sum_amount) / "
+            "CAST(nullif(sum(un0.rollup_order.count_amount), 0) AS NUMERIC)"
+        )
+        for measure, error_code in [
+            (MeasureDefinition(function=Aggregate.MAX, field_name="amount"), "UNSUPPORTED_ROLLUP_MEASURE"),
+            (MeasureDefinition(function=Aggregate.SUM, field_name="price"), "UNKNOWN_ROLLUP_FIELD"),
+        ]:
+            with pytest.raises(ReportError) as e:
+                rollup_measure_column(order_rollup_table, ORDER_ROLLUP, measure)
+            assert e.value.error_code == error_code
+
+    def test_rollup_group_by(self):
+        definition = report(
+            MeasureDefinition(function=Aggregate.COUNT), group_by=("email",)
+        )
+        with pytest.raises(ReportError) as e:
+            rollup_report_statement(USER_TENANT_DAY, definition)
+        assert e.value.error_code == "UNKNOWN_REPORT_FIELD"
@@ -0,0 +1,17 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+from sqlalchemy.dialects import postgresql
+
+from un0.reports.runner import claim_statement
+
+
+class TestClaimStatement:
+    def test_claim_statement(self):
+        sql = str(claim_statement(60).compile(dialect=postgresql.dialect()))
+        assert "FOR UPDATE SKIP LOCKED" in sql
+        assert "un0.report_run.completed_at IS NULL" in sql
+        assert "ORDER BY un0.report_run.requested_at" in sql
+        assert "SET locked_until=(now() + %(param_1)s)" in sql
+        assert "(SELECT un0.\"user\".email" in sql
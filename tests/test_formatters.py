@@ -0,0 +1,97 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import decimal
+
+from datetime import datetime, date, timedelta, timezone
+
+import pytest
+
+from babel import dates, numbers
+
+from un0.formatters import (
+    formatter,
+    request_locale,
+    get_locale,
+    parse_accept_language,
+)
+from un0.config import settings
+
+
+LOCALES = ["en_US", "de_DE", "fr_FR", "ja_JP"]
+
+
+class TestLocaleFormatter:
+    @pytest.mark.parametrize("locale", LOCALES)
+    def test_matches_babel(self, locale):
+        fmt = formatter(locale)
+        naive = datetime(2024, 3, 5, 14, 30, 15)
+        aware = datetime(2024, 3, 5, 14, 30, 15, tzinfo=timezone(timedelta(hours=2)))
+        assert fmt.format_date(date(2024, 3, 5)) == dates.format_date(
+            date(2024, 3, 5), format="medium", locale=locale
+        )
+        assert fmt.format_date(naive) == dates.format_date(
+            naive, format="medium", locale=locale
+        )
+        assert fmt.format_datetime(naive) == dates.format_datetime(
+            naive, format="medium", locale=locale
+        )
+        assert fmt.format_datetime(aware) == dates.format_datetime(
+            aware, format="medium", locale=locale
+        )
+        assert fmt.format_decimal(decimal.Decimal("1234567.891")) == (
+            numbers.format_decimal(decimal.Decimal("1234567.891"), locale=locale)
+        )
+        assert fmt.format_timedelta(timedelta(days=3)) == dates.format_timedelta(
+            timedelta(days=3), locale=locale
+        )
+
+    def test_none_values(self):
+        fmt = formatter("en_US")
+        assert fmt.format_date(None) is None
+        assert fmt.format_datetime(None) is None
+        assert fmt.format_decimal(None) is None
+        assert fmt.format_timedelta(None) is None
+        assert fmt.format_boolean(None) is None
+        assert fmt.format_boolean(True) == "Yes"
+
+    def test_formatter_is_cached(self):
+        assert formatter("de_DE") is formatter("de_DE")
+        assert formatter("de_DE") is not formatter("fr_FR")
+
+    def test_format_rows(self):
+        fmt = formatter("en_US")
+        rows = [
+            {"name": "a", "due": date(2024, 1, 2), "done": True},
+            {"name": "b", "due": date(2024, 1, 2), "done": False},
+            {"name": "c", "due": None},
+        ]
+        formatted = fmt.format_rows(rows, {"due": date, "done": bool})
+        assert formatted == [
+            {"name": "a", "due": "Jan 2, 2024", "done": "Yes"},
+            {"name": "b", "due": "Jan 2, 2024", "done": "No"},
+            {"name": "c", "due": None},
+        ]
+        # The rows passed in are not modified
+        assert rows[0]["due"] == date(2024, 1, 2)
+
+
+class TestRequestLocale:
+    def test_default_locale(self):
+        assert get_locale() == settings.LOCALE
+
+    def test_request_locale(self):
+        token = request_locale.set("de_DE")
+        try:
+            assert get_locale() == "de_DE"
+            assert formatter().locale == formatter("de_DE").locale
+        finally:
+            request_locale.reset(token)
+
+    def test_parse_accept_language(self):
+        assert parse_accept_language("fr-CH, fr;q=0.9, en;q=0.8") == "fr_CH"
+        assert parse_accept_language("en;q=0.5, de") == "de"
+        assert parse_accept_language("xx-YY, de-DE") == "de_DE"
+        assert parse_accept_language("*") is None
+        assert parse_accept_language(None) is None
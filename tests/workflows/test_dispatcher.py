@@ -0,0 +1,187 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import json
+
+import pytest
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from un0.database.sql_emitters import WorkflowEventNotifySQL
+from un0.database.management.sql_emitters import CreateWorkflowEventNotifySQL
+from un0.workflows.enums import WorkflowDBEvent
+from un0.workflows.dispatcher import WorkflowDispatcher, dispatch_statement
+
+
+def payload(operation: str, tenant_id: str, ids: list[str]) -> str:
+    return json.dumps(
+        {
+            "table_type_id": 3,
+            "operation": operation,
+            "tenant_id": tenant_id,
+            "ids": ids,
+        }
+    )
+
+
+class FailingEngine:
+    """An engine whose transactions fail to begin, after calling on_begin."""
+
+    def __init__(self):
+        self.on_begin = lambda: None
+
+    def begin(self):
+        return self
+
+    async def __aenter__(self):
+        self.on_begin()
+        raise OperationalError("BEGIN", {}, ConnectionError("connection refused"))
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeResult:
+    def all(self):
+        return []
+
+
+class RejectingEngine:
+    """
+    An engine whose dispatch statement fails, as a foreign key violation would,
+    for the changes of the tenant "deleted", and records the ids dispatched.
+    """
+
+    def __init__(self):
+        self.dispatched = []
+        self.pending = []
+
+    def begin(self):
+        return self
+
+    async def __aenter__(self):
+        self.pending = []
+        return self
+
+    async def __aexit__(self, exc_type, *args):
+        if exc_type is None:
+            self.dispatched.extend(self.pending)
+        return False
+
+    async def execute(self, statement, params=None):
+        if isinstance(params, list) and statement.is_insert:
+            if any("deleted" in param["tenant_ids"] for param in params):
+                raise IntegrityError("INSERT", params, Exception("tenant_id_fkey"))
+            self.pending.extend(id for param in params for id in param["ids"])
+        return FakeResult()
+
+
+class TestWorkflowEventNotifySQL:
+    def test_triggers(self):
+        sql = WorkflowEventNotifySQL(table_name="group", schema_name="un0").emit_sql()
+        assert sql.count("FOR EACH STATEMENT") == 3
+        assert sql.count("REFERENCING NEW TABLE AS new_rows") == 2
+        assert "REFERENCING OLD TABLE AS old_rows" in sql
+        assert sql.count("EXECUTE FUNCTION un0.notify_workflow_event()") == 3
+
+    def test_function(self):
+        sql = CreateWorkflowEventNotifySQL().emit_sql()
+        assert "CREATE OR REPLACE FUNCTION un0.notify_workflow_event()" in sql
+        assert "db_event = TG_OP::un0.workflowdbevent" in sql
+        assert "FROM old_rows AS changed" in sql
+        assert "FROM new_rows AS changed" in sql
+        assert "GROUP BY tenant_id, batch" in sql
+
+
+class TestWorkflowDispatcher:
+    def test_dispatch_statement(self):
+        sql = str(dispatch_statement().compile(dialect=postgresql.dialect()))
+        assert sql.startswith("INSERT INTO un0.workflowevent")
+        assert "unnest(" in sql
+        assert "un0.workflow.parent_id IS NULL" in sql
+        assert "un0.workflow.limiting_query_id IS NULL" in sql
+
+    def test_limited_dispatch_statement(self):
+        sql = str(dispatch_statement(limited=True).compile(dialect=postgresql.dialect()))
+        assert "un0.workflow.id = %(workflow_id)s" in sql
+        assert "limiting_query_id" not in sql
+
+    @pytest.mark.asyncio
+    async def test_changes_are_coalesced(self):
+        dispatcher = WorkflowDispatcher(window=60.0)
+        dispatcher.notify(payload("INSERT", "t1", ["a", "b"]))
+        dispatcher.notify(payload("UPDATE", "t1", ["a"]))
+        dispatcher.notify(payload("UPDATE", "t1", ["a", "c"]))
+        params = dispatcher.take_pending()
+        assert params == [
+            {
+                "table_type_id": 3,
+                "operation": WorkflowDBEvent.INSERT,
+                "ids": ["a", "b"],
+                "tenant_ids": ["t1", "t1"],
+            },
+            {
+                "table_type_id": 3,
+                "operation": WorkflowDBEvent.UPDATE,
+                "ids": ["a", "c"],
+                "tenant_ids": ["t1", "t1"],
+            },
+        ]
+        assert dispatcher.take_pending() == []
+        dispatcher._flush_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_changes_notified_during_a_flush_are_flushed(self):
+        dispatcher = WorkflowDispatcher(window=0.0)
+        flushed = []
+
+        async def flush():
+            flushed.append(dispatcher.take_pending())
+            if len(flushed) == 1:
+                # The flush task is still running, so notify does not start one
+                dispatcher.notify(payload("UPDATE", "t1", ["b"]))
+
+        dispatcher.flush = flush
+        dispatcher.notify(payload("INSERT", "t1", ["a"]))
+        await dispatcher._flush_task
+        assert [params[0]["ids"] for params in flushed] == [["a"], ["b"]]
+        assert dispatcher.pending == {}
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_restores_changes(self):
+        dispatcher = WorkflowDispatcher(engine=FailingEngine(), window=60.0)
+        dispatcher.notify(payload("INSERT", "t1", ["a", "b"]))
+        dispatcher._flush_task.cancel()
+
+        def changed_during_flush():
+            dispatcher.notify(payload("INSERT", "t2", ["b", "c"]))
+
+        dispatcher.engine.on_begin = changed_during_flush
+        with pytest.raises(OperationalError):
+            await dispatcher.flush()
+        # The latest tenant of a row changed again is kept
+        assert dispatcher.pending == {
+            (3, WorkflowDBEvent.INSERT): {"a": "t1", "b": "t2", "c": "t2"}
+        }
+        assert dispatcher.dispatched == 0
+        dispatcher._flush_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_permanent_failure_is_dropped(self):
+        dispatcher = WorkflowDispatcher(
+            engine=RejectingEngine(), window=60.0, max_failures=2
+        )
+        dispatcher.notify(payload("INSERT", "t1", ["a"]))
+        dispatcher.notify(payload("UPDATE", "deleted", ["b"]))
+        dispatcher._flush_task.cancel()
+        await dispatcher.flush()
+        # The other changes are not held back by the failing ones
+        assert dispatcher.engine.dispatched == ["a"]
+        assert dispatcher.pending == {(3, WorkflowDBEvent.UPDATE): {"b": "deleted"}}
+        assert dispatcher.failures == {(3, WorkflowDBEvent.UPDATE): 1}
+        await dispatcher.flush()
+        assert dispatcher.pending == {}
+        assert dispatcher.failures == {}
+        assert dispatcher.dispatched == 1
@@ -0,0 +1,286 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import dataclasses
+import datetime
+import time
+
+import pytest
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from un0.relatedobjects.models import TableType
+from un0.workflows.enums import WorkflowTrigger
+from un0.workflows.executor import (
+    WorkflowDefinition,
+    WorkflowJob,
+    WorkflowWorker,
+    WorkerMetrics,
+    claim_statement,
+    complete_statement,
+    object_function,
+    object_functions,
+    retry_delay,
+    retry_statement,
+)
+from un0.workflows.models import Workflow, WorkflowEvent, WorkflowRecord
+from un0.config import settings
+
+from tests.conftest import compiled, mock_rls_vars
+
+
+job = WorkflowJob(
+    id="01J0000000000000000000000A",
+    workflow_id=1,
+    tenant_id="01J0000000000000000000000T",
+    workflow_object_id="01J0000000000000000000000O",
+    date_due=datetime.date(2024, 5, 8),
+    run_at=datetime.datetime(2024, 5, 1, tzinfo=datetime.UTC),
+    attempts=1,
+)
+
+
+class TestClaimStatement:
+    def test_claim_statement(self):
+        sql = str(claim_statement(100, 10, 300).compile(dialect=postgresql.dialect()))
+        assert "FOR UPDATE SKIP LOCKED" in sql
+        assert "row_number() OVER (PARTITION BY candidates.tenant_id" in sql
+        assert "UPDATE un0.workflowevent SET locked_until=(now() + " in sql
+        assert "attempts=(un0.workflowevent.attempts + " in sql
+        assert "RETURNING un0.workflowevent.id" in sql
+        assert "un0.workflowevent.completed_at IS NULL" in sql
+
+
+class TestOutcomeStatements:
+    def test_complete_statement(self):
+        outcome = {"id": job.id, "attempts": 1, "value": True, "error": None}
+        sql = compiled(complete_statement([outcome]))
+        assert (
+            "FROM unnest(%(outcome_id)s::TEXT[], %(outcome_attempts)s::INTEGER[]" in sql
+        )
+        assert "AS outcome(id, attempts, value, error)" in sql
+        # Only the events still leased by the attempt that ran them are written
+        assert "un0.workflowevent.attempts = outcome.attempts" in sql
+        assert "un0.workflowevent.completed_at IS NULL" in sql
+        assert "completed_at=now()" in sql
+        assert sql.endswith("RETURNING un0.workflowevent.id")
+
+    def test_retry_statement(self):
+        stmt = retry_statement(
+            [
+                {
+                    "id": job.id,
+                    "attempts": 1,
+                    "delay": datetime.timedelta(seconds=30),
+                    "error": "ValueError: failed",
+                }
+            ]
+        )
+        sql = compiled(stmt)
+        assert "run_at=(now() + outcome.delay)" in sql
+        assert "un0.workflowevent.attempts = outcome.attempts" in sql
+        assert stmt.compile().params["outcome_attempts"] == [1]
+
+
+class TestWorker:
+    def test_retry_delay(self):
+        assert retry_delay(1, 30.0, 3600.0) == 30.0
+        assert retry_delay(3, 30.0, 3600.0) == 120.0
+        assert retry_delay(20, 30.0, 3600.0) == 3600.0
+
+    def test_object_function_registry(self):
+        @object_function("test_complete")
+        def complete(job: WorkflowJob) -> bool:
+            return True
+
+        assert object_functions["test_complete"] is complete
+
+    @pytest.mark.asyncio
+    async def test_run_job(self):
+        @object_function("test_fails")
+        async def fails(job: WorkflowJob) -> bool:
+            raise ValueError("failed")
+
+        worker = WorkflowWorker()
+        worker.definitions = {
+            1: WorkflowDefinition(
+                id=1,
+                trigger=WorkflowTrigger.DB_EVENT,
+                repeat_every=0,
+                due_within=7,
+                record_required=True,
+                process_child_value=True,
+                objectfunction_name="test_fails",
+            )
+        }
+        assert isinstance(await worker.run_job(job), ValueError)
+
+    @pytest.mark.asyncio
+    async def test_unknown_workflow_fails(self):
+        worker = WorkflowWorker()
+        assert isinstance(await worker.run_job(job), LookupError)
+
+    @pytest.mark.asyncio
+    async def test_unknown_workflow_reloads_definitions(self):
+        worker = WorkflowWorker()
+        worker.definitions_loaded = time.monotonic()
+        loads, completed = [], []
+
+        async def claim():
+            return [job]
+
+        async def load_definitions():
+            loads.append(worker.definitions_loaded)
+            if worker.definitions_loaded == 0.0:
+                worker.definitions = {
+                    1: WorkflowDefinition(
+                        id=1,
+                        trigger=WorkflowTrigger.DB_EVENT,
+                        repeat_every=0,
+                        due_within=7,
+                        record_required=False,
+                        process_child_value=True,
+                    )
+                }
+
+        async def complete(outcomes):
+            completed.extend(outcomes)
+
+        worker.claim, worker.load_definitions = claim, load_definitions
+        worker.complete = complete
+        assert await worker.run_once() == 1
+        # The cached definitions did not have the workflow, they were reloaded
+        assert len(loads) == 2 and loads[1] == 0.0
+        assert completed == [(job, None)]
+
+    def test_record_values(self):
+        values = WorkflowWorker.record_values(job, True)
+        assert values["status"] == "CLOSED"
+        assert values["state"] == "COMPLETE"
+        assert values["date_due"] == job.date_due
+        assert WorkflowWorker.record_values(job, False)["status"] == "OPEN"
+
+    def test_event_values(self):
+        definition = WorkflowDefinition(
+            id=2,
+            trigger=WorkflowTrigger.SCHEDULE,
+            repeat_every=7,
+            due_within=3,
+            record_required=False,
+            process_child_value=True,
+        )
+        run_at = job.run_at + datetime.timedelta(days=7)
+        values = WorkflowWorker.event_values(definition, job, run_at)
+        assert values["workflow_id"] == 2
+        assert values["run_at"] == run_at
+        assert values["date_due"] == datetime.date(2024, 5, 11)
+
+    def test_metrics(self):
+        metrics = WorkerMetrics()
+        metrics.claimed = 4
+        metrics.run_seconds = 2.0
+        assert metrics.snapshot()["mean_run_ms"] == 500.0
+
+
+class TestWorkerLease:
+    @pytest.fixture(scope="class")
+    def event_id(self, session, superuser_id, data_dict):
+        """Creates a due event of a workflow that requires a record, claimed twice."""
+        workflow = Workflow.table.__table__
+        event = WorkflowEvent.table.__table__
+        with session.begin():
+            session.execute(
+                func.un0.mock_authorize_user(
+                    *mock_rls_vars(superuser_id, role_name="admin")
+                )
+            )
+            workflow_id = session.execute(
+                insert(workflow)
+                .values(
+                    name="Lease test",
+                    explanation="Tests the completion of reclaimed events",
+                    applicable_table_type_id=select(TableType.table.__table__.c.id)
+                    .limit(1)
+                    .scalar_subquery(),
+                    record_required=True,
+                )
+                .returning(workflow.c.id)
+            ).scalar()
+            event_id = session.execute(
+                insert(event)
+                .values(
+                    workflow_id=workflow_id,
+                    tenant_id=data_dict["tenants"]["Acme Inc."]["id"],
+                    date_due=datetime.date.today(),
+                    attempts=2,
+                )
+                .returning(event.c.id)
+            ).scalar()
+        yield workflow_id, event_id
+
+    def event_state(self, session, superuser_id, event_id):
+        event = WorkflowEvent.table.__table__
+        record = WorkflowRecord.table.__table__
+        with session.begin():
+            session.execute(
+                func.un0.mock_authorize_user(
+                    *mock_rls_vars(superuser_id, role_name="admin")
+                )
+            )
+            completed_at = session.execute(
+                select(event.c.completed_at).where(event.c.id == event_id)
+            ).scalar()
+            records = session.execute(
+                select(func.count())
+                .select_from(record)
+                .where(record.c.workflowevent_id == event_id)
+            ).scalar()
+        return completed_at, records
+
+    @pytest.mark.asyncio
+    async def test_only_the_current_lease_completes(
+        self, session, superuser_id, data_dict, event_id
+    ):
+        workflow_id, event_id = event_id
+        async_engine = create_async_engine(settings.DB_URL)
+        worker = WorkflowWorker(engine=async_engine)
+        worker.definitions = {
+            workflow_id: WorkflowDefinition(
+                id=workflow_id,
+                trigger=WorkflowTrigger.DB_EVENT,
+                repeat_every=0,
+                due_within=7,
+                record_required=True,
+                process_child_value=True,
+            )
+        }
+        stale = WorkflowJob(
+            id=event_id,
+            workflow_id=workflow_id,
+            tenant_id=data_dict["tenants"]["Acme Inc."]["id"],
+            workflow_object_id=None,
+            date_due=datetime.date.today(),
+            run_at=datetime.datetime.now(datetime.UTC),
+            attempts=1,
+        )
+        current = dataclasses.replace(stale, attempts=2)
+        try:
+            # The first attempt's lease expired and the event was claimed again
+            await worker.complete([(stale, True)])
+            assert self.event_state(session, superuser_id, event_id) == (None, 0)
+            assert worker.metrics.lost == 1
+
+            await worker.complete([(current, True)])
+            completed_at, records = self.event_state(session, superuser_id, event_id)
+            assert completed_at is not None and records == 1
+
+            # A completed event is not completed, nor followed, again
+            await worker.complete([(current, True)])
+            assert self.event_state(session, superuser_id, event_id)[1] == 1
+            assert worker.metrics.completed == 1
+            assert worker.metrics.lost == 2
+        finally:
+            await async_engine.dispose()
@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import sys
+import time
+
+import pytest
+
+from un0.workflows.runtime import (
+    ObjectFunctionRuntime,
+    import_modules,
+    object_function,
+    object_function_options,
+    run_batch,
+)
+
+
+@object_function("test_cpu_even", cpu_bound=True)
+def even(job: int) -> bool:
+    return sum(range(job * 1000)) % 2 == 0 or job % 2 == 0
+
+
+@object_function("test_cpu_fails", cpu_bound=True)
+def fails(job: int) -> bool:
+    raise ValueError(f"failed {job}")
+
+
+def sleeps(job: float) -> bool:
+    time.sleep(job)
+    return True
+
+
+def imported(module: str) -> bool:
+    return module in sys.modules
+
+
+class TestRunBatch:
+    def test_outcomes_and_times(self):
+        results = run_batch(even, [2, 4], 5.0)
+        assert [outcome for outcome, seconds in results] == [True, True]
+        assert all(seconds >= 0 for outcome, seconds in results)
+
+    def test_exceptions_are_returned(self):
+        [(outcome, seconds)] = run_batch(fails, [1], 5.0)
+        assert isinstance(outcome, ValueError)
+
+    def test_timeout(self):
+        [(outcome, seconds)] = run_batch(sleeps, [2.0], 0.1)
+        assert isinstance(outcome, TimeoutError)
+        assert seconds < 1.0
+
+
+class TestObjectFunctionRuntime:
+    def test_registry(self):
+        assert object_function_options["test_cpu_even"].cpu_bound
+
+    def test_async_cpu_bound_is_refused(self):
+        with pytest.raises(TypeError):
+
+            @object_function("test_cpu_async", cpu_bound=True)
+            async def cpu_async(job):
+                return True
+
+    @pytest.mark.asyncio
+    async def test_io_timeout(self):
+        @object_function("test_io_slow", timeout=0.05)
+        async def slow(job):
+            await asyncio.sleep(1)
+            return True
+
+        runtime = ObjectFunctionRuntime()
+        [outcome] = await runtime.run("test_io_slow", [1])
+        assert isinstance(outcome, TimeoutError)
+        assert runtime.snapshot()["test_io_slow"]["timeouts"] == 1
+
+    @pytest.mark.asyncio
+    async def test_unregistered(self):
+        outcomes = await ObjectFunctionRuntime().run("test_missing", [1, 2])
+        assert all(isinstance(outcome, LookupError) for outcome in outcomes)
+
+    @pytest.mark.asyncio
+    async def test_process_pool_batches(self):
+        runtime = ObjectFunctionRuntime(max_processes=1, batch_size=2)
+        try:
+            outcomes = await runtime.run("test_cpu_even", [1, 2, 3, 4, 5])
+            failed = await runtime.run("test_cpu_fails", [1])
+        finally:
+            runtime.close()
+        assert outcomes == [even(job) for job in [1, 2, 3, 4, 5]]
+        assert isinstance(failed[0], ValueError)
+        assert runtime.snapshot()["test_cpu_even"]["calls"] == 5
+        assert runtime.snapshot()["test_cpu_fails"]["failures"] == 1
+
+    def test_import_modules(self):
+        import_modules(["tests.workflows.test_runtime"])
+        assert "tests.workflows.test_runtime" in sys.modules
+
+    def test_pool_imports_modules(self):
+        runtime = ObjectFunctionRuntime(max_processes=1, modules=["colorsys"])
+        try:
+            assert runtime.pool.submit(imported, "colorsys").result(timeout=30)
+        finally:
+            runtime.close()
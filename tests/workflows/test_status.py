@@ -0,0 +1,53 @@
+# SPDX-FileCopyrightText: 2024-present Richard Dahl <richard@dahl.us>
+#
+# SPDX-License-Identifier: MIT
+
+import datetime
+
+from sqlalchemy.dialects import postgresql
+
+from un0.workflows.enums import WorkflowRecordStatus
+from un0.workflows.models import WorkflowRecord
+from un0.workflows.status import WorkflowStatusUpdater, status_statement
+
+from tests.conftest import compiled
+
+
+class TestStatusStatement:
+    def test_overdue(self):
+        sql = compiled(status_statement(WorkflowRecordStatus.OVERDUE))
+        assert sql.startswith("WITH changed AS \n(UPDATE un0.workflowrecord")
+        assert "un0.workflowrecord.date_due < %(today)s" in sql
+        assert "RETURNING un0.workflowrecord.tenant_id" in sql
+        assert "GROUP BY changed.tenant_id" in sql
+
+    def test_at_risk(self):
+        sql = compiled(status_statement(WorkflowRecordStatus.AT_RISK))
+        assert "un0.workflowrecord.date_due >= %(today)s" in sql
+        assert "un0.workflowrecord.date_due <= %(at_risk_until)s" in sql
+
+    def test_only_changed_statuses_are_read(self):
+        statement = status_statement(WorkflowRecordStatus.OPEN).compile(
+            dialect=postgresql.dialect()
+        )
+        assert statement.params["status_1"] == [
+            WorkflowRecordStatus.AT_RISK,
+            WorkflowRecordStatus.OVERDUE,
+        ]
+        assert "un0.workflowrecord.date_due > %(at_risk_until)s" in str(statement)
+
+    def test_status_date_due_index(self):
+        indexes = {
+            index.name: [column.name for column in index.columns]
+            for index in WorkflowRecord.table.__table__.indexes
+        }
+        assert indexes["ix_workflowrecord_status_date_due"] == ["status", "date_due"]
+
+
+class TestWorkflowStatusUpdater:
+    def test_params(self):
+        updater = WorkflowStatusUpdater(at_risk_days=3)
+        assert updater.params(datetime.date(2024, 12, 30)) == {
+            "today": datetime.date(2024, 12, 30),
+            "at_risk_until": datetime.date(2025, 1, 2),
+        }